@@ -2,10 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import re
-from collections import defaultdict
-from datetime import datetime
+import unicodedata
+from collections import defaultdict, Counter
+from datetime import date, timedelta
 import statistics
 
+import numpy as np
+
 STOP_WORDS = set([
     'achat', 'achats', 'a', 'au', 'aux', 'avec', 'ce', 'ces', 'dans', 'de', 'des', 'du',
     'elle', 'en', 'et', 'eux', 'il', 'je', 'la', 'le', 'les', 'leur', 'lui', 'ma',
@@ -16,6 +19,29 @@ STOP_WORDS = set([
     'prelevement', 'carte', 'cb', 'vir', 'virement', 'debit'
 ])
 
+# Préfixes et mentions ajoutés par les banques, sans valeur pour identifier un marchand
+MOTS_BANCAIRES = set([
+    'prlv', 'sepa', 'prelevement', 'prelev', 'paiement', 'carte', 'cb', 'vir', 'virement', 'inst',
+    'recu', 'emis', 'retrait', 'dab', 'achat', 'facture', 'fact', 'echeance', 'ref', 'mandat',
+    'europe', 'sas', 'sa', 'sarl', 'www', 'com', 'fr', 'de', 'du', 'le', 'la', 'les'
+])
+
+# Périodicités reconnues par la détection : écart (en jours) minimal et maximal entre deux occurrences
+PERIODICITES_DETECTEES = {
+    'Hebdomadaire': (5, 9),
+    'Mensuelle': (25, 35),
+    'Trimestrielle': (80, 100),
+}
+# Écart en mois entre deux échéances, pour les périodicités calées sur le mois de départ de la règle
+MOIS_PAR_PERIODICITE = {'Mensuelle': 1, 'Trimestrielle': 3}
+TOLERANCE_MONTANT = 0.05
+SEUIL_COHERENCE = 0.7
+
+# Seuils des comparaisons pluriannuelles du rapport annuel
+SEUIL_VARIATION_ANNUELLE_EUR = 100.0
+SEUIL_VARIATION_ANNUELLE_PCT = 20.0
+SEUIL_SAISONNALITE = 2.0
+
 MOIS_FRANCAIS = [
     "", "Janvier", "Février", "Mars", "Avril", "Mai", "Juin",
     "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre"
@@ -48,48 +74,156 @@ class CategorizationAI:
             if keyword in self.keyword_map:
                 return self.keyword_map[keyword]
         return None
+    def _signature_marchand(self, description):
+        """Retourne une signature normalisée du marchand (insensible aux références, dates et préfixes bancaires)."""
+        texte = unicodedata.normalize('NFKD', str(description or '').lower())
+        texte = ''.join(c for c in texte if not unicodedata.combining(c))
+        mots_significatifs = []
+        for mot in re.split(r'[^a-z0-9]+', texte):
+            if len(mot) < 2 or mot in STOP_WORDS or mot in MOTS_BANCAIRES or any(c.isdigit() for c in mot):
+                continue
+            if mot not in mots_significatifs:
+                mots_significatifs.append(mot)
+            if len(mots_significatifs) == 2:
+                break
+        return ' '.join(sorted(mots_significatifs))
+
+    def _regrouper_par_montant(self, transactions):
+        """Découpe une liste de transactions en groupes de montants proches (tolérance relative, minimum 2 €)."""
+        groupes = []
+        groupe_courant, montant_reference = [], None
+        for trans in sorted(transactions, key=lambda t: t['montant']):
+            montant = trans['montant']
+            if groupe_courant and abs(montant - montant_reference) > max(2.0, abs(montant_reference) * TOLERANCE_MONTANT):
+                groupes.append(groupe_courant)
+                groupe_courant = []
+            if not groupe_courant:
+                montant_reference = montant
+            groupe_courant.append(trans)
+        if groupe_courant:
+            groupes.append(groupe_courant)
+        return groupes
+
+    def _detecter_periodicite(self, dates):
+        """Déduit la périodicité d'une série de dates triées. Retourne (periodicite, jour_echeance) ou None."""
+        ecarts = [(d2 - d1).days for d1, d2 in zip(dates, dates[1:]) if d2 != d1]
+        if len(ecarts) < 2:
+            return None
+        ecart_median = statistics.median(ecarts)
+        for periodicite, (ecart_min, ecart_max) in PERIODICITES_DETECTEES.items():
+            if not (ecart_min <= ecart_median <= ecart_max):
+                continue
+            if sum(1 for e in ecarts if ecart_min <= e <= ecart_max) / len(ecarts) < SEUIL_COHERENCE:
+                return None
+            if periodicite == 'Hebdomadaire':
+                jours = [d.isoweekday() for d in dates]
+                jour_cible, nb = Counter(jours).most_common(1)[0]
+                if nb / len(jours) < SEUIL_COHERENCE:
+                    return None
+            else:
+                jours = [d.day for d in dates]
+                jour_cible = sorted(jours)[len(jours) // 2]
+                if sum(1 for j in jours if abs(j - jour_cible) <= 3) / len(jours) < SEUIL_COHERENCE:
+                    return None
+            return periodicite, jour_cible
+        return None
+
+    def _debut_regle(self, periodicite, derniere_occurrence):
+        """
+        Date de début d'une règle détectée : le lendemain de la dernière occurrence pour une règle hebdomadaire,
+        sinon le 1er du mois de la prochaine échéance. Le générateur cale les règles trimestrielles sur le mois
+        de date_debut : ce mois reste dans la phase observée, et la dernière occurrence (déjà saisie) n'est pas regénérée.
+        """
+        if periodicite not in MOIS_PAR_PERIODICITE:
+            return derniere_occurrence + timedelta(days=1)
+        mois = derniere_occurrence.year * 12 + derniere_occurrence.month - 1 + MOIS_PAR_PERIODICITE[periodicite]
+        return date(mois // 12, mois % 12 + 1, 1)
+
     def detect_recurring_transactions(self, transactions, existing_recurring):
-        manual_transactions = [t for t in transactions if t.get('origine') != 'recurrente']
+        # Index des règles existantes par signature : l'exclusion se fait en O(1) par groupe
+        signatures_existantes = {self._signature_marchand(rule.get('description', '')) for rule in existing_recurring}
+        signatures_existantes.discard('')
+
         groups = defaultdict(list)
-        for trans in manual_transactions:
-            keywords = self._get_keywords_from_description(trans.get('description', ''))
-            if keywords: groups[keywords[0]].append(trans)
+        for trans in transactions:
+            if trans.get('origine') in ('recurrente', 'echeancier') or trans.get('categorie') == "(Virement)":
+                continue
+            montant = trans.get('montant')
+            if not montant:
+                continue
+            signature = self._signature_marchand(trans.get('description', ''))
+            if not signature or signature in signatures_existantes:
+                continue
+            groups[(signature, montant > 0)].append(trans)
+
         suggestions = []
-        for group_key, trans_list in groups.items():
+        for trans_list in groups.values():
             if len(trans_list) < 3: continue
-            if any(group_key in str(rule.get('description','')).lower() for rule in existing_recurring): continue
-            montants = [t['montant'] for t in trans_list]
-            avg_montant = sum(montants) / len(montants)
-            variance = sum((m - avg_montant) ** 2 for m in montants) / len(montants)
-            if variance > 2: continue
-            jours = [datetime.strptime(t['date'], "%Y-%m-%d").day for t in trans_list]
-            jour_median = sorted(jours)[len(jours) // 2]
-            jours_coherents = sum(1 for j in jours if abs(j - jour_median) <= 3)
-            if (jours_coherents / len(jours)) < 0.7: continue
-            suggestions.append({'description': trans_list[0]['description'], 'montant': avg_montant, 'jour_du_mois': jour_median, 'categorie': trans_list[0]['categorie'], 'type': 'Dépense' if avg_montant < 0 else 'Revenu'})
-        return suggestions
+            for groupe in self._regrouper_par_montant(trans_list):
+                if len(groupe) < 3: continue
+                datees = []
+                for t in groupe:
+                    try: datees.append((date.fromisoformat(str(t.get('date', ''))[:10]), t))
+                    except ValueError: continue
+                if len(datees) < 3: continue
+                datees.sort(key=lambda x: x[0])
+                resultat = self._detecter_periodicite([d for d, _ in datees])
+                if resultat is None: continue
+                periodicite, jour_cible = resultat
+
+                avg_montant = round(sum(t['montant'] for _, t in datees) / len(datees), 2)
+                derniere_trans = datees[-1][1]
+                categorie = Counter(t.get('categorie') for _, t in datees).most_common(1)[0][0]
+                suggestions.append({
+                    'description': derniere_trans['description'], 'montant': avg_montant,
+                    'jour_du_mois': jour_cible if periodicite != 'Hebdomadaire' else datees[-1][0].day,
+                    'jour_echeance': str(jour_cible), 'periodicite': periodicite,
+                    'categorie': categorie, 'type': 'Dépense' if avg_montant < 0 else 'Revenu',
+                    'derniere_occurrence': datees[-1][0].isoformat(),
+                    'date_debut': self._debut_regle(periodicite, datees[-1][0]).isoformat()
+                })
+        return sorted(suggestions, key=lambda s: s['description'].lower())
+
+    def construire_matrice(self, data_by_cat):
+        """Convertit un dictionnaire {catégorie: {mois: montant}} en (liste des catégories, matrice catégories x 12 mois)."""
+        categories = sorted(data_by_cat.keys())
+        matrice = np.zeros((len(categories), 12))
+        for i, cat in enumerate(categories):
+            for month_num, valeur in data_by_cat[cat].items():
+                matrice[i, month_num - 1] += valeur
+        return categories, matrice
+
+    def _statistiques_lignes(self, matrice):
+        """Nombre de mois renseignés, moyenne et écart-type (échantillon) de chaque ligne, sur les seules valeurs positives."""
+        masque = matrice > 0
+        nb = masque.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            moyennes = np.where(nb > 0, (matrice * masque).sum(axis=1) / nb, 0.0)
+            ecarts = ((matrice - moyennes[:, None]) ** 2) * masque
+            ecart_types = np.where(nb > 1, np.sqrt(ecarts.sum(axis=1) / (nb - 1)), 0.0)
+        return masque, nb, moyennes, ecart_types
 
     def analyser_budget_annuel(self, data_by_cat, budget_type):
         """Analyse les données et retourne une liste de dictionnaires d'anomalies."""
         anomalies = []
         SENSIBILITE = 1.5
 
-        for cat, monthly_data in data_by_cat.items():
-            valeurs = [v for v in monthly_data.values() if v > 0]
-            if len(valeurs) < 4: continue
-            moyenne = statistics.mean(valeurs)
-            ecart_type = statistics.stdev(valeurs) if len(valeurs) > 1 else 0
-            if ecart_type == 0: continue
-            seuil = moyenne + (SENSIBILITE * ecart_type)
-
-            for month_num, valeur in monthly_data.items():
-                if valeur > seuil:
-                    nom_mois = MOIS_FRANCAIS[month_num]
-                    type_str = "Pic de dépenses" if budget_type == "Dépenses" else "Pic de recettes"
-                    anomalie_text = f"-> {type_str} pour '{cat}' en {nom_mois} : {valeur:,.2f}€ (moyenne : {moyenne:,.2f}€)".replace(",", " ")
-                    # On retourne maintenant un dictionnaire avec le texte ET la catégorie
-                    anomalies.append({'text': anomalie_text, 'categorie': cat})
-        
+        categories, matrice = self.construire_matrice(data_by_cat)
+        if not categories: return anomalies
+        _, nb, moyennes, ecart_types = self._statistiques_lignes(matrice)
+
+        # Calcul vectorisé : une cellule est anormale si elle dépasse moyenne + SENSIBILITE * écart-type de sa catégorie
+        lignes_valides = (nb >= 4) & (ecart_types > 0)
+        seuils = moyennes + SENSIBILITE * ecart_types
+        pics = (matrice > seuils[:, None]) & lignes_valides[:, None]
+
+        type_str = "Pic de dépenses" if budget_type == "Dépenses" else "Pic de recettes"
+        for i, j in zip(*np.nonzero(pics)):
+            cat, valeur, moyenne = categories[i], matrice[i, j], moyennes[i]
+            anomalie_text = f"-> {type_str} pour '{cat}' en {MOIS_FRANCAIS[j + 1]} : {valeur:,.2f}€ (moyenne : {moyenne:,.2f}€)".replace(",", " ")
+            # On retourne maintenant un dictionnaire avec le texte ET la catégorie
+            anomalies.append({'text': anomalie_text, 'categorie': cat})
+
         return sorted(anomalies, key=lambda x: x['text'])
 
 
@@ -97,36 +231,78 @@ class CategorizationAI:
     def analyser_tendances(self, data_by_cat):
         """Analyse les données pour trouver des tendances à la hausse ou à la baisse."""
         tendances = []
-        for cat, monthly_data in data_by_cat.items():
-            # On crée une liste de points (mois, valeur) pour les mois avec des données
-            points = [(m, v) for m, v in monthly_data.items() if v > 0]
-            
-            # Il faut au moins 6 points pour qu'une tendance soit significative
-            if len(points) < 6:
-                continue
+        categories, matrice = self.construire_matrice(data_by_cat)
+        if not categories: return tendances
 
-            # Calcul de la régression linéaire simple (pente de la droite de tendance)
-            n = len(points)
-            sum_x = sum(p[0] for p in points)
-            sum_y = sum(p[1] for p in points)
-            sum_xy = sum(p[0] * p[1] for p in points)
-            sum_x_sq = sum(p[0]**2 for p in points)
-            
-            try:
-                pente = (n * sum_xy - sum_x * sum_y) / (n * sum_x_sq - sum_x**2)
-            except ZeroDivisionError:
-                continue
+        # Régression linéaire par moindres carrés sur les mois renseignés, pour toutes les catégories à la fois
+        masque = matrice > 0
+        x = np.arange(1, 13, dtype=float)
+        n = masque.sum(axis=1)
+        sum_x = (masque * x).sum(axis=1)
+        sum_y = (matrice * masque).sum(axis=1)
+        sum_xy = (matrice * masque * x).sum(axis=1)
+        sum_x_sq = (masque * x ** 2).sum(axis=1)
+        denominateur = n * sum_x_sq - sum_x ** 2
 
-            # On interprète la pente
-            variation_annuelle = pente * 12
+        # Il faut au moins 6 points pour qu'une tendance soit significative
+        valides = (n >= 6) & (denominateur != 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pentes = np.where(valides, (n * sum_xy - sum_x * sum_y) / np.where(denominateur != 0, denominateur, 1), 0.0)
             # Seuil de significativité : si la variation sur l'année est > 10% de la moyenne
-            seuil_significatif = sum_y / n * 0.1 
+            seuils = np.where(n > 0, sum_y / np.maximum(n, 1) * 0.1, 0.0)
+        variations_annuelles = pentes * 12
+
+        for i in np.nonzero(valides)[0]:
+            cat, pente = categories[i], pentes[i]
+            if variations_annuelles[i] > seuils[i]:
+                tendances.append(f"-> Tendance '{cat}' : En hausse (environ +{pente:,.2f} €/mois)".replace(",", " "))
+            elif variations_annuelles[i] < -seuils[i]:
+                tendances.append(f"-> Tendance '{cat}' : En baisse (environ {pente:,.2f} €/mois)".replace(",", " "))
+
+        return sorted(tendances)
+
+    def comparer_annees(self, data_by_year, annee):
+        """Compare l'année donnée aux années précédentes : variations sur un an et saisonnalité par catégorie.
+        data_by_year est un dictionnaire {année: {catégorie: {mois: montant}}}. Un mois n'est observé pour une année
+        que si elle a des données ce mois-là : une année en cours est comparée à la même période de l'année précédente,
+        et les mois non encore observés ne comptent pas dans la saisonnalité."""
+        observations = []
+        annees = sorted(a for a in data_by_year if a <= annee)
+        if annee not in data_by_year or len(annees) < 2: return observations
+
+        categories = sorted({cat for a in annees for cat in data_by_year[a]})
+        index_cat = {cat: i for i, cat in enumerate(categories)}
+        cube = np.zeros((len(annees), len(categories), 12))
+        observes = np.zeros((len(annees), 12), dtype=bool) # (année, mois) ayant au moins une donnée
+        for k, a in enumerate(annees):
+            for cat, monthly_data in data_by_year[a].items():
+                for month_num, valeur in monthly_data.items():
+                    cube[k, index_cat[cat], month_num - 1] += valeur
+                    observes[k, month_num - 1] = True
+
+        # Variations d'une année sur l'autre, sur les mois observés de l'année donnée
+        mois_compares = observes[-1]
+        totaux = cube[:, :, mois_compares].sum(axis=2)
+        courant, precedent = totaux[-1], totaux[-2]
+        annee_prec = annees[-2]
+        periode = "" if mois_compares.all() else " (même période)"
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variations_pct = np.where(precedent > 0, (courant - precedent) / precedent * 100, np.nan)
+        significatives = (np.abs(courant - precedent) >= SEUIL_VARIATION_ANNUELLE_EUR) & (np.abs(np.nan_to_num(variations_pct, nan=100.0)) >= SEUIL_VARIATION_ANNUELLE_PCT)
+        for i in np.nonzero(significatives)[0]:
+            delta = courant[i] - precedent[i]
+            pct = "nouveau" if np.isnan(variations_pct[i]) else f"{variations_pct[i]:+.0f}%"
+            observations.append(f"-> '{categories[i]}' vs {annee_prec}{periode} : {delta:+,.2f}€ ({pct})".replace(",", " "))
 
-            if variation_annuelle > seuil_significatif:
-                tendance_str = f"-> Tendance '{cat}' : En hausse (environ +{pente:,.2f} €/mois)".replace(",", " ")
-                tendances.append(tendance_str)
-            elif variation_annuelle < -seuil_significatif:
-                tendance_str = f"-> Tendance '{cat}' : En baisse (environ {pente:,.2f} €/mois)".replace(",", " ")
-                tendances.append(tendance_str)
+        # Saisonnalité : moyenne de chaque mois sur les années qui l'ont observé, rapportée à la moyenne mensuelle de la catégorie
+        if len(annees) >= 3:
+            nb_observations = observes.sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                profil = np.where(nb_observations > 0, cube.sum(axis=0) / nb_observations, np.nan)
+                moyennes = np.nanmean(profil, axis=1)
+                indices = np.nan_to_num(np.where(moyennes[:, None] > 0, profil / moyennes[:, None], 0.0), nan=0.0)
+            mois_pic = indices.argmax(axis=1)
+            for i in np.nonzero(indices.max(axis=1) >= SEUIL_SAISONNALITE)[0]:
+                observations.append(f"-> Saisonnalité '{categories[i]}' : pic en {MOIS_FRANCAIS[mois_pic[i] + 1]} (x{indices[i, mois_pic[i]]:.1f} la moyenne mensuelle sur {len(annees)} ans)")
 
-        return sorted(tendances)
\ No newline at end of file
+        return observations
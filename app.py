@@ -12,25 +12,33 @@ import os
 import traceback
 import shutil
 from datetime import date, datetime, timedelta
-import matplotlib.dates as mdates
 from collections import defaultdict
 import csv
 from tkinter import filedialog
 import uuid
 import copy
 import calendar
+import importlib.util
 from models import Compte, LignePortefeuille
 from utils import format_nombre_fr
 from ui_components import (ConflictStrategyDialog, TemplateManagerWindow,
                            ApplyTemplateDialog, VirementDialog, RecurrentTransactionManager,
                            DetailPrevisionnelWindow, DailyBudgetCalendarDialog,
                            HoldingEditDialog, PortfolioManagerWindow, RapportMensuelWindow,
-                           SelectFromListDialog, TransactionDialog, RapportVariationPatrimoineWindow)
-from services import SqlDataManager, GraphManager
+                           SelectFromListDialog, TransactionDialog, RapportVariationPatrimoineWindow,
+                           RapprochementWindow)
+from services import SqlDataManager, GraphManager, ConflitDeVersion
+from series_patrimoine import HistorySeries
+from variation_patrimoine import ServiceVariationPatrimoine
+from registre_categories import RegistreCategories
+from cycles_carte import CyclesCarte
+from frame_transactions import TransactionFrame
+from import_csv import RapportImport, ErreurFichierImport, lire_csv, colonne, normaliser_nombres, normaliser_dates
 from ai_service import CategorizationAI
 from market_service import MarketDataService
-from rapport_annuel import YearlyReportApp
-from comparateur_patrimoine import ComparateurPatrimoineApp
+from journalisation import get_logger
+
+log = get_logger('app')
 
 try:
     import sv_ttk
@@ -39,16 +47,12 @@ except ImportError:
     sv_ttk = None
 
 
-try:
-    import matplotlib
-    matplotlib.use('TkAgg')
-    import matplotlib.pyplot as plt
-    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-    from matplotlib.figure import Figure
-    MATPLOTLIB_AVAILABLE = True
-    print("INFO: Matplotlib trouvé et importé.")
-except ImportError:
-    MATPLOTLIB_AVAILABLE = False
+# Matplotlib est lourd à importer : on vérifie seulement sa présence ici, GraphManager
+# l'importe à la création du premier graphique affiché.
+MATPLOTLIB_AVAILABLE = importlib.util.find_spec("matplotlib") is not None
+if MATPLOTLIB_AVAILABLE:
+    print("INFO: Matplotlib trouvé (chargé au premier graphique affiché).")
+else:
     print("ATTENTION : Matplotlib n'est pas installé.")
 
 class PatrimoineApp:
@@ -71,14 +75,18 @@ class PatrimoineApp:
             self.base_dir = base_dir # On ajoute la ligne qui mémorise le répertoire
             db_path = os.path.join(self.base_dir, "budget.db") # On corrige la création du chemin
             self.data_manager = SqlDataManager(db_path)
+            self.registre_categories = RegistreCategories(self.data_manager)
 
             settings = self.data_manager.charger_parametres()
-            self.comptes, self.historique_patrimoine = self.data_manager.charger_donnees()
-            self.budget_data = self.data_manager.charger_budget_donnees()
+            self.comptes, self.historique_patrimoine, self.budget_data = self.data_manager.charger_donnees_demarrage()
+            self.dates_historique_modifiees = set() # Instantanés à réécrire à la prochaine sauvegarde
+            self._frame_partagee = None # TransactionFrame du budget partagée par les vues pendant mettre_a_jour_toutes_les_vues
             
+            # L'apprentissage se fait en arrière-plan : tant qu'il n'est pas terminé,
+            # suggest_category ne propose simplement rien.
             self.ai_service = CategorizationAI()
             all_transactions = self._get_all_transactions()
-            self.ai_service.train(all_transactions)
+            threading.Thread(target=self.ai_service.train, args=(all_transactions,), daemon=True).start()
             
             self.market_service = MarketDataService()
             
@@ -94,32 +102,40 @@ class PatrimoineApp:
             self.dernier_tri_reverse = False
             self.bouton_actualiser_cours = None
 
-            main_notebook = ttk.Notebook(root)
-            main_notebook.pack(expand=True, fill='both', padx=5, pady=5)
-            self.patrimoine_tab_frame = ttk.Frame(main_notebook)
-            self.budget_tab_frame = ttk.Frame(main_notebook)
-            main_notebook.add(self.patrimoine_tab_frame, text='Patrimoine')
-            main_notebook.add(self.budget_tab_frame, text='Budget Mensuel')
+            self.main_notebook = ttk.Notebook(root)
+            self.main_notebook.pack(expand=True, fill='both', padx=5, pady=5)
+            self.patrimoine_tab_frame = ttk.Frame(self.main_notebook)
+            self.budget_tab_frame = ttk.Frame(self.main_notebook)
+            self.main_notebook.add(self.patrimoine_tab_frame, text='Patrimoine')
+            self.main_notebook.add(self.budget_tab_frame, text='Budget Mensuel')
             
             self.creer_widgets_patrimoine()
             self.creer_widgets_budget()
             
             if MATPLOTLIB_AVAILABLE:
-                figures_axes_canvases = {
-                    'camembert_classe': {'fig': self.fig_camembert_classe, 'ax': self.ax_camembert_classe, 'canvas': self.canvas_camembert_classe},
-                    'banque': {'fig': self.fig_banque, 'ax': self.ax_banque, 'canvas': self.canvas_banque},
-                    'historique': {'fig': self.fig_historique, 'ax': self.ax_historique, 'canvas': self.canvas_historique},
-                    'historique_perso': {'fig': self.fig_historique_perso, 'ax': self.ax_historique_perso, 'canvas': self.canvas_historique_perso},
-                    'depenses': {'fig': self.fig_depenses, 'ax': self.ax_depenses, 'canvas': self.canvas_depenses},
-                    'recettes': {'fig': self.fig_recettes, 'ax': self.ax_recettes, 'canvas': self.canvas_recettes},
-                    'evolution': {'fig': self.fig_evolution, 'ax': self.ax_evolution, 'canvas': self.canvas_evolution},
-                    'vs': {'fig': self.fig_vs, 'ax': self.ax_vs, 'canvas': self.canvas_vs}
+                # Pour chaque graphique : (onglet principal, notebook des graphiques, onglet, conteneur du canvas)
+                self.emplacements_graphiques = {
+                    'camembert_classe': (self.patrimoine_tab_frame, self.notebook_graphiques, self.tab_camembert_classe, self.tab_camembert_classe),
+                    'banque': (self.patrimoine_tab_frame, self.notebook_graphiques, self.tab_banque, self.tab_banque),
+                    'historique': (self.patrimoine_tab_frame, self.notebook_graphiques, self.tab_historique, self.tab_historique),
+                    'historique_perso': (self.patrimoine_tab_frame, self.notebook_graphiques, self.tab_historique_perso, self.graph_frame_hist),
+                    'depenses': (self.budget_tab_frame, self.notebook_budget_graphs, self.tab_graph_depenses, self.tab_graph_depenses),
+                    'recettes': (self.budget_tab_frame, self.notebook_budget_graphs, self.tab_graph_recettes, self.tab_graph_recettes),
+                    'evolution': (self.budget_tab_frame, self.notebook_budget_graphs, self.tab_graph_evolution, self.tab_graph_evolution),
+                    'vs': (self.budget_tab_frame, self.notebook_budget_graphs, self.tab_graph_vs, self.tab_graph_vs)
                 }
-                self.graph_manager = GraphManager(figures_axes_canvases)
+                conteneurs = {nom: emplacement[3] for nom, emplacement in self.emplacements_graphiques.items()}
+                self.graph_manager = GraphManager(conteneurs, est_visible=self._graphique_visible)
+                for notebook in (self.main_notebook, self.notebook_graphiques, self.notebook_budget_graphs):
+                    notebook.bind("<<NotebookTabChanged>>", lambda e: self.graph_manager.afficher_en_attente(), add="+")
             else:
                 self.graph_manager = None
 
-            self.mettre_a_jour_toutes_les_vues()
+            # Démarrage en deux temps : la fenêtre s'affiche d'abord avec la liste des comptes et les totaux,
+            # la projection budgétaire et les graphiques sont calculés dès que la boucle Tk est disponible.
+            self.mettre_a_jour_liste()
+            self.calculer_et_afficher_patrimoine()
+            self.root.after_idle(self.mettre_a_jour_toutes_les_vues)
             
             print("INFO: __init__ - Initialisation terminée.")
 
@@ -134,7 +150,15 @@ class PatrimoineApp:
         if sv_ttk:
             theme = self.theme_var.get()
             sv_ttk.set_theme(theme)
-            self.data_manager.sauvegarder_parametres({"theme": theme})
+            settings = self.data_manager.charger_parametres()
+            settings["theme"] = theme
+            self.data_manager.sauvegarder_parametres(settings)
+
+    def _graphique_visible(self, nom):
+        """Indique si l'onglet du graphique 'nom' est celui affiché, dans son notebook et dans le notebook principal."""
+        onglet_principal, notebook, onglet, _ = self.emplacements_graphiques[nom]
+        return (self.main_notebook.select() == str(onglet_principal)
+                and notebook.select() == str(onglet))
 
     def creer_widgets_patrimoine(self):
         menubar = tk.Menu(self.root)
@@ -151,6 +175,8 @@ class PatrimoineApp:
         file_menu.add_command(label="Exporter Historique (CSV)...", command=self.exporter_csv_historique)
         file_menu.add_command(label="Importer Historique (CSV)...", command=self.importer_csv_historique)
         file_menu.add_separator()
+        file_menu.add_command(label="Importer un Relevé Bancaire (CSV)...", command=self.importer_releve_bancaire)
+        file_menu.add_separator()
         file_menu.add_command(label="Quitter", command=self.on_closing)
         
         tools_menu = tk.Menu(menubar, tearoff=0)
@@ -158,11 +184,12 @@ class PatrimoineApp:
         tools_menu.add_command(label="Gérer les Transactions Récurrentes...", command=self.ouvrir_gestion_transactions_recurrentes)
         tools_menu.add_command(label="Détecter les récurrences...", command=self.lancer_detection_recurrences)
         tools_menu.add_command(label="Fusionner des Catégories de Budget...", command=self.ouvrir_fenetre_fusion_categories)
+        tools_menu.add_command(label="Annuler la Dernière Fusion de Catégories", command=self.annuler_derniere_fusion_categories)
         tools_menu.add_separator()
         tools_menu.add_command(label="Ouvrir le Tableau de Bord Annuel...", command=self.ouvrir_rapport_annuel)
         tools_menu.add_command(label="Comparer des périodes...", command=self.ouvrir_comparateur)
         tools_menu.add_separator()
-        tools_menu.add_command(label="Purger les anciennes transactions...", command=self.ouvrir_fenetre_purge_transactions)
+        tools_menu.add_command(label="Archiver les anciennes données du budget...", command=self.ouvrir_fenetre_purge_transactions)
 
         options_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Options", menu=options_menu)
@@ -242,15 +269,6 @@ class PatrimoineApp:
         self.notebook_graphiques.add(self.tab_banque, text='Actifs par Banque')
         self.notebook_graphiques.add(self.tab_historique, text='Évolution Patrimoine')
         self.notebook_graphiques.pack(expand=True, fill='both')
-        self.canvas_camembert_classe = None
-        self.fig_camembert_classe = None
-        self.ax_camembert_classe = None
-        self.canvas_historique = None
-        self.fig_historique = None
-        self.ax_historique = None
-        self.canvas_banque = None
-        self.fig_banque = None
-        self.ax_banque = None
         
         self.tab_historique_perso = ttk.Frame(self.notebook_graphiques)
         self.notebook_graphiques.add(self.tab_historique_perso, text='Historique Personnalisé')
@@ -276,38 +294,14 @@ class PatrimoineApp:
             cb.pack(anchor=tk.NW, padx=5)
             self.vars_comptes_historique[compte.nom] = var
 
-        graph_frame_hist = ttk.Frame(pane_hist_perso)
-        pane_hist_perso.add(graph_frame_hist, weight=4)
+        self.graph_frame_hist = ttk.Frame(pane_hist_perso)
+        pane_hist_perso.add(self.graph_frame_hist, weight=4)
 
-        if MATPLOTLIB_AVAILABLE:
-            self.fig_historique_perso = Figure(figsize=(5, 4), dpi=100)
-            self.ax_historique_perso = self.fig_historique_perso.add_subplot(111)
-            self.canvas_historique_perso = FigureCanvasTkAgg(self.fig_historique_perso, master=graph_frame_hist)
-            self.canvas_historique_perso.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-        else:
-            ttk.Label(graph_frame_hist, text="Graphique indisponible.", justify=tk.CENTER).pack(padx=20, pady=50)
-        
-        if MATPLOTLIB_AVAILABLE:
-            try:
-                plt.ioff()
-                self.fig_camembert_classe, self.ax_camembert_classe = plt.subplots()
-                self.canvas_camembert_classe = FigureCanvasTkAgg(self.fig_camembert_classe, master=self.tab_camembert_classe)
-                self.canvas_camembert_classe.get_tk_widget().pack(side=tk.TOP,fill=tk.BOTH,expand=True)
-                
-                self.fig_banque, self.ax_banque = plt.subplots()
-                self.canvas_banque = FigureCanvasTkAgg(self.fig_banque, master=self.tab_banque)
-                self.canvas_banque.get_tk_widget().pack(side=tk.TOP,fill=tk.BOTH,expand=True)
-                
-                self.fig_historique, self.ax_historique = plt.subplots()
-                self.canvas_historique = FigureCanvasTkAgg(self.fig_historique, master=self.tab_historique)
-                self.canvas_historique.get_tk_widget().pack(side=tk.TOP,fill=tk.BOTH,expand=True)
-            except Exception as e:
-                print(f"ERREUR Init Graphiques: {e}")
-                self.canvas_camembert_classe = self.canvas_historique = self.canvas_banque = None
-        
-        if not self.canvas_camembert_classe: ttk.Label(self.tab_camembert_classe, text="Graphique indisponible.").pack(padx=20, pady=50)
-        if not self.canvas_banque: ttk.Label(self.tab_banque, text="Graphique indisponible.").pack(padx=20, pady=50)
-        if not self.canvas_historique: ttk.Label(self.tab_historique, text="Graphique indisponible.").pack(padx=20, pady=50)
+        # Les figures sont créées par GraphManager au premier affichage de leur onglet
+        if not MATPLOTLIB_AVAILABLE:
+            ttk.Label(self.graph_frame_hist, text="Graphique indisponible.", justify=tk.CENTER).pack(padx=20, pady=50)
+            for tab in [self.tab_camembert_classe, self.tab_banque, self.tab_historique]:
+                ttk.Label(tab, text="Graphique indisponible.").pack(padx=20, pady=50)
 
     def creer_widgets_budget(self):
         alertes_frame = ttk.Frame(self.budget_tab_frame, padding="10 5")
@@ -448,6 +442,7 @@ class PatrimoineApp:
         ttk.Button(transactions_buttons_frame, text="Solder Carte Différée", command=self.solder_carte_differee).pack(side=tk.LEFT, padx=5)
         ttk.Separator(transactions_buttons_frame, orient=tk.VERTICAL).pack(side=tk.LEFT, padx=(15, 5), fill='y')
         ttk.Button(transactions_buttons_frame, text="Pointer Sélection", command=self.pointer_transactions).pack(side=tk.LEFT)
+        ttk.Button(transactions_buttons_frame, text="Rapprocher un Relevé...", command=self.ouvrir_fenetre_rapprochement).pack(side=tk.LEFT, padx=5)
         self.afficher_pointees_var = tk.BooleanVar(value=False)
         show_pointed_check = ttk.Checkbutton(transactions_buttons_frame, text="Afficher les pointées", variable=self.afficher_pointees_var, command=self.mettre_a_jour_toutes_les_vues)
         show_pointed_check.pack(side=tk.RIGHT, padx=5)
@@ -466,23 +461,7 @@ class PatrimoineApp:
         self.notebook_budget_graphs.add(self.tab_graph_evolution, text="Évolution")
         self.notebook_budget_graphs.add(self.tab_graph_vs, text="Budget/Réalisé")
 
-        if MATPLOTLIB_AVAILABLE:
-            self.fig_depenses, self.ax_depenses = plt.subplots()
-            self.canvas_depenses = FigureCanvasTkAgg(self.fig_depenses, master=self.tab_graph_depenses)
-            self.canvas_depenses.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-
-            self.fig_recettes, self.ax_recettes = plt.subplots()
-            self.canvas_recettes = FigureCanvasTkAgg(self.fig_recettes, master=self.tab_graph_recettes)
-            self.canvas_recettes.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-
-            self.fig_evolution, self.ax_evolution = plt.subplots()
-            self.canvas_evolution = FigureCanvasTkAgg(self.fig_evolution, master=self.tab_graph_evolution)
-            self.canvas_evolution.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-
-            self.fig_vs, self.ax_vs = plt.subplots()
-            self.canvas_vs = FigureCanvasTkAgg(self.fig_vs, master=self.tab_graph_vs)
-            self.canvas_vs.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        else:
+        if not MATPLOTLIB_AVAILABLE:
             for tab in [self.tab_graph_depenses, self.tab_graph_recettes, self.tab_graph_evolution, self.tab_graph_vs]:
                 ttk.Label(tab, text="Matplotlib non disponible.").pack()
 
@@ -497,44 +476,29 @@ class PatrimoineApp:
             annee_selectionnee = int(self.budget_annee_var.get())
             mois_selectionne = int(self.budget_mois_var.get())
             cle_mois_annee = f"{annee_selectionnee:04d}-{mois_selectionne:02d}"
-            date_fin_mois_selectionne = (date(annee_selectionnee, mois_selectionne, 28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            date(annee_selectionnee, mois_selectionne, 1) # Lève ValueError si le mois est invalide
         except (ValueError, TypeError):
             return
 
         if cle_mois_annee not in self.budget_data:
             self.budget_data[cle_mois_annee] = {'categories_prevues': [], 'transactions': []}
 
-        self.generer_transactions_recurrentes_pour_le_mois(annee_selectionnee, mois_selectionne)
+        if self.generer_transactions_recurrentes_pour_le_mois(annee_selectionnee, mois_selectionne) and self._frame_partagee is not None:
+            self._frame_partagee = TransactionFrame.depuis_budget(self.budget_data) # Occurrences générées à l'instant
     
         comptes_suivis_budget = [c for c in self.comptes if c.suivi_budget]
         tresorerie_pointee_correcte = sum(c.solde if c.type_compte == 'Actif' else -abs(c.solde) for c in comptes_suivis_budget)
     
-        toutes_les_transactions = self._get_all_transactions()
-    
-        # --- CORRECTION MAJEURE : Logique de calcul du montant en attente ---
-        montant_attente_correct = 0.0
-        transactions_du_mois_budgetaire = []
-    
-        for t in toutes_les_transactions:
-            try:
-                date_a_utiliser_str = t.get('date_budgetaire') or t.get('date')
-                date_a_utiliser = datetime.strptime(date_a_utiliser_str, "%Y-%m-%d").date()
-
-                # Calcul du "En attente" : toute transaction non pointée dont la date budgétaire est passée ou dans le mois courant
-                if not t.get('pointe', False) and date_a_utiliser <= date_fin_mois_selectionne:
-                    montant_attente_correct += t.get('montant', 0.0)
-
-                # Liste des transactions à afficher ce mois-ci
-                if date_a_utiliser.year == annee_selectionnee and date_a_utiliser.month == mois_selectionne:
-                    transactions_du_mois_budgetaire.append(t)
-            except (ValueError, TypeError):
-                continue
-        # --- FIN DE LA CORRECTION MAJEURE ---
+        # "En attente" : toute transaction non pointée dont la date budgétaire est passée ou dans le mois courant
+        frame = self._frame_budget()
+        montant_attente_correct = float(frame.montant[~frame.pointe & frame.jusqu_au_mois_budgetaire(cle_mois_annee)].sum())
 
+        # Transactions à afficher ce mois-ci et réalisé par catégorie
+        du_mois_budgetaire = frame.du_mois_budgetaire(cle_mois_annee)
+        transactions_du_mois_budgetaire = frame.transactions_selon(du_mois_budgetaire)
         realise_par_categorie = defaultdict(float)
-        for trans in transactions_du_mois_budgetaire:
-            if trans.get('categorie') != "(Virement)":
-                realise_par_categorie[trans.get('categorie', '(Non assigné)')] += trans.get('montant', 0.0)
+        for cat_nom, montant in frame.somme_par_categorie(du_mois_budgetaire & frame.hors_virements()).items():
+            realise_par_categorie[cat_nom if cat_nom is not None else '(Non assigné)'] += montant
 
         solde_virtuel_correct = tresorerie_pointee_correcte + montant_attente_correct
 
@@ -644,26 +608,38 @@ class PatrimoineApp:
         detail_message += f"TOTAL POINTÉ : {format_nombre_fr(total)} €"
         messagebox.showinfo("Détail Trésorerie Pointée", detail_message, parent=self.root)
 
+    def _afficher_rapport_import(self, titre, rapport, **libelles):
+        """Résumé d'un import ; propose d'enregistrer le détail quand toutes les erreurs ne tiennent pas dans le message."""
+        messagebox.showinfo(titre, rapport.resume(**libelles), parent=self.root)
+        if len(rapport.erreurs) > 5 and messagebox.askyesno(titre, f"Enregistrer le détail des {len(rapport.erreurs)} lignes en erreur ?", parent=self.root):
+            chemin = filedialog.asksaveasfilename(title="Enregistrer le rapport d'erreurs", defaultextension=".csv", filetypes=[("Fichiers CSV (*.csv)", "*.csv")], initialfile="rapport_import_erreurs.csv", parent=self.root)
+            if chemin: rapport.exporter_erreurs(chemin)
+
+    def _demander_strategie_conflits(self, titre, potential_conflicts):
+        """Stratégie de ConflictStrategyDialog ('ask_each' sans conflit), ou None si l'import est annulé."""
+        if potential_conflicts == 0: return "ask_each"
+        strategy = ConflictStrategyDialog(self.root, title=titre, potential_conflicts=potential_conflicts).result
+        if strategy is None:
+            messagebox.showinfo("Import Annulé", "Importation annulée.", parent=self.root)
+        return strategy
+
     def importer_csv_historique(self):
         filename = filedialog.askopenfilename(title="Ouvrir un fichier CSV d'historique", filetypes=[("Fichiers CSV (*.csv)", "*.csv"), ("Tous les fichiers (*.*)", "*.*")])
         if not filename: return
-        entrees_ajoutees, entrees_mises_a_jour, lignes_ignorees, modifications_effectuees = 0, 0, 0, False
-        erreurs_detaillees = []
         expected_headers = ["Date", "Patrimoine Net", "Total Actifs", "Total Passifs Magnitude"]
+        rapport = RapportImport()
         try:
-            lignes_csv_temp = []
-            header = None
-            with open(filename, 'r', newline='', encoding='utf-8-sig') as f_csv:
-                reader = csv.reader(f_csv, delimiter=';')
-                header = next(reader, None)
-                if header is None:
-                    messagebox.showerror("Erreur Fichier", "CSV historique vide.", parent=self.root)
-                    return
-                if header[:len(expected_headers)] != expected_headers:
-                    messagebox.showerror("Erreur En-tête CSV", f"En-têtes incorrects.\nAttendu: {';'.join(expected_headers)}\nObtenu: {';'.join(header)}", parent=self.root)
-                    return
-                for row in reader: lignes_csv_temp.append(row)
-            if not lignes_csv_temp:
+            # Index date -> position : chaque conflit se résout par une recherche dans un dictionnaire
+            index_par_date = {snap.get('date'): i for i, snap in enumerate(self.historique_patrimoine)}
+
+            # 1er passage en flux sur la seule colonne Date pour compter les conflits
+            header, lots = lire_csv(filename, expected_headers, mode='prefixe')
+            nb_lignes, potential_conflicts = 0, 0
+            for lot in lots:
+                dates_iso, valides = normaliser_dates(colonne(lot, 0))
+                nb_lignes += len(lot)
+                potential_conflicts += sum(1 for d in dates_iso[valides] if d in index_par_date)
+            if nb_lignes == 0:
                 messagebox.showinfo("Import Historique", "Aucune donnée après en-tête.", parent=self.root)
                 return
             map_classe_col = {}
@@ -671,81 +647,72 @@ class PatrimoineApp:
                 if col_name.startswith("Classe:"):
                     classe_name = col_name.split(":", 1)[1]
                     if classe_name in Compte.CLASSE_ACTIF_CHOICES: map_classe_col[classe_name] = i
-            potential_conflicts = sum(1 for row in lignes_csv_temp if len(row) >= 1 and row[0].strip() and any(snap.get('date') == datetime.strptime(row[0].strip(), "%Y-%m-%d").strftime("%Y-%m-%d") for snap in self.historique_patrimoine))
-            strategy = "ask_each"
-            if potential_conflicts > 0:
-                dialog = ConflictStrategyDialog(self.root, title="Stratégie d'Import Historique", potential_conflicts=potential_conflicts)
-                strategy = dialog.result
-                if strategy is None:
-                    messagebox.showinfo("Import Annulé", "Importation annulée.", parent=self.root)
-                    return
-            for num_ligne, row in enumerate(lignes_csv_temp, start=2):
-                if len(row) < len(expected_headers):
-                    erreurs_detaillees.append(f"L{num_ligne}: Pas assez de colonnes.")
-                    lignes_ignorees += 1
-                    continue
-                try:
-                    date_str = row[0].strip()
-                    pn_str = row[1].strip().replace(' ', '').replace(',', '.')
-                    ta_str = row[2].strip().replace(' ', '').replace(',', '.')
-                    tp_str = row[3].strip().replace(' ', '').replace(',', '.')
-                    if not date_str:
-                        erreurs_detaillees.append(f"L{num_ligne}: Date manquante.")
-                        lignes_ignorees += 1
+            strategy = self._demander_strategie_conflits("Stratégie d'Import Historique", potential_conflicts)
+            if strategy is None: return
+
+            # 2nd passage : normalisation vectorisée par lot, instantanés retenus accumulés pour une seule écriture
+            instantanes_retenus = {}
+            _, lots = lire_csv(filename, expected_headers, mode='prefixe')
+            for lot in lots:
+                dates_iso, dates_ok = normaliser_dates(colonne(lot, 0))
+                nombres = [normaliser_nombres(colonne(lot, i)) for i in (1, 2, 3)]
+                classes = {classe_name: normaliser_nombres(colonne(lot, col_idx), vide=None) for classe_name, col_idx in map_classe_col.items()}
+                for k, (num_ligne, row) in enumerate(lot):
+                    if len(row) < len(expected_headers):
+                        rapport.erreur(num_ligne, row[0].strip(), "Pas assez de colonnes.")
+                        continue
+                    if not dates_ok[k]:
+                        rapport.erreur(num_ligne, row[0].strip(), "Date manquante ou invalide (attendu AAAA-MM-JJ ou JJ/MM/AAAA).")
+                        continue
+                    colonnes_invalides = [expected_headers[j + 1] for j, (_, valides) in enumerate(nombres) if not valides[k]]
+                    if colonnes_invalides:
+                        rapport.erreur(num_ligne, row[0].strip(), f"Format nombre invalide ({', '.join(colonnes_invalides)}).")
                         continue
-                    date_obj_norm = datetime.strptime(date_str, "%Y-%m-%d").strftime("%Y-%m-%d")
-                    pn_val = float(pn_str) if pn_str else 0.0
-                    ta_val = float(ta_str) if ta_str else 0.0
-                    tp_val = float(tp_str) if tp_str else 0.0
-                    repartition_actifs_csv = {}
-                    for classe_name, col_idx in map_classe_col.items():
-                        if col_idx < len(row) and row[col_idx].strip():
-                            try: repartition_actifs_csv[classe_name] = float(row[col_idx].strip().replace(' ', '').replace(',', '.'))
-                            except ValueError: erreurs_detaillees.append(f"L{num_ligne}: Format nombre invalide pour {header[col_idx]} ('{row[col_idx]}').")
+                    date_obj_norm = str(dates_iso[k])
+                    pn_val, ta_val, tp_val = (float(valeurs[k]) for valeurs, _ in nombres)
+                    repartition_actifs_csv = {classe_name: float(valeurs[k]) for classe_name, (valeurs, valides) in classes.items() if valides[k]}
                     nouvel_instantane = {'date': date_obj_norm, 'patrimoine_net': pn_val, 'total_actifs': ta_val, 'total_passifs_magnitude': tp_val, 'repartition_actifs_par_classe': repartition_actifs_csv}
-                    index_existant = next((i for i, snap in enumerate(self.historique_patrimoine) if snap.get('date') == date_obj_norm), -1)
-                    appliquer_maj = False
-                    if index_existant != -1:
-                        if strategy == "update_all": appliquer_maj = True
-                        elif strategy == "skip_all":
-                            lignes_ignorees += 1
+                    if date_obj_norm in instantanes_retenus:
+                        rapport.erreur(num_ligne, row[0].strip(), "Date en double dans le fichier.")
+                        continue
+                    index_existant = index_par_date.get(date_obj_norm)
+                    if index_existant is not None:
+                        if strategy == "skip_all":
+                            rapport.ignores += 1
                             continue
-                        elif strategy == "ask_each":
+                        if strategy == "ask_each":
                             ancien_snap = self.historique_patrimoine[index_existant]
                             msg_upd = (f"Instantané existe pour {date_obj_norm}:\nAnc.Net: {format_nombre_fr(ancien_snap.get('patrimoine_net', 0))} €\nNouv.Net: {format_nombre_fr(pn_val)} €\nRemplacer?")
                             choix = messagebox.askyesnocancel("Remplacer Instantané?", msg_upd, parent=self.root)
-                            if choix is True: appliquer_maj = True
-                            elif choix is False:
-                                lignes_ignorees += 1
+                            if choix is False:
+                                rapport.ignores += 1
                                 continue
-                            else:
+                            if choix is None:
                                 messagebox.showinfo("Import Annulé", "Importation annulée.", parent=self.root)
                                 return
-                        if appliquer_maj:
-                            self.historique_patrimoine[index_existant] = nouvel_instantane
-                            entrees_mises_a_jour += 1
-                            modifications_effectuees = True
+                        rapport.mis_a_jour += 1
                     else:
-                        self.historique_patrimoine.append(nouvel_instantane)
-                        entrees_ajoutees += 1
-                        modifications_effectuees = True
-                except ValueError as ve:
-                    erreurs_detaillees.append(f"L{num_ligne} ('{row[0]}'): Format date/nombre invalide - {ve}.")
-                    lignes_ignorees += 1
-                except Exception as ex_row:
-                    erreurs_detaillees.append(f"L{num_ligne} ('{row[0]}'): Erreur - {ex_row}.")
-                    lignes_ignorees += 1
-            
-            if modifications_effectuees:
+                        index_par_date[date_obj_norm] = len(self.historique_patrimoine) + len(instantanes_retenus)
+                        rapport.ajoutes += 1
+                    instantanes_retenus[date_obj_norm] = nouvel_instantane
+
+            if instantanes_retenus:
+                # Une seule transaction SQL pour tout le fichier
+                self.data_manager.importer_instantanes(list(instantanes_retenus.values()))
+                for date_obj_norm, nouvel_instantane in instantanes_retenus.items():
+                    index_existant = index_par_date[date_obj_norm]
+                    if index_existant < len(self.historique_patrimoine): self.historique_patrimoine[index_existant] = nouvel_instantane
+                    else: self.historique_patrimoine.append(nouvel_instantane)
+                # Les instantanés importés sont déjà en base : la rétention examine leurs mois tout de suite
+                politique = self.data_manager.charger_parametres().get("retention_historique")
+                supprimees = set(self.data_manager.appliquer_retention(politique, instantanes_retenus.keys()))
+                if supprimees:
+                    self.historique_patrimoine = [snap for snap in self.historique_patrimoine if snap.get('date') not in supprimees]
                 self.historique_patrimoine.sort(key=lambda x: x.get('date', ''))
                 if self.graph_manager:
-                    self.graph_manager.update_historique_patrimoine(self.historique_patrimoine)
-            
-            summary = (f"Terminé.\nAjoutées: {entrees_ajoutees}\nMis à jour: {entrees_mises_a_jour}\nIgnorées: {lignes_ignorees}")
-            if erreurs_detaillees: summary += "\n\nErreurs (premières 5):\n" + "\n".join(erreurs_detaillees[:5])
-            if len(erreurs_detaillees) > 5: summary += f"\n...et {len(erreurs_detaillees) - 5} autres."
-            messagebox.showinfo("Rapport Import Historique", summary, parent=self.root)
-            if modifications_effectuees: messagebox.showinfo("Sauvegarde", "N'oubliez pas de sauvegarder.", parent=self.root)
+                    self.graph_manager.update_historique_patrimoine(HistorySeries.depuis_historique(self.historique_patrimoine))
+            self._afficher_rapport_import("Rapport Import Historique", rapport, libelle_ajoutes="Ajoutées", libelle_ignores="Ignorées")
+        except ErreurFichierImport as e: messagebox.showerror("Erreur Fichier", str(e), parent=self.root)
         except FileNotFoundError: messagebox.showerror("Erreur", f"Fichier non trouvé: {filename}", parent=self.root)
         except Exception as e:
             messagebox.showerror("Erreur Importation Majeure", f"Erreur: {e}", parent=self.root)
@@ -820,8 +787,10 @@ class PatrimoineApp:
             self._set_item_open_state_recursive(top_level_item_iid, False)
 
     def _finalize_app(self):
-        if MATPLOTLIB_AVAILABLE:
-            plt.close('all')
+        self.data_manager.rafraichir_cache_demarrage()
+        # pyplot n'est chargé que si une fenêtre secondaire l'a utilisé
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
         print("INFO: Fermé.")
 
     def on_closing(self):
@@ -829,7 +798,7 @@ class PatrimoineApp:
         
         if reponse is True:
             self.sauvegarder_donnees()
-            self.sauvegarder_budget_donnees()
+            if not self.sauvegarder_budget_donnees(): return # Budget rechargé ou non enregistré : on ne quitte pas
             self._finalize_app()
             self.root.quit()
             self.root.destroy()
@@ -951,18 +920,42 @@ class PatrimoineApp:
             self.historique_patrimoine.append(nouvel_instantane)
         
         self.historique_patrimoine.sort(key=lambda x: x.get('date', ''))
-        self.nettoyer_historique()
+        self.dates_historique_modifiees.add(aujourdhui_str)
 
-        self.data_manager.sauvegarder_donnees(self.comptes, self.historique_patrimoine)
+        # Seuls les instantanés modifiés sont réécrits, puis la politique de rétention n'examine que leurs mois
+        self.data_manager.sauvegarder_donnees(self.comptes, self.historique_patrimoine, self.dates_historique_modifiees)
+        politique = self.data_manager.charger_parametres().get("retention_historique")
+        supprimees = set(self.data_manager.appliquer_retention(politique, self.dates_historique_modifiees))
+        self.dates_historique_modifiees = set()
+        if supprimees:
+            self.historique_patrimoine = [snap for snap in self.historique_patrimoine if snap.get('date') not in supprimees]
 
     def sauvegarder_donnees_menu(self):
         self.sauvegarder_donnees()
-        self.sauvegarder_budget_donnees()
+        if not self.sauvegarder_budget_donnees(): return
         messagebox.showinfo("Sauvegarde", "Données et instantané sauvegardés avec succès !", parent=self.root)
         self.mettre_a_jour_toutes_les_vues()
 
     def sauvegarder_budget_donnees(self):
-        self.data_manager.sauvegarder_budget_donnees(self.budget_data)
+        """
+        Réécrit le budget en base si personne d'autre ne l'a modifié depuis son chargement (application web,
+        génération des récurrences en arrière-plan). Sinon, propose de recharger le budget au lieu d'écraser
+        ces modifications. Retourne True si le budget a été enregistré.
+        """
+        try:
+            self.data_manager.sauvegarder_budget_donnees(self.budget_data, version_attendue=self.data_manager.version_chargee)
+        except ConflitDeVersion:
+            if messagebox.askyesno("Budget modifié ailleurs",
+                                   "Le budget a été modifié dans la base depuis son chargement (application web...).\n"
+                                   "L'enregistrer maintenant effacerait ces modifications.\n\n"
+                                   "Recharger le budget depuis la base ? Votre dernière modification sera perdue et devra être refaite.\n"
+                                   "(Non : rien n'est enregistré, le budget affiché n'est pas sauvegardé.)", parent=self.root):
+                self.budget_data = self.data_manager.charger_budget_donnees()
+                self.registre_categories.invalider()
+                self.root.after_idle(self.mettre_a_jour_toutes_les_vues) # Peut être appelé pendant un rafraîchissement
+            return False
+        self.registre_categories.invalider()
+        return True
 
     def calculer_et_afficher_patrimoine(self):
         patrimoine_net = 0.0
@@ -982,89 +975,70 @@ class PatrimoineApp:
     def importer_csv_comptes(self):
         filename = filedialog.askopenfilename(title="Ouvrir un fichier CSV de comptes", filetypes=[("Fichiers CSV (*.csv)", "*.csv"), ("Tous les fichiers (*.*)", "*.*")])
         if not filename: return
-        comptes_ajoutes, comptes_mis_a_jour, lignes_ignorees, modifications_effectuees = 0, 0, 0, False
-        erreurs_detaillees = []
         expected_headers = ["Nom du Compte", "Banque", "Type de Compte", "Solde", "Classe d'Actif", "Liquidité", "Terme du Passif", "Suivi Budget"]
+        rapport = RapportImport()
         try:
-            lignes_csv_temp = []
-            with open(filename, 'r', newline='', encoding='utf-8-sig') as f_csv:
-                reader = csv.reader(f_csv, delimiter=';')
-                header = next(reader, None)
-                if header is None:
-                    messagebox.showerror("Erreur Fichier", "CSV vide.", parent=self.root)
-                    return
-                if header != expected_headers:
-                    messagebox.showerror("Erreur En-tête", f"En-têtes CSV incorrects.\nAttendu: {';'.join(expected_headers)}\nObtenu: {';'.join(header)}", parent=self.root)
-                    return
-                for row in reader: lignes_csv_temp.append(row)
-            if not lignes_csv_temp:
+            # Index (nom, banque) -> compte, construit une fois pour tout le fichier
+            index_comptes = {(c.nom, c.banque): c for c in self.comptes}
+            header, lots = lire_csv(filename, expected_headers)
+            lots = list(lots) # Un fichier de comptes reste petit : on le garde pour compter les conflits avant d'appliquer
+            if not lots:
                 messagebox.showinfo("Import CSV", "Aucune donnée après en-tête.", parent=self.root)
                 return
-            potential_conflicts = sum(1 for r in lignes_csv_temp if len(r) == len(expected_headers) and any(c.nom == r[0].strip() and c.banque == r[1].strip() for c in self.comptes))
-            strategy = "ask_each"
-            if potential_conflicts > 0:
-                dialog = ConflictStrategyDialog(self.root, title="Stratégie d'Import Comptes", potential_conflicts=potential_conflicts)
-                strategy = dialog.result
-                if strategy is None:
-                    messagebox.showinfo("Import Annulé", "Importation annulée.", parent=self.root)
-                    return
-            for num_ligne, row in enumerate(lignes_csv_temp, start=2):
-                if len(row) != len(expected_headers):
-                    erreurs_detaillees.append(f"L{num_ligne}: Nb colonnes incorrect.")
-                    lignes_ignorees += 1
-                    continue
-                try:
+            potential_conflicts = sum(1 for lot in lots for _, r in lot if len(r) == len(expected_headers) and (r[0].strip(), r[1].strip()) in index_comptes)
+            strategy = self._demander_strategie_conflits("Stratégie d'Import Comptes", potential_conflicts)
+            if strategy is None: return
+            for lot in lots:
+                soldes, soldes_ok = normaliser_nombres(colonne(lot, 3), vide=None)
+                for k, (num_ligne, row) in enumerate(lot):
+                    if len(row) != len(expected_headers):
+                        rapport.erreur(num_ligne, row[0].strip(), "Nb colonnes incorrect.")
+                        continue
                     nom, banque, type_c, solde_s, classe_a, liq, ter_p, suivi_budget_str = map(str.strip, row)
                     if not all([nom, banque, type_c, solde_s]):
-                        erreurs_detaillees.append(f"L{num_ligne} ('{nom}'): Données manquantes.")
-                        lignes_ignorees += 1
+                        rapport.erreur(num_ligne, nom, "Données manquantes.")
+                        continue
+                    if not soldes_ok[k]:
+                        rapport.erreur(num_ligne, nom, f"Solde invalide ('{solde_s}').")
                         continue
-                    solde = float(solde_s.replace(' ', '').replace(',', '.'))
                     if type_c not in ["Actif", "Passif"]:
-                        erreurs_detaillees.append(f"L{num_ligne} ('{nom}'): Type '{type_c}' invalide.")
-                        lignes_ignorees += 1
+                        rapport.erreur(num_ligne, nom, f"Type '{type_c}' invalide.")
                         continue
+                    solde = float(soldes[k])
                     suivi_budget_val = suivi_budget_str.lower() == 'oui'
-                    compte_existant = next((c for c in self.comptes if c.nom == nom and c.banque == banque), None)
+                    compte_existant = index_comptes.get((nom, banque))
                     if compte_existant:
-                        appliquer_maj = False
-                        if strategy == "update_all": appliquer_maj = True
-                        elif strategy == "skip_all":
-                            lignes_ignorees += 1
+                        if strategy == "skip_all":
+                            rapport.ignores += 1
                             continue
-                        elif strategy == "ask_each":
+                        if strategy == "ask_each":
                             msg_upd = (f"Compte '{nom}' ({banque}) existe.\nActuel: {format_nombre_fr(compte_existant.solde)} €\nCSV: {format_nombre_fr(solde)} €\nMettre à jour?")
                             choix = messagebox.askyesnocancel("Mise à jour", msg_upd, parent=self.root)
-                            if choix is True: appliquer_maj = True
-                            elif choix is False:
-                                lignes_ignorees += 1
+                            if choix is False:
+                                rapport.ignores += 1
                                 continue
-                            else:
+                            if choix is None:
                                 messagebox.showinfo("Import Annulé", "Importation annulée.", parent=self.root)
                                 return
-                        if appliquer_maj:
-                            compte_existant.nom, compte_existant.banque, compte_existant.type_compte, compte_existant.solde = nom, banque, type_c, solde
-                            compte_existant.liquidite, compte_existant.classe_actif, compte_existant.terme_passif = liq, classe_a, ter_p
-                            compte_existant.suivi_budget = suivi_budget_val
-                            compte_existant.__init__(**compte_existant.to_dict())
-                            comptes_mis_a_jour += 1
-                            modifications_effectuees = True
+                        compte_existant.nom, compte_existant.banque, compte_existant.type_compte, compte_existant.solde = nom, banque, type_c, solde
+                        compte_existant.liquidite, compte_existant.classe_actif, compte_existant.terme_passif = liq, classe_a, ter_p
+                        compte_existant.suivi_budget = suivi_budget_val
+                        compte_existant.__init__(**compte_existant.to_dict())
+                        rapport.mis_a_jour += 1
                     else:
-                        self.comptes.append(Compte(nom=nom, banque=banque, type_compte=type_c, solde=solde, liquidite=liq, terme_passif=ter_p, classe_actif=classe_a, suivi_budget=suivi_budget_val))
-                        comptes_ajoutes += 1
-                        modifications_effectuees = True
-                except ValueError as ve:
-                    erreurs_detaillees.append(f"L{num_ligne} ('{row[0]}'): Données invalides - {ve}.")
-                    lignes_ignorees += 1
-                except Exception as ex:
-                    erreurs_detaillees.append(f"L{num_ligne} ('{row[0]}'): Erreur - {ex}.")
-                    lignes_ignorees += 1
+                        try:
+                            nouveau_compte = Compte(nom=nom, banque=banque, type_compte=type_c, solde=solde, liquidite=liq, terme_passif=ter_p, classe_actif=classe_a, suivi_budget=suivi_budget_val)
+                        except ValueError as ve:
+                            rapport.erreur(num_ligne, nom, f"Données invalides - {ve}.")
+                            continue
+                        self.comptes.append(nouveau_compte)
+                        index_comptes[(nom, banque)] = nouveau_compte
+                        rapport.ajoutes += 1
+            modifications_effectuees = bool(rapport.ajoutes or rapport.mis_a_jour)
             if modifications_effectuees: self.mettre_a_jour_toutes_les_vues()
-            summary = (f"Terminé.\nAjoutés: {comptes_ajoutes}\nMis à jour: {comptes_mis_a_jour}\nIgnorés: {lignes_ignorees}")
-            if erreurs_detaillees: summary += "\n\nErreurs (premières 5):\n" + "\n".join(erreurs_detaillees[:5])
-            if len(erreurs_detaillees) > 5: summary += f"\n...et {len(erreurs_detaillees) - 5} autres."
-            messagebox.showinfo("Rapport Importation Comptes", summary, parent=self.root)
+            self._afficher_rapport_import("Rapport Importation Comptes", rapport)
             if modifications_effectuees: messagebox.showinfo("Sauvegarde", "N'oubliez pas de sauvegarder.", parent=self.root)
+        except ErreurFichierImport as e: messagebox.showerror("Erreur En-tête", str(e), parent=self.root)
         except FileNotFoundError: messagebox.showerror("Erreur", f"Fichier non trouvé: {filename}", parent=self.root)
         except Exception as e:
             messagebox.showerror("Erreur Importation Majeure", f"Erreur: {e}", parent=self.root)
@@ -1388,6 +1362,7 @@ class PatrimoineApp:
                 return
                 
             categories_du_mois.append(result)
+            self.registre_categories.noter(result['categorie'], result.get('type'))
             self.mettre_a_jour_toutes_les_vues()
 
     def modifier_categorie_budget(self, event=None):
@@ -1421,6 +1396,7 @@ class PatrimoineApp:
                 messagebox.showwarning("Nom Existant", f"Une catégorie avec le nom '{result['categorie']}' existe déjà.", parent=self.root)
                 return
             cat_a_modifier.update(result)
+            self.registre_categories.noter(result['categorie'], result.get('type'))
             self.mettre_a_jour_toutes_les_vues()
 
     def _parse_date_flexible(self, date_str):
@@ -1448,23 +1424,7 @@ class PatrimoineApp:
                 except (TypeError, SyntaxError, KeyError, ZeroDivisionError, NameError): raise ValueError("Expression mathématique invalide")
 
     def get_all_unique_budget_categories(self):
-            all_categories = set()
-            for cle, data in self.budget_data.items():
-                if cle == "_templates" and isinstance(data, dict):
-                    for template_name, template_cats in data.items():
-                        if isinstance(template_cats, list):
-                            for cat in template_cats:
-                                if cat.get('categorie'): all_categories.add(cat.get('categorie'))
-                elif isinstance(data, dict) and not cle.startswith("_"):
-                    for cat in data.get('categories_prevues', []):
-                        if cat.get('categorie'): all_categories.add(cat.get('categorie'))
-                    for trans in data.get('transactions', []):
-                        cat_name = trans.get('categorie')
-                        if cat_name and cat_name not in ["(Virement)", "(Hors Budget)"]: all_categories.add(cat_name)
-            for trans_rec in self.budget_data.get('transactions_recurrentes', []):
-                cat_name = trans_rec.get('categorie')
-                if cat_name and cat_name not in ["(Virement)", "(Hors Budget)"]: all_categories.add(cat_name)
-            return sorted(list(all_categories))
+        return self.registre_categories.noms_utilises()
 
     def ajouter_transaction(self):
         dialog = TransactionDialog(self.root, "Ajouter une Transaction", self.comptes, self.get_all_budget_categories(), self.ai_service)
@@ -1527,93 +1487,141 @@ class PatrimoineApp:
             self.mettre_a_jour_toutes_les_vues()
             messagebox.showinfo("Modèle Appliqué", f"Le modèle '{nom_modele_choisi}' a été appliqué.", parent=self.root)
 
+    def _resoudre_transactions(self, ids, cles_mois=()):
+        """Transactions du budget en mémoire dont l'id est dans 'ids' : cherchées d'abord dans les mois indiqués,
+        puis dans tout le budget pour celles qui n'y ont pas été trouvées."""
+        restants, trouvees = set(ids), []
+        def parcourir(cles):
+            for cle in cles:
+                data = self.budget_data.get(cle)
+                if not isinstance(data, dict) or 'transactions' not in data: continue
+                for trans in data['transactions']:
+                    if trans.get('id') in restants:
+                        restants.discard(trans['id'])
+                        trouvees.append(trans)
+                if not restants: return
+        parcourir(cles_mois)
+        if restants: parcourir([cle for cle in self.budget_data if cle not in cles_mois])
+        return trouvees
+
+    def _pointer_en_memoire(self, transactions):
+        """
+        Marque pointées les transactions non pointées dont le compte existe et reporte leurs montants sur les soldes :
+        les montants sont cumulés par compte puis appliqués une fois par compte (soustraits pour un passif),
+        comme SqlDataManager.pointer_transactions le fait en base. Retourne (ids pointés, transactions au compte introuvable).
+        """
+        comptes_par_nom = {}
+        for compte in self.comptes: comptes_par_nom.setdefault(compte.nom, compte)
+        cumuls, ids_pointes, introuvables = defaultdict(float), [], []
+        for trans in transactions:
+            if trans.get('pointe', False): continue
+            if trans.get('compte_affecte') not in comptes_par_nom:
+                introuvables.append(trans)
+                continue
+            cumuls[trans['compte_affecte']] += trans.get('montant') or 0.0
+            trans['pointe'] = True
+            ids_pointes.append(trans['id'])
+        for nom, cumul in cumuls.items():
+            compte = comptes_par_nom[nom]
+            # Pour un passif, on soustrait le montant (ex: une dépense de -50€ sur une CB augmente la dette)
+            nouveau_solde = compte.solde - cumul if compte.type_compte == 'Passif' else compte.solde + cumul
+            compte.solde = round(nouveau_solde, 2)
+        return ids_pointes, introuvables
+
     def pointer_transactions(self):
         selection = self.transactions_tree.selection()
         if not selection:
             messagebox.showinfo("Information", "Veuillez sélectionner une ou plusieurs transactions à pointer.", parent=self.root)
             return
         if not messagebox.askyesno("Confirmer le Pointage", f"Pointer {len(selection)} transaction(s) ?\nCette action modifiera définitivement le solde des comptes associés.", parent=self.root): return
-        transactions_a_pointer_ids = set(selection)
-        modifications_effectuees = False
-        
-        # On doit potentiellement chercher dans plusieurs mois si des transactions reportées sont sélectionnées
-        for cle_mois_annee, data in self.budget_data.items():
-            if not isinstance(data, dict) or 'transactions' not in data: continue
-            
-            for trans in data.get('transactions', []):
-                if trans.get('id') in transactions_a_pointer_ids and not trans.get('pointe', False):
-                    compte_a_modifier = next((c for c in self.comptes if c.nom == trans.get('compte_affecte')), None)
-                    if compte_a_modifier:
-                        montant_transaction = trans.get('montant', 0.0)
-                        # --- DÉBUT DE LA CORRECTION ---
-                        solde_actuel = compte_a_modifier.solde
-                        if compte_a_modifier.type_compte == 'Passif':
-                            # Pour un passif, on soustrait le montant (ex: une dépense de -50€ sur une CB augmente la dette)
-                            nouveau_solde = solde_actuel - montant_transaction
-                        else:
-                            # Pour un actif, on ajoute le montant
-                            nouveau_solde = solde_actuel + montant_transaction
-                        
-                        # On arrondit systématiquement le résultat à 2 décimales
-                        compte_a_modifier.solde = round(nouveau_solde, 2)
-                        # --- FIN DE LA CORRECTION ---
-                        trans['pointe'] = True
-                        modifications_effectuees = True
-                    else:
-                        messagebox.showwarning("Compte Non Trouvé", f"Le compte '{trans.get('compte_affecte')}' pour la transaction '{trans.get('description')}' n'a pas été trouvé.", parent=self.root)
-        
-        if modifications_effectuees:
-            messagebox.showinfo("Pointage Réussi", "Transactions pointées et soldes mis à jour.", parent=self.root)
-            self.sauvegarder_donnees()
-            self.sauvegarder_budget_donnees()
+
+        # Les transactions affichées viennent du mois budgétaire : on cherche d'abord dans ce mois et ses voisins
+        try:
+            premier_du_mois = date(int(self.budget_annee_var.get()), int(self.budget_mois_var.get()), 1)
+            cles_mois = [premier_du_mois.strftime("%Y-%m"), (premier_du_mois - timedelta(days=1)).strftime("%Y-%m"),
+                         (premier_du_mois + timedelta(days=32)).strftime("%Y-%m")]
+        except (ValueError, TypeError):
+            cles_mois = []
+        nombre = self._pointer_ids(selection, cles_mois)
+        if nombre:
+            messagebox.showinfo("Pointage Réussi", f"{nombre} transaction(s) pointée(s) et soldes mis à jour.", parent=self.root)
+
+    def _pointer_ids(self, ids, cles_mois=()):
+        """Pointe les transactions 'ids' en mémoire et en base, puis rafraîchit les vues. Retourne le nombre de transactions pointées."""
+        ids_pointes, introuvables = self._pointer_en_memoire(self._resoudre_transactions(ids, cles_mois))
+        if introuvables:
+            comptes_introuvables = sorted({str(trans.get('compte_affecte')) for trans in introuvables})
+            messagebox.showwarning("Compte Non Trouvé", f"{len(introuvables)} transaction(s) n'ont pas été pointées, compte(s) introuvable(s) :\n" + "\n".join(comptes_introuvables), parent=self.root)
+        if ids_pointes:
+            # Drapeaux et soldes écrits en une seule petite transaction SQL, sans réécrire le budget ni le patrimoine
+            try:
+                self.data_manager.pointer_transactions(ids_pointes)
+            except Exception as e:
+                log.error("Échec de l'enregistrement du pointage : %s", e, exc_info=True)
+                messagebox.showerror("Erreur SQL", f"Le pointage n'a pas pu être enregistré, il le sera à la prochaine sauvegarde.\n\nErreur : {e}", parent=self.root)
             self.mettre_a_jour_toutes_les_vues()
+        return len(ids_pointes)
+
+    def _transactions_non_pointees(self, nom_compte):
+        """Transactions non pointées d'un compte dans le budget en mémoire (saisies non encore sauvegardées comprises)."""
+        return [trans for cle, data in self.budget_data.items() if isinstance(data, dict) and 'transactions' in data
+                for trans in data['transactions'] if trans.get('compte_affecte') == nom_compte and not trans.get('pointe', False)]
+
+    def ouvrir_fenetre_rapprochement(self):
+        if not self.comptes:
+            messagebox.showerror("Erreur", "Aucun compte n'est disponible.", parent=self.root)
+            return
+        RapprochementWindow(self.root, self.comptes, self._transactions_non_pointees, self._pointer_ids)
+
+    def _frame_budget(self):
+        """TransactionFrame du budget en mémoire : celle du rafraîchissement en cours, sinon construite pour l'appel."""
+        if self._frame_partagee is not None:
+            return self._frame_partagee
+        return TransactionFrame.depuis_budget(self.budget_data)
+
+    def _mettre_a_jour_graphiques_budget(self, annee_selectionnee, mois_selectionne):
+        # On prépare un dictionnaire propre pour le GraphManager : les agrégats du mois budgétaire
+        # sont calculés sur le budget en mémoire, comme le tableau du budget à côté
+        cle_mois_annee = f"{annee_selectionnee:04d}-{mois_selectionne:02d}"
+        frame = self._frame_budget()
+        donnees_pour_graphiques = {
+            'frame': (frame, frame.du_mois_budgetaire(cle_mois_annee)),
+            'categories_prevues': self.budget_data.get(cle_mois_annee, {}).get('categories_prevues', [])
+        }
+        
+        # On passe les bonnes données aux graphiques
+        self.graph_manager.update_all_budget_graphs(donnees_pour_graphiques, annee_selectionnee, mois_selectionne)
 
     def mettre_a_jour_toutes_les_vues(self, event=None):
-        # --- DÉBUT DE LA LOGIQUE CORRIGÉE ---
         try:
             annee_selectionnee = int(self.budget_annee_var.get())
             mois_selectionne = int(self.budget_mois_var.get())
         except (ValueError, TypeError):
             return # Date invalide, on ne fait rien
 
-        # On filtre correctement les transactions appartenant au mois budgétaire
-        transactions_du_mois_budgetaire = []
-        for t in self._get_all_transactions():
-            try:
-                date_a_utiliser_str = t.get('date_budgetaire') or t.get('date')
-                date_a_utiliser = datetime.strptime(date_a_utiliser_str, "%Y-%m-%d").date()
-                if date_a_utiliser.year == annee_selectionnee and date_a_utiliser.month == mois_selectionne:
-                    transactions_du_mois_budgetaire.append(t)
-            except (ValueError, TypeError):
-                continue
-        # --- FIN DE LA LOGIQUE CORRIGÉE ---
-
-        resultats_projection = self._calculer_projection_mensuelle()
-        self.mettre_a_jour_liste()
-        self.calculer_et_afficher_patrimoine()
-        self.mettre_a_jour_vue_budget(resultats_projection)
-        
-        if self.graph_manager:
-            self.graph_manager.update_camembert_classe(self.comptes)
-            self.graph_manager.update_camembert_banque(self.comptes)
-            self.graph_manager.update_historique_patrimoine(self.historique_patrimoine)
-            
-            # On prépare un dictionnaire propre pour le GraphManager
-            cle_mois_annee = f"{annee_selectionnee:04d}-{mois_selectionne:02d}"
-            donnees_pour_graphiques = {
-                'transactions': transactions_du_mois_budgetaire,
-                'categories_prevues': self.budget_data.get(cle_mois_annee, {}).get('categories_prevues', [])
-            }
-            
-            # On passe les bonnes données aux graphiques
-            self.graph_manager.update_all_budget_graphs(donnees_pour_graphiques, annee_selectionnee, mois_selectionne)
+        # Une seule passe sur les transactions pour toutes les vues de ce rafraîchissement
+        self._frame_partagee = TransactionFrame.depuis_budget(self.budget_data)
+        try:
+            resultats_projection = self._calculer_projection_mensuelle()
+            self.mettre_a_jour_liste()
+            self.calculer_et_afficher_patrimoine()
+            self.mettre_a_jour_vue_budget(resultats_projection)
             
-            if resultats_projection:
-                self.graph_manager.update_evolution_line(
-                    resultats_projection['dates_graphe'], 
-                    resultats_projection['evolution_par_compte']
-                )
-        self.verifier_et_afficher_alertes_decouvert()
+            if self.graph_manager:
+                self.graph_manager.update_camembert_classe(self.comptes)
+                self.graph_manager.update_camembert_banque(self.comptes)
+                self.graph_manager.update_historique_patrimoine(HistorySeries.depuis_historique(self.historique_patrimoine))
+                
+                self._mettre_a_jour_graphiques_budget(annee_selectionnee, mois_selectionne)
+                
+                if resultats_projection:
+                    self.graph_manager.update_evolution_line(
+                        resultats_projection['dates_graphe'], 
+                        resultats_projection['evolution_par_compte']
+                    )
+            self.verifier_et_afficher_alertes_decouvert()
+        finally:
+            self._frame_partagee = None
 
     def ajouter_virement(self):
         dialog = VirementDialog(self.root, self.comptes)
@@ -1719,20 +1727,7 @@ class PatrimoineApp:
         RecurrentTransactionManager(self)
 
     def get_all_budget_categories(self, type_filtre=None):
-        all_categories = set()
-        for cle, data in self.budget_data.items():
-            if not cle.startswith("_") and isinstance(data, dict):
-                for cat in data.get('categories_prevues', []):
-                    if type_filtre is None or cat.get('type') == type_filtre:
-                        all_categories.add(cat['categorie'])
-
-        templates = self.budget_data.get("_templates", {})
-        for template_name, template_cats in templates.items():
-            for cat in template_cats:
-                if type_filtre is None or cat.get('type') == type_filtre:
-                    all_categories.add(cat['categorie'])
-
-        return sorted(list(all_categories))
+        return self.registre_categories.noms_budget(type_filtre)
 
     def generer_transactions_recurrentes_pour_le_mois(self, annee, mois):
         if 'transactions_recurrentes' not in self.budget_data: return
@@ -1856,6 +1851,7 @@ class PatrimoineApp:
 
         if modifications_faites:
             self.sauvegarder_budget_donnees()
+        return modifications_faites
         
     def update_action_buttons_state(self, event=None):
         selected_item_ids = self.tree.selection()
@@ -1905,54 +1901,82 @@ class PatrimoineApp:
         filename = filedialog.askopenfilename(title=f"Sélectionner l'échéancier pour '{nom_compte_passif}'", filetypes=[("Fichiers CSV (*.csv)", "*.csv")], parent=self.root)
         if not filename: return
 
+        rapport = RapportImport()
         try:
-            lignes_ajoutees = 0
-            with open(filename, 'r', newline='', encoding='utf-8-sig') as f_csv:
-                reader = csv.DictReader(f_csv, delimiter=';')
-                headers = reader.fieldnames
-                if not all(h in headers for h in ['Date', 'Capital', 'Interets']):
-                    messagebox.showerror("Erreur de Fichier", "Le fichier CSV doit contenir au minimum les colonnes 'Date', 'Capital', et 'Interets'.", parent=self.root)
-                    return
-
-                for row in reader:
-                    try:
-                        date_str = row['Date']
-                        if '/' in date_str: date_obj = datetime.strptime(date_str, "%d/%m/%Y")
-                        else: date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-
-                        capital = float(row['Capital'].replace(',', '.'))
-                        interets = float(row['Interets'].replace(',', '.'))
-                        assurance = float(row['Assurance'].replace(',', '.')) if 'Assurance' in row and row['Assurance'] else 0.0
-
-                        cle_mois_annee = date_obj.strftime("%Y-%m")
-                        if cle_mois_annee not in self.budget_data:
-                            self.budget_data[cle_mois_annee] = {'categories_prevues': [], 'transactions': []}
-                        
-                        transactions_du_mois = self.budget_data[cle_mois_annee]['transactions']
-
-                        if capital > 0:
-                            id_virement = uuid.uuid4().hex
-                            trans_sortie_k = { "id": uuid.uuid4().hex, "virement_id": id_virement, "origine": "echeancier", "date": date_obj.strftime("%Y-%m-%d"), "description": f"Remb. Capital Prêt {nom_compte_passif}", "montant": -capital, "categorie": "(Virement)", "compte_affecte": compte_source_paiement, "pointe": False }
-                            trans_entree_k = { "id": uuid.uuid4().hex, "virement_id": id_virement, "origine": "echeancier", "date": date_obj.strftime("%Y-%m-%d"), "description": f"Remb. Capital Prêt {nom_compte_passif}", "montant": capital, "categorie": "(Virement)", "compte_affecte": nom_compte_passif, "pointe": False }
-                            transactions_du_mois.extend([trans_sortie_k, trans_entree_k])
-
-                        if interets > 0:
-                            trans_interets = { "id": uuid.uuid4().hex, "origine": "echeancier", "date": date_obj.strftime("%Y-%m-%d"), "description": f"Intérêts Prêt {nom_compte_passif}", "montant": -interets, "categorie": cat_interets, "compte_affecte": compte_source_paiement, "pointe": False }
-                            transactions_du_mois.append(trans_interets)
-
-                        if assurance > 0 and cat_assurance:
-                            trans_assurance = { "id": uuid.uuid4().hex, "origine": "echeancier", "date": date_obj.strftime("%Y-%m-%d"), "description": f"Assurance Prêt {nom_compte_passif}", "montant": -assurance, "categorie": cat_assurance, "compte_affecte": compte_source_paiement, "pointe": False }
-                            transactions_du_mois.append(trans_assurance)
-                        
-                        lignes_ajoutees += 1
-                    except (ValueError, KeyError) as row_err:
-                        print(f"Ligne ignorée dans le CSV : {row}. Erreur : {row_err}")
+            header, lots = lire_csv(filename, ['Date', 'Capital', 'Interets'], mode='contient')
+            col_date, col_capital, col_interets = header.index('Date'), header.index('Capital'), header.index('Interets')
+            col_assurance = header.index('Assurance') if 'Assurance' in header else None
+            nouvelles_transactions = []
+            for lot in lots:
+                dates_iso, dates_ok = normaliser_dates(colonne(lot, col_date))
+                capitaux, capitaux_ok = normaliser_nombres(colonne(lot, col_capital), vide=None)
+                interets_lot, interets_ok = normaliser_nombres(colonne(lot, col_interets), vide=None)
+                # Colonne Assurance facultative : absente, elle vaut 0 partout
+                assurances, assurances_ok = normaliser_nombres(colonne(lot, col_assurance) if col_assurance is not None else [''] * len(lot))
+                for k, (num_ligne, row) in enumerate(lot):
+                    identifiant = row[col_date].strip() if col_date < len(row) else ''
+                    if not dates_ok[k]:
+                        rapport.erreur(num_ligne, identifiant, "Date invalide (attendu AAAA-MM-JJ ou JJ/MM/AAAA).")
                         continue
-            
-            self.sauvegarder_budget_donnees()
-            self.mettre_a_jour_toutes_les_vues()
-            messagebox.showinfo("Importation Réussie", f"{lignes_ajoutees} échéances ont été importées comme transactions futures.", parent=self.root)
+                    colonnes_invalides = [nom for nom, valides in (('Capital', capitaux_ok), ('Interets', interets_ok), ('Assurance', assurances_ok)) if not valides[k]]
+                    if colonnes_invalides:
+                        rapport.erreur(num_ligne, identifiant, f"Montant invalide ({', '.join(colonnes_invalides)}).")
+                        continue
+                    date_iso = str(dates_iso[k])
+                    capital, interets, assurance = float(capitaux[k]), float(interets_lot[k]), float(assurances[k])
+
+                    if capital > 0:
+                        id_virement = uuid.uuid4().hex
+                        trans_sortie_k = { "id": uuid.uuid4().hex, "virement_id": id_virement, "origine": "echeancier", "date": date_iso, "description": f"Remb. Capital Prêt {nom_compte_passif}", "montant": -capital, "categorie": "(Virement)", "compte_affecte": compte_source_paiement, "pointe": False }
+                        trans_entree_k = { "id": uuid.uuid4().hex, "virement_id": id_virement, "origine": "echeancier", "date": date_iso, "description": f"Remb. Capital Prêt {nom_compte_passif}", "montant": capital, "categorie": "(Virement)", "compte_affecte": nom_compte_passif, "pointe": False }
+                        nouvelles_transactions.extend([trans_sortie_k, trans_entree_k])
+
+                    if interets > 0:
+                        trans_interets = { "id": uuid.uuid4().hex, "origine": "echeancier", "date": date_iso, "description": f"Intérêts Prêt {nom_compte_passif}", "montant": -interets, "categorie": cat_interets, "compte_affecte": compte_source_paiement, "pointe": False }
+                        nouvelles_transactions.append(trans_interets)
+
+                    if assurance > 0 and cat_assurance:
+                        trans_assurance = { "id": uuid.uuid4().hex, "origine": "echeancier", "date": date_iso, "description": f"Assurance Prêt {nom_compte_passif}", "montant": -assurance, "categorie": cat_assurance, "compte_affecte": compte_source_paiement, "pointe": False }
+                        nouvelles_transactions.append(trans_assurance)
+
+                    rapport.ajoutes += 1
+
+            # Un seul executemany pour tout l'échéancier, au lieu de réécrire tout le budget
+            if nouvelles_transactions:
+                self.data_manager.inserer_transactions(nouvelles_transactions)
+                for trans in nouvelles_transactions:
+                    self.budget_data.setdefault(trans['date'][:7], {'categories_prevues': [], 'transactions': []})['transactions'].append(trans)
+                self.mettre_a_jour_toutes_les_vues()
+            self._afficher_rapport_import("Importation Échéancier", rapport, libelle_ajoutes="Échéances importées", libelle_ignores="Lignes ignorées")
 
+        except ErreurFichierImport as e: messagebox.showerror("Erreur de Fichier", f"Le fichier CSV doit contenir au minimum les colonnes 'Date', 'Capital', et 'Interets'.\n\n{e}", parent=self.root)
+        except FileNotFoundError: messagebox.showerror("Erreur", f"Fichier non trouvé: {filename}", parent=self.root)
+        except Exception as e:
+            messagebox.showerror("Erreur d'Importation", f"Une erreur imprévue est survenue:\n{e}", parent=self.root)
+            traceback.print_exc()
+
+    def importer_releve_bancaire(self):
+        noms_comptes = [c.nom for c in self.comptes]
+        if not noms_comptes:
+            messagebox.showerror("Erreur", "Aucun compte n'est disponible.", parent=self.root)
+            return
+        compte = SelectFromListDialog(self.root, "Compte du Relevé", "À quel compte ce relevé correspond-il ?", noms_comptes).result
+        if not compte: return
+        filename = filedialog.askopenfilename(title=f"Sélectionner le relevé de '{compte}'", filetypes=[("Fichiers CSV (*.csv)", "*.csv"), ("Tous les fichiers (*.*)", "*.*")], parent=self.root)
+        if not filename: return
+        try:
+            from import_releve import ImportReleve
+            rapport, nouvelles, ids_pointees = ImportReleve(self.data_manager, compte, categoriser=self.ai_service.suggest_category).importer(filename)
+            # La base est à jour : on reporte le résultat dans les données en mémoire
+            for trans in nouvelles:
+                self.budget_data.setdefault(trans['date'][:7], {'categories_prevues': [], 'transactions': []})['transactions'].append(trans)
+            if ids_pointees:
+                # Drapeaux et soldes sont déjà en base : seules les données en mémoire restent à mettre à jour
+                self._pointer_en_memoire(self._resoudre_transactions(ids_pointees))
+            if nouvelles or ids_pointees: self.mettre_a_jour_toutes_les_vues()
+            self._afficher_rapport_import("Rapport Import Relevé", rapport, libelle_ajoutes="Nouvelles opérations (à pointer)",
+                                          libelle_mis_a_jour="Prévisions pointées automatiquement", libelle_ignores="Doublons et lignes ignorées")
+        except ErreurFichierImport as e: messagebox.showerror("Erreur de Fichier", str(e), parent=self.root)
         except FileNotFoundError: messagebox.showerror("Erreur", f"Fichier non trouvé: {filename}", parent=self.root)
         except Exception as e:
             messagebox.showerror("Erreur d'Importation", f"Une erreur imprévue est survenue:\n{e}", parent=self.root)
@@ -1961,7 +1985,7 @@ class PatrimoineApp:
     def mettre_a_jour_graphique_historique_personnalise(self):
         if self.graph_manager:
             comptes_selectionnes = [nom for nom, var in self.vars_comptes_historique.items() if var.get()]
-            self.graph_manager.update_historique_personnalise(self.historique_patrimoine, comptes_selectionnes)
+            self.graph_manager.update_historique_personnalise(HistorySeries.depuis_base(self.data_manager, comptes=comptes_selectionnes, classes=False))
 
     def generer_rapport_mensuel(self):
         try:
@@ -1973,16 +1997,8 @@ class PatrimoineApp:
             return
 
         # CORRECTION : On filtre les transactions sur la base de la date budgétaire
-        toutes_les_transactions = self._get_all_transactions()
-        transactions_du_mois_budgetaire = []
-        for t in toutes_les_transactions:
-            try:
-                date_a_utiliser_str = t.get('date_budgetaire') or t.get('date')
-                date_a_utiliser = datetime.strptime(date_a_utiliser_str, "%Y-%m-%d").date()
-                if date_a_utiliser.year == annee and date_a_utiliser.month == mois:
-                    transactions_du_mois_budgetaire.append(t)
-            except (ValueError, TypeError):
-                continue
+        frame = self._frame_budget()
+        transactions_du_mois_budgetaire = frame.transactions_selon(frame.du_mois_budgetaire(cle_mois_annee))
         
         if not transactions_du_mois_budgetaire:
             messagebox.showinfo("Rapport Mensuel", f"Aucune transaction budgétaire trouvée pour {cle_mois_annee}.", parent=self.root)
@@ -1991,52 +2007,11 @@ class PatrimoineApp:
         # On passe la bonne liste de transactions à la fenêtre du rapport
         RapportMensuelWindow(self.root, cle_mois_annee, transactions_du_mois_budgetaire) 
 
-    def nettoyer_historique(self):
-        if not self.historique_patrimoine:
-            return
-
-        histo_nettoye = []
-        snapshots_par_mois = defaultdict(list)
-        
-        for snap in self.historique_patrimoine:
-            try:
-                snap_date = datetime.strptime(snap['date'], "%Y-%m-%d").date()
-                cle_mois = snap_date.strftime("%Y-%m")
-                snapshots_par_mois[cle_mois].append(snap)
-            except (ValueError, KeyError):
-                continue
-
-        mois_actuel_str = date.today().strftime("%Y-%m")
-
-        for cle_mois, snaps_du_mois in snapshots_par_mois.items():
-            if not snaps_du_mois:
-                continue
-                
-            snaps_du_mois.sort(key=lambda x: x['date'])
-
-            if cle_mois == mois_actuel_str:
-                histo_nettoye.extend(snaps_du_mois)
-            else:
-                histo_nettoye.append(snaps_du_mois[0])
-                if len(snaps_du_mois) > 1:
-                    histo_nettoye.append(snaps_du_mois[-1])
-
-        liste_finale_sans_doublons = []
-        vus = set()
-        for snap in histo_nettoye:
-            identifiant = snap['date'] 
-            if identifiant not in vus:
-                liste_finale_sans_doublons.append(snap)
-                vus.add(identifiant)
-
-        liste_finale_sans_doublons.sort(key=lambda x: x['date'])
-        self.historique_patrimoine = liste_finale_sans_doublons
-
     def ouvrir_fenetre_purge_transactions(self):
-        date_limite_str = simpledialog.askstring("Purger les Données du Budget", 
+        date_limite_str = simpledialog.askstring("Archiver les Données du Budget", 
                                                  "Veuillez saisir la date limite.\n"
                                                  "TOUTES les données de budget (transactions, règles) ANTÉRIEURES\n"
-                                                 "à cette date seront supprimées ou mises à jour.\n\n"
+                                                 "à cette date seront déplacées dans la base d'archive.\n\n"
                                                  "Format : AAAA-MM-JJ",
                                                  initialvalue="2025-06-01",
                                                  parent=self.root)
@@ -2050,102 +2025,62 @@ class PatrimoineApp:
             messagebox.showerror("Format invalide", "Le format de la date est incorrect. L'opération a été annulée.", parent=self.root)
             return
 
-        msg = (f"Vous allez purger toutes les données de budget avant le {date_limite.strftime('%d/%m/%Y')}.\n\n"
+        chemin_archive = self.data_manager.chemin_archive()
+        msg = (f"Vous allez archiver toutes les données de budget avant le {date_limite.strftime('%d/%m/%Y')}.\n\n"
                f"Ceci va :\n"
-               f"1. Supprimer les transactions individuelles passées.\n"
-               f"2. Supprimer les règles récurrentes terminées avant cette date.\n"
+               f"1. Déplacer les transactions passées et les budgets des mois terminés dans {os.path.basename(chemin_archive)}.\n"
+               f"2. Archiver les règles récurrentes terminées avant cette date.\n"
                f"3. Mettre à jour la date de début des règles récurrentes encore actives.\n\n"
-               f"L'action est IRRÉVERSIBLE. Êtes-vous certain de vouloir continuer ?")
+               f"Les données archivées n'apparaîtront plus dans le budget, seulement dans le rapport annuel.\n"
+               f"Êtes-vous certain de vouloir continuer ?")
 
-        if not messagebox.askyesno("CONFIRMATION FINALE REQUISE", msg, icon='error', parent=self.root):
-            messagebox.showinfo("Annulé", "L'opération de purge a été annulée.", parent=self.root)
+        if not messagebox.askyesno("CONFIRMATION FINALE REQUISE", msg, icon='warning', parent=self.root):
+            messagebox.showinfo("Annulé", "L'opération d'archivage a été annulée.", parent=self.root)
             return
 
-        transactions_supprimees, regles_modifiees, regles_supprimees = 0, 0, 0
+        date_limite_str = date_limite.isoformat()
+        try:
+            compteurs = self.data_manager.archiver_budget(date_limite_str)
+        except Exception as e:
+            log.error("Échec de l'archivage du budget : %s", e, exc_info=True)
+            messagebox.showerror("Erreur d'Archivage", f"L'archivage a échoué, aucune donnée n'a été déplacée.\n\nErreur : {e}", parent=self.root)
+            return
 
+        # Même opération sur les données en mémoire (comparaison de chaînes ISO, sans réécrire le budget)
         for cle in list(self.budget_data.keys()):
-            if isinstance(self.budget_data[cle], dict) and not cle.startswith("_"):
-                transactions_mois = self.budget_data[cle].get('transactions', [])
-                transactions_a_garder = []
-                for trans in transactions_mois:
-                    try:
-                        trans_date = datetime.strptime(trans.get('date'), "%Y-%m-%d").date()
-                        if trans_date >= date_limite:
-                            transactions_a_garder.append(trans)
-                        else:
-                            transactions_supprimees += 1
-                    except (ValueError, TypeError):
-                        transactions_a_garder.append(trans)
-                self.budget_data[cle]['transactions'] = transactions_a_garder
-
-        regles_recurrentes_actives = []
+            if cle.startswith("_") or cle == 'transactions_recurrentes' or not isinstance(self.budget_data[cle], dict):
+                continue
+            if cle < date_limite_str[:7]:
+                del self.budget_data[cle]
+            elif cle == date_limite_str[:7]:
+                self.budget_data[cle]['transactions'] = [trans for trans in self.budget_data[cle].get('transactions', [])
+                                                         if not (trans.get('date') and trans['date'] < date_limite_str)]
+        regles_conservees = []
         for regle in self.budget_data.get('transactions_recurrentes', []):
-            try:
-                date_debut_regle_str = regle.get('date_debut')
-                date_fin_regle_str = regle.get('date_fin')
-
-                if not date_debut_regle_str:
-                    regles_recurrentes_actives.append(regle)
-                    continue
-
-                date_debut_regle = datetime.strptime(date_debut_regle_str, "%Y-%m-%d").date()
-                date_fin_regle = datetime.strptime(date_fin_regle_str, "%Y-%m-%d").date() if date_fin_regle_str else None
-
-                if date_fin_regle and date_fin_regle < date_limite:
-                    regles_supprimees += 1
-                    continue 
-
-                if date_debut_regle < date_limite:
-                    regle['date_debut'] = date_limite.strftime("%Y-%m-%d")
-                    regles_modifiees += 1
-                
-                regles_recurrentes_actives.append(regle)
-
-            except (ValueError, TypeError):
-                regles_recurrentes_actives.append(regle)
-
-        self.budget_data['transactions_recurrentes'] = regles_recurrentes_actives
-
-        self.sauvegarder_budget_donnees()
+            if regle.get('date_fin') and regle['date_fin'] < date_limite_str:
+                continue
+            if regle.get('date_debut') and regle['date_debut'] < date_limite_str:
+                regle['date_debut'] = date_limite_str
+            regles_conservees.append(regle)
+        self.budget_data['transactions_recurrentes'] = regles_conservees
+        self.registre_categories.invalider()
         self.mettre_a_jour_toutes_les_vues()
 
-        rapport_final = (f"Opération de purge terminée !\n\n"
-                         f"- Transactions individuelles supprimées : {transactions_supprimees}\n"
-                         f"- Règles récurrentes mises à jour : {regles_modifiees}\n"
-                         f"- Règles récurrentes obsolètes supprimées : {regles_supprimees}")
+        rapport_final = (f"Opération d'archivage terminée !\n\n"
+                         f"- Transactions archivées : {compteurs['transactions']}\n"
+                         f"- Lignes de budget archivées : {compteurs['lignes_budget']}\n"
+                         f"- Règles récurrentes mises à jour : {compteurs['regles_modifiees']}\n"
+                         f"- Règles récurrentes terminées archivées : {compteurs['regles_archivees']}\n\n"
+                         f"Archive : {chemin_archive}")
         
-        messagebox.showinfo("Purge Terminée", rapport_final, parent=self.root)
+        messagebox.showinfo("Archivage Terminé", rapport_final, parent=self.root)
 
     def ouvrir_fenetre_fusion_categories(self):
         try:
-            all_categories = set()
-            for cle in list(self.budget_data.keys()):
-                data = self.budget_data.get(cle)
-                if cle == "_templates":
-                    if isinstance(data, dict):
-                        for template_name, template_cats in data.items():
-                            if isinstance(template_cats, list):
-                                for cat in template_cats:
-                                    all_categories.add(cat.get('categorie'))
-                elif isinstance(data, dict) and not cle.startswith("_"):
-                    for cat in data.get('categories_prevues', []): 
-                        all_categories.add(cat.get('categorie'))
-                    for trans in data.get('transactions', []):
-                        cat_name = trans.get('categorie')
-                        if cat_name and cat_name != "(Virement)":
-                            all_categories.add(cat_name)
-            
-            for trans_rec in self.budget_data.get('transactions_recurrentes', []):
-                cat_name = trans_rec.get('categorie')
-                if cat_name and cat_name != "(Virement)":
-                    all_categories.add(cat_name)
-                    
-            sorted_categories = sorted([cat for cat in all_categories if cat])
-            
+            sorted_categories = [cat for cat in self.registre_categories.noms_utilises(inclure_techniques=True) if cat != "(Virement)"]
             if not sorted_categories:
                 messagebox.showinfo("Aucune Catégorie", "Aucune catégorie de budget à fusionner n'a été trouvée.", parent=self.root)
                 return
-
         except Exception as e:
             messagebox.showerror("Erreur de Lecture", f"Impossible de lire les catégories existantes.\n\nErreur : {e}", parent=self.root)
             traceback.print_exc()
@@ -2191,33 +2126,60 @@ class PatrimoineApp:
                 messagebox.showerror("Conflit", "La catégorie de destination ne peut pas être l'une des sources.", parent=dialog)
                 return
 
-            msg = f"Êtes-vous sûr de vouloir fusionner {len(sources)} catégorie(s) dans '{destination}' ?\n\n"
-            msg += "Cette action est IRRÉVERSIBLE et modifiera l'intégralité de vos données de budget."
+            # Une seule source vers un nom nouveau : simple renommage, les lignes de budget sont conservées
+            renommage = len(sources) == 1 and destination not in sorted_categories
+            if renommage:
+                msg = f"Renommer la catégorie '{sources[0]}' en '{destination}' dans tout le budget ?\n\n"
+            else:
+                msg = f"Êtes-vous sûr de vouloir fusionner {len(sources)} catégorie(s) dans '{destination}' ?\n\n"
+                msg += "Les lignes de budget et de modèle des catégories sources seront supprimées.\n"
+            msg += "L'opération pourra être annulée depuis le menu Outils."
             
             if not messagebox.askyesno("Confirmer la fusion", msg, icon='warning', parent=dialog):
                 return
 
+            try:
+                if renommage: _, compteurs = self.data_manager.renommer_categorie(sources[0], destination)
+                else: _, compteurs = self.data_manager.fusionner_categories(sources, destination)
+            except Exception as e:
+                messagebox.showerror("Erreur SQL", f"La fusion n'a pas pu être effectuée : {e}", parent=dialog)
+                traceback.print_exc()
+                return
+
+            # La base est à jour ; on applique le même remplacement aux données en mémoire (sans réécrire le budget)
             for cle in list(self.budget_data.keys()):
                 data = self.budget_data.get(cle)
                 if cle == "_templates" and isinstance(data, dict):
                     for template_name in data:
                         if isinstance(data[template_name], list):
-                            cats_a_garder = [cat for cat in data[template_name] if cat.get('categorie') not in sources]
-                            self.budget_data[cle][template_name] = cats_a_garder
+                            if renommage:
+                                for cat in data[template_name]:
+                                    if cat.get('categorie') in sources: cat['categorie'] = destination
+                            else:
+                                self.budget_data[cle][template_name] = [cat for cat in data[template_name] if cat.get('categorie') not in sources]
                 elif isinstance(data, dict) and not cle.startswith("_"):
                     for trans in data.get('transactions', []):
                         if trans.get('categorie') in sources: trans['categorie'] = destination
-                    cats_prevues_a_garder = [cat for cat in data.get('categories_prevues', []) if cat.get('categorie') not in sources]
-                    self.budget_data[cle]['categories_prevues'] = cats_prevues_a_garder
+                    if renommage:
+                        for cat in data.get('categories_prevues', []):
+                            if cat.get('categorie') in sources: cat['categorie'] = destination
+                    else:
+                        self.budget_data[cle]['categories_prevues'] = [cat for cat in data.get('categories_prevues', []) if cat.get('categorie') not in sources]
             
             for trans_rec in self.budget_data.get('transactions_recurrentes', []):
                 if trans_rec.get('categorie') in sources:
                     trans_rec['categorie'] = destination
 
-            self.sauvegarder_budget_donnees()
-            self.mettre_a_jour_toutes_les_vues()
+            # Seules la vue et les graphiques du budget dépendent des catégories
+            self.mettre_a_jour_vue_budget(self._calculer_projection_mensuelle())
+            if self.graph_manager:
+                self._mettre_a_jour_graphiques_budget(int(self.budget_annee_var.get()), int(self.budget_mois_var.get()))
             
-            messagebox.showinfo("Succès", "La fusion des catégories a été effectuée avec succès.", parent=dialog)
+            messagebox.showinfo("Succès", f"{'Renommage' if renommage else 'Fusion'} effectué(e) :\n"
+                                f"- {compteurs.get('transactions', 0)} transaction(s)\n"
+                                f"- {compteurs.get('transactions_recurrentes', 0)} récurrence(s)\n"
+                                f"- {compteurs.get('categories_prevues', 0)} ligne(s) de budget {'renommée(s)' if renommage else 'supprimée(s)'}\n"
+                                f"- {compteurs.get('budget_template_categories', 0)} ligne(s) de modèle {'renommée(s)' if renommage else 'supprimée(s)'}", parent=dialog)
             dialog.destroy()
 
         button_frame = ttk.Frame(main_frame)
@@ -2227,6 +2189,26 @@ class PatrimoineApp:
 
         self.root.wait_window(dialog)
 
+    def annuler_derniere_fusion_categories(self):
+        operation = self.data_manager.derniere_operation_categories()
+        if operation is None:
+            messagebox.showinfo("Annuler", "Aucune fusion ou renommage de catégories à annuler.", parent=self.root)
+            return
+        libelle = "le renommage" if operation['type'] == 'renommage' else "la fusion"
+        if not messagebox.askyesno("Annuler", f"Annuler {libelle} du {operation['date'].replace('T', ' à ')} :\n{', '.join(operation['sources'])} → {operation['destination']} ?", parent=self.root):
+            return
+        try:
+            # Le budget en mémoire est d'abord sauvegardé, puis rechargé une fois l'annulation appliquée en base
+            if not self.sauvegarder_budget_donnees(): return
+            compteurs = self.data_manager.annuler_operation_categories(operation['id'])
+            self.budget_data = self.data_manager.charger_budget_donnees()
+        except Exception as e:
+            messagebox.showerror("Erreur SQL", f"L'annulation a échoué : {e}", parent=self.root)
+            traceback.print_exc()
+            return
+        self.mettre_a_jour_toutes_les_vues()
+        messagebox.showinfo("Annulation effectuée", f"{sum(compteurs.values())} ligne(s) restaurée(s).", parent=self.root)
+
     def solder_ou_reouvrir_categorie(self):
         selection = self.budget_tree.selection()
         if not selection: return
@@ -2360,7 +2342,14 @@ class PatrimoineApp:
             compte_carte = next((c for c in self.comptes if c.nom == carte_nom), None)
             if not compte_carte: return
 
-            montant_a_regler = abs(compte_carte.solde)
+            cle_mois_annee = date_obj.strftime("%Y-%m")
+            cycles_carte = CyclesCarte([compte_carte], self._get_all_transactions())
+            if cycles_carte.reglement_saisi(carte_nom, cle_mois_annee) and not messagebox.askyesno(
+                    "Règlement déjà saisi", f"Un règlement de la carte {carte_nom} est déjà saisi pour ce mois.\nEn enregistrer un autre ?", parent=dialog):
+                return
+            # Carte configurée : on règle le relevé du cycle prélevé ce mois-ci, sinon tout le solde
+            montant_cycle = round(abs(cycles_carte.montant_cycle(carte_nom, cle_mois_annee)), 2) if carte_nom in cycles_carte.cartes else 0.0
+            montant_a_regler = montant_cycle or abs(compte_carte.solde)
             if montant_a_regler == 0:
                 messagebox.showinfo("Information", "Le solde de cette carte est déjà à zéro.", parent=dialog)
                 return
@@ -2377,14 +2366,13 @@ class PatrimoineApp:
                 "categorie": "(Virement)", "compte_affecte": carte_nom, "pointe": False
             }
 
-            cle_mois_annee = date_obj.strftime("%Y-%m")
             if cle_mois_annee not in self.budget_data:
                 self.budget_data[cle_mois_annee] = {'categories_prevues': [], 'transactions': []}
             
             self.budget_data[cle_mois_annee]['transactions'].extend([trans_sortie, trans_entree])
             self.sauvegarder_budget_donnees()
             self.mettre_a_jour_toutes_les_vues()
-            messagebox.showinfo("Opération Réussie", f"Le règlement de la carte {carte_nom} a bien été enregistré.", parent=self.root)
+            messagebox.showinfo("Opération Réussie", f"Le règlement de la carte {carte_nom} ({format_nombre_fr(montant_a_regler)} €) a bien été enregistré.", parent=self.root)
             dialog.destroy()
 
         button_frame = ttk.Frame(form_frame)
@@ -2443,22 +2431,26 @@ class PatrimoineApp:
             montant_abs = abs(sugg['montant'])
             jour = sugg['jour_du_mois']
             desc = sugg['description']
+            periodicite = sugg.get('periodicite', 'Mensuelle')
+            jour_echeance = sugg.get('jour_echeance', str(jour))
+            libelle_jour = "Jour de la semaine (1=Lundi)" if periodicite == 'Hebdomadaire' else "Jour du mois"
 
             question = (f"Nous avons détecté une transaction potentiellement récurrente :\n\n"
                         f"Description : '{desc}'\n"
                         f"Montant : ~{format_nombre_fr(montant_abs)} €\n"
-                        f"Jour du mois : ~{jour}\n\n"
+                        f"Périodicité : {periodicite}\n"
+                        f"{libelle_jour} : ~{jour_echeance}\n\n"
                         f"Voulez-vous créer une règle de transaction récurrente pour cela ?")
 
             if messagebox.askyesno("Suggestion de Récurrence", question, parent=self.root):
                 nouvelle_regle = {
                     "id": uuid.uuid4().hex, "active": True, "jour_du_mois": jour,
-                    "jour_echeance": str(jour), "description": sugg['description'],
+                    "jour_echeance": jour_echeance, "description": sugg['description'],
                     "montant": sugg['montant'], "categorie": sugg['categorie'],
                     "type": sugg['type'], "compte_affecte": None,
                     "source": None, "destination": None,
-                    "date_debut": date.today().strftime("%Y-%m-%d"),
-                    "date_fin": None, "periodicite": "Mensuelle"
+                    "date_debut": sugg.get('date_debut', date.today().strftime("%Y-%m-%d")),
+                    "date_fin": None, "periodicite": periodicite
                 }
                 self.budget_data['transactions_recurrentes'].append(nouvelle_regle)
                 suggestions_ajoutees += 1
@@ -2530,91 +2522,35 @@ class PatrimoineApp:
         activite_par_compte = {c.nom: 0.0 for c in comptes_suivis}
         impact_budget_restant_par_compte = {c.nom: 0.0 for c in comptes_suivis}
         
-        toutes_les_transactions = self._get_all_transactions()
+        frame = self._frame_budget()
         cle_mois_annee = f"{annee:04d}-{mois:02d}"
 
-        transactions_du_mois_en_cours = [t for t in toutes_les_transactions if self._parse_date_flexible(t['date']).strftime('%Y-%m') == cle_mois_annee]
-
-        realise_par_categorie = defaultdict(float)
-        for t in transactions_du_mois_en_cours:
-            if t.get('categorie') != "(Virement)":
-                realise_par_categorie[t.get('categorie')] += t.get('montant', 0.0)
+        du_mois_en_cours = frame.du_mois(cle_mois_annee)
+        realise_par_categorie = frame.somme_par_categorie(du_mois_en_cours & frame.hors_virements())
 
-        cartes_passives = [c for c in comptes_suivis if c.type_compte == 'Passif']
+        # Cycles de relevé des cartes à débit différé : une passe sur les transactions, règlements liés par virement_id
+        cycles_cartes = CyclesCarte([c for c in comptes_suivis if c.type_compte == 'Passif'], frame.transactions)
+        prelevements_cartes = cycles_cartes.prelevements_a_simuler(cle_mois_annee)
         lignes_budget_futures = []
-        for carte in cartes_passives:
-            if not all([carte.jour_debit, carte.jour_debut_periode, carte.jour_fin_periode, carte.compte_debit_associe]):
-                continue
-            # --- DÉBUT DE LA CORRECTION ---
-            # On vérifie si un virement de règlement pour cette carte a déjà été saisi ce mois-ci
-            reglement_deja_saisi = any(
-                t.get('categorie') == '(Virement)' and
-                (
-                    # Soit on trouve le débit sur le compte source vers la carte
-                    (t.get('compte_affecte') == carte.compte_debit_associe and f"vers {carte.nom}" in t.get('description', '')) or
-                    # Soit on trouve le crédit sur la carte depuis le compte source
-                    (t.get('compte_affecte') == carte.nom and f"depuis {carte.compte_debit_associe}" in t.get('description', '')) or
-                    # Vérification plus générique sur la description
-                    (f"Règlement CB {carte.nom}" in t.get('description', ''))
-                )
-                for t in transactions_du_mois_en_cours
-            )
+        for carte, montant_a_regler in prelevements_cartes:
+            if carte.compte_debit_associe not in comptes_suivis_dict: continue
+            impact_debit = -montant_a_regler
+            activite_par_compte[carte.compte_debit_associe] += impact_debit
+            lignes_budget_futures.append(f"  Prélèvement {carte.nom} sur {carte.compte_debit_associe}: {format_nombre_fr(impact_debit)} €")
 
-            # Si le règlement a déjà été créé (même s'il n'est pas pointé), on passe à la carte suivante
-            if reglement_deja_saisi:
-                print(f"INFO (Projection): Le règlement pour '{carte.nom}' est déjà saisi pour ce mois. La simulation est ignorée.")
-                continue
-            # --- FIN DE LA CORRECTION ---
-                
-            try:
-                # --- DÉBUT DE LA CORRECTION ---
-                # On détermine le mois/année de la période de relevé précédente
-                annee_debut = annee if mois > 1 else annee - 1
-                mois_debut = mois - 1 if mois > 1 else 12
-
-                # On s'assure que les jours sont valides pour les mois concernés
-                _, nb_jours_mois_precedent = calendar.monthrange(annee_debut, mois_debut)
-                jour_debut_effectif = min(carte.jour_debut_periode, nb_jours_mois_precedent)
-
-                _, nb_jours_mois_en_cours = calendar.monthrange(annee, mois)
-                jour_fin_effectif = min(carte.jour_fin_periode, nb_jours_mois_en_cours)
-
-                # On crée les dates avec les jours corrigés et valides
-                date_fin_releve = date(annee, mois, jour_fin_effectif)
-                date_debut_releve = date(annee_debut, mois_debut, jour_debut_effectif)
-                # --- FIN DE LA CORRECTION ---
-
-                transactions_reglement_carte = [
-                    t for t in toutes_les_transactions 
-                    if t.get('compte_affecte') == carte.nom 
-                    and date_debut_releve <= self._parse_date_flexible(t['date']) <= date_fin_releve
-                    and t.get('categorie') != '(Virement)'
-                    and t.get('pointe', False)
-                ]
-                
-                montant_a_regler = sum(t.get('montant', 0.0) for t in transactions_reglement_carte)
-                
-                if montant_a_regler != 0 and carte.compte_debit_associe in comptes_suivis_dict:
-                    impact_debit = -abs(montant_a_regler)
-                    activite_par_compte[carte.compte_debit_associe] += impact_debit
-                    lignes_budget_futures.append(f"  Prélèvement {carte.nom} sur {carte.compte_debit_associe}: {format_nombre_fr(impact_debit)} €")
-
-                    impact_credit = abs(montant_a_regler)
-                    activite_par_compte[carte.nom] += impact_credit
-                    lignes_budget_futures.append(f"  Apurement solde {carte.nom}: +{format_nombre_fr(impact_credit)} €")
-
-            except (ValueError, TypeError) as e:
-                print(f"  -> AVERTISSEMENT: Impossible de calculer le règlement pour {carte.nom}. Erreur: {e}")
-                continue
+            impact_credit = montant_a_regler
+            activite_par_compte[carte.nom] += impact_credit
+            lignes_budget_futures.append(f"  Apurement solde {carte.nom}: +{format_nombre_fr(impact_credit)} €")
 
         _, nb_jours_mois = calendar.monthrange(annee, mois)
         date_fin_mois_actuel = date(annee, mois, nb_jours_mois)
         
-        for t in toutes_les_transactions:
-            if not t.get('pointe', False) and self._parse_date_flexible(t['date']) <= date_fin_mois_actuel:
-                if t.get('compte_affecte') in comptes_suivis_dict:
-                     activite_par_compte[t.get('compte_affecte')] += t.get('montant', 0.0)
+        non_pointees = ~frame.pointe
+        for nom_compte, montant in frame.somme_par_compte(non_pointees & frame.jusqu_au(date_fin_mois_actuel)).items():
+            if nom_compte in comptes_suivis_dict:
+                activite_par_compte[nom_compte] += montant
         
+        jours_par_categorie = frame.jours_par_categorie(du_mois_en_cours)
         for cat in self.budget_data.get(cle_mois_annee, {}).get('categories_prevues', []):
             if cat.get('soldee', False): continue
 
@@ -2625,8 +2561,7 @@ class PatrimoineApp:
             realise_pour_cette_cat = realise_par_categorie.get(cat.get('categorie'), 0.0)
 
             if daily_details:
-                transactions_de_la_cat = [t for t in transactions_du_mois_en_cours if t.get('categorie') == cat.get('categorie')]
-                jours_avec_transaction_reelle = {self._parse_date_flexible(t['date']).day for t in transactions_de_la_cat}
+                jours_avec_transaction_reelle = jours_par_categorie.get(cat.get('categorie'), set())
 
                 impact_detail_reste_a_faire = 0.0
                 for detail in daily_details:
@@ -2675,36 +2610,22 @@ class PatrimoineApp:
         dates_graphe = [date(annee, mois, jour) for jour in range(1, nb_jours_mois + 1)]
         evolution_par_compte = {}
         comptes_actifs = [c for c in comptes_suivis if c.type_compte == 'Actif']
+        # Transactions non pointées de chaque jour du mois, par compte
+        sommes_journalieres = frame.sommes_journalieres_par_compte(non_pointees, dates_graphe[0], nb_jours_mois)
         
         for compte in comptes_actifs:
             evolution_par_compte[compte.nom] = []
             solde_courant = compte.solde
+            sommes_du_compte = sommes_journalieres.get(compte.nom)
             for jour in range(1, nb_jours_mois + 1):
-                date_jour = date(annee, mois, jour)
-                for t in toutes_les_transactions:
-                     if not t.get('pointe') and t.get('compte_affecte') == compte.nom and self._parse_date_flexible(t['date']) == date_jour:
-                         solde_courant += t.get('montant', 0.0)
+                if sommes_du_compte is not None:
+                    solde_courant += float(sommes_du_compte[jour - 1])
                 if jour == nb_jours_mois:
                      solde_courant += impact_budget_restant_par_compte.get(compte.nom, 0.0)
-                     for carte in cartes_passives:
+                     # Prélèvements des cartes sans règlement saisi ce mois-ci
+                     for carte, montant_a_regler in prelevements_cartes:
                          if carte.compte_debit_associe == compte.nom:
-                            # --- DÉBUT DE LA CORRECTION FINALE ---
-
-                            annee_debut_graph = annee if mois > 1 else annee - 1
-                            mois_debut_graph = mois - 1 if mois > 1 else 12
-                            
-                            _, nb_jours_mois_prec_graph = calendar.monthrange(annee_debut_graph, mois_debut_graph)
-                            jour_debut_eff_graph = min(carte.jour_debut_periode, nb_jours_mois_prec_graph)
-                            
-                            _, nb_jours_mois_cours_graph = calendar.monthrange(annee, mois)
-                            jour_fin_eff_graph = min(carte.jour_fin_periode, nb_jours_mois_cours_graph)
-
-                            date_fin_releve = date(annee, mois, jour_fin_eff_graph)
-                            date_debut_releve = date(annee_debut_graph, mois_debut_graph, jour_debut_eff_graph)
-                            # --- FIN DE LA CORRECTION FINALE ---
-
-                            montant_a_regler_graph = sum(t.get('montant', 0.0) for t in toutes_les_transactions if t.get('compte_affecte') == carte.nom and date_debut_releve <= self._parse_date_flexible(t['date']) <= date_fin_releve and t.get('pointe'))
-                            solde_courant -= abs(montant_a_regler_graph)
+                            solde_courant -= montant_a_regler
                 evolution_par_compte[compte.nom].append(solde_courant)
 
         return {
@@ -2785,103 +2706,28 @@ class PatrimoineApp:
             messagebox.showerror("Erreur", "Date invalide.", parent=self.root)
             return
 
-        # --- DÉBUT DE LA LOGIQUE DÉFINITIVE DE L'INSTANTANÉ VIRTUEL ---
-
-        # 1. Définir les dates pour le mois précédent
-        premier_jour_mois_selectionne = date(annee, mois, 1)
-        dernier_jour_mois_precedent = premier_jour_mois_selectionne - timedelta(days=1)
-        premier_jour_mois_precedent = dernier_jour_mois_precedent.replace(day=1)
-        annee_precedente, mois_precedent = premier_jour_mois_precedent.year, premier_jour_mois_precedent.month
-
-        # 2. Trouver le dernier instantané RÉEL du mois précédent
-        snapshots_mois_precedent = [
-            s for s in self.historique_patrimoine 
-            if premier_jour_mois_precedent <= datetime.strptime(s['date'], "%Y-%m-%d").date() <= dernier_jour_mois_precedent
-        ]
-        
-        if not snapshots_mois_precedent:
-            messagebox.showinfo("Données Insuffisantes", 
-                                f"Aucun instantané de patrimoine trouvé pour le mois précédent ({premier_jour_mois_precedent.strftime('%Y-%m')}) afin de servir de point de départ.",
+        # Instantanés (recherche dichotomique dans la série) et flux (regroupés sur la frame du budget)
+        service = ServiceVariationPatrimoine(HistorySeries.depuis_historique(self.historique_patrimoine), self._frame_budget(), self.comptes)
+        mois_precedent = (date(annee, mois, 1) - timedelta(days=1)).strftime("%Y-%m")
+        if service.indice_fin_de_mois(mois_precedent) is None:
+            messagebox.showinfo("Données Insuffisantes",
+                                f"Aucun instantané de patrimoine trouvé pour le mois précédent ({mois_precedent}) afin de servir de point de départ.",
                                 parent=self.root)
             return
-            
-        snapshots_mois_precedent.sort(key=lambda x: x['date'])
-        snapshot_base = copy.deepcopy(snapshots_mois_precedent[-1]) # On prend une copie pour la modifier
-
-        # 3. Trouver les transactions d'ajustement
-        toutes_les_transactions = self._get_all_transactions()
-        transactions_a_retirer = []
-        for t in toutes_les_transactions:
-            try:
-                date_trans_str = t.get('date')
-                date_budget_str = t.get('date_budgetaire')
-                if not date_trans_str or not date_budget_str:
-                    continue
-                
-                date_trans = datetime.strptime(date_trans_str, "%Y-%m-%d").date()
-                date_budget = datetime.strptime(date_budget_str, "%Y-%m-%d").date()
-
-                # On cherche les transactions qui ont eu lieu le mois précédent MAIS qui appartiennent au budget du mois en cours
-                if (date_trans.year == annee_precedente and date_trans.month == mois_precedent and
-                    date_budget.year == annee and date_budget.month == mois):
-                    transactions_a_retirer.append(t)
-            except (ValueError, TypeError):
-                continue
-
-        # 4. Créer l'instantané de départ VIRTUEL
-        if transactions_a_retirer:
-            print(f"INFO: {len(transactions_a_retirer)} transaction(s) d'ajustement trouvée(s) pour créer l'instantané virtuel.")
-            for t in transactions_a_retirer:
-                compte_nom = t.get('compte_affecte')
-                montant = t.get('montant', 0.0)
-                if compte_nom in snapshot_base['soldes_comptes']:
-                    # On "annule" la transaction sur le solde du compte
-                    snapshot_base['soldes_comptes'][compte_nom] -= montant
-            
-            # On recalcule les totaux du snapshot virtuel
-            pat_net, total_actifs, total_passifs = 0.0, 0.0, 0.0
-            for compte in self.comptes:
-                solde_ajuste = snapshot_base['soldes_comptes'].get(compte.nom, compte.solde) # On prend le solde ajusté
-                if compte.type_compte == 'Actif':
-                    total_actifs += solde_ajuste
-                elif compte.type_compte == 'Passif':
-                    total_passifs += solde_ajuste
-            pat_net = total_actifs - total_passifs
-            snapshot_base['patrimoine_net'] = pat_net
-            snapshot_base['total_actifs'] = total_actifs
-            snapshot_base['total_passifs_magnitude'] = total_passifs
-
-        snapshot_debut = snapshot_base # Notre point de départ est maintenant le snapshot virtuel
-
-        # 5. Trouver le dernier instantané du mois en cours (inchangé)
-        dernier_jour_mois_selectionne = (premier_jour_mois_selectionne.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
-        snapshots_mois_selectionne = [s for s in self.historique_patrimoine if premier_jour_mois_selectionne <= datetime.strptime(s['date'], "%Y-%m-%d").date() <= dernier_jour_mois_selectionne]
-        if not snapshots_mois_selectionne:
+        if service.indice_fin_de_mois(cle_mois_annee) is None:
             messagebox.showinfo("Données Insuffisantes", f"Aucun instantané de patrimoine trouvé pour le mois sélectionné ({cle_mois_annee}).", parent=self.root)
             return
-        snapshots_mois_selectionne.sort(key=lambda x: x['date'])
-        snapshot_fin = snapshots_mois_selectionne[-1]
-
-        # --- FIN DE LA LOGIQUE DE L'INSTANTANÉ VIRTUEL ---
-
-        # Le reste de la méthode pour préparer les transactions du mois est inchangé
-        transactions_du_mois_budgetaire = []
-        for t in toutes_les_transactions:
-            try:
-                date_a_utiliser_str = t.get('date_budgetaire') or t.get('date')
-                date_a_utiliser = datetime.strptime(date_a_utiliser_str, "%Y-%m-%d").date()
-                if date_a_utiliser.year == annee and date_a_utiliser.month == mois:
-                    transactions_du_mois_budgetaire.append(t)
-            except (ValueError, TypeError): continue
 
-        RapportVariationPatrimoineWindow(self.root, cle_mois_annee, snapshot_debut, snapshot_fin, self.comptes, transactions_du_mois_budgetaire)
+        # Toute l'année en un appel : le mois sélectionné et le tableau mensuel de l'onglet annuel
+        reconciliations_annee = service.reconciliations_annee(annee)
+        RapportVariationPatrimoineWindow(self.root, reconciliations_annee[mois - 1], reconciliations_annee)
 
     def _recalculer_soldes_portefeuilles(self):
         """
         Force le recalcul du solde de tous les comptes de type 'Actions/Titres'.
         Cette méthode garantit que le solde total est à jour avec les derniers cours connus.
         """
-        print("INFO: Recalcul des soldes des portefeuilles...")
+        log.debug("Recalcul des soldes des portefeuilles...")
         for compte in self.comptes:
             if compte.classe_actif == "Actions/Titres":
                 valeur_titres = 0
@@ -2893,12 +2739,14 @@ class PatrimoineApp:
                 compte.solde = valeur_titres + compte.solde_especes
 
     def ouvrir_rapport_annuel(self):
+        from rapport_annuel import YearlyReportApp
         report_window = tk.Toplevel(self.root)
         # MODIFICATION : On passe self.base_dir à la nouvelle fenêtre
         YearlyReportApp(report_window, self.base_dir)
 
     def ouvrir_comparateur(self):
         """Ouvre la fenêtre du comparateur de patrimoine en mode module."""
+        from comparateur_patrimoine import ComparateurPatrimoineApp
         # On charge les paramètres actuels pour les transmettre
         settings = self.data_manager.charger_parametres()
     
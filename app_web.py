@@ -1,24 +1,104 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import threading
+import logging
+import hashlib
+import json
+import base64
+import binascii
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, g
 from datetime import datetime, date, timedelta
 import calendar
-from collections import defaultdict
 
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 
 # Importe les classes et fonctions nécessaires de tes fichiers existants
 from models import Compte
-from services import SqlDataManager
+from services import SqlDataManager, ConflitDeVersion
 from utils import format_nombre_fr
+from cycles_carte import CyclesCarte
+from frame_transactions import TransactionFrame
+from journalisation import configurer_journalisation, get_logger, CANAL_PROJECTION
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'TA_CLE_SECRETE_ALEATOIRE_ET_LONGUE' # Utilise ta clé SECURE ici
 app.config['JSON_AS_ASCII'] = False # Pour gérer les caractères accentués correctement
 
+configurer_journalisation()
+log_web = get_logger('web')
+log_recurrences = get_logger('recurrences')
+log_projection = logging.getLogger(CANAL_PROJECTION)
+
+LIMITE_MAX_API = 500 # Nombre maximal de transactions par page de l'API
+INTERVALLE_PRECALCUL_SECONDES = 2.0 # Fréquence de vérification de la version des données par le thread de précalcul
+TENTATIVES_ECRITURE = 3 # Nombre d'essais d'une écriture conditionnelle en cas de conflit de version
+
 # Configure le chemin de la base de données sur ton SSD
-DB_PATH = os.path.join(app.root_path, "budget.db")
-data_manager = SqlDataManager(DB_PATH)
+DB_PATH = os.environ.get("SLC_DB_PATH", os.path.join(app.root_path, "budget.db"))
+# Une connexion par thread et par worker, base en journal WAL : voir wsgi.py / gunicorn.conf.py pour le déploiement
+data_manager = SqlDataManager(DB_PATH, connexion_par_thread=True)
+data_manager.activer_mode_concurrent()
+
+class CacheDonnees:
+    """
+    Cache des données chargées, partagé par toutes les requêtes du processus.
+    Chaque partie (patrimoine, budget) est rechargée seulement quand le compteur
+    de version de la base a changé depuis son dernier chargement.
+    """
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self._lock = threading.Lock()
+        self._entrees = {}
+
+    def version_courante(self):
+        """
+        Version des données : le compteur meta_version, relu à chaque appel. C'est une ligne lue par clé primaire sur
+        la connexion du thread ; les dates et tailles des fichiers de la base ne suffisent pas à détecter une écriture
+        (journal WAL réutilisé depuis le début après un checkpoint, même taille, même horodatage).
+        """
+        return self.data_manager.get_version()
+
+    def obtenir(self, partie, version):
+        with self._lock:
+            entree = self._entrees.get(partie)
+            if entree is None or entree[0] != version:
+                if partie == 'patrimoine':
+                    donnees = self.data_manager.charger_donnees()
+                elif partie == 'frame':
+                    # Colonnes des transactions du budget de la même version (construites une fois par version)
+                    entree_budget = self._entrees.get('budget')
+                    if entree_budget is None or entree_budget[0] != version:
+                        entree_budget = self._entrees['budget'] = (version, self.data_manager.charger_budget_donnees())
+                    donnees = TransactionFrame.depuis_budget(entree_budget[1])
+                else:
+                    donnees = self.data_manager.charger_budget_donnees()
+                # La version lue AVANT le chargement : une écriture concurrente provoquera un nouveau rechargement
+                entree = (version, donnees)
+                self._entrees[partie] = entree
+            return entree[1]
+
+cache_donnees = CacheDonnees(data_manager)
+
+class DonneesRequete:
+    """Vue des données pour une requête : la version est lue une seule fois, les parties sont chargées à la demande."""
+    def __init__(self, cache):
+        self.cache = cache
+        self.version = cache.version_courante()
+
+    def patrimoine(self):
+        return self.cache.obtenir('patrimoine', self.version)
+
+    def budget(self):
+        return self.cache.obtenir('budget', self.version)
+
+    def frame(self):
+        return self.cache.obtenir('frame', self.version)
+
+def _donnees_requete(rafraichir=False):
+    """Retourne les données de la requête courante, réutilisées par tous les appels de la même requête."""
+    if rafraichir or 'donnees' not in g:
+        g.donnees = DonneesRequete(cache_donnees)
+    return g.donnees
 
 # --- Configuration Flask-Login ---
 login_manager = LoginManager()
@@ -44,43 +124,26 @@ USERS_CREDENTIALS = {
 
 # --- Fonctions utilitaires réintégrées et adaptées ---
 
-def _parse_date_flexible(date_str):
-    """Tente de parser une chaîne de date avec plusieurs formats courants."""
-    formats_a_tester = [
-        "%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y",
-    ]
-    for fmt in formats_a_tester:
-        try:
-            return datetime.strptime(date_str, fmt).date()
-        except ValueError:
-            continue
-    raise ValueError(f"Format de date '{date_str}' non reconnu.")
-
-def _get_all_transactions_flat(budget_data):
-    """Rassemble toutes les transactions de tous les mois en une seule liste plate."""
-    all_trans = []
-    for cle, data in budget_data.items():
-        if not cle.startswith("_") and isinstance(data, dict) and 'transactions' in data:
-            all_trans.extend(data['transactions'])
-    return all_trans
-
-def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, comptes_app, data_manager):
+def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, comptes_app, data_manager, version_attendue=None):
     """
     Adapte la logique de generer_transactions_recurrentes_pour_le_mois de main.py
     pour l'environnement Flask.
+    L'écriture n'a lieu que si la base est toujours à version_attendue (sinon ConflitDeVersion) :
+    deux workers ne peuvent pas générer deux fois les mêmes occurrences.
     """
-    print(f"\n[DEBUG REC] Lancement génération récurrences pour {year:04d}-{month:02d}")
+    log_recurrences.debug("Lancement génération récurrences pour %04d-%02d", year, month)
 
     if 'transactions_recurrentes' not in budget_data:
-        print("[DEBUG REC] Pas de règles récurrentes définies.")
-        return
+        log_recurrences.debug("Pas de règles récurrentes définies.")
+        return False
 
     cle_mois_annee = f"{year}-{month:02d}"
-    if cle_mois_annee not in budget_data:
-        budget_data[cle_mois_annee] = {'categories_prevues': [], 'transactions': []}
+    donnees_du_mois = budget_data.get(cle_mois_annee, {'categories_prevues': [], 'transactions': []})
 
-    transactions_du_mois = budget_data[cle_mois_annee]['transactions']
-    categories_prevues_du_mois = budget_data[cle_mois_annee]['categories_prevues']
+    # budget_data provient du cache partagé : on ne le modifie pas, on collecte les ajouts à écrire en base
+    transactions_du_mois = donnees_du_mois['transactions']
+    categories_prevues_du_mois = donnees_du_mois['categories_prevues']
+    nouvelles_transactions, nouvelles_categories = [], []
     noms_categories_existantes = {cat['categorie'].lower() for cat in categories_prevues_du_mois}
 
     # Filtrer les transactions déjà générées ce mois-ci par une règle spécifique
@@ -107,7 +170,7 @@ def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, com
             date_debut = datetime.strptime(date_debut_str, "%Y-%m-%d").date()
             date_fin = datetime.strptime(date_fin_str, "%Y-%m-%d").date() if date_fin_str else date(9999, 12, 31)
         except (ValueError, TypeError):
-            print(f"[DEBUG REC] Erreur de date pour règle {id_recurrence}: {date_debut_str}/{date_fin_str}")
+            log_recurrences.debug("Erreur de date pour règle %s: %s/%s", id_recurrence, date_debut_str, date_fin_str)
             continue
 
         if date_fin < premier_jour_mois or date_debut > dernier_jour_mois:
@@ -135,7 +198,7 @@ def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, com
                 try:
                     dates_a_generer.append(date(year, month, min(jour_echeance_val, calendar.monthrange(year, month)[1])))
                 except ValueError:
-                    print(f"[DEBUG REC] Jour '{jour_echeance_val}' invalide pour {year}-{month} pour règle {id_recurrence}.")
+                    log_recurrences.debug("Jour '%s' invalide pour %s-%s pour règle %s.", jour_echeance_val, year, month, id_recurrence)
                     pass
 
         elif periodicite == 'Bi-mensuelle':
@@ -145,10 +208,10 @@ def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, com
                     try:
                         dates_a_generer.append(date(year, month, min(jour, calendar.monthrange(year, month)[1])))
                     except ValueError:
-                        print(f"[DEBUG REC] Jour bi-mensuel '{jour}' invalide pour {year}-{month} pour règle {id_recurrence}.")
+                        log_recurrences.debug("Jour bi-mensuel '%s' invalide pour %s-%s pour règle %s.", jour, year, month, id_recurrence)
                         pass
             except ValueError:
-                print(f"[DEBUG REC] Format jours bi-mensuels invalide pour règle {id_recurrence}.")
+                log_recurrences.debug("Format jours bi-mensuels invalide pour règle %s.", id_recurrence)
                 pass
 
         elif periodicite == 'Hebdomadaire':
@@ -160,17 +223,17 @@ def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, com
                         dates_a_generer.append(current_day)
                     current_day += timedelta(days=1)
             except ValueError:
-                print(f"[DEBUG REC] Jour semaine invalide pour règle {id_recurrence}.")
+                log_recurrences.debug("Jour semaine invalide pour règle %s.", id_recurrence)
                 pass
 
         for date_trans in dates_a_generer:
             if not (date_debut <= date_trans <= date_fin):
-                print(f"[DEBUG REC] Date {date_trans} hors période de validité pour règle {id_recurrence}.")
+                log_recurrences.debug("Date %s hors période de validité pour règle %s.", date_trans, id_recurrence)
                 continue
 
             id_gen = f"{id_recurrence}_{date_trans.strftime('%Y%m%d')}"
             if id_gen in ids_recurrence_generees_mois:
-                print(f"[DEBUG REC] Règle {id_recurrence} déjà générée pour {date_trans}.")
+                log_recurrences.debug("Règle %s déjà générée pour %s.", id_recurrence, date_trans)
                 continue
 
             modifications_faites = True
@@ -179,18 +242,18 @@ def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, com
                 montant_virement = abs(trans_rec.get('montant', 0.0))
                 source, dest = trans_rec.get('source'), trans_rec.get('destination')
                 if not source or not dest:
-                    print(f"[DEBUG REC] Virement incomplet pour règle {id_recurrence}.")
+                    log_recurrences.debug("Virement incomplet pour règle %s.", id_recurrence)
                     continue
 
-                transactions_du_mois.extend([
+                nouvelles_transactions.extend([
                     {"id": os.urandom(16).hex(), "id_recurrence": id_gen, "origine": "recurrente", "date": date_trans.strftime("%Y-%m-%d"), "description": f"Virement récurrent vers {dest}", "montant": -montant_virement, "categorie": "(Virement)", "compte_affecte": source, "pointe": False},
                     {"id": os.urandom(16).hex(), "id_recurrence": id_gen, "origine": "recurrente", "date": date_trans.strftime("%Y-%m-%d"), "description": f"Virement récurrent depuis {source}", "montant": montant_virement, "categorie": "(Virement)", "compte_affecte": dest, "pointe": False}
                 ])
-                print(f"[DEBUG REC] Virement récurrent généré: {montant_virement} de {source} vers {dest} le {date_trans}.")
+                log_recurrences.debug("Virement récurrent généré: %s de %s vers %s le %s.", montant_virement, source, dest, date_trans)
             else:
                 # Assurez-vous que le compte affecté est un compte suivi pour le budget
                 if not trans_rec.get('compte_affecte') or trans_rec.get('compte_affecte') not in [c.nom for c in comptes_app if c.suivi_budget]:
-                    print(f"[DEBUG REC] Règle '{trans_rec.get('description')}' ignorée, compte affecté non spécifié ou non suivi.")
+                    log_recurrences.debug("Règle '%s' ignorée, compte affecté non spécifié ou non suivi.", trans_rec.get('description'))
                     continue
 
                 nouvelle_trans = {
@@ -198,8 +261,8 @@ def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, com
                     "description": trans_rec['description'], "montant": trans_rec['montant'], "categorie": trans_rec['categorie'],
                     "compte_affecte": trans_rec['compte_affecte'], "pointe": False
                 }
-                transactions_du_mois.append(nouvelle_trans)
-                print(f"[DEBUG REC] Transaction récurrente générée: {trans_rec['description']} ({trans_rec['montant']}€) le {date_trans}.")
+                nouvelles_transactions.append(nouvelle_trans)
+                log_recurrences.debug("Transaction récurrente générée: %s (%s€) le %s.", trans_rec['description'], trans_rec['montant'], date_trans)
 
                 # --- PARTIE 3 : Création automatique du budget ---
                 cat_nom_lower = trans_rec['categorie'].lower()
@@ -212,140 +275,96 @@ def _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, com
                         'compte_prevu': trans_rec['compte_affecte'],
                         'soldee': False
                     }
-                    categories_prevues_du_mois.append(nouvelle_cat_budget)
+                    nouvelles_categories.append(nouvelle_cat_budget)
                     noms_categories_existantes.add(cat_nom_lower)
-                    print(f"[DEBUG REC] Catégorie de budget auto-créée pour '{trans_rec['categorie']}'.")
+                    log_recurrences.debug("Catégorie de budget auto-créée pour '%s'.", trans_rec['categorie'])
 
-    if modifications_faites:
-        data_manager.sauvegarder_budget_donnees(budget_data)
-        print("[DEBUG REC] Modifications de budget_data sauvegardées.")
-    else:
-        print("[DEBUG REC] Aucune modification à sauvegarder.")
+    if modifications_faites and (nouvelles_transactions or nouvelles_categories):
+        data_manager.ajouter_elements_budget(cle_mois_annee, nouvelles_transactions, nouvelles_categories, version_attendue=version_attendue)
+        log_recurrences.debug("Transactions générées ajoutées à la base.")
+        return True
+    log_recurrences.debug("Aucune modification à sauvegarder.")
+    return False
 
-def _calculer_solde_previsionnel(year, month, comptes_app, all_budget_data):
+def _calculer_solde_previsionnel(year, month, comptes_app, all_budget_data, frame=None):
     """
     Adapte le moteur de calcul _calculer_projection_mensuelle de main.py
     pour être utilisé dans Flask.
+    frame : TransactionFrame de all_budget_data si elle est déjà construite (cache des données), sinon elle l'est ici.
     """
     try:
-        print(f"\n[DEBUG PROJECTION] Lancement du calcul prévisionnel pour {year:04d}-{month:02d}")
+        year, month = int(year), int(month)
     except (ValueError, TypeError):
-        print("[DEBUG PROJECTION] Erreur initiale de type/valeur pour projection.")
+        log_projection.warning("Erreur initiale de type/valeur pour projection.")
         return None
+    # Le canal de diagnostic est coupé par défaut : on évite alors jusqu'aux appels dans les boucles
+    debug_actif = log_projection.isEnabledFor(logging.DEBUG)
+    log_projection.debug("Lancement du calcul prévisionnel pour %04d-%02d", year, month)
 
     comptes_suivis = [c for c in comptes_app if c.suivi_budget]
-    print(f"[DEBUG PROJECTION] Nombre total de comptes passés (comptes_app) : {len(comptes_app)}")
-    for c in comptes_app:
-        print(f"[DEBUG PROJECTION] Compte: {c.nom} (Type: {c.type_compte}), Suivi Budget: {c.suivi_budget}, Solde: {c.solde}")
+    log_projection.debug("Nombre total de comptes passés (comptes_app) : %s", len(comptes_app))
+    for c in (comptes_app if debug_actif else ()):
+        log_projection.debug("Compte: %s (Type: %s), Suivi Budget: %s, Solde: %s", c.nom, c.type_compte, c.suivi_budget, c.solde)
 
-    print(f"[DEBUG PROJECTION] Nombre de comptes suivis trouvés : {len(comptes_suivis)}")
+    log_projection.debug("Nombre de comptes suivis trouvés : %s", len(comptes_suivis))
 
     if not comptes_suivis:
-        print("[DEBUG PROJECTION] Aucun compte marqué pour le suivi budgétaire trouvé. Retourne None.")
+        log_projection.debug("Aucun compte marqué pour le suivi budgétaire trouvé. Retourne None.")
         return None
 
     comptes_suivis_dict = {c.nom: c for c in comptes_suivis}
     activite_par_compte = {c.nom: 0.0 for c in comptes_suivis}
     impact_budget_restant_par_compte = {c.nom: 0.0 for c in comptes_suivis}
 
-    # _get_all_transactions_flat est une fonction auxiliaire qui doit être définie
-    toutes_les_transactions = _get_all_transactions_flat(all_budget_data)
+    if frame is None:
+        frame = TransactionFrame.depuis_budget(all_budget_data)
 
     cle_mois_annee = f"{year:04d}-{month:02d}"
 
-    transactions_du_mois_en_cours = [t for t in toutes_les_transactions if _parse_date_flexible(t['date']).strftime('%Y-%m') == cle_mois_annee]
-
-    realise_par_categorie = defaultdict(float)
-    for t in transactions_du_mois_en_cours:
-        if t.get('categorie') != "(Virement)":
-            realise_par_categorie[t.get('categorie')] += t.get('montant', 0.0)
+    du_mois_en_cours = frame.du_mois(cle_mois_annee)
+    realise_par_categorie = frame.somme_par_categorie(du_mois_en_cours & frame.hors_virements())
 
-    # --- Simulation des règlements de cartes (logique dupliquée de main.py) ---
-    print("[DEBUG PROJECTION] Simulation des règlements de cartes à débit différé...")
-    cartes_passives = [c for c in comptes_suivis if c.type_compte == 'Passif']
+    # --- Simulation des règlements de cartes (cycles de relevé partagés avec l'application de bureau) ---
+    log_projection.debug("Simulation des règlements de cartes à débit différé...")
+    cycles_cartes = CyclesCarte([c for c in comptes_suivis if c.type_compte == 'Passif'], frame.transactions)
+    prelevements_cartes = cycles_cartes.prelevements_a_simuler(cle_mois_annee)
     lignes_budget_futures = [] # Pour le détail affiché
-    for carte in cartes_passives:
-        if not all([carte.jour_debit, carte.jour_debut_periode, carte.jour_fin_periode, carte.compte_debit_associe]):
-            print(f"  [DEBUG PROJECTION] -> Carte '{carte.nom}' ignorée, infos de règlement manquantes.")
-            continue
+    for carte, montant_a_regler in prelevements_cartes:
+        if carte.compte_debit_associe not in comptes_suivis_dict: continue
+        impact_debit = -montant_a_regler
+        activite_par_compte[carte.compte_debit_associe] += impact_debit
+        lignes_budget_futures.append(f"  Prélèvement CB {carte.nom} sur {carte.compte_debit_associe}: {format_nombre_fr(impact_debit)} €")
 
-        reglement_deja_saisi = any(
-            t.get('categorie') == '(Virement)' and
-            (
-                (t.get('compte_affecte') == carte.compte_debit_associe and f"vers {carte.nom}" in t.get('description', '')) or
-                (t.get('compte_affecte') == carte.nom and f"depuis {carte.compte_debit_associe}" in t.get('description', ''))
-            )
-            for t in transactions_du_mois_en_cours # On cherche dans les transactions DU MOIS EN COURS
-        )
-
-        if reglement_deja_saisi:
-            print(f"  [DEBUG PROJECTION] -> Un règlement manuel pour la carte '{carte.nom}' a déjà été trouvé. Simulation ignorée.")
-            continue
-
-        try:
-            # Calcul robuste des dates de relevé (gestion des fins de mois)
-            last_day_month_fin = calendar.monthrange(year, month)[1]
-            jour_fin_releve_clamped = min(carte.jour_fin_periode, last_day_month_fin)
-            date_fin_releve = date(year, month, jour_fin_releve_clamped)
-
-            prev_month = month - 1
-            prev_year = year
-            if prev_month == 0:
-                prev_month = 12
-                prev_year -= 1
-
-            last_day_month_debut = calendar.monthrange(prev_year, prev_month)[1]
-            jour_debut_releve_clamped = min(carte.jour_debut_periode, last_day_month_debut)
-            date_debut_releve = date(prev_year, prev_month, jour_debut_releve_clamped)
-
-            transactions_reglement_carte = [
-                t for t in toutes_les_transactions # On cherche dans TOUTES les transactions de la BD
-                if t.get('compte_affecte') == carte.nom
-                and date_debut_releve <= _parse_date_flexible(t['date']) <= date_fin_releve
-                and t.get('categorie') != '(Virement)'
-                and t.get('pointe', False) # On ne prend que les transactions pointées pour le solde de la CB
-            ]
-
-            montant_a_regler = sum(t.get('montant', 0.0) for t in transactions_reglement_carte)
-
-            if montant_a_regler != 0 and carte.compte_debit_associe in comptes_suivis_dict:
-                impact_debit = -abs(montant_a_regler)
-                activite_par_compte[carte.compte_debit_associe] += impact_debit
-                lignes_budget_futures.append(f"  Prélèvement CB {carte.nom} sur {carte.compte_debit_associe}: {format_nombre_fr(impact_debit)} €")
-
-                impact_credit = abs(montant_a_regler)
-                activite_par_compte[carte.nom] += impact_credit
-                lignes_budget_futures.append(f"  Apurement solde {carte.nom}: +{format_nombre_fr(impact_credit)} €")
-                print(f"  [DEBUG PROJECTION] -> Simulation règlement carte: {carte.nom} de {montant_a_regler}€")
-
-        except (ValueError, TypeError, AttributeError) as e:
-            print(f"  [DEBUG PROJECTION] -> AVERTISSEMENT: Impossible de calculer le règlement pour {carte.nom}. Erreur: {e}")
-            continue
+        impact_credit = montant_a_regler
+        activite_par_compte[carte.nom] += impact_credit
+        lignes_budget_futures.append(f"  Apurement solde {carte.nom}: +{format_nombre_fr(impact_credit)} €")
+        log_projection.debug("Simulation règlement carte: %s de %s€", carte.nom, montant_a_regler)
 
     # --- Calcul de l'activité (transactions non pointées) ---
-    print("[DEBUG PROJECTION] Calcul de l'activité (transactions non pointées jusqu'à la fin du mois)...")
+    log_projection.debug("Calcul de l'activité (transactions non pointées jusqu'à la fin du mois)...")
     _, nb_jours_mois = calendar.monthrange(year, month)
     date_fin_mois_actuel = date(year, month, nb_jours_mois)
 
-    for t in toutes_les_transactions: # Cherche dans TOUTES les transactions
-        if not t.get('pointe', False) and _parse_date_flexible(t['date']) <= date_fin_mois_actuel:
-            if t.get('compte_affecte') in comptes_suivis_dict:
-                 activite_par_compte[t.get('compte_affecte')] += t.get('montant', 0.0)
-                 print(f"  [DEBUG PROJECTION] -> Transaction non pointée: {t.get('description')} ({t.get('montant')}€ sur {t.get('compte_affecte')})")
+    non_pointees = ~frame.pointe
+    for nom_compte, montant in frame.somme_par_compte(non_pointees & frame.jusqu_au(date_fin_mois_actuel)).items(): # TOUTES les transactions
+        if nom_compte in comptes_suivis_dict:
+            activite_par_compte[nom_compte] += montant
+            if debug_actif: log_projection.debug("Transactions non pointées sur %s : %s€", nom_compte, montant)
 
     # --- Calcul du budget restant (logique dupliquée de main.py) ---
-    print("[DEBUG PROJECTION] Calcul de l'impact du budget restant (logique hybride)...")
+    log_projection.debug("Calcul de l'impact du budget restant (logique hybride)...")
     donnees_mois_budget = all_budget_data.get(cle_mois_annee, {}) # Accès aux données du mois
     categories_prevues_mois = donnees_mois_budget.get('categories_prevues', [])
+    jours_par_categorie = frame.jours_par_categorie(du_mois_en_cours)
 
     for cat in categories_prevues_mois:
         if cat.get('soldee', False):
-            print(f"  [DEBUG PROJECTION] Catégorie '{cat.get('categorie')}' est soldée, ignorée pour impact prévisionnel.")
+            log_projection.debug("Catégorie '%s' est soldée, ignorée pour impact prévisionnel.", cat.get('categorie'))
             continue
 
         compte_prevu = cat.get('compte_prevu')
         if not compte_prevu or compte_prevu not in comptes_suivis_dict:
-            print(f"  [DEBUG PROJECTION] Catégorie '{cat.get('categorie')}' ignorée (compte non trouvé ou non suivi).")
+            log_projection.debug("Catégorie '%s' ignorée (compte non trouvé ou non suivi).", cat.get('categorie'))
             continue
 
         daily_details = cat.get('details')
@@ -353,8 +372,7 @@ def _calculer_solde_previsionnel(year, month, comptes_app, all_budget_data):
         realise_pour_cette_cat = realise_par_categorie.get(cat.get('categorie'), 0.0) # Ce realise_par_categorie est pour transactions DU MOIS
 
         if daily_details:
-            transactions_de_la_cat = [t for t in transactions_du_mois_en_cours if t.get('categorie') == cat.get('categorie')]
-            jours_avec_transaction_reelle = {_parse_date_flexible(t['date']).day for t in transactions_de_la_cat}
+            jours_avec_transaction_reelle = jours_par_categorie.get(cat.get('categorie'), set())
 
             impact_detail_reste_a_faire = 0.0
             for detail in daily_details:
@@ -374,7 +392,7 @@ def _calculer_solde_previsionnel(year, month, comptes_app, all_budget_data):
                 impact_final = impact_detail_reste_a_faire
 
             impact_budget_restant_par_compte[compte_prevu] += impact_final
-            print(f"  [DEBUG PROJECTION] -> Impact détails journaliers '{cat.get('categorie')}': {impact_final} € sur {compte_prevu}")
+            log_projection.debug("Impact détails journaliers '%s': %s € sur %s", cat.get('categorie'), impact_final, compte_prevu)
 
         else: # Si pas de détails journaliers, la logique actuelle est bonne (prévu - réalisé)
             prevu_signe = -cat.get('prevu', 0.0) if cat.get('type') == 'Dépense' else cat.get('prevu', 0.0)
@@ -383,11 +401,11 @@ def _calculer_solde_previsionnel(year, month, comptes_app, all_budget_data):
             if abs(reste_a_impacter) > 0.01:
                 impact_budget_restant_par_compte[compte_prevu] += reste_a_impacter
                 lignes_budget_futures.append(f"  Budget standard '{cat.get('categorie')}': {format_nombre_fr(reste_a_impacter)} € sur {compte_prevu}")
-                print(f"  [DEBUG PROJECTION] -> Impact restant '{cat.get('categorie')}': {reste_a_impacter} € sur {compte_prevu}")
+                log_projection.debug("Impact restant '%s': %s € sur %s", cat.get('categorie'), reste_a_impacter, compte_prevu)
 
 
     # --- Construction finale (logique des totaux inchangée) ---
-    print("[DEBUG PROJECTION] Construction du détail final pour affichage...")
+    log_projection.debug("Construction du détail final pour affichage...")
     details_pour_affichage = {}
     total_previsionnel_actifs = 0.0
     total_previsionnel_passifs = 0.0
@@ -420,54 +438,36 @@ def _calculer_solde_previsionnel(year, month, comptes_app, all_budget_data):
             'impact_budget': impact_budget,
             'solde_previsionnel': solde_previsionnel_display
         }
-        print(f"  [DEBUG PROJECTION] -> Compte '{compte.nom}': Solde Pointé={solde_pointe_compte}, Activité Mois={activite_mois}, Impact Budget={impact_budget}, Solde Prévisionnel={solde_previsionnel_display}")
+        if debug_actif: log_projection.debug("Compte '%s': Solde Pointé=%s, Activité Mois=%s, Impact Budget=%s, Solde Prévisionnel=%s", compte.nom, solde_pointe_compte, activite_mois, impact_budget, solde_previsionnel_display)
 
     total_previsionnel_net = total_previsionnel_actifs - total_previsionnel_passifs
-    print(f"[DEBUG PROJECTION] Total Actifs Prévisionnels : {total_previsionnel_actifs}")
-    print(f"[DEBUG PROJECTION] Total Passifs Prévisionnels : {total_previsionnel_passifs}")
-    print(f"[DEBUG PROJECTION] PATRIMOINE NET PRÉVISIONNEL CALCULÉ : {total_previsionnel_net}")
+    log_projection.debug("Total Actifs Prévisionnels : %s", total_previsionnel_actifs)
+    log_projection.debug("Total Passifs Prévisionnels : %s", total_previsionnel_passifs)
+    log_projection.debug("PATRIMOINE NET PRÉVISIONNEL CALCULÉ : %s", total_previsionnel_net)
 
     # --- Calcul pour le graphique d'évolution des soldes (dans _calculer_projection_mensuelle) ---
+    # Transactions non pointées de chaque jour du mois, par compte
+    sommes_journalieres = frame.sommes_journalieres_par_compte(non_pointees, dates_graphe[0], nb_jours_mois)
     for compte in comptes_app: # Itérer sur tous les comptes, pas seulement suivis
         if compte.type_compte == 'Actif': # Seulement les actifs pour ce graphique
             evolution_par_compte[compte.nom] = []
             solde_courant = compte.solde # Solde initial pointé
+            sommes_du_compte = sommes_journalieres.get(compte.nom)
 
             # Pour chaque jour du mois
             for jour in range(1, calendar.monthrange(year, month)[1] + 1):
-                date_jour = date(year, month, jour)
-
-                # Ajouter les transactions non pointées qui se sont déroulées jusqu'à ce jour
-                for t in toutes_les_transactions:
-                     # Assurez-vous que la transaction est du bon compte et non pointée
-                     if not t.get('pointe') and t.get('compte_affecte') == compte.nom and _parse_date_flexible(t['date']) == date_jour:
-                         solde_courant += t.get('montant', 0.0)
+                # Ajouter les transactions non pointées du compte qui se sont déroulées ce jour
+                if sommes_du_compte is not None:
+                    solde_courant += float(sommes_du_compte[jour - 1])
 
                 # A la fin du mois, ajoute l'impact du budget et des règlements de cartes
                 if jour == calendar.monthrange(year, month)[1]: # Dernier jour du mois
                      solde_courant += impact_budget_restant_par_compte.get(compte.nom, 0.0) # Impact du budget
 
-                     # Impact des règlements de cartes de débit différé (qui arrivent généralement en fin de mois)
-                     for carte in cartes_passives:
+                     # Impact des règlements de cartes de débit différé sans règlement saisi ce mois-ci
+                     for carte, montant_a_regler in prelevements_cartes:
                          if carte.compte_debit_associe == compte.nom:
-                             # On recalcule le montant à régler pour cette simulation de graphique
-                             last_day_month_fin_graph = calendar.monthrange(year, month)[1]
-                             jour_fin_releve_clamped_graph = min(carte.jour_fin_periode, last_day_month_fin_graph)
-                             date_fin_releve_graph = date(year, month, jour_fin_releve_clamped_graph)
-
-                             prev_month_graph = month - 1
-                             prev_year_graph = year
-                             if prev_month_graph == 0:
-                                 prev_month_graph = 12
-                                 prev_year_graph -= 1
-
-                             last_day_month_debut_graph = calendar.monthrange(prev_year_graph, prev_month_graph)[1]
-                             jour_debut_releve_clamped_graph = min(carte.jour_debut_periode, last_day_month_debut_graph)
-                             date_debut_releve_graph = date(prev_year_graph, prev_month_graph, jour_debut_releve_clamped_graph)
-
-                             montant_a_regler_graph = sum(t.get('montant', 0.0) for t in toutes_les_transactions if t.get('compte_affecte') == carte.nom and date_debut_releve_graph <= _parse_date_flexible(t['date']) <= date_fin_releve_graph and t.get('pointe'))
-                             if not any(t.get('categorie') == '(Virement)' and t.get('compte_affecte') == compte.nom and f"vers {carte.nom}" in t.get('description','') for t in transactions_du_mois_en_cours):
-                                  solde_courant -= abs(montant_a_regler_graph) # Si pas de virement manuel pour ce mois
+                             solde_courant -= montant_a_regler
 
                 evolution_par_compte[compte.nom].append(solde_courant)
 
@@ -481,6 +481,126 @@ def _calculer_solde_previsionnel(year, month, comptes_app, all_budget_data):
         "total_previsionnel_net": total_previsionnel_net
     }
 
+def _calculer_synthese_mois(year, month, comptes_app, all_budget_data, frame=None):
+    """Projection, trésorerie et synthèse des catégories d'un mois (montants bruts, non formatés)."""
+    cle_mois_annee = f"{year:04d}-{month:02d}"
+    comptes_suivis_budget = [c for c in comptes_app if c.suivi_budget]
+    tresorerie_pointee = sum(c.solde if c.type_compte == 'Actif' else -abs(c.solde) for c in comptes_suivis_budget)
+    if frame is None:
+        frame = TransactionFrame.depuis_budget(all_budget_data)
+    # Comme la vue Budget du bureau, le mois s'entend en mois budgétaire (date_budgetaire, sinon date réelle) :
+    # "en attente" = transactions non pointées rattachées à ce mois ou à un mois antérieur
+    montant_attente = float(frame.montant[~frame.pointe & frame.jusqu_au_mois_budgetaire(cle_mois_annee)].sum())
+
+    # Réalisé par catégorie du mois budgétaire, lu dans les agrégats mensuels plutôt que recalculé sur les transactions
+    realise_par_categorie = data_manager.realise_par_categorie(cle_mois_annee)
+    categories = []
+    for cat_data in all_budget_data.get(cle_mois_annee, {}).get('categories_prevues', []):
+        prevu = cat_data.get('prevu', 0.0)
+        realise_brut = realise_par_categorie.get(cat_data.get('categorie'), 0.0)
+        if cat_data.get('type') == 'Dépense':
+            realise, ecart = abs(realise_brut), prevu - abs(realise_brut)
+        else: # Revenu
+            realise, ecart = realise_brut, realise_brut - prevu
+        categories.append({'categorie': cat_data.get('categorie'), 'prevu': prevu, 'realise': realise, 'reste': ecart, 'soldee': cat_data.get('soldee', False)})
+
+    return {
+        'projection': _calculer_solde_previsionnel(year, month, comptes_app, all_budget_data, frame),
+        'tresorerie_pointee': tresorerie_pointee,
+        'montant_attente': montant_attente,
+        'categories': categories
+    }
+
+class PrecalculMois:
+    """
+    Tâche de fond (un thread par worker) qui, à chaque changement de version des données, génère les
+    récurrences puis précalcule la synthèse du mois courant et du mois suivant. Les pages servent ces
+    résultats sans attendre la projection.
+    """
+    def __init__(self, cache, intervalle=INTERVALLE_PRECALCUL_SECONDES):
+        self.cache = cache
+        self.intervalle = intervalle
+        self._resultats = {}
+        self._lock = threading.Lock()
+        self._reveil = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._version_calculee = None
+
+    def demarrer(self):
+        """Démarre le thread s'il ne tourne pas déjà dans ce processus (les threads ne survivent pas à un fork)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._boucle, name="precalcul-mois", daemon=True)
+            self._thread.start()
+
+    def signaler(self):
+        """Demande un nouveau passage sans attendre la fin de l'intervalle."""
+        self._reveil.set()
+
+    def obtenir(self, year, month):
+        """Retourne (version, synthèse) si ce mois a été précalculé, sinon None."""
+        with self._lock:
+            return self._resultats.get((year, month))
+
+    @staticmethod
+    def mois_precalcules():
+        aujourd_hui = date.today()
+        suivant = (aujourd_hui.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return [(aujourd_hui.year, aujourd_hui.month), (suivant.year, suivant.month)]
+
+    def _boucle(self):
+        while True:
+            try:
+                version = self.cache.version_courante()
+                if version != self._version_calculee:
+                    self._precalculer(version)
+            except Exception:
+                log_web.exception("Échec du précalcul des synthèses mensuelles")
+            self._reveil.wait(self.intervalle)
+            self._reveil.clear()
+
+    def _precalculer(self, version):
+        comptes, _ = self.cache.obtenir('patrimoine', version)
+        budget_data = self.cache.obtenir('budget', version)
+        mois = self.mois_precalcules()
+        for year, month in mois:
+            try:
+                if _generer_transactions_recurrentes_pour_le_mois(year, month, budget_data, comptes, data_manager, version_attendue=version):
+                    self.signaler() # La base vient de changer : on recalcule aussitôt sur les nouvelles données
+                    return
+            except ConflitDeVersion:
+                self.signaler()
+                return
+        frame = self.cache.obtenir('frame', version)
+        resultats = {(year, month): (version, _calculer_synthese_mois(year, month, comptes, budget_data, frame)) for year, month in mois}
+        with self._lock:
+            self._resultats = resultats
+        self._version_calculee = version
+        log_web.debug("Synthèses précalculées pour %s (version %s)", mois, version)
+
+precalcul_mois = PrecalculMois(cache_donnees)
+
+def _synthese_mois(year, month, comptes_app, all_budget_data):
+    """
+    Synthèse du mois pour une requête. Pour les mois précalculés, on sert le dernier résultat disponible,
+    même s'il date d'une version précédente (le thread est alors réveillé). Retourne (synthèse, à_jour).
+    Les autres mois, ou avant le premier passage du thread, sont calculés à la demande.
+    """
+    precalcule = precalcul_mois.obtenir(year, month)
+    if precalcule is not None:
+        version, synthese = precalcule
+        a_jour = version == _donnees_requete().version
+        if not a_jour: precalcul_mois.signaler()
+        return synthese, a_jour
+    return _calculer_synthese_mois(year, month, comptes_app, all_budget_data, _donnees_requete().frame()), True
+
+@app.before_request
+def _demarrer_precalcul():
+    precalcul_mois.demarrer()
+
 # --- ROUTES FLASK ---
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -512,16 +632,31 @@ def logout():
 @login_required
 def dashboard():
     try:
-        comptes, historique_patrimoine = data_manager.charger_donnees()
+        comptes, historique_patrimoine = _donnees_requete().patrimoine()
         patrimoine_net = sum(c.solde if c.type_compte == 'Actif' else -abs(c.solde) for c in comptes)
 
         current_year = date.today().year
         current_month = date.today().month
 
+        # Synthèse du mois courant à partir des agrégats mensuels (quelques lignes au lieu de toutes les transactions)
+        recettes_mois = depenses_mois = 0.0
+        for row in data_manager.charger_rollup(f"{current_year:04d}-{current_month:02d}"):
+            if row['categorie'] == "(Virement)": continue
+            if row['signe'] > 0: recettes_mois += row['somme']
+            else: depenses_mois += row['somme']
+
+        # Solde prévisionnel du mois : servi seulement s'il a déjà été précalculé (jamais calculé ici)
+        precalcule = precalcul_mois.obtenir(current_year, current_month)
+        projection = precalcule[1]['projection'] if precalcule else None
+
         return render_template('dashboard.html',
                                username=current_user.id,
+                               total_previsionnel_net=format_nombre_fr(projection['total_previsionnel_net']) if projection else None,
                                comptes=comptes,
                                patrimoine_net=format_nombre_fr(patrimoine_net),
+                               recettes_mois=format_nombre_fr(recettes_mois),
+                               depenses_mois=format_nombre_fr(depenses_mois),
+                               solde_mois=format_nombre_fr(recettes_mois + depenses_mois),
                                current_year=current_year,
                                current_month=current_month)
     except Exception as e:
@@ -543,17 +678,27 @@ def budget_mensuel():
 
     cle_mois_annee = f"{year:04d}-{month:02d}"
 
-    comptes, _ = data_manager.charger_donnees() # Recharge les comptes pour avoir les dernières données
-    all_budget_data = data_manager.charger_budget_donnees() # Charge toutes les données de budget
+    comptes, _ = _donnees_requete().patrimoine()
+    all_budget_data = _donnees_requete().budget()
 
     # --- IMPORTANT : Générer les transactions récurrentes AVANT de calculer la projection ---
-    _generer_transactions_recurrentes_pour_le_mois(year, month, all_budget_data, comptes, data_manager)
-    # Recharger les données du budget après la génération si des modifs ont eu lieu
-    all_budget_data = data_manager.charger_budget_donnees() 
+    # Le budget n'est relu (via le cache) que si la génération a réellement écrit en base,
+    # ou si un autre worker a modifié la base entre notre lecture et notre écriture.
+    for tentative in range(TENTATIVES_ECRITURE):
+        try:
+            genere = _generer_transactions_recurrentes_pour_le_mois(year, month, all_budget_data, comptes, data_manager,
+                                                                     version_attendue=_donnees_requete().version)
+        except ConflitDeVersion:
+            genere = True
+            if tentative == TENTATIVES_ECRITURE - 1: raise
+        if not genere: break
+        comptes, _ = _donnees_requete(rafraichir=True).patrimoine()
+        all_budget_data = _donnees_requete().budget()
 
 
-    # --- Appel de la fonction de calcul du solde prévisionnel ---
-    projection_results = _calculer_solde_previsionnel(year, month, comptes, all_budget_data)
+    # --- Synthèse du mois : précalculée en tâche de fond pour le mois courant et le suivant ---
+    synthese, synthese_a_jour = _synthese_mois(year, month, comptes, all_budget_data)
+    projection_results = synthese['projection']
 
     if projection_results is None:
         total_previsionnel_net = 0.0
@@ -568,45 +713,22 @@ def budget_mensuel():
         total_previsionnel_net = projection_results.get('total_previsionnel_net', 0.0)
         details_pour_affichage = projection_results.get('details_pour_affichage', {})
 
-        # Calcul des totaux actuels de trésorerie (Pointée, En Attente, Virtuel)
-        comptes_suivis_budget = [c for c in comptes if c.suivi_budget]
-        tresorerie_pointee = sum(c.solde if c.type_compte == 'Actif' else -abs(c.solde) for c in comptes_suivis_budget)
-
-        transactions_non_pointees_actuelles = [t for t in _get_all_transactions_flat(all_budget_data) if not t.get('pointe', False) and _parse_date_flexible(t['date']).strftime('%Y-%m') == cle_mois_annee]
-        montant_attente = sum(t.get('montant', 0.0) for t in transactions_non_pointees_actuelles)
+        # Totaux actuels de trésorerie (Pointée, En Attente, Virtuel)
+        tresorerie_pointee = synthese['tresorerie_pointee']
+        montant_attente = synthese['montant_attente']
         solde_virtuel = tresorerie_pointee + montant_attente
 
-        # Préparation des catégories et transactions pour l'affichage (depuis les données DU MOIS)
-        donnees_du_mois = all_budget_data.get(cle_mois_annee, {'categories_prevues': [], 'transactions': []})
-        transactions_du_mois = donnees_du_mois.get('transactions', [])
-        categories_prevues = donnees_du_mois.get('categories_prevues', [])
-
-        realise_par_categorie = defaultdict(float)
-        for trans in transactions_du_mois:
-            cat_nom = trans.get('categorie', '(Non assigné)')
-            if cat_nom != "(Virement)":
-                realise_par_categorie[cat_nom] = realise_par_categorie.get(cat_nom, 0.0) + trans.get('montant', 0.0)
+        # Préparation des transactions pour l'affichage : celles du mois budgétaire, comme le réalisé des catégories
+        frame = _donnees_requete().frame()
+        transactions_du_mois = frame.transactions_selon(frame.du_mois_budgetaire(cle_mois_annee))
 
-        budget_categories_display = []
-        for cat_data in categories_prevues:
-            nom_cat = cat_data.get('categorie')
-            prevu = cat_data.get('prevu', 0.0)
-            realise_brut = realise_par_categorie.get(nom_cat, 0.0)
-
-            realise_display = abs(realise_brut) if cat_data.get('type') == 'Dépense' else realise_brut
-
-            if cat_data.get('type') == 'Dépense':
-                ecart = prevu - abs(realise_brut)
-            else: # Revenu
-                ecart = realise_brut - prevu
-
-            budget_categories_display.append({
-                'categorie': nom_cat,
-                'prevu': format_nombre_fr(prevu),
-                'realise': format_nombre_fr(realise_display),
-                'reste': format_nombre_fr(ecart),
-                'soldee': cat_data.get('soldee', False)
-            })
+        budget_categories_display = [{
+            'categorie': cat['categorie'],
+            'prevu': format_nombre_fr(cat['prevu']),
+            'realise': format_nombre_fr(cat['realise']),
+            'reste': format_nombre_fr(cat['reste']),
+            'soldee': cat['soldee']
+        } for cat in synthese['categories']]
 
         transactions_display = []
         # On n'affiche que les transactions du mois sélectionné, non pointées ou toutes si l'option est active (quand on aura l'option)
@@ -638,7 +760,8 @@ def budget_mensuel():
                            solde_virtuel=format_nombre_fr(solde_virtuel),
                            total_previsionnel_net=format_nombre_fr(total_previsionnel_net),
                            lignes_budget_futures=projection_results.get('lignes_budget_futures', []) if projection_results else [],
-                           details_pour_affichage=projection_results.get('details_pour_affichage', {}) if projection_results else {} # pour le détail éventuel
+                           details_pour_affichage=projection_results.get('details_pour_affichage', {}) if projection_results else {}, # pour le détail éventuel
+                           synthese_a_jour=synthese_a_jour # False : résultat précalculé en cours de mise à jour
                            )
 
 @app.route('/api/budget/categorie', methods=['POST'])
@@ -646,6 +769,8 @@ def ajouter_categorie_budget_api():
     """
     API pour créer une nouvelle catégorie de budget pour un mois donné.
     Attend un JSON avec : { cle_mois_annee, categorie, prevu, type, compte_prevu }
+    Concurrence optimiste : si l'en-tête If-Match (ou le champ 'version') est fourni, l'ajout est
+    refusé (412) lorsque les données ont changé depuis cette version.
     """
     # 1. Récupérer les données envoyées par le frontend
     data = request.get_json()
@@ -662,16 +787,7 @@ def ajouter_categorie_budget_api():
         return jsonify({"erreur": "Données manquantes"}), 400
 
     try:
-        # 3. Charger les données de budget existantes
-        budget_data = data_manager.charger_budget_donnees()
-
-        # 4. Vérifier si la catégorie existe déjà pour ce mois
-        if cle_mois_annee in budget_data:
-            categories_du_mois = budget_data[cle_mois_annee].get('categories_prevues', [])
-            if any(cat['categorie'].lower() == nom_categorie.lower() for cat in categories_du_mois):
-                return jsonify({"erreur": f"La catégorie '{nom_categorie}' existe déjà pour ce mois."}), 409 # 409 = Conflit
-
-        # 5. Préparer le nouvel objet catégorie
+        # 3. Préparer le nouvel objet catégorie
         nouvelle_categorie = {
             "categorie": nom_categorie,
             "prevu": float(montant_prevu),
@@ -681,21 +797,138 @@ def ajouter_categorie_budget_api():
             "details": [] # Pour la compatibilité future avec le budget journalier
         }
 
-        # 6. Ajouter la catégorie aux données et sauvegarder
-        if cle_mois_annee not in budget_data:
-             budget_data[cle_mois_annee] = {'categories_prevues': [], 'transactions': []}
-
-        budget_data[cle_mois_annee]['categories_prevues'].append(nouvelle_categorie)
-        data_manager.sauvegarder_budget_donnees(budget_data)
+        # 4. Insérer uniquement cette ligne ; la base refuse un doublon de nom pour ce mois
+        version_client = request.headers.get('If-Match', data.get('version'))
+        try:
+            version_attendue = int(str(version_client).strip('W/"')) if version_client not in (None, '') else None
+        except ValueError:
+            return jsonify({"erreur": "Version invalide"}), 400
+        try:
+            ajoutees = data_manager.ajouter_elements_budget(cle_mois_annee, categories=[nouvelle_categorie], version_attendue=version_attendue)
+        except ConflitDeVersion as e:
+            return jsonify({"erreur": str(e), "version": e.version_actuelle}), 412 # 412 = Précondition échouée
+        if not ajoutees:
+            return jsonify({"erreur": f"La catégorie '{nom_categorie}' existe déjà pour ce mois."}), 409 # 409 = Conflit
 
-        # 7. Renvoyer une réponse de succès
-        return jsonify({"message": "Catégorie ajoutée avec succès", "categorie": nouvelle_categorie}), 201 # 201 = Créé
+        # 5. Renvoyer une réponse de succès
+        return jsonify({"message": "Catégorie ajoutée avec succès", "categorie": nouvelle_categorie, "version": data_manager.get_version()}), 201 # 201 = Créé
 
     except Exception as e:
         # En cas d'erreur serveur, renvoyer une réponse claire
-        print(f"ERREUR API /api/budget/categorie: {e}")
+        log_web.exception("Erreur API /api/budget/categorie : %s", e)
         return jsonify({"erreur": "Erreur interne du serveur"}), 500
 
+# --- API JSON (lecture) ---
+
+def _reponse_json_conditionnelle(construire_contenu):
+    """
+    Répond en JSON avec un ETag dérivé de la version des données et de l'URL demandée.
+    Si le client présente le même ETag (If-None-Match), on répond 304 sans rien recalculer
+    ni interroger SQLite (la version est validée par un simple stat du fichier).
+    """
+    version = cache_donnees.version_courante()
+    etag = hashlib.sha1(f"{version}|{request.full_path}".encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        reponse = app.response_class(status=304)
+    else:
+        reponse = jsonify(construire_contenu())
+    reponse.set_etag(etag)
+    reponse.headers['Cache-Control'] = 'private, no-cache'
+    reponse.headers['X-Data-Version'] = str(version) # À renvoyer dans If-Match pour une écriture conditionnelle
+    return reponse
+
+def _mois_demande():
+    """Lit le paramètre 'mois' (AAAA-MM) de la requête, le mois courant par défaut."""
+    cle_mois_annee = request.args.get('mois', date.today().strftime('%Y-%m'))
+    try:
+        datetime.strptime(cle_mois_annee, '%Y-%m')
+    except ValueError:
+        return None
+    return cle_mois_annee
+
+def _encoder_curseur(trans):
+    return base64.urlsafe_b64encode(json.dumps([trans['date'], trans['id']]).encode('utf-8')).decode('ascii')
+
+def _decoder_curseur(curseur):
+    date_str, trans_id = json.loads(base64.urlsafe_b64decode(curseur.encode('ascii')))
+    return str(date_str), str(trans_id)
+
+@app.route('/api/comptes', methods=['GET'])
+@login_required
+def api_comptes():
+    def contenu():
+        comptes, _ = _donnees_requete().patrimoine()
+        return {"comptes": [c.to_dict() for c in comptes]}
+    return _reponse_json_conditionnelle(contenu)
+
+@app.route('/api/transactions', methods=['GET'])
+@login_required
+def api_transactions():
+    """Transactions d'un mois, paginées par curseur. Filtres : compte, categorie, pointe (0/1). Taille : limite (max 500)."""
+    cle_mois_annee = _mois_demande()
+    if cle_mois_annee is None:
+        return jsonify({"erreur": "Paramètre 'mois' invalide (attendu AAAA-MM)"}), 400
+    limite = max(1, min(request.args.get('limite', type=int, default=100), LIMITE_MAX_API))
+    pointe = request.args.get('pointe')
+    try:
+        apres = _decoder_curseur(request.args['curseur']) if request.args.get('curseur') else None
+    except (ValueError, TypeError, binascii.Error):
+        return jsonify({"erreur": "Curseur invalide"}), 400
+
+    def contenu():
+        transactions = data_manager.lister_transactions_mois(
+            cle_mois_annee, compte=request.args.get('compte'), categorie=request.args.get('categorie'),
+            pointe=None if pointe is None else pointe in ('1', 'true', 'oui'), apres=apres, limite=limite + 1)
+        page = transactions[:limite]
+        return {
+            "mois": cle_mois_annee,
+            "transactions": page,
+            "curseur_suivant": _encoder_curseur(page[-1]) if len(transactions) > limite else None
+        }
+    return _reponse_json_conditionnelle(contenu)
+
+@app.route('/api/budget/categories', methods=['GET'])
+@login_required
+def api_budget_categories():
+    cle_mois_annee = _mois_demande()
+    if cle_mois_annee is None:
+        return jsonify({"erreur": "Paramètre 'mois' invalide (attendu AAAA-MM)"}), 400
+
+    def contenu():
+        categories_prevues = _donnees_requete().budget().get(cle_mois_annee, {}).get('categories_prevues', [])
+        realise_par_categorie = data_manager.realise_par_categorie(cle_mois_annee)
+        categories = []
+        for cat in categories_prevues:
+            realise = realise_par_categorie.get(cat.get('categorie'), 0.0)
+            categories.append({
+                'categorie': cat.get('categorie'), 'type': cat.get('type'), 'prevu': cat.get('prevu', 0.0),
+                'realise': realise, 'compte_prevu': cat.get('compte_prevu'), 'soldee': cat.get('soldee', False)
+            })
+        return {"mois": cle_mois_annee, "categories": categories}
+    return _reponse_json_conditionnelle(contenu)
+
+@app.route('/api/projection', methods=['GET'])
+@login_required
+def api_projection():
+    year = request.args.get('year', type=int, default=date.today().year)
+    month = request.args.get('month', type=int, default=date.today().month)
+    if not (1 <= month <= 12) or not (2000 <= year <= 2100):
+        return jsonify({"erreur": "Mois ou année invalide."}), 400
+
+    def contenu():
+        precalcule = precalcul_mois.obtenir(year, month)
+        if precalcule is not None and precalcule[0] == _donnees_requete().version:
+            resultats = precalcule[1]['projection']
+        else:
+            comptes, _ = _donnees_requete().patrimoine()
+            resultats = _calculer_solde_previsionnel(year, month, comptes, _donnees_requete().budget(), _donnees_requete().frame())
+        if resultats is None:
+            return {"projection": None}
+        resultats = dict(resultats)
+        resultats['dates_graphe'] = [d.isoformat() for d in resultats['dates_graphe']]
+        return {"projection": resultats}
+    return _reponse_json_conditionnelle(contenu)
+
 # --- Route pour l'erreur (simple pour le moment) ---
 @app.route('/error')
 def error():
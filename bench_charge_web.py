@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Test de charge local de l'application web : débit (requêtes/s) avec 1, 2, 4... workers.
+
+Chaque worker est un processus distinct qui importe app_web (donc ses propres connexions et son
+propre cache), comme sous gunicorn, et enchaîne les requêtes via le client de test Flask sur une
+base synthétique. Aucun serveur HTTP n'est nécessaire.
+
+    python bench_charge_web.py [--workers 1,2,4] [--duree 5] [--transactions 20000]
+
+Avec --url http://hote:port, le test vise à la place un serveur déjà lancé (gunicorn/waitress),
+avec autant de clients concurrents que de workers demandés (la connexion doit alors être désactivée
+côté serveur ou la session fournie via --cookie).
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import urllib.request
+from datetime import date, timedelta
+
+URLS = [
+    "/api/transactions?mois={mois}&limite=100",
+    "/api/transactions?mois={mois}&pointe=0",
+    "/api/budget/categories?mois={mois}",
+    "/api/comptes",
+]
+
+def creer_base_synthetique(db_path, nb_transactions):
+    from models import Compte
+    from services import SqlDataManager
+    data_manager = SqlDataManager(db_path)
+    data_manager.sauvegarder_donnees([
+        Compte(nom="Compte Courant", banque="Banque", type_compte="Actif", solde=2500.0, suivi_budget=True),
+        Compte(nom="Livret A", banque="Banque", type_compte="Actif", solde=12000.0, suivi_budget=True),
+    ], [])
+    categories = ["Courses", "Loyer", "Transport", "Loisirs", "Santé", "Salaire"]
+    debut = date.today().replace(day=1) - timedelta(days=730)
+    par_mois = {}
+    for i in range(nb_transactions):
+        jour = debut + timedelta(days=random.randint(0, 760))
+        categorie = random.choice(categories)
+        montant = round(random.uniform(1500, 3000), 2) if categorie == "Salaire" else -round(random.uniform(5, 300), 2)
+        par_mois.setdefault(jour.strftime("%Y-%m"), []).append({
+            "id": f"bench{i:07d}", "date": jour.isoformat(), "description": f"{categorie} {i}", "montant": montant,
+            "categorie": categorie, "compte_affecte": "Compte Courant", "pointe": jour < date.today() - timedelta(days=10)
+        })
+    for cle_mois, transactions in par_mois.items():
+        data_manager.ajouter_elements_budget(cle_mois, transactions, [{"categorie": c, "prevu": 300.0, "type": "Dépense", "compte_prevu": "Compte Courant"} for c in categories[:-1]])
+
+def _worker_local(args):
+    db_path, duree = args
+    os.environ["SLC_DB_PATH"] = db_path
+    os.environ.setdefault("SLC_LOG_LEVEL", "WARNING")
+    import app_web
+    app_web.app.config["LOGIN_DISABLED"] = True
+    client = app_web.app.test_client()
+    mois = date.today().strftime("%Y-%m")
+    nb, fin = 0, time.perf_counter() + duree
+    while time.perf_counter() < fin:
+        reponse = client.get(URLS[nb % len(URLS)].format(mois=mois))
+        assert reponse.status_code == 200, reponse.status_code
+        nb += 1
+    return nb
+
+def _worker_http(args):
+    base_url, duree, cookie = args
+    mois = date.today().strftime("%Y-%m")
+    nb, fin = 0, time.perf_counter() + duree
+    while time.perf_counter() < fin:
+        requete = urllib.request.Request(base_url + URLS[nb % len(URLS)].format(mois=mois))
+        if cookie: requete.add_header("Cookie", cookie)
+        with urllib.request.urlopen(requete) as reponse:
+            reponse.read()
+        nb += 1
+    return nb
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--duree", type=float, default=5.0)
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("--url")
+    parser.add_argument("--cookie")
+    args = parser.parse_args()
+
+    if args.url:
+        travail, parametres = _worker_http, (args.url.rstrip("/"), args.duree, args.cookie)
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench_slc_"), "budget.db")
+        print(f"Création d'une base synthétique de {args.transactions} transactions : {db_path}")
+        creer_base_synthetique(db_path, args.transactions)
+        travail, parametres = _worker_local, (db_path, args.duree)
+
+    reference = None
+    for nb_workers in [int(n) for n in args.workers.split(",")]:
+        with multiprocessing.Pool(nb_workers) as pool:
+            total = sum(pool.map(travail, [parametres] * nb_workers))
+        debit = total / args.duree
+        reference = reference or debit / nb_workers
+        print(f"{nb_workers} worker(s) : {debit:8.1f} req/s  (x{debit / reference:.2f} par rapport à 1 worker)")
+
+if __name__ == "__main__":
+    main()
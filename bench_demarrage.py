@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Mesure du temps de démarrage de l'application de bureau.
+
+1. Temps d'import du module app (python -X importtime), avec les modules les plus coûteux :
+   matplotlib, yfinance/pandas ne doivent plus y apparaître.
+2. Démarrage de PatrimoineApp sur une base synthétique : durée de __init__ (fenêtre prête avec
+   la liste des comptes et les totaux), puis durée jusqu'à la fin du rafraîchissement complet
+   (projection budgétaire et premier graphique visible).
+
+    python bench_demarrage.py [--transactions 20000] [--top 15] [--sans-fenetre]
+
+Chaque mesure tourne dans un processus neuf pour ne pas profiter des modules déjà importés.
+La seconde nécessite un affichage (DISPLAY) ; --sans-fenetre ne fait que la première.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPERTOIRE = os.path.dirname(os.path.abspath(__file__))
+
+def mesurer_imports(module, top):
+    """Retourne (durée totale en s, [(durée cumulée en s, nom du module)...]) pour 'import module'."""
+    resultat = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=REPERTOIRE, capture_output=True, text=True)
+    modules = []
+    for ligne in resultat.stderr.splitlines():
+        if not ligne.startswith("import time:") or "cumulative" in ligne:
+            continue
+        _, cumul, nom = ligne[len("import time:"):].split("|")
+        modules.append((int(cumul) / 1e6, nom.rstrip()))
+    if resultat.returncode != 0 or not modules:
+        raise RuntimeError(resultat.stderr.strip().splitlines()[-1] if resultat.stderr.strip() else "import impossible")
+    total = next(cumul for cumul, nom in reversed(modules) if nom.strip() == module)
+    # Seuls les imports de premier niveau (indentation minimale) font sens dans un classement
+    premiers = [(cumul, nom.strip()) for cumul, nom in modules if nom.startswith("  ") and not nom.startswith("    ")]
+    return total, sorted(premiers, reverse=True)[:top]
+
+SCRIPT_DEMARRAGE = """
+import sys, time, os
+debut = time.perf_counter()
+import tkinter as tk
+from app import PatrimoineApp
+imports = time.perf_counter()
+root = tk.Tk()
+app = PatrimoineApp(root, sys.argv[1])
+init = time.perf_counter()
+root.update()
+complet = time.perf_counter()
+print(imports - debut, init - imports, complet - init)
+root.destroy()
+"""
+
+def mesurer_demarrage(base_dir):
+    env = dict(os.environ, SLC_LOG_LEVEL="WARNING")
+    resultat = subprocess.run([sys.executable, "-c", SCRIPT_DEMARRAGE, base_dir],
+                              cwd=REPERTOIRE, capture_output=True, text=True, env=env)
+    if resultat.returncode != 0:
+        raise RuntimeError(resultat.stderr.strip().splitlines()[-1] if resultat.stderr.strip() else "échec")
+    return [float(v) for v in resultat.stdout.strip().splitlines()[-1].split()]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--sans-fenetre", action="store_true")
+    args = parser.parse_args()
+
+    total, premiers = mesurer_imports("app", args.top)
+    print(f"Import de app : {total * 1000:.0f} ms")
+    for cumul, nom in premiers:
+        print(f"  {cumul * 1000:8.1f} ms  {nom}")
+
+    if args.sans_fenetre:
+        return
+    from bench_charge_web import creer_base_synthetique
+    with tempfile.TemporaryDirectory() as base_dir:
+        debut = time.perf_counter()
+        creer_base_synthetique(os.path.join(base_dir, "budget.db"), args.transactions)
+        print(f"\nBase synthétique : {args.transactions} transactions ({time.perf_counter() - debut:.1f} s)")
+        try:
+            imports, init, complet = mesurer_demarrage(base_dir)
+        except RuntimeError as e:
+            print(f"Démarrage non mesuré (affichage indisponible ?) : {e}")
+            return
+        print(f"  imports             : {imports * 1000:8.0f} ms")
+        print(f"  fenêtre + totaux    : {init * 1000:8.0f} ms")
+        print(f"  vues complètes      : {complet * 1000:8.0f} ms")
+        print(f"  total               : {(imports + init + complet) * 1000:8.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Mesure de l'empreinte mémoire des transactions du budget chargées en mémoire.
+
+Sur une base synthétique, les transactions sont relues de la table et rangées sous trois formes :
+1. dictionnaires (ancienne forme : dict(row), onze clés par transaction) ;
+2. Transaction (models.py) : slots, chaînes répétées internées ;
+3. colonnes array (montants en double, dates en ordinaux) : plancher des seules données numériques,
+   pour les calculs qui n'ont pas besoin des libellés.
+Pour chacune : octets alloués par transaction (tracemalloc, chaînes lues comprises) et temps de construction.
+Le temps de chargement complet du budget (charger_budget_donnees) est donné en plus.
+
+    python bench_memoire.py [--transactions 100000]
+"""
+import argparse
+import gc
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from array import array
+from datetime import date
+
+def en_dictionnaires(cursor):
+    transactions = []
+    for row in cursor:
+        trans = dict(row)
+        trans['pointe'] = bool(trans.get('pointe'))
+        transactions.append(trans)
+    return transactions
+
+def en_transactions(cursor):
+    from models import Transaction
+    return [Transaction.depuis_ligne(row) for row in cursor]
+
+def en_colonnes(cursor):
+    montants, dates = array('d'), array('l')
+    for row in cursor:
+        montants.append(row['montant'] or 0.0)
+        dates.append(date.fromisoformat(row['date'][:10]).toordinal())
+    return montants, dates
+
+def mesurer(db_path, construire):
+    """Retourne (octets alloués par transaction, durée en s, nombre de transactions) pour une forme de stockage."""
+    from models import Transaction
+    con = sqlite3.connect(db_path)
+    con.row_factory = sqlite3.Row
+    gc.collect()
+    tracemalloc.start()
+    avant = tracemalloc.get_traced_memory()[0]
+    debut = time.perf_counter()
+    resultat = construire(con.execute(f"SELECT {', '.join(Transaction.CHAMPS)} FROM transactions"))
+    duree = time.perf_counter() - debut
+    gc.collect()
+    octets = tracemalloc.get_traced_memory()[0] - avant
+    tracemalloc.stop()
+    con.close()
+    nombre = len(resultat[0]) if isinstance(resultat, tuple) else len(resultat)
+    del resultat
+    return octets / max(nombre, 1), duree, nombre
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=100000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("SLC_LOG_LEVEL", "WARNING")
+    from bench_charge_web import creer_base_synthetique
+    from services import SqlDataManager
+    with tempfile.TemporaryDirectory() as base_dir:
+        db_path = os.path.join(base_dir, "budget.db")
+        debut = time.perf_counter()
+        creer_base_synthetique(db_path, args.transactions)
+        print(f"Base synthétique : {args.transactions} transactions ({time.perf_counter() - debut:.1f} s)")
+
+        formes = [("dictionnaires", en_dictionnaires), ("Transaction (slots)", en_transactions), ("colonnes array", en_colonnes)]
+        reference = None
+        for libelle, construire in formes:
+            par_transaction, duree, nombre = mesurer(db_path, construire)
+            reference = reference or par_transaction
+            print(f"  {libelle:<20}: {par_transaction:7.0f} octets/transaction ({par_transaction * nombre / 2**20:6.1f} Mo, "
+                  f"{par_transaction / reference:4.0%}) construits en {duree * 1000:5.0f} ms")
+
+        debut = time.perf_counter()
+        SqlDataManager(db_path).charger_budget_donnees()
+        print(f"  charger_budget_donnees : {(time.perf_counter() - debut) * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
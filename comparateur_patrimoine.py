@@ -1,10 +1,11 @@
 ﻿# -*- coding: utf-8 -*-
 
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, messagebox
 import os
 import sys
 import json
+from datetime import date
 from collections import defaultdict
 
 try:
@@ -15,6 +16,7 @@ except ImportError:
 # --- GESTION DES IMPORTS RELATIFS ---
 try:
     from services import SqlDataManager
+    from series_patrimoine import SnapshotStore
     from utils import format_nombre_fr
     from models import Compte
 except ImportError:
@@ -68,10 +70,11 @@ class ComparateurPatrimoineApp:
             db_path = os.path.join(base_dir, "budget.db")
         
         self.data_manager = SqlDataManager(db_path)
-        self.comptes, self.historique = self.data_manager.charger_donnees()
+        self.comptes = self.data_manager.charger_comptes()
+        # Totaux indexés par date ; les soldes d'un instantané ne sont lus que s'il est affiché
+        self.store = SnapshotStore(self.data_manager, self.comptes)
         self.comptes_lookup = {c.nom: c for c in self.comptes}
-        
-        self.historique.sort(key=lambda x: x.get('date', ''), reverse=True)
+        self._lignes_affichees = {} # Arbre -> {iid: (parent, position, valeurs, tags)} tel qu'affiché
 
         self.creer_widgets()
         self.populate_comboboxes()
@@ -89,16 +92,20 @@ class ComparateurPatrimoineApp:
         selection_frame.columnconfigure(1, weight=1)
         selection_frame.columnconfigure(3, weight=1)
 
+        # Combobox saisissables : une date sans instantané (AAAA-MM-JJ, puis Entrée) est estimée
         ttk.Label(selection_frame, text="Date de référence :").grid(row=0, column=0, padx=(0, 5), pady=5, sticky=tk.W)
-        self.combo1 = ttk.Combobox(selection_frame, state="readonly")
+        self.combo1 = ttk.Combobox(selection_frame)
         self.combo1.grid(row=0, column=1, padx=5, pady=5, sticky=tk.EW)
 
         ttk.Label(selection_frame, text="Date de comparaison :").grid(row=0, column=2, padx=(20, 5), pady=5, sticky=tk.W)
-        self.combo2 = ttk.Combobox(selection_frame, state="readonly")
+        self.combo2 = ttk.Combobox(selection_frame)
         self.combo2.grid(row=0, column=3, padx=5, pady=5, sticky=tk.EW)
-        
-        self.combo1.bind("<<ComboboxSelected>>", self.update_comparison)
-        self.combo2.bind("<<ComboboxSelected>>", self.update_comparison)
+
+        ttk.Button(selection_frame, text="Fins d'année", command=self.comparer_fins_d_annee).grid(row=0, column=4, padx=(20, 0), pady=5)
+
+        for combo in (self.combo1, self.combo2):
+            combo.bind("<<ComboboxSelected>>", self.update_comparison)
+            combo.bind("<Return>", self.update_comparison)
         
         notebook = ttk.Notebook(main_frame)
         notebook.pack(fill=tk.BOTH, expand=True)
@@ -172,7 +179,7 @@ class ComparateurPatrimoineApp:
             self.tree_comptes.item(item_id, open=False)
 
     def populate_comboboxes(self):
-        dates = [snap['date'] for snap in self.historique]
+        dates = self.store.dates()[::-1]
         self.combo1['values'] = dates
         self.combo2['values'] = dates
         if len(dates) >= 2:
@@ -180,92 +187,156 @@ class ComparateurPatrimoineApp:
             self.combo1.set(dates[1])
 
     def update_comparison(self, event=None):
-        date1 = self.combo1.get()
-        date2 = self.combo2.get()
+        date1 = self.combo1.get().strip()
+        date2 = self.combo2.get().strip()
         if not date1 or not date2: return
-        snap1 = next((s for s in self.historique if s['date'] == date1), None)
-        snap2 = next((s for s in self.historique if s['date'] == date2), None)
-        if not snap1 or not snap2: return
-        self.update_synthese_view(snap1, snap2)
-        self.update_comptes_view(snap1, snap2)
-
-    def update_synthese_view(self, snap1, snap2):
-        tree = self.tree_synthese
-        for item in tree.get_children(): tree.delete(item)
-        self._add_comparison_row(tree, "Patrimoine Net", snap1.get('patrimoine_net', 0.0), snap2.get('patrimoine_net', 0.0), tag='total')
-        tree.insert('', 'end', values=("", "", "", "", ""), tags=('header',))
-        self._add_comparison_row(tree, "Total des Actifs", snap1.get('total_actifs', 0.0), snap2.get('total_actifs', 0.0))
-        self._add_comparison_row(tree, "Total des Passifs", snap1.get('total_passifs_magnitude', 0.0), snap2.get('total_passifs_magnitude', 0.0))
-        tree.insert('', 'end', values=("Répartition des Actifs", "", "", "", ""), tags=('header',))
-        repartition1 = snap1.get('repartition_actifs_par_classe', {})
-        repartition2 = snap2.get('repartition_actifs_par_classe', {})
-        all_classes = sorted(list(set(repartition1.keys()) | set(repartition2.keys())))
+        self.comparer([date1, date2])
+
+    def comparer_fins_d_annee(self):
+        """Compare côte à côte le dernier instantané de chaque année."""
+        dates = self.store.fins_de_periode('A')
+        if len(dates) < 2:
+            messagebox.showinfo("Comparaison", "Il faut des instantanés sur au moins deux années.", parent=self.root)
+            return
+        self.comparer(dates)
+
+    def comparer(self, dates):
+        """Compare les instantanés de plusieurs dates (ISO), dans l'ordre donné ; l'évolution va de la première à la dernière."""
+        snapshots = []
+        for date_str in dates:
+            try:
+                date.fromisoformat(date_str)
+            except ValueError:
+                messagebox.showerror("Date invalide", f"'{date_str}' n'est pas une date au format AAAA-MM-JJ.", parent=self.root)
+                return
+            snap = self.store.instantane_au(date_str)
+            if snap is None:
+                messagebox.showerror("Date invalide", f"Aucun instantané n'existe avant le {date_str}.", parent=self.root)
+                return
+            snapshots.append(snap)
+        self._configurer_colonnes([f"{s['date']} (estimé)" if s.get('virtuel') else s['date'] for s in snapshots])
+        self.update_synthese_view(snapshots)
+        self.update_comptes_view(snapshots)
+
+    def _configurer_colonnes(self, libelles):
+        """Une colonne de valeurs par instantané ; les colonnes ne sont recréées que si leur nombre change."""
+        valeurs = [f"snapshot{i + 1}" for i in range(len(libelles))]
+        largeur = max(90, 600 // len(libelles))
+        for tree, premiere, dernieres in ((self.tree_synthese, 'metric', ('evolution_val', 'evolution_pct')), (self.tree_comptes, 'compte', ('evolution',))):
+            colonnes = (premiere, *valeurs, *dernieres)
+            if tuple(tree['columns']) != colonnes:
+                titres = {c: tree.heading(c, 'text') for c in (premiere, *dernieres)}
+                largeurs = {c: tree.column(c, 'width') for c in (premiere, *dernieres)}
+                tree['columns'] = colonnes
+                for c in (premiere, *dernieres):
+                    tree.heading(c, text=titres[c])
+                    tree.column(c, width=largeurs[c], anchor=tk.W if c == premiere else tk.E)
+                self._lignes_affichees.pop(tree, None) # Toutes les valeurs sont à réécrire
+            for colonne, libelle in zip(valeurs, libelles):
+                tree.heading(colonne, text=f"{libelle} (€)")
+                tree.column(colonne, width=largeur, anchor=tk.E)
+
+    def _synchroniser_arbre(self, tree, lignes):
+        """
+        Met l'arbre en conformité avec lignes [(iid, parent, valeurs, tags)], données dans l'ordre d'affichage, en ne
+        touchant qu'aux différences : les lignes inchangées restent telles quelles (et une banque dépliée le reste),
+        les autres sont modifiées sur place, insérées ou supprimées, et un niveau n'est réordonné que si besoin.
+        """
+        if tree not in self._lignes_affichees:
+            # Première synchronisation (ou colonnes recréées) : les lignes présentes sont à réécrire
+            self._lignes_affichees[tree] = {iid: None for iid in self._tous_les_iids(tree)}
+        affichees = self._lignes_affichees[tree]
+        voulues = {ligne[0] for ligne in lignes}
+        for iid in [iid for iid in affichees if iid not in voulues]:
+            if tree.exists(iid): tree.delete(iid) # Supprimer une banque supprime ses comptes
+            del affichees[iid]
+        enfants = defaultdict(list)
+        for iid, parent, valeurs, tags in lignes:
+            enfants[parent].append(iid)
+            if iid not in affichees:
+                tree.insert(parent, 'end', iid=iid, values=valeurs, tags=tags, open=False)
+            elif affichees[iid] != (valeurs, tags):
+                tree.item(iid, values=valeurs, tags=tags)
+            affichees[iid] = (valeurs, tags)
+        for parent, iids in enfants.items():
+            if list(tree.get_children(parent)) != iids:
+                for position, iid in enumerate(iids):
+                    tree.move(iid, parent, position)
+
+    @staticmethod
+    def _tous_les_iids(tree, parent=''):
+        iids = []
+        for iid in tree.get_children(parent):
+            iids.append(iid)
+            iids.extend(ComparateurPatrimoineApp._tous_les_iids(tree, iid))
+        return iids
+
+    def update_synthese_view(self, snapshots):
+        lignes = [self._ligne_comparaison('net', "Patrimoine Net", [s.get('patrimoine_net', 0.0) for s in snapshots], tag='total'),
+                  ('separateur', '', ("",) * (len(snapshots) + 3), ('header',)),
+                  self._ligne_comparaison('actifs', "Total des Actifs", [s.get('total_actifs', 0.0) for s in snapshots]),
+                  self._ligne_comparaison('passifs', "Total des Passifs", [s.get('total_passifs_magnitude', 0.0) for s in snapshots]),
+                  ('repartition', '', ("Répartition des Actifs",) + ("",) * (len(snapshots) + 2), ('header',))]
+        repartitions = [s.get('repartition_actifs_par_classe', {}) for s in snapshots]
+        all_classes = sorted(set().union(*repartitions))
         for classe in all_classes:
              if classe not in ["N/A", "Non Renseigné"]:
-                val1 = repartition1.get(classe, 0.0)
-                val2 = repartition2.get(classe, 0.0)
-                if val1 != 0 or val2 != 0:
-                    self._add_comparison_row(tree, f"  {classe}", val1, val2)
-
-    # Dans la classe ComparateurPatrimoineApp, remplacez la méthode update_comptes_view
+                valeurs = [repartition.get(classe, 0.0) for repartition in repartitions]
+                if any(v != 0 for v in valeurs):
+                    lignes.append(self._ligne_comparaison(f"classe:{classe}", f"  {classe}", valeurs))
+        self._synchroniser_arbre(self.tree_synthese, lignes)
 
-    def update_comptes_view(self, snap1, snap2):
-        """Met à jour la vue par comptes avec la logique corrigée pour l'affichage des sous-totaux."""
-        tree = self.tree_comptes
-        for item in tree.get_children(): tree.delete(item)
+    def update_comptes_view(self, snapshots):
+        """Met à jour la vue par comptes : une ligne par banque (évolution patrimoniale du sous-total), dépliable par compte."""
+        tous_les_soldes = [s.get('soldes_comptes', {}) for s in snapshots]
+        all_account_names = set().union(*tous_les_soldes)
 
-        soldes1 = snap1.get('soldes_comptes', {})
-        soldes2 = snap2.get('soldes_comptes', {})
-        all_account_names = set(soldes1.keys()) | set(soldes2.keys())
-    
         data_par_banque = defaultdict(list)
         for nom_compte in all_account_names:
             compte_obj = self.comptes_lookup.get(nom_compte)
             banque = compte_obj.banque if compte_obj else "Banque Inconnue"
-            data_par_banque[banque].append({'nom': nom_compte, 'solde1': soldes1.get(nom_compte, 0.0), 'solde2': soldes2.get(nom_compte, 0.0), 'type': compte_obj.type_compte if compte_obj else 'Actif'})
-    
+            data_par_banque[banque].append({'nom': nom_compte, 'soldes': [soldes.get(nom_compte, 0.0) for soldes in tous_les_soldes], 'type': compte_obj.type_compte if compte_obj else 'Actif'})
+
+        lignes = []
         for banque in sorted(data_par_banque.keys()):
             comptes_de_la_banque = data_par_banque[banque]
-        
-            subtotal1 = sum(c['solde1'] for c in comptes_de_la_banque)
-            subtotal2 = sum(c['solde2'] for c in comptes_de_la_banque)
-        
+            subtotals = [sum(c['soldes'][i] for c in comptes_de_la_banque) for i in range(len(snapshots))]
+
+            # L'évolution du sous-total est patrimoniale (une dette qui baisse est un gain), pas la somme brute des soldes
             evolution_patrimoniale_st = 0
             for c in comptes_de_la_banque:
-                evo_brute = c['solde2'] - c['solde1']
+                evo_brute = c['soldes'][-1] - c['soldes'][0]
                 signe = -1 if c['type'] == 'Passif' else 1
                 evolution_patrimoniale_st += (evo_brute * signe)
 
             subtotal_tags = ('subtotal',)
             if evolution_patrimoniale_st > 0.01: subtotal_tags += ('gain',)
             elif evolution_patrimoniale_st < -0.01: subtotal_tags += ('perte',)
-        
-            # --- CORRECTION APPLIQUÉE ICI ---
-            # On affiche maintenant l'évolution patrimoniale du sous-total, et non plus la somme brute.
-            parent_id = tree.insert('', 'end', values=(
-                banque,
-                format_nombre_fr(subtotal1),
-                format_nombre_fr(subtotal2),
-                f"{evolution_patrimoniale_st:+.2f}".replace('.', ',') # <-- CHANGEMENT ICI
-            ), tags=subtotal_tags, open=False)
+            parent_id = f"banque:{banque}"
+            lignes.append((parent_id, '', (banque, *map(format_nombre_fr, subtotals), f"{evolution_patrimoniale_st:+.2f}".replace('.', ',')), subtotal_tags))
 
             for compte_data in sorted(comptes_de_la_banque, key=lambda x: x['nom']):
-                val1, val2, evolution_brute = compte_data['solde1'], compte_data['solde2'], compte_data['solde2'] - compte_data['solde1']
+                soldes = compte_data['soldes']
+                evolution_brute = soldes[-1] - soldes[0]
                 signe = -1 if compte_data['type'] == 'Passif' else 1
                 evolution_patrimoniale = evolution_brute * signe
                 compte_tags = ()
                 if evolution_patrimoniale > 0.01: compte_tags += ('gain',)
                 elif evolution_patrimoniale < -0.01: compte_tags += ('perte',)
-                tree.insert(parent_id, 'end', values=(f"  {compte_data['nom']}", format_nombre_fr(val1), format_nombre_fr(val2), f"{evolution_brute:+.2f}".replace('.', ',')), tags=compte_tags)
-    
-        # La logique du Total Global reste inchangée et correcte
-        tree.insert('', 'end', values=())
-        evo_pn = snap2.get('patrimoine_net', 0.0) - snap1.get('patrimoine_net', 0.0)
+                lignes.append((f"{parent_id}/{compte_data['nom']}", parent_id, (f"  {compte_data['nom']}", *map(format_nombre_fr, soldes), f"{evolution_brute:+.2f}".replace('.', ',')), compte_tags))
+
+        lignes.append(('separateur', '', (), ()))
+        nets = [s.get('patrimoine_net', 0.0) for s in snapshots]
+        evo_pn = nets[-1] - nets[0]
         total_tags = ('grandtotal',)
         if evo_pn > 0.01: total_tags += ('gain',)
         elif evo_pn < -0.01: total_tags += ('perte',)
-        tree.insert('', 'end', values=("TOTAL GLOBAL (Patrimoine Net)", format_nombre_fr(snap1.get('patrimoine_net', 0.0)), format_nombre_fr(snap2.get('patrimoine_net', 0.0)), f"{evo_pn:+.2f}".replace('.', ',')), tags=total_tags)
-    def _add_comparison_row(self, tree, metric_name, val1, val2, tag=''):
+        lignes.append(('total', '', ("TOTAL GLOBAL (Patrimoine Net)", *map(format_nombre_fr, nets), f"{evo_pn:+.2f}".replace('.', ',')), total_tags))
+        self._synchroniser_arbre(self.tree_comptes, lignes)
+
+    def _ligne_comparaison(self, iid, metric_name, valeurs, tag=''):
+        """Ligne (iid, parent, valeurs, tags) de la synthèse : une valeur par instantané, évolution de la première à la dernière."""
+        val1, val2 = valeurs[0], valeurs[-1]
         evolution_val = val2 - val1
         evolution_pct_str = "N/A"
         if val1 != 0:
@@ -274,7 +345,7 @@ class ComparateurPatrimoineApp:
         current_tags = (tag,)
         if evolution_val > 0.01: current_tags += ('gain',)
         elif evolution_val < -0.01: current_tags += ('perte',)
-        tree.insert('', 'end', values=(metric_name, format_nombre_fr(val1), format_nombre_fr(val2), f"{evolution_val:+.2f}".replace('.', ','), evolution_pct_str), tags=current_tags)
+        return (iid, '', (metric_name, *map(format_nombre_fr, valeurs), f"{evolution_val:+.2f}".replace('.', ','), evolution_pct_str), current_tags)
 
 
 # --- CORRECTION : SIMPLIFICATION RADICALE du point d'entrée pour le mode standalone ---
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Cycles de relevé des cartes à débit différé.
+
+Une carte (compte passif) est configurée par jour_debut_periode, jour_fin_periode, jour_debit et
+compte_debit_associe. Le relevé prélevé le mois M couvre les opérations du jour_debut_periode du mois M-1
+au jour_fin_periode du mois M (jours ramenés à la fin du mois si besoin).
+CyclesCarte range chaque transaction pointée d'une carte dans le ou les cycles qui la couvrent, en une seule
+passe et sans analyse de dates (comparaisons de chaînes ISO). Il est reconstruit à chaque calcul, comme la
+TransactionFrame : les transactions changent par trop de chemins pour tenir des totaux à jour au fil de l'eau.
+Un règlement est un virement crédité sur la carte : ses deux jambes partagent un virement_id (ou un
+id_recurrence pour les virements récurrents), il n'y a pas de recherche dans les libellés.
+"""
+import calendar
+from collections import defaultdict
+
+from frame_transactions import date_iso
+
+CATEGORIE_VIREMENT = "(Virement)"
+
+def carte_configuree(compte):
+    """True si le compte est une carte à débit différé dont les paramètres de relevé sont renseignés."""
+    return compte.type_compte == 'Passif' and all([compte.jour_debit, compte.jour_debut_periode, compte.jour_fin_periode, compte.compte_debit_associe])
+
+def _mois_precedent(annee, mois):
+    return (annee, mois - 1) if mois > 1 else (annee - 1, 12)
+
+def _mois_suivant(cle_mois):
+    annee, mois = int(cle_mois[:4]), int(cle_mois[5:7])
+    return f"{annee + 1:04d}-01" if mois == 12 else f"{annee:04d}-{mois + 1:02d}"
+
+def periode_releve(carte, annee, mois):
+    """(date de début, date de fin) ISO du relevé de la carte prélevé le mois (annee, mois)."""
+    annee_debut, mois_debut = _mois_precedent(annee, mois)
+    jour_debut = min(int(carte.jour_debut_periode), calendar.monthrange(annee_debut, mois_debut)[1])
+    jour_fin = min(int(carte.jour_fin_periode), calendar.monthrange(annee, mois)[1])
+    return f"{annee_debut:04d}-{mois_debut:02d}-{jour_debut:02d}", f"{annee:04d}-{mois:02d}-{jour_fin:02d}"
+
+def cle_liaison(trans):
+    """Identifiant commun aux deux jambes d'un virement (virement_id, sinon id_recurrence), ou celui de la transaction."""
+    return trans.get('virement_id') or trans.get('id_recurrence') or trans.get('id')
+
+class CyclesCarte:
+    """Totaux pointés par cycle de relevé et règlements saisis, pour un ensemble de cartes à débit différé."""
+
+    def __init__(self, comptes, transactions=()):
+        self.cartes = {compte.nom: compte for compte in comptes if carte_configuree(compte)}
+        self._periodes = {} # (carte, 'AAAA-MM') -> (début, fin)
+        self._totaux = defaultdict(float) # (carte, mois de prélèvement) -> somme des opérations pointées du cycle
+        self._reglements = defaultdict(set) # (carte, mois) -> clés de liaison des virements de règlement
+        for trans in transactions:
+            self._ranger(trans)
+
+    def periode(self, nom_carte, cle_mois):
+        """(début, fin) ISO du cycle de la carte prélevé le mois 'AAAA-MM' (calculé une fois)."""
+        cle = (nom_carte, cle_mois)
+        if cle not in self._periodes:
+            self._periodes[cle] = periode_releve(self.cartes[nom_carte], int(cle_mois[:4]), int(cle_mois[5:7]))
+        return self._periodes[cle]
+
+    def _ranger(self, trans):
+        """Range une transaction dans les totaux de cycle ou les règlements de sa carte."""
+        nom_carte = trans.get('compte_affecte')
+        date_trans = str(trans.get('date') or '')[:10]
+        if date_trans[4:5] != '-':
+            date_trans = date_iso(date_trans) or '' # Date saisie dans un autre format (JJ/MM/AAAA...)
+        if nom_carte not in self.cartes or len(date_trans) != 10:
+            return
+        if trans.get('categorie') == CATEGORIE_VIREMENT:
+            if (trans.get('montant') or 0.0) > 0:
+                self._reglements[(nom_carte, date_trans[:7])].add(cle_liaison(trans))
+            return
+        if not trans.get('pointe', False):
+            return
+        # Le cycle prélevé le mois M commence le mois M-1 : seuls le mois de l'opération et le suivant sont possibles
+        for cle_mois in (date_trans[:7], _mois_suivant(date_trans[:7])):
+            debut, fin = self.periode(nom_carte, cle_mois)
+            if debut <= date_trans <= fin:
+                self._totaux[(nom_carte, cle_mois)] += trans.get('montant') or 0.0
+
+    def montant_cycle(self, nom_carte, cle_mois):
+        """Somme (signée) des opérations pointées du cycle de la carte prélevé le mois 'AAAA-MM'."""
+        return self._totaux.get((nom_carte, cle_mois), 0.0)
+
+    def reglement_saisi(self, nom_carte, cle_mois):
+        """True si un virement de règlement vers la carte a déjà été saisi (pointé ou non) ce mois-ci."""
+        return bool(self._reglements.get((nom_carte, cle_mois)))
+
+    def prelevements_a_simuler(self, cle_mois):
+        """[(carte, montant à prélever > 0)] des cartes sans règlement saisi ce mois-ci dont le cycle n'est pas nul."""
+        prelevements = []
+        for nom_carte, carte in self.cartes.items():
+            if self.reglement_saisi(nom_carte, cle_mois): continue
+            montant = self.montant_cycle(nom_carte, cle_mois)
+            if montant != 0:
+                prelevements.append((carte, abs(montant)))
+        return prelevements
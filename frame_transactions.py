@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Transactions du budget rangées en colonnes NumPy, pour les agrégations des vues.
+
+Les vues du budget (réalisé par catégorie, camemberts dépenses/recettes, budget/réalisé, activité non pointée
+et courbe d'évolution de la projection) reparcouraient toutes les transactions en Python, en relisant les dates
+avec strptime, parfois une fois par jour du mois. TransactionFrame fait une seule passe sur les transactions :
+montant, date et mois budgétaire en ordinaux (jours / mois depuis 1970, lus par NumPy), catégorie, compte et
+origine en codes entiers, indicateur de pointage. Un regroupement est ensuite un np.bincount sur les codes
+d'une sélection (masque booléen), et les transactions sources restent accessibles par leur position.
+"""
+from datetime import datetime
+
+import numpy as np
+
+CATEGORIE_VIREMENT = "(Virement)"
+FORMATS_DATE = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y") # Mêmes formats que _parse_date_flexible
+ORDINAL_INVALIDE = np.iinfo(np.int64).min # Date absente ou illisible (à exclure des comparaisons de dates)
+
+def jour_ordinal(jour):
+    """Ordinal (jours depuis le 01/01/1970) d'une date ou d'une chaîne ISO, comme la colonne 'jour'."""
+    return int(np.datetime64(jour, 'D').astype(np.int64))
+
+def mois_ordinal(cle_mois):
+    """Ordinal (mois depuis janvier 1970) d'une clé 'AAAA-MM', comme les colonnes 'mois' et 'mois_budget'."""
+    return (int(cle_mois[:4]) - 1970) * 12 + int(cle_mois[5:7]) - 1
+
+def date_iso(texte):
+    """Date 'AAAA-MM-JJ' d'une chaîne dans l'un des FORMATS_DATE, ou None."""
+    for fmt in FORMATS_DATE:
+        try:
+            return datetime.strptime(texte, fmt).date().isoformat()
+        except (ValueError, TypeError):
+            continue
+    return None
+
+def _en_jours(textes):
+    """Colonne datetime64[D] de dates ISO ; si une date est dans un autre format, conversion ligne à ligne."""
+    try:
+        return np.array(textes, dtype='datetime64[D]')
+    except ValueError:
+        return np.array([date_iso(texte) if texte else None for texte in textes], dtype='datetime64[D]')
+
+def _ordinaux(jours, unite):
+    valeurs = jours.astype(f'datetime64[{unite}]').astype(np.int64)
+    valeurs[np.isnat(jours)] = ORDINAL_INVALIDE
+    return valeurs
+
+class _Codes:
+    """Encodage catégoriel : chaque valeur distincte reçoit un entier, dans l'ordre de première apparition."""
+    def __init__(self):
+        self.index = {}
+        self.valeurs = []
+
+    def code(self, valeur):
+        code = self.index.get(valeur)
+        if code is None:
+            code = self.index[valeur] = len(self.valeurs)
+            self.valeurs.append(valeur)
+        return code
+
+class TransactionFrame:
+    """
+    Colonnes (une ligne par transaction) : montant, jour, mois (date réelle), mois_budget (date budgétaire,
+    sinon date réelle), categorie / compte / origine (codes dans self.categories, self.comptes, self.origines),
+    pointe. self.transactions garde les transactions sources, dans le même ordre.
+    """
+
+    def __init__(self, transactions):
+        self.transactions = transactions if isinstance(transactions, list) else list(transactions)
+        categories, comptes, origines = _Codes(), _Codes(), _Codes()
+        code_categorie, code_compte, code_origine = categories.code, comptes.code, origines.code
+        montants, pointes, codes_categorie, codes_compte, codes_origine, dates, dates_budget = [], [], [], [], [], [], []
+        for trans in self.transactions:
+            get = trans.get
+            montants.append(get('montant') or 0.0)
+            pointes.append(bool(get('pointe', False)))
+            codes_categorie.append(code_categorie(get('categorie')))
+            codes_compte.append(code_compte(get('compte_affecte')))
+            codes_origine.append(code_origine(get('origine')))
+            date_reelle = (get('date') or '')[:10]
+            dates.append(date_reelle or None)
+            dates_budget.append((get('date_budgetaire') or '')[:10] or date_reelle or None)
+
+        self.montant = np.array(montants, dtype=np.float64)
+        self.pointe = np.array(pointes, dtype=bool)
+        self.categorie = np.array(codes_categorie, dtype=np.int32)
+        self.compte = np.array(codes_compte, dtype=np.int32)
+        self.origine = np.array(codes_origine, dtype=np.int32)
+        self.categories, self.comptes, self.origines = categories.valeurs, comptes.valeurs, origines.valeurs
+        jours = _en_jours(dates)
+        self.jour = _ordinaux(jours, 'D')
+        self.mois = _ordinaux(jours, 'M')
+        self.mois_budget = _ordinaux(_en_jours(dates_budget), 'M')
+
+    @classmethod
+    def depuis_budget(cls, budget_data):
+        """Frame de toutes les transactions d'un budget {'AAAA-MM': {'transactions': [...]}, ...}."""
+        return cls([trans for cle, data in budget_data.items()
+                    if not cle.startswith("_") and isinstance(data, dict) and 'transactions' in data
+                    for trans in data['transactions']])
+
+    def __len__(self):
+        return len(self.transactions)
+
+    # --- Sélections (masques booléens combinables avec & et |) ---
+
+    def du_mois(self, cle_mois):
+        """Transactions dont la date réelle tombe dans le mois 'AAAA-MM'."""
+        return self.mois == mois_ordinal(cle_mois)
+
+    def du_mois_budgetaire(self, cle_mois):
+        """Transactions rattachées au mois budgétaire 'AAAA-MM' (date budgétaire, sinon date réelle)."""
+        return self.mois_budget == mois_ordinal(cle_mois)
+
+    def jusqu_au(self, jour):
+        """Transactions dont la date réelle est au plus tard le jour donné (date ou chaîne ISO)."""
+        return (self.jour <= jour_ordinal(jour)) & (self.jour != ORDINAL_INVALIDE)
+
+    def jusqu_au_mois_budgetaire(self, cle_mois):
+        """Transactions rattachées au mois budgétaire 'AAAA-MM' ou à un mois antérieur."""
+        return (self.mois_budget <= mois_ordinal(cle_mois)) & (self.mois_budget != ORDINAL_INVALIDE)
+
+    def hors_virements(self):
+        code = self._code(self.categories, CATEGORIE_VIREMENT)
+        return np.ones(len(self), dtype=bool) if code is None else self.categorie != code
+
+    @staticmethod
+    def _code(valeurs, valeur):
+        try:
+            return valeurs.index(valeur)
+        except ValueError:
+            return None
+
+    def transactions_selon(self, masque):
+        """Les transactions sources sélectionnées par le masque, dans leur ordre d'origine."""
+        return [self.transactions[i] for i in np.flatnonzero(masque)]
+
+    # --- Regroupements ---
+
+    def _somme_par(self, codes, libelles, masque, selection=None):
+        """{libellé: somme des montants} pour les codes présents dans la sélection (comme un defaultdict(float))."""
+        if selection is not None:
+            masque = selection if masque is None else masque & selection
+        codes = codes if masque is None else codes[masque]
+        montants = self.montant if masque is None else self.montant[masque]
+        sommes = np.bincount(codes, weights=montants, minlength=len(libelles))
+        presents = np.bincount(codes, minlength=len(libelles)) > 0
+        return {libelles[code]: float(sommes[code]) for code in np.flatnonzero(presents)}
+
+    def somme_par_categorie(self, masque=None):
+        return self._somme_par(self.categorie, self.categories, masque)
+
+    def somme_par_compte(self, masque=None):
+        return self._somme_par(self.compte, self.comptes, masque)
+
+    def depenses_recettes_par_categorie(self, masque=None):
+        """(dépenses en valeur absolue, recettes, réalisé signé) par catégorie, virements exclus."""
+        masque = self.hors_virements() if masque is None else masque & self.hors_virements()
+        depenses = self._somme_par(self.categorie, self.categories, masque, self.montant < 0)
+        recettes = self._somme_par(self.categorie, self.categories, masque, self.montant > 0)
+        return {cat: abs(somme) for cat, somme in depenses.items()}, recettes, self.somme_par_categorie(masque)
+
+    def jours_par_categorie(self, masque):
+        """{catégorie: ensemble des jours du mois (1-31) où elle a une transaction} pour la sélection."""
+        jours = self.jour[masque]
+        valides = jours != ORDINAL_INVALIDE
+        dates = jours[valides].astype('datetime64[D]')
+        jours_du_mois = (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1
+        resultat = {}
+        for code, jour in set(zip(self.categorie[masque][valides].tolist(), jours_du_mois.tolist())):
+            resultat.setdefault(self.categories[code], set()).add(jour)
+        return resultat
+
+    def sommes_journalieres_par_compte(self, masque, premier_jour, nb_jours):
+        """{compte: tableau des sommes des nb_jours jours à partir de premier_jour (date ou ISO)} pour la sélection."""
+        debut = jour_ordinal(premier_jour)
+        masque = masque & (self.jour >= debut) & (self.jour < debut + nb_jours)
+        sommes = np.zeros((len(self.comptes), nb_jours))
+        np.add.at(sommes, (self.compte[masque], self.jour[masque] - debut), self.montant[masque])
+        return {nom: sommes[code] for code, nom in enumerate(self.comptes)}
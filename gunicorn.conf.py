@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Configuration Gunicorn de l'application web : gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = os.environ.get("SLC_WEB_BIND", "0.0.0.0:8000")
+
+# Plusieurs processus, chacun avec quelques threads : SQLite (WAL) accepte des lectures concurrentes,
+# les écritures sont courtes et sérialisées par la base.
+workers = int(os.environ.get("SLC_WEB_WORKERS", min(4, multiprocessing.cpu_count())))
+threads = int(os.environ.get("SLC_WEB_THREADS", 4))
+worker_class = "gthread"
+
+# Pas de préchargement : chaque worker importe app_web lui-même et ouvre ses propres connexions.
+preload_app = False
+
+timeout = 60
+graceful_timeout = 30
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("SLC_LOG_LEVEL", "info").lower()
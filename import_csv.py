@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Pipeline d'import CSV commun (comptes, historique, échéanciers, relevés bancaires).
+
+Le fichier est lu en flux, par lots de TAILLE_LOT lignes : il n'est jamais chargé entièrement en mémoire.
+Les colonnes numériques et les dates d'un lot sont normalisées d'un bloc avec numpy, les conflits
+sont recherchés dans des index (dictionnaires) construits une seule fois, et chaque ligne rejetée est
+consignée avec son numéro et la raison dans un RapportImport.
+"""
+import csv
+
+import numpy as np
+
+TAILLE_LOT = 5000
+DELIMITEUR = ';'
+ENCODAGE = 'utf-8-sig'
+
+class ErreurFichierImport(Exception):
+    """Fichier vide ou en-tête incorrect : rien n'est importé."""
+
+class RapportImport:
+    """Compteurs et détail ligne par ligne d'un import."""
+    def __init__(self):
+        self.ajoutes = 0
+        self.mis_a_jour = 0
+        self.ignores = 0
+        self.erreurs = [] # (numéro de ligne, identifiant, message)
+
+    def erreur(self, num_ligne, identifiant, message):
+        """Consigne une ligne rejetée."""
+        self.erreurs.append((num_ligne, identifiant, message))
+        self.ignores += 1
+
+    def resume(self, libelle_ajoutes="Ajoutés", libelle_mis_a_jour="Mis à jour", libelle_ignores="Ignorés", nb_erreurs_affichees=5):
+        texte = f"Terminé.\n{libelle_ajoutes}: {self.ajoutes}\n{libelle_mis_a_jour}: {self.mis_a_jour}\n{libelle_ignores}: {self.ignores}"
+        if self.erreurs:
+            texte += f"\n\nErreurs (premières {nb_erreurs_affichees}):\n" + "\n".join(
+                f"L{num} ('{ident}'): {message}" if ident else f"L{num}: {message}" for num, ident, message in self.erreurs[:nb_erreurs_affichees])
+        if len(self.erreurs) > nb_erreurs_affichees:
+            texte += f"\n...et {len(self.erreurs) - nb_erreurs_affichees} autres."
+        return texte
+
+    def exporter_erreurs(self, chemin):
+        """Écrit le détail de toutes les lignes rejetées dans un CSV (Ligne;Identifiant;Erreur)."""
+        with open(chemin, 'w', newline='', encoding=ENCODAGE) as f_csv:
+            writer = csv.writer(f_csv, delimiter=DELIMITEUR)
+            writer.writerow(["Ligne", "Identifiant", "Erreur"])
+            writer.writerows(self.erreurs)
+
+def lire_csv(chemin, colonnes_attendues, mode='exact', taille_lot=TAILLE_LOT):
+    """
+    Ouvre un CSV, vérifie son en-tête et retourne (en_tete, lots).
+    lots est un générateur de listes [(numéro de ligne, row), ...] d'au plus taille_lot lignes ;
+    le fichier est fermé quand il est épuisé.
+    :param mode: 'exact' (en-tête identique), 'prefixe' (commence par les colonnes attendues)
+                 ou 'contient' (les colonnes attendues sont présentes, dans n'importe quel ordre).
+    """
+    f_csv = open(chemin, 'r', newline='', encoding=ENCODAGE)
+    try:
+        reader = csv.reader(f_csv, delimiter=DELIMITEUR)
+        en_tete = next(reader, None)
+        if en_tete is None:
+            raise ErreurFichierImport("Le fichier CSV est vide.")
+        en_tete = [colonne.strip() for colonne in en_tete]
+        if mode == 'exact': valide = en_tete == list(colonnes_attendues)
+        elif mode == 'prefixe': valide = en_tete[:len(colonnes_attendues)] == list(colonnes_attendues)
+        else: valide = all(colonne in en_tete for colonne in colonnes_attendues)
+        if not valide:
+            raise ErreurFichierImport(f"En-têtes CSV incorrects.\nAttendu: {';'.join(colonnes_attendues)}\nObtenu: {';'.join(en_tete)}")
+    except BaseException:
+        f_csv.close()
+        raise
+
+    def lots():
+        with f_csv:
+            lot = []
+            for num_ligne, row in enumerate(reader, start=2):
+                if not any(cellule.strip() for cellule in row):
+                    continue # Lignes vides (fin de fichier, séparateurs)
+                lot.append((num_ligne, row))
+                if len(lot) >= taille_lot:
+                    yield lot
+                    lot = []
+            if lot:
+                yield lot
+    return en_tete, lots()
+
+def colonne(lot, index):
+    """Valeurs (chaînes) de la colonne 'index' d'un lot, '' quand la ligne est trop courte."""
+    return np.array([row[index] if index < len(row) else '' for _, row in lot], dtype=str)
+
+# Séparateurs de milliers : espace, espace insécable, espace fine insécable
+SEPARATEURS_MILLIERS = (' ', '\xa0', '\u202f')
+
+def normaliser_nombres(valeurs, vide=0.0):
+    """
+    Convertit d'un bloc des montants au format français ('1 234,56', espaces insécables) en float.
+    Retourne (nombres, valides). Une cellule vide vaut 'vide', ou est invalide si vide=None ;
+    'nan', 'inf' et les valeurs hors de la plage des float sont invalides.
+    """
+    textes = np.char.strip(np.asarray(valeurs, dtype=str))
+    for separateur in SEPARATEURS_MILLIERS:
+        textes = np.char.replace(textes, separateur, '')
+    textes = np.char.replace(textes, ',', '.')
+    vides = textes == ''
+    textes = np.where(vides, '0', textes)
+    valides = np.ones(len(textes), dtype=bool)
+    try:
+        nombres = textes.astype(float)
+    except ValueError:
+        # Au moins une valeur invalide dans le lot : on repère lesquelles
+        nombres = np.empty(len(textes))
+        for i, texte in enumerate(textes):
+            try: nombres[i] = float(texte)
+            except ValueError: nombres[i], valides[i] = np.nan, False
+    # float() accepte aussi 'nan' et 'inf' : ce ne sont pas des montants
+    valides &= np.isfinite(nombres)
+    if vide is None:
+        valides &= ~vides
+    else:
+        nombres[vides] = vide
+    return nombres, valides
+
+# Position des caractères de 'JJ/MM/AAAA' qui forment 'AAAA-MM-JJ' (les séparateurs sont remplacés ensuite)
+_ORDRE_DATE_FR = [6, 7, 8, 9, 2, 3, 4, 5, 0, 1]
+
+def normaliser_dates(valeurs):
+    """
+    Convertit d'un bloc des dates 'AAAA-MM-JJ' ou 'JJ/MM/AAAA' en chaînes ISO 'AAAA-MM-JJ'.
+    Retourne (dates_iso, valides) ; les dates impossibles (31/02...) sont invalides.
+    """
+    textes = np.char.strip(np.asarray(valeurs, dtype=str))
+    valides = np.char.str_len(textes) == 10
+    caracteres = np.where(valides, textes, '').astype('U10').view('U1').reshape(-1, 10).copy()
+    francaises = (caracteres[:, 2] == '/') & (caracteres[:, 5] == '/')
+    caracteres[francaises] = caracteres[francaises][:, _ORDRE_DATE_FR]
+    caracteres[francaises, 4] = '-'
+    caracteres[francaises, 7] = '-'
+    valides &= (caracteres[:, 4] == '-') & (caracteres[:, 7] == '-')
+    dates_iso = np.ascontiguousarray(caracteres).view('U10').reshape(-1)
+    candidates = np.where(valides, dates_iso, '1970-01-01')
+    try:
+        np.array(candidates, dtype='datetime64[D]')
+    except ValueError:
+        for i in np.flatnonzero(valides):
+            try: np.datetime64(dates_iso[i], 'D')
+            except ValueError: valides[i] = False
+    return dates_iso, valides
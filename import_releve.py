@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Import de relevés bancaires (CSV) avec détection des doublons et pointage automatique.
+
+Chaque opération, existante ou importée, a une empreinte (date, montant, libellé normalisé, compte)
+conservée dans la table empreintes_transactions. Un relevé peut donc être ré-importé, ou couvrir une
+période déjà importée, sans créer de doublons. Les lignes nouvelles qui correspondent à une transaction
+prévue non pointée du même compte (même montant, date proche) pointent cette transaction au lieu d'en créer une.
+Le fichier est traité en une seule passe, par lots (voir import_csv).
+"""
+import hashlib
+import re
+import unicodedata
+import uuid
+from collections import defaultdict
+from datetime import date
+
+from import_csv import RapportImport, ErreurFichierImport, lire_csv, colonne, normaliser_nombres, normaliser_dates
+
+ORIGINE_RELEVE = "releve"
+CATEGORIE_A_CLASSER = "(À catégoriser)"
+JOURS_TOLERANCE_POINTAGE = 5 # Écart admis entre la date prévue et la date de l'opération bancaire
+
+def normaliser_description(description):
+    """Libellé en minuscules, sans accents ni ponctuation, espaces réduits."""
+    texte = unicodedata.normalize('NFKD', str(description or '').lower())
+    texte = ''.join(c for c in texte if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[a-z0-9]+', texte))
+
+def empreinte_transaction(date_iso, montant, description, compte):
+    """Empreinte d'une opération : deux opérations de même empreinte sont considérées identiques."""
+    cle = f"{str(date_iso)[:10]}|{round(float(montant or 0.0) * 100)}|{normaliser_description(description)}|{compte or ''}"
+    return hashlib.blake2b(cle.encode('utf-8'), digest_size=16).hexdigest()
+
+class ImportReleve:
+    """Import d'un relevé CSV (Date;Libellé;Montant, ou Date;Libellé;Débit;Crédit) dans un compte."""
+
+    def __init__(self, data_manager, compte, categoriser=None, jours_tolerance=JOURS_TOLERANCE_POINTAGE):
+        """
+        :param compte: nom du compte concerné par le relevé.
+        :param categoriser: fonction libellé -> catégorie (ou None) pour les opérations nouvelles.
+        """
+        self.data_manager = data_manager
+        self.compte = compte
+        self.categoriser = categoriser
+        self.jours_tolerance = jours_tolerance
+
+    def _colonnes_montant(self, en_tete):
+        if 'Montant' in en_tete:
+            return en_tete.index('Montant'), None
+        if 'Débit' in en_tete and 'Crédit' in en_tete:
+            return en_tete.index('Débit'), en_tete.index('Crédit')
+        raise ErreurFichierImport("Le relevé doit contenir une colonne 'Montant', ou les colonnes 'Débit' et 'Crédit'.")
+
+    def _montants(self, lot, col_montant, col_credit):
+        """Montants signés d'un lot (les débits sont négatifs, qu'ils soient écrits avec ou sans signe)."""
+        if col_credit is None:
+            return normaliser_nombres(colonne(lot, col_montant), vide=None)
+        debits, debits_ok = normaliser_nombres(colonne(lot, col_montant))
+        credits, credits_ok = normaliser_nombres(colonne(lot, col_credit))
+        return credits - abs(debits), debits_ok & credits_ok
+
+    def _candidats_pointage(self):
+        """
+        Transactions prévues non pointées du compte, regroupées par montant en centimes. Les opérations créées par
+        un import de relevé précédent sont des opérations bancaires, pas des prévisions : elles sont exclues.
+        """
+        candidats = defaultdict(list)
+        for trans in self.data_manager.transactions_non_pointees(self.compte):
+            if trans.get('origine') == ORIGINE_RELEVE: continue
+            try: jour = date.fromisoformat(str(trans['date'])[:10])
+            except ValueError: continue
+            candidats[round((trans['montant'] or 0.0) * 100)].append((jour, trans['id']))
+        return candidats
+
+    def _rapprocher(self, candidats, centimes, jour):
+        """Retire et retourne l'id de la transaction prévue la plus proche en date (dans la tolérance), ou None."""
+        liste = candidats.get(centimes)
+        if not liste: return None
+        ecart, position = min((abs((jour_prevu - jour).days), i) for i, (jour_prevu, _) in enumerate(liste))
+        if ecart > self.jours_tolerance: return None
+        return liste.pop(position)[1]
+
+    def importer(self, chemin):
+        """
+        Lit le relevé et enregistre le résultat en une seule transaction SQL.
+        Retourne (rapport, nouvelles transactions, ids des transactions pointées).
+        rapport.ajoutes = opérations créées, rapport.mis_a_jour = prévisions pointées,
+        rapport.ignores = doublons et lignes en erreur (détaillées dans rapport.erreurs).
+        """
+        en_tete, lots = lire_csv(chemin, ['Date', 'Libellé'], mode='contient')
+        col_date, col_libelle = en_tete.index('Date'), en_tete.index('Libellé')
+        col_montant, col_credit = self._colonnes_montant(en_tete)
+
+        # Les opérations déjà en base reçoivent leur empreinte avant la comparaison
+        self.data_manager.indexer_empreintes(empreinte_transaction)
+        candidats = self._candidats_pointage()
+        rapport = RapportImport()
+        occurrences_restantes = {} # empreinte -> nombre d'opérations identiques déjà en base non encore retrouvées
+        nouvelles, pointees, empreintes = [], [], []
+
+        for lot in lots:
+            dates_iso, dates_ok = normaliser_dates(colonne(lot, col_date))
+            montants, montants_ok = self._montants(lot, col_montant, col_credit)
+            libelles = colonne(lot, col_libelle)
+            empreintes_lot = [empreinte_transaction(dates_iso[k], montants[k], libelles[k], self.compte) if dates_ok[k] and montants_ok[k] else None
+                              for k in range(len(lot))]
+            inconnues = {e for e in empreintes_lot if e is not None and e not in occurrences_restantes}
+            occurrences_restantes.update(dict.fromkeys(inconnues, 0))
+            occurrences_restantes.update(self.data_manager.compter_empreintes(inconnues))
+
+            for k, (num_ligne, row) in enumerate(lot):
+                libelle = str(libelles[k]).strip()
+                if not dates_ok[k]:
+                    rapport.erreur(num_ligne, libelle, "Date invalide (attendu AAAA-MM-JJ ou JJ/MM/AAAA).")
+                    continue
+                if not montants_ok[k]:
+                    rapport.erreur(num_ligne, libelle, "Montant invalide.")
+                    continue
+                empreinte = empreintes_lot[k]
+                # Multiensemble : deux cafés identiques le même jour restent deux opérations distinctes
+                if occurrences_restantes[empreinte] > 0:
+                    occurrences_restantes[empreinte] -= 1
+                    rapport.ignores += 1
+                    continue
+                date_iso, montant = str(dates_iso[k]), round(float(montants[k]), 2)
+                id_prevue = self._rapprocher(candidats, round(montant * 100), date.fromisoformat(date_iso))
+                if id_prevue:
+                    pointees.append(id_prevue)
+                    empreintes.append((id_prevue, empreinte))
+                    rapport.mis_a_jour += 1
+                    continue
+                trans = {"id": uuid.uuid4().hex, "origine": ORIGINE_RELEVE, "date": date_iso, "description": libelle, "montant": montant,
+                         "categorie": (self.categoriser(libelle) if self.categoriser else None) or CATEGORIE_A_CLASSER,
+                         "compte_affecte": self.compte, "pointe": False}
+                nouvelles.append(trans)
+                empreintes.append((trans['id'], empreinte))
+                rapport.ajoutes += 1
+
+        if nouvelles or pointees:
+            self.data_manager.enregistrer_import_releve(nouvelles, pointees, empreintes)
+        return rapport, nouvelles, pointees
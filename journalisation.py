@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration de la journalisation de l'application (bureau et web).
+
+Tous les modules écrivent dans des loggers enfants de 'slc' (ex. 'slc.services').
+Les niveaux se règlent sans toucher au code, par variables d'environnement :
+    SLC_LOG_LEVEL=WARNING                                   -> niveau global (INFO par défaut)
+    SLC_LOG_LEVELS=slc.services=DEBUG,slc.recurrences=INFO  -> niveaux par module
+    SLC_DEBUG_PROJECTION=1                                  -> active le canal de diagnostic du moteur de projection
+
+Le canal 'slc.projection' est coupé par défaut : ses messages (un par compte, par carte,
+par transaction...) ne coûtent alors qu'un test de niveau.
+"""
+import logging
+import os
+
+LOGGER_RACINE = "slc"
+CANAL_PROJECTION = f"{LOGGER_RACINE}.projection"
+FORMAT_MESSAGE = "%(levelname)s: %(message)s"
+
+_configuree = False
+
+def get_logger(nom):
+    """Retourne le logger 'slc.<nom>'."""
+    return logging.getLogger(f"{LOGGER_RACINE}.{nom}")
+
+def _lire_niveau(valeur, defaut):
+    if not valeur:
+        return defaut
+    valeur = valeur.strip().upper()
+    if valeur.isdigit():
+        return int(valeur)
+    niveau = logging.getLevelName(valeur)
+    return niveau if isinstance(niveau, int) else defaut
+
+def configurer_journalisation(niveau=None, niveaux_par_module=None, debug_projection=None):
+    """
+    Installe le gestionnaire de sortie et applique les niveaux. Peut être appelée plusieurs fois :
+    le gestionnaire n'est ajouté qu'une seule fois, les niveaux sont mis à jour.
+    Les arguments explicites l'emportent sur les variables d'environnement.
+    """
+    global _configuree
+    racine = logging.getLogger(LOGGER_RACINE)
+    if not _configuree:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(FORMAT_MESSAGE))
+        racine.addHandler(handler)
+        racine.propagate = False
+        _configuree = True
+
+    racine.setLevel(niveau if niveau is not None else _lire_niveau(os.environ.get("SLC_LOG_LEVEL"), logging.INFO))
+
+    if debug_projection is None:
+        debug_projection = os.environ.get("SLC_DEBUG_PROJECTION", "").strip().lower() in ("1", "true", "oui", "on")
+    logging.getLogger(CANAL_PROJECTION).setLevel(logging.DEBUG if debug_projection else logging.WARNING)
+
+    niveaux = {}
+    for element in os.environ.get("SLC_LOG_LEVELS", "").split(","):
+        if "=" in element:
+            nom_module, valeur = element.split("=", 1)
+            niveaux[nom_module.strip()] = _lire_niveau(valeur, logging.INFO)
+    niveaux.update(niveaux_par_module or {})
+    for nom_module, valeur in niveaux.items():
+        logging.getLogger(nom_module).setLevel(valeur)
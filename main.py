@@ -5,9 +5,11 @@ import os
 import sys
 
 from app import PatrimoineApp  # On importe notre classe depuis le nouveau fichier
+from journalisation import configurer_journalisation
 
 # Point d'entrée de l'application
 if __name__ == "__main__":
+    configurer_journalisation()
     print("INFO: Lancement ...")
     
     # On détermine le répertoire de base de l'application
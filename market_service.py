@@ -1,4 +1,3 @@
-import yfinance as yf
 from functools import lru_cache
 
 class MarketDataService:
@@ -13,6 +12,9 @@ class MarketDataService:
     def get_stock_info(self, ticker):
         """Récupère les informations complètes pour un ticker donné."""
         try:
+            # yfinance (et pandas derrière lui) n'est importé qu'à la première demande de cours :
+            # son import coûte plusieurs secondes au démarrage de l'application.
+            import yfinance as yf
             stock = yf.Ticker(ticker)
             # .info est coûteux, on le fait une fois et on met en cache le résultat
             return stock.info
@@ -1,4 +1,14 @@
+import sys
+from collections.abc import MutableMapping
+
+from utils import format_nombre_fr
+
 class Compte:
+    # Attributs fixes : pas de __dict__ par instance (les listes de choix restent des attributs de classe)
+    __slots__ = ('id', 'nom', 'banque', 'type_compte', 'solde', 'liquidite', 'terme_passif', 'classe_actif',
+                 'suivi_budget', 'alerte_decouvert', 'solde_especes', 'lignes_portefeuille',
+                 'jour_debit', 'jour_debut_periode', 'jour_fin_periode', 'compte_debit_associe')
+
     LIQUIDITE_CHOICES = ["Non Renseigné", "Immédiate", "Court Terme (<1 an)", "Long Terme (>1 an)", "N/A"]
     CLASSE_ACTIF_CHOICES = ["Non Renseigné", "Monétaire", "Actions/Titres", "Obligations", "Immobilier", "Autre", "N/A"]
     TERME_PASSIF_CHOICES = ["Non Renseigné", "Court Terme", "Moyen Terme", "Long Terme", "N/A"]
@@ -70,6 +80,8 @@ class Compte:
         
 # Dans models.py
 class LignePortefeuille:
+    __slots__ = ('id', 'compte_id', 'nom', 'ticker', 'quantite', 'pru', 'dernier_cours')
+
     # --- DÉBUT MODIFICATION ---
     def __init__(self, nom, ticker, quantite, pru, id=None, compte_id=None, dernier_cours=0.0):
     # --- FIN MODIFICATION ---
@@ -95,4 +107,86 @@ class LignePortefeuille:
             'pru': self.pru,
             'dernier_cours': self.dernier_cours
         }
-    # --- FIN DE L'AJOUT ---
\ No newline at end of file
+    # --- FIN DE L'AJOUT ---
+
+
+class Transaction(MutableMapping):
+    """
+    Transaction du budget chargée depuis la base, sous une forme compacte.
+    Elle se manipule comme le dictionnaire qu'elle remplace (trans['montant'], trans.get('pointe'), update()...),
+    mais ses onze champs sont des slots : pas de table de hachage par transaction. Les chaînes très répétées
+    (catégorie, compte, origine, dates) sont internées et partagées entre toutes les transactions.
+    Une clé hors des colonnes de la table est rangée dans un petit dictionnaire annexe créé à la demande.
+    """
+    CHAMPS = ('id', 'date', 'description', 'montant', 'categorie', 'compte_affecte', 'pointe',
+              'virement_id', 'origine', 'id_recurrence', 'date_budgetaire')
+    CHAMPS_INTERNES = frozenset(('date', 'categorie', 'compte_affecte', 'origine', 'date_budgetaire'))
+    _EST_CHAMP = frozenset(CHAMPS)
+    __slots__ = CHAMPS + ('_autres',)
+
+    def __init__(self, valeurs=(), **autres_valeurs):
+        for champ in self.CHAMPS:
+            setattr(self, champ, None)
+        self._autres = None
+        self.update(valeurs, **autres_valeurs)
+
+    @classmethod
+    def depuis_ligne(cls, ligne):
+        """Construit la transaction depuis les valeurs d'une ligne de la table, dans l'ordre de CHAMPS."""
+        trans = cls.__new__(cls)
+        trans._autres = None
+        for champ, valeur in zip(cls.CHAMPS, ligne):
+            setattr(trans, champ, sys.intern(valeur) if champ in cls.CHAMPS_INTERNES and type(valeur) is str else valeur)
+        trans.pointe = bool(trans.pointe)
+        return trans
+
+    def __getitem__(self, cle):
+        if cle in self._EST_CHAMP:
+            return getattr(self, cle)
+        if self._autres is not None and cle in self._autres:
+            return self._autres[cle]
+        raise KeyError(cle)
+
+    def __setitem__(self, cle, valeur):
+        if cle in self._EST_CHAMP:
+            setattr(self, cle, sys.intern(valeur) if cle in self.CHAMPS_INTERNES and type(valeur) is str else valeur)
+        else:
+            if self._autres is None:
+                self._autres = {}
+            self._autres[cle] = valeur
+
+    def __delitem__(self, cle):
+        if cle in self._EST_CHAMP:
+            setattr(self, cle, None) # Les colonnes de la table existent toujours, vides au besoin
+        elif self._autres is not None and cle in self._autres:
+            del self._autres[cle]
+        else:
+            raise KeyError(cle)
+
+    def __iter__(self):
+        yield from self.CHAMPS
+        if self._autres:
+            yield from self._autres
+
+    def __len__(self):
+        return len(self.CHAMPS) + (len(self._autres) if self._autres else 0)
+
+    def __contains__(self, cle):
+        return cle in self._EST_CHAMP or (self._autres is not None and cle in self._autres)
+
+    def __getstate__(self):
+        return tuple(getattr(self, champ) for champ in self.CHAMPS) + (self._autres,)
+
+    def __setstate__(self, etat):
+        *valeurs, self._autres = etat
+        for champ, valeur in zip(self.CHAMPS, valeurs):
+            setattr(self, champ, sys.intern(valeur) if champ in self.CHAMPS_INTERNES and type(valeur) is str else valeur)
+
+    def copy(self):
+        return Transaction(self)
+
+    def to_dict(self):
+        return dict(self)
+
+    def __repr__(self):
+        return f"Transaction({self.to_dict()!r})"
@@ -17,6 +17,7 @@ except ImportError:
     SV_TTK_AVAILABLE = False
 
 from services import SqlDataManager
+from series_patrimoine import HistorySeries
 from utils import format_nombre_fr
 from ai_service import CategorizationAI
 
@@ -24,6 +25,7 @@ MOIS_FRANCAIS = [
     "", "Janvier", "Février", "Mars", "Avril", "Mai", "Juin",
     "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre"
 ]
+ANNEES_COMPARAISON = 5 # Nombre d'années (année affichée incluse) utilisées pour les comparaisons pluriannuelles
 
 class YearlyReportApp:
     def __init__(self, root, base_dir):
@@ -53,6 +55,7 @@ class YearlyReportApp:
 
         self.data_manager = SqlDataManager(db_path)
         self.ai_service = CategorizationAI()
+        self._rollup_cache = {}
         
         self.create_widgets()
         self.refresh_all_data()
@@ -100,23 +103,23 @@ class YearlyReportApp:
         ia_frame.grid(row=3, column=0, sticky='ew', pady=(10, 0))
         self.ia_analysis_text = tk.Text(ia_frame, height=6, wrap="word", relief="flat", state="disabled")
         self.ia_analysis_text.pack(fill=tk.X, expand=True)
-    def refresh_all_data(self): self.load_patrimoine_data(); self.load_budget_data()
+    def refresh_all_data(self): self._rollup_cache = {}; self.load_patrimoine_data(); self.load_budget_data()
+    def _charger_rollup_periode(self, year_to_load):
+        """Agrégats mensuels de l'année et des années de comparaison (années archivées comprises), mis en cache jusqu'au prochain rafraîchissement."""
+        if year_to_load not in self._rollup_cache:
+            self._rollup_cache[year_to_load] = self.data_manager.charger_rollup(f"{year_to_load - ANNEES_COMPARAISON + 1:04d}-01", f"{year_to_load:04d}-12", inclure_archive=True)
+        return self._rollup_cache[year_to_load]
     def load_patrimoine_data(self):
         try: year_to_load = int(self.year_var.get())
         except (ValueError, TypeError): return
-        _, historique = self.data_manager.charger_donnees()
-        snapshots_prev_year = [s for s in historique if datetime.strptime(s['date'], "%Y-%m-%d").year == year_to_load - 1]
-        patrimoine_net_prev = 0
-        if snapshots_prev_year: snapshots_prev_year.sort(key=lambda x: x['date']); patrimoine_net_prev = snapshots_prev_year[-1].get('patrimoine_net', 0.0)
-        snapshots_of_year = [s for s in historique if datetime.strptime(s['date'], "%Y-%m-%d").year == year_to_load]
-        last_snapshots = {}
-        for snap in snapshots_of_year:
-            month_key = snap['date'][:7]
-            if month_key not in last_snapshots or snap['date'] > last_snapshots[month_key]['date']: last_snapshots[month_key] = snap
-        all_asset_classes = set()
-        for snap in last_snapshots.values():
-            if 'repartition_actifs_par_classe' in snap: all_asset_classes.update(snap['repartition_actifs_par_classe'].keys())
-        sorted_asset_classes = sorted(list(all_asset_classes))
+        # Historique de l'année et de la précédente en colonnes : une requête indexée, pas de re-parsing des dates
+        series = HistorySeries.depuis_base(self.data_manager, f"{year_to_load - 1:04d}-01-01", f"{year_to_load:04d}-12-31", comptes=[])
+        annee_precedente = series.entre(date_fin=f"{year_to_load - 1:04d}-12-31")
+        patrimoine_net_prev = float(annee_precedente.net[-1]) if len(annee_precedente) else 0.0
+        fins_de_mois = series.entre(date_debut=f"{year_to_load:04d}-01-01").reechantillonner('M')
+        variations = fins_de_mois.variations('net', patrimoine_net_prev)
+        index_par_mois = {cle: i for i, cle in enumerate(fins_de_mois.periodes('M'))}
+        sorted_asset_classes = sorted(classe for classe, montants in fins_de_mois.classes.items() if montants.any())
         columns = ["Mois"] + sorted_asset_classes + ["Total Actifs", "Total Passifs", "Patrimoine Net", "Variation (€)"]
         self.tree_patrimoine["columns"] = columns
         for col in columns: self.tree_patrimoine.heading(col, text=col); self.tree_patrimoine.column(col, width=120, anchor=tk.E if col != "Mois" else tk.W)
@@ -124,13 +127,13 @@ class YearlyReportApp:
         total_variation_annuelle = 0; final_row_data = None
         for month_num in range(1, 13):
             month_name = MOIS_FRANCAIS[month_num]; month_key = f"{year_to_load:04d}-{month_num:02d}"
-            snap = last_snapshots.get(month_key)
-            if snap:
-                current_patrimoine_net = snap.get('patrimoine_net', 0.0); variation = current_patrimoine_net - patrimoine_net_prev
-                total_variation_annuelle += variation; patrimoine_net_prev = current_patrimoine_net
+            i = index_par_mois.get(month_key)
+            if i is not None:
+                current_patrimoine_net = float(fins_de_mois.net[i]); variation = float(variations[i])
+                total_variation_annuelle += variation
                 row_data = {"Mois": month_name}
-                for asset_class in sorted_asset_classes: row_data[asset_class] = snap['repartition_actifs_par_classe'].get(asset_class, 0.0)
-                row_data["Total Actifs"] = snap.get('total_actifs', 0.0); row_data["Total Passifs"] = snap.get('total_passifs_magnitude', 0.0)
+                for asset_class in sorted_asset_classes: row_data[asset_class] = float(fins_de_mois.classes[asset_class][i])
+                row_data["Total Actifs"] = float(fins_de_mois.actifs[i]); row_data["Total Passifs"] = float(fins_de_mois.passifs[i])
                 row_data["Patrimoine Net"] = current_patrimoine_net; row_data["Variation (€)"] = variation
                 values_for_tree = [month_name] + [format_nombre_fr(row_data.get(ac, 0.0)) for ac in sorted_asset_classes] + [format_nombre_fr(row_data["Total Actifs"]), format_nombre_fr(row_data["Total Passifs"]), format_nombre_fr(row_data["Patrimoine Net"]), format_nombre_fr(row_data["Variation (€)"])]
                 tag = 'gain' if variation > 0 else 'perte' if variation < 0 else ''
@@ -143,29 +146,27 @@ class YearlyReportApp:
         try: year_to_load = int(self.year_var.get())
         except (ValueError, TypeError): return
         budget_type = self.budget_type_var.get()
-        budget_data = self.data_manager.charger_budget_donnees()
-        all_transactions = [t for data in budget_data.values() if isinstance(data, dict) for t in data.get('transactions', [])]
-        transactions_of_year = []
-        for t in all_transactions:
-            try:
-                date_str = t.get('date_budgetaire') or t.get('date')
-                if datetime.strptime(date_str, "%Y-%m-%d").date().year == year_to_load: transactions_of_year.append(t)
-            except (ValueError, TypeError): continue
-        total_recettes = sum(t['montant'] for t in transactions_of_year if t['montant'] > 0 and t['categorie'] != "(Virement)")
-        total_depenses = sum(t['montant'] for t in transactions_of_year if t['montant'] < 0 and t['categorie'] != "(Virement)")
+        rollup = self._charger_rollup_periode(year_to_load)
+        # Données par année (catégorie -> mois -> montant) pour l'année affichée et les précédentes, lues dans les agrégats mensuels
+        data_by_year = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
+        total_recettes = total_depenses = 0.0
+        for row in rollup:
+            try: annee, month = int(row['mois'][:4]), int(row['mois'][5:7])
+            except ValueError: continue
+            cat = row['categorie']; somme = row['somme']
+            if cat == '(Virement)': continue
+            if annee == year_to_load:
+                if row['signe'] > 0: total_recettes += somme
+                else: total_depenses += somme
+            if not cat or somme == 0: continue
+            if (budget_type == "Dépenses" and row['signe'] < 0) or (budget_type == "Recettes" and row['signe'] > 0):
+                data_by_year[annee][cat][month] += abs(somme)
         solde_annuel = total_recettes + total_depenses
         self.total_recettes_label.config(text=f"Total Recettes : +{format_nombre_fr(total_recettes)} €")
         self.total_depenses_label.config(text=f"Total Dépenses : {format_nombre_fr(total_depenses)} €")
         self.solde_annuel_label.config(text=f"Solde Annuel : {format_nombre_fr(solde_annuel)} €")
-        data_by_cat = defaultdict(lambda: defaultdict(float))
-        all_categories = set()
-        for t in transactions_of_year:
-            is_expense = t.get('montant', 0.0) < 0; is_income = t.get('montant', 0.0) > 0; cat = t.get('categorie')
-            if not cat or cat == '(Virement)': continue
-            if (budget_type == "Dépenses" and is_expense) or (budget_type == "Recettes" and is_income):
-                all_categories.add(cat)
-                month = datetime.strptime(t.get('date_budgetaire') or t.get('date'), "%Y-%m-%d").date().month
-                data_by_cat[cat][month] += abs(t['montant'])
+        data_by_cat = data_by_year[year_to_load]
+        all_categories = set(data_by_cat.keys())
         analysis_results_anomalies = self.ai_service.analyser_budget_annuel(data_by_cat, budget_type)
         categories_anormales = {res['categorie'] for res in analysis_results_anomalies}
         sorted_categories = sorted(list(all_categories), key=lambda cat: sum(data_by_cat[cat].values()), reverse=True)
@@ -190,6 +191,7 @@ class YearlyReportApp:
         self.tree_budget.insert("", "end", values=[""] * len(columns))
         self.tree_budget.insert("", "end", values=total_values, tags=('total',))
         analysis_results_tendances = self.ai_service.analyser_tendances(data_by_cat)
+        analysis_results_comparaison = self.ai_service.comparer_annees({a: d for a, d in data_by_year.items() if d}, year_to_load)
         self.ia_analysis_text.config(state="normal")
         self.ia_analysis_text.delete("1.0", tk.END)
         self.ia_analysis_text.tag_configure("bold", font=('TkDefaultFont', 9, 'bold'))
@@ -199,7 +201,11 @@ class YearlyReportApp:
         if analysis_results_tendances:
             self.ia_analysis_text.insert(tk.END, "Tendances Annuelles :\n", "bold")
             self.ia_analysis_text.insert(tk.END, "\n".join(analysis_results_tendances))
-        if not analysis_results_anomalies and not analysis_results_tendances:
+        if analysis_results_comparaison:
+            if analysis_results_anomalies or analysis_results_tendances: self.ia_analysis_text.insert(tk.END, "\n\n")
+            self.ia_analysis_text.insert(tk.END, "Comparaison Pluriannuelle :\n", "bold")
+            self.ia_analysis_text.insert(tk.END, "\n".join(analysis_results_comparaison))
+        if not analysis_results_anomalies and not analysis_results_tendances and not analysis_results_comparaison:
              self.ia_analysis_text.insert(tk.END, "Aucune observation particulière de l'IA pour cette sélection.")
         self.ia_analysis_text.config(state="disabled")
 
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Rapprochement automatique d'un compte avec le solde d'un relevé bancaire.
+
+On cherche, parmi les transactions non pointées du compte, celles dont le pointage amène le solde du compte
+au solde du relevé (somme exacte au centime). Les transactions anciennes ont presque toujours été débitées :
+seules celles d'une fenêtre de quelques jours avant la date du relevé (et quelques jours après, pour les dates
+de valeur) sont laissées libres, les plus anciennes sont retenues d'office. Si aucune combinaison ne tombe
+juste, la fenêtre est doublée, jusqu'à couvrir toutes les transactions.
+La recherche de sous-ensemble se fait sur les centimes avec des entiers Python utilisés comme ensembles
+de bits (bit k = somme k atteignable), ce qui traite des centaines de lignes en une fraction de seconde.
+"""
+from datetime import date, timedelta
+
+JOURS_FENETRE_INITIALE = 7 # Transactions laissées libres avant la date du relevé (la fenêtre double à chaque essai)
+MARGE_JOURS_APRES_RELEVE = 3 # Opérations datées après le relevé mais débitées avant (dates de valeur)
+LIMITE_BITS_RECHERCHE = 400_000_000 # Taille maximale (bits) des ensembles de sommes conservés pour une recherche
+
+class RechercheTropVaste(Exception):
+    """Trop de transactions libres (ou de trop gros montants) pour une recherche interactive."""
+
+class PropositionRapprochement:
+    """Transactions à pointer pour atteindre le solde du relevé."""
+    def __init__(self, transactions, fenetre_jours):
+        self.transactions = transactions
+        self.ids = [trans['id'] for trans in transactions]
+        self.total = round(sum(trans.get('montant') or 0.0 for trans in transactions), 2)
+        self.fenetre_jours = fenetre_jours # Fenêtre (en jours avant le relevé) qui a suffi à trouver la combinaison
+
+def _centimes(montant):
+    return round((montant or 0.0) * 100)
+
+def sous_ensemble(valeurs, cible, limite_bits=LIMITE_BITS_RECHERCHE):
+    """
+    Indices d'un sous-ensemble de 'valeurs' (entiers, signés) de somme 'cible', ou None s'il n'y en a pas.
+    Parmi les solutions, les derniers éléments sont écartés en priorité (placer les moins probables en fin de liste).
+    """
+    negatif = sum(-v for v in valeurs if v < 0)
+    largeur = negatif + sum(v for v in valeurs if v > 0) + 1
+    if not 0 <= cible + negatif < largeur:
+        return None
+    if largeur * len(valeurs) > limite_bits:
+        raise RechercheTropVaste(f"{len(valeurs)} transactions libres pour {largeur} sommes possibles.")
+    # etats[i] = sommes atteignables avec les i premiers éléments (décalées de 'negatif')
+    etats = [1 << negatif]
+    for valeur in valeurs:
+        atteignables = etats[-1]
+        etats.append(atteignables | (atteignables << valeur if valeur >= 0 else atteignables >> -valeur))
+    position = cible + negatif
+    if not (etats[-1] >> position) & 1:
+        return None
+    choisis = []
+    for i in range(len(valeurs) - 1, -1, -1):
+        if (etats[i] >> position) & 1:
+            continue # La somme reste atteignable sans cet élément
+        choisis.append(i)
+        position -= valeurs[i]
+    choisis.reverse()
+    return choisis
+
+def rapprocher(transactions, solde_compte, solde_releve, date_releve, passif=False, jours_fenetre=JOURS_FENETRE_INITIALE,
+               marge_jours=MARGE_JOURS_APRES_RELEVE, limite_bits=LIMITE_BITS_RECHERCHE):
+    """
+    Cherche les transactions non pointées dont le pointage amène le solde du compte au solde du relevé.
+    :param transactions: transactions du compte (dictionnaires avec 'id', 'date' ISO et 'montant') ; celles déjà pointées sont ignorées.
+    :param solde_compte: solde actuel du compte (transactions déjà pointées comprises).
+    :param date_releve: date ISO 'AAAA-MM-JJ' du solde du relevé.
+    :param passif: pour un passif, le pointage soustrait les montants du solde.
+    Retourne une PropositionRapprochement, ou None si aucune combinaison n'atteint le solde du relevé.
+    Lève RechercheTropVaste si la fenêtre à explorer devient trop grande pour une recherche interactive.
+    """
+    jour_releve = date.fromisoformat(date_releve)
+    date_max = (jour_releve + timedelta(days=marge_jours)).isoformat()
+    candidates = sorted((trans for trans in transactions if not trans.get('pointe', False) and trans.get('date') and str(trans['date'])[:10] <= date_max),
+                        key=lambda trans: (str(trans['date'])[:10], str(trans.get('id'))))
+    ecart = _centimes(solde_releve) - _centimes(solde_compte)
+    cible = -ecart if passif else ecart
+
+    fenetre = jours_fenetre
+    while True:
+        debut_fenetre = (jour_releve - timedelta(days=fenetre)).isoformat()
+        anciennes = [trans for trans in candidates if str(trans['date'])[:10] < debut_fenetre]
+        # Les montants nuls ne changent rien : retenus s'ils sont datés d'avant le relevé
+        libres = [trans for trans in candidates[len(anciennes):] if _centimes(trans.get('montant'))]
+        nulles = [trans for trans in candidates[len(anciennes):] if not _centimes(trans.get('montant')) and str(trans['date'])[:10] <= date_releve]
+        reste = cible - sum(_centimes(trans.get('montant')) for trans in anciennes)
+        # Les libres sont triées par date : les plus récentes, les moins sûres, sont écartées en priorité
+        choisis = sous_ensemble([_centimes(trans.get('montant')) for trans in libres], reste, limite_bits)
+        if choisis is not None:
+            retenues = anciennes + [libres[i] for i in choisis] + nulles
+            retenues.sort(key=lambda trans: (str(trans['date'])[:10], str(trans.get('id'))))
+            return PropositionRapprochement(retenues, fenetre)
+        if not anciennes:
+            return None # La fenêtre couvre déjà toutes les transactions
+        fenetre *= 2
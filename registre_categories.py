@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Registre en mémoire des catégories de budget.
+
+La table 'categories' (id, nom, type, compteurs d'utilisation) est tenue à jour par des triggers à chaque
+écriture de transaction, de ligne de budget, de modèle ou de récurrence. Le registre en garde une copie
+qu'il ne recharge que lorsque la version de la base a changé : les listes de catégories des fenêtres
+et boîtes de dialogue ne reparcourent plus tous les mois et toutes les transactions.
+Les catégories créées en mémoire et pas encore sauvegardées sont signalées avec noter().
+"""
+
+CATEGORIES_TECHNIQUES = ("(Virement)", "(Hors Budget)")
+
+class RegistreCategories:
+
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self._version = None
+        self._par_nom = {}
+        self._en_attente = {} # Catégories du budget en mémoire, pas encore écrites en base
+
+    def _categories(self):
+        version = self.data_manager.get_version()
+        if version != self._version:
+            self._par_nom = {cat['nom']: cat for cat in self.data_manager.charger_categories()}
+            self._version = version
+        if self._en_attente:
+            return {**self._en_attente, **self._par_nom}
+        return self._par_nom
+
+    def noter(self, nom, type_categorie=None):
+        """Signale une catégorie de budget ajoutée en mémoire, visible jusqu'à la prochaine sauvegarde du budget."""
+        if nom and nom not in self._par_nom:
+            self._en_attente[nom] = {'id': None, 'nom': nom, 'type': type_categorie, 'nb_transactions': 0,
+                                     'nb_prevues': 1, 'nb_modeles': 0, 'nb_recurrences': 0}
+
+    def invalider(self):
+        """Force le rechargement à la prochaine lecture (à appeler après une sauvegarde du budget)."""
+        self._version = None
+        self._en_attente.clear()
+
+    def get(self, nom):
+        """La catégorie (dictionnaire id, nom, type, nb_*) de ce nom, ou None."""
+        return self._categories().get(nom)
+
+    def id_de(self, nom):
+        cat = self.get(nom)
+        return cat['id'] if cat else None
+
+    def noms_budget(self, type_filtre=None):
+        """Catégories présentes dans un budget mensuel ou un modèle, éventuellement d'un seul type (Dépense/Revenu)."""
+        return sorted(nom for nom, cat in self._categories().items()
+                      if cat['nb_prevues'] + cat['nb_modeles'] > 0 and (type_filtre is None or cat['type'] == type_filtre))
+
+    def noms_utilises(self, inclure_techniques=False):
+        """Toutes les catégories encore utilisées quelque part (budgets, modèles, transactions, récurrences)."""
+        return sorted(nom for nom, cat in self._categories().items()
+                      if cat['nb_transactions'] + cat['nb_prevues'] + cat['nb_modeles'] + cat['nb_recurrences'] > 0
+                      and (inclure_techniques or nom not in CATEGORIES_TECHNIQUES))
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Historique du patrimoine sous forme de colonnes numpy.
+
+HistorySeries est construit une fois par chargement (depuis la liste d'instantanés de l'application
+ou directement depuis les tables snapshot_*) ; graphiques, comparateur et rapport annuel consomment
+ensuite des tableaux au lieu de reparcourir des listes de dictionnaires et de re-parser les dates.
+SnapshotStore s'appuie sur les seuls totaux et lit le détail d'un instantané quand on le demande.
+"""
+from datetime import date
+
+import numpy as np
+
+FREQUENCES = ('M', 'Q', 'A') # Fin (ou début) de mois, de trimestre, d'année
+
+def _en_date64(valeur):
+    return np.datetime64(valeur, 'D') if valeur is not None else None
+
+class HistorySeries:
+    """
+    dates   : tableau datetime64[D] trié, une entrée par instantané
+    net, actifs, passifs : tableaux float alignés sur dates
+    comptes : {nom du compte: tableau float}, NaN aux dates où le compte n'a pas de solde enregistré
+    classes : {classe d'actif: tableau float}, 0.0 aux dates où la classe est absente
+    """
+    def __init__(self, dates, net, actifs, passifs, comptes=None, classes=None):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.net = np.asarray(net, dtype=float)
+        self.actifs = np.asarray(actifs, dtype=float)
+        self.passifs = np.asarray(passifs, dtype=float)
+        self.comptes = comptes or {}
+        self.classes = classes or {}
+
+    @classmethod
+    def depuis_historique(cls, historique):
+        """Construit la série depuis la liste d'instantanés (dictionnaires) de l'application."""
+        historique = sorted((s for s in historique if s.get('date')), key=lambda s: s['date'])
+        n = len(historique)
+        comptes, classes = {}, {}
+        for i, snap in enumerate(historique):
+            for nom, solde in (snap.get('soldes_comptes') or {}).items():
+                if nom not in comptes:
+                    comptes[nom] = np.full(n, np.nan)
+                comptes[nom][i] = solde
+            for classe, montant in (snap.get('repartition_actifs_par_classe') or {}).items():
+                if classe not in classes:
+                    classes[classe] = np.zeros(n)
+                classes[classe][i] = montant
+        return cls([s['date'] for s in historique],
+                   [s.get('patrimoine_net') or 0.0 for s in historique],
+                   [s.get('total_actifs') or 0.0 for s in historique],
+                   [s.get('total_passifs_magnitude') or 0.0 for s in historique],
+                   comptes, classes)
+
+    @classmethod
+    def depuis_base(cls, data_manager, date_debut=None, date_fin=None, comptes=None, classes=True):
+        """
+        Construit la série par requêtes indexées sur les tables de l'historique.
+        :param comptes: noms des comptes à charger (None = tous, [] = aucun).
+        :param classes: charger aussi la répartition par classe d'actif.
+        """
+        totaux = data_manager.charger_totaux_historique(date_debut, date_fin)
+        dates = [row['date'] for row in totaux]
+        position = {d: i for i, d in enumerate(dates)}
+        n = len(dates)
+
+        colonnes_comptes = {}
+        if comptes is None or comptes:
+            for nom, serie in data_manager.historique_soldes_comptes(comptes, date_debut, date_fin).items():
+                colonne = np.full(n, np.nan)
+                for date_snapshot, solde in serie:
+                    if date_snapshot in position:
+                        colonne[position[date_snapshot]] = solde
+                colonnes_comptes[nom] = colonne
+
+        colonnes_classes = {}
+        if classes:
+            for date_snapshot, repartition in data_manager.repartition_par_classe(date_debut, date_fin).items():
+                if date_snapshot not in position: continue
+                for classe, montant in repartition.items():
+                    if classe not in colonnes_classes:
+                        colonnes_classes[classe] = np.zeros(n)
+                    colonnes_classes[classe][position[date_snapshot]] = montant
+
+        return cls(dates,
+                   [row['patrimoine_net'] or 0.0 for row in totaux],
+                   [row['total_actifs'] or 0.0 for row in totaux],
+                   [row['total_passifs_magnitude'] or 0.0 for row in totaux],
+                   colonnes_comptes, colonnes_classes)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _extraire(self, indices):
+        return HistorySeries(self.dates[indices], self.net[indices], self.actifs[indices], self.passifs[indices],
+                             {nom: col[indices] for nom, col in self.comptes.items()},
+                             {classe: col[indices] for classe, col in self.classes.items()})
+
+    def entre(self, date_debut=None, date_fin=None):
+        """Sous-série des instantanés compris entre les deux dates (incluses, 'YYYY-MM-DD' ou None)."""
+        debut = np.searchsorted(self.dates, _en_date64(date_debut), side='left') if date_debut else 0
+        fin = np.searchsorted(self.dates, _en_date64(date_fin), side='right') if date_fin else len(self.dates)
+        return self._extraire(slice(debut, fin))
+
+    def indices_par_periode(self, frequence='M', position='fin'):
+        """Indices du dernier (position='fin') ou du premier ('debut') instantané de chaque mois, trimestre ou année."""
+        if frequence not in FREQUENCES:
+            raise ValueError(f"Fréquence inconnue : {frequence} (attendu : {', '.join(FREQUENCES)})")
+        if not len(self.dates):
+            return np.array([], dtype=int)
+        mois = self.dates.astype('datetime64[M]').astype(np.int64)
+        periodes = {'M': mois, 'Q': mois // 3, 'A': mois // 12}[frequence]
+        changements = periodes[1:] != periodes[:-1]
+        if position == 'debut':
+            return np.flatnonzero(np.r_[True, changements])
+        return np.flatnonzero(np.r_[changements, True])
+
+    def reechantillonner(self, frequence='M', position='fin'):
+        """Un instantané par période : fin de mois ('M'), de trimestre ('Q') ou d'année ('A')."""
+        return self._extraire(self.indices_par_periode(frequence, position))
+
+    def periodes(self, frequence='M'):
+        """Clés de période des instantanés : 'YYYY-MM' pour 'M', 'YYYY-Tn' pour 'Q', 'YYYY' pour 'A'."""
+        mois = self.dates.astype('datetime64[M]')
+        if frequence == 'M':
+            return mois.astype(str)
+        annees = self.dates.astype('datetime64[Y]').astype(str)
+        if frequence == 'A':
+            return annees
+        trimestres = mois.astype(np.int64) % 12 // 3 + 1
+        return np.char.add(np.char.add(annees, '-T'), trimestres.astype(str))
+
+    def variations(self, colonne='net', valeur_initiale=None):
+        """Écart de chaque instantané avec le précédent. Le premier est comparé à valeur_initiale (0 si None)."""
+        valeurs = self.colonne(colonne)
+        return np.diff(valeurs, prepend=valeur_initiale if valeur_initiale is not None else 0.0)
+
+    def colonne(self, nom):
+        """Colonne 'net', 'actifs', 'passifs', ou le solde d'un compte, ou le montant d'une classe d'actif."""
+        if nom in ('net', 'actifs', 'passifs'):
+            return getattr(self, nom)
+        if nom in self.comptes:
+            return self.comptes[nom]
+        if nom in self.classes:
+            return self.classes[nom]
+        return np.zeros(len(self.dates))
+
+    def index_de(self, date_snapshot):
+        """Position de l'instantané de cette date exacte, ou None."""
+        cible = _en_date64(date_snapshot)
+        i = int(np.searchsorted(self.dates, cible))
+        return i if i < len(self.dates) and self.dates[i] == cible else None
+
+    def instantane(self, i):
+        """L'instantané d'indice i sous la forme de dictionnaire utilisée par le reste de l'application."""
+        return {
+            'date': str(self.dates[i]),
+            'patrimoine_net': float(self.net[i]),
+            'total_actifs': float(self.actifs[i]),
+            'total_passifs_magnitude': float(self.passifs[i]),
+            'soldes_comptes': {nom: float(col[i]) for nom, col in self.comptes.items() if not np.isnan(col[i])},
+            'repartition_actifs_par_classe': {classe: float(col[i]) for classe, col in self.classes.items() if col[i] != 0},
+        }
+
+    def difference(self, i, j):
+        """Écarts (j - i) entre deux instantanés pour toutes les colonnes : {'net': .., 'comptes': {..}, 'classes': {..}}."""
+        return {
+            'net': float(self.net[j] - self.net[i]),
+            'actifs': float(self.actifs[j] - self.actifs[i]),
+            'passifs': float(self.passifs[j] - self.passifs[i]),
+            'comptes': {nom: float(np.nan_to_num(col[j]) - np.nan_to_num(col[i])) for nom, col in self.comptes.items()},
+            'classes': {classe: float(col[j] - col[i]) for classe, col in self.classes.items()},
+        }
+
+class SnapshotStore:
+    """
+    Instantanés indexés par date et chargés à la demande. À l'ouverture, seuls les totaux sont lus (une HistorySeries
+    sans colonnes de comptes) ; les soldes et la répartition d'une date sont lus à la première demande
+    (details_snapshot, par la clé primaire) puis gardés. Pour une date sans instantané, instantane_au() estime
+    un instantané virtuel (voir instantane_virtuel).
+    comptes : les comptes actuels (type, classe d'actif et solde, qui sert d'état final après le dernier instantané).
+    """
+    def __init__(self, data_manager, comptes):
+        self.data_manager = data_manager
+        self.comptes = {c.nom: c for c in comptes}
+        self.totaux = HistorySeries.depuis_base(data_manager, comptes=[], classes=False)
+        self._details = {}
+
+    def __len__(self):
+        return len(self.totaux)
+
+    def dates(self):
+        """Dates ISO des instantanés enregistrés, triées."""
+        return self.totaux.dates.astype(str).tolist()
+
+    def fins_de_periode(self, frequence='A'):
+        """Dates du dernier instantané de chaque mois ('M'), trimestre ('Q') ou année ('A')."""
+        return self.totaux.dates[self.totaux.indices_par_periode(frequence, 'fin')].astype(str).tolist()
+
+    def _instantane_indice(self, i):
+        date_snapshot = str(self.totaux.dates[i])
+        if date_snapshot not in self._details:
+            self._details[date_snapshot] = self.data_manager.details_snapshot(date_snapshot)
+        details = self._details[date_snapshot]
+        return {
+            'date': date_snapshot,
+            'patrimoine_net': float(self.totaux.net[i]),
+            'total_actifs': float(self.totaux.actifs[i]),
+            'total_passifs_magnitude': float(self.totaux.passifs[i]),
+            'soldes_comptes': dict(details['soldes_comptes']),
+            'repartition_actifs_par_classe': dict(details['repartition_actifs_par_classe']),
+        }
+
+    def instantane(self, date_snapshot):
+        """L'instantané enregistré à cette date exacte, ou None."""
+        i = self.totaux.index_de(date_snapshot)
+        return self._instantane_indice(i) if i is not None else None
+
+    def instantane_au(self, jour):
+        """L'instantané enregistré à cette date, sinon un instantané virtuel (None avant le premier instantané)."""
+        return self.instantane(jour) or self.instantane_virtuel(jour)
+
+    def instantane_virtuel(self, jour):
+        """
+        Estimation des soldes au jour donné (ISO), marqué 'virtuel': True. Chaque solde part de l'instantané
+        précédent et reçoit les transactions pointées du compte jusqu'au jour (les prévisions non pointées
+        n'ont pas encore modifié les soldes). Ce que les transactions n'expliquent pas
+        jusqu'à l'instantané suivant (valorisation des titres au fil des cours, amortissement d'un emprunt...)
+        est réparti linéairement dans le temps. Après le dernier instantané, les soldes actuels des comptes
+        servent d'état final, datés d'aujourd'hui. Retourne None avant le premier instantané.
+        """
+        cible = np.datetime64(jour, 'D')
+        i = int(np.searchsorted(self.totaux.dates, cible, side='right')) - 1
+        if i < 0:
+            return None
+        precedent = self._instantane_indice(i)
+        if i + 1 < len(self.totaux):
+            suivant = self._instantane_indice(i + 1)
+        elif cible < np.datetime64(date.today(), 'D'):
+            suivant = {'date': date.today().isoformat(), 'soldes_comptes': {nom: c.solde for nom, c in self.comptes.items()}}
+        else:
+            suivant = None
+
+        flux_au_jour = self.data_manager.flux_par_compte(precedent['date'], str(cible), pointees_seulement=True)
+        soldes = dict(precedent['soldes_comptes'])
+        noms = set(soldes) | (set(suivant['soldes_comptes']) if suivant else set())
+        if suivant:
+            flux_periode = self.data_manager.flux_par_compte(precedent['date'], suivant['date'], pointees_seulement=True)
+            debut = np.datetime64(precedent['date'], 'D')
+            fraction = float((cible - debut) / (np.datetime64(suivant['date'], 'D') - debut))
+        for nom in noms:
+            compte = self.comptes.get(nom)
+            # Les passifs sont enregistrés en valeur absolue : une transaction (impact sur le patrimoine) les réduit
+            signe = -1.0 if compte is not None and compte.type_compte == 'Passif' else 1.0
+            solde = soldes.get(nom, 0.0) + signe * flux_au_jour.get(nom, 0.0)
+            if suivant:
+                inexplique = suivant['soldes_comptes'].get(nom, 0.0) - soldes.get(nom, 0.0) - signe * flux_periode.get(nom, 0.0)
+                solde += fraction * inexplique
+            soldes[nom] = solde
+
+        total_actifs, total_passifs, repartition = 0.0, 0.0, {}
+        for nom, solde in soldes.items():
+            compte = self.comptes.get(nom)
+            if compte is not None and compte.type_compte == 'Passif':
+                total_passifs += abs(solde)
+                continue
+            total_actifs += solde
+            classe = compte.classe_actif if compte is not None else None
+            if classe and classe not in ["N/A", "Non Renseigné"]:
+                repartition[classe] = repartition.get(classe, 0.0) + solde
+        return {
+            'date': str(cible),
+            'virtuel': True,
+            'patrimoine_net': total_actifs - total_passifs,
+            'total_actifs': total_actifs,
+            'total_passifs_magnitude': total_passifs,
+            'soldes_comptes': soldes,
+            'repartition_actifs_par_classe': repartition,
+        }
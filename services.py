@@ -3,33 +3,86 @@ import sqlite3
 import json
 import os
 import shutil
-from tkinter import messagebox
+import pickle
+from tkinter import messagebox, ttk
 import traceback
+import threading
 from datetime import date, datetime, timedelta
 from collections import defaultdict
+import functools
 
-# Imports pour les graphiques
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import numpy as np
 
 # Imports depuis nos propres modules
-from models import Compte, LignePortefeuille
+from models import Compte, LignePortefeuille, Transaction
+from frame_transactions import TransactionFrame
 from utils import format_nombre_fr
+from journalisation import get_logger
+
+log = get_logger('services')
+
+def _graphique_differe(nom):
+    """Décore une méthode de dessin de GraphManager : elle ne s'exécute que si le graphique 'nom' est visible,
+    sinon seul le dernier appel est mémorisé et rejoué par afficher_en_attente()."""
+    def decorateur(methode):
+        @functools.wraps(methode)
+        def enveloppe(self, *args):
+            if not self.est_visible(nom):
+                self.en_attente[nom] = (enveloppe, args)
+                return
+            self.en_attente.pop(nom, None)
+            if self._preparer(nom):
+                methode(self, *args)
+        return enveloppe
+    return decorateur
 
 class GraphManager:
     """
     Gère la création et la mise à jour de tous les graphiques Matplotlib.
+    Matplotlib n'est importé, et chaque figure créée, qu'au premier affichage de son onglet :
+    une mise à jour demandée pour un onglet masqué est mise en attente jusqu'à ce qu'il soit affiché.
     """
-    def __init__(self, figures_axes_canvases):
+    def __init__(self, conteneurs, est_visible=None):
         """
-        Initialise le manager avec les objets matplotlib nécessaires.
-        :param figures_axes_canvases: Un dictionnaire contenant les figures, axes et canvas.
-        Exemple: {'camembert_classe': {'fig': fig_obj, 'ax': ax_obj, 'canvas': canvas_obj}, ...}
+        :param conteneurs: Un dictionnaire {nom du graphique: widget Tk qui accueillera le canvas}.
+        Exemple: {'camembert_classe': tab_frame, 'historique_perso': graph_frame, ...}
+        :param est_visible: Fonction nom -> bool indiquant si le graphique est actuellement affiché.
+        Sans elle, tous les graphiques sont considérés visibles.
         """
-        self.figs = {key: value['fig'] for key, value in figures_axes_canvases.items()}
-        self.axes = {key: value['ax'] for key, value in figures_axes_canvases.items()}
-        self.canvases = {key: value['canvas'] for key, value in figures_axes_canvases.items()}
+        self.conteneurs = conteneurs
+        self.est_visible = est_visible or (lambda nom: True)
+        self.figs, self.axes, self.canvases = {}, {}, {}
+        self.indisponibles = set()
+        self.en_attente = {}
+
+    def _preparer(self, nom):
+        """Crée la figure du graphique au premier usage. Retourne False si la création a échoué."""
+        if nom in self.figs:
+            return True
+        if nom in self.indisponibles:
+            return False
+        try:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            fig = Figure(dpi=100)
+            ax = fig.add_subplot(111)
+            canvas = FigureCanvasTkAgg(fig, master=self.conteneurs[nom])
+            canvas.get_tk_widget().pack(side='top', fill='both', expand=True)
+        except Exception as e:
+            log.error("Création du graphique '%s' impossible : %s", nom, e)
+            self.indisponibles.add(nom)
+            ttk.Label(self.conteneurs[nom], text="Graphique indisponible.").pack(padx=20, pady=50)
+            return False
+        self.figs[nom], self.axes[nom], self.canvases[nom] = fig, ax, canvas
+        return True
+
+    def afficher_en_attente(self):
+        """Exécute les mises à jour en attente des graphiques devenus visibles (à appeler au changement d'onglet)."""
+        for nom in [n for n in self.en_attente if self.est_visible(n)]:
+            methode, args = self.en_attente.pop(nom)
+            methode(self, *args)
 
+    @_graphique_differe('camembert_classe')
     def update_camembert_classe(self, comptes):
         ax = self.axes['camembert_classe']
         fig = self.figs['camembert_classe']
@@ -56,6 +109,7 @@ class GraphManager:
         fig.tight_layout()
         canvas.draw()
 
+    @_graphique_differe('banque')
     def update_camembert_banque(self, comptes):
         ax = self.axes['banque']
         fig = self.figs['banque']
@@ -80,24 +134,22 @@ class GraphManager:
         fig.tight_layout()
         canvas.draw()
 
-    def update_historique_patrimoine(self, historique):
+    @_graphique_differe('historique')
+    def update_historique_patrimoine(self, series):
+        """:param series: HistorySeries de l'historique du patrimoine."""
         ax = self.axes['historique']
         fig = self.figs['historique']
         canvas = self.canvases['historique']
         ax.clear()
 
-        if not historique:
+        if not len(series):
             ax.text(0.5, 0.5, "Pas de données d'historique.", ha='center', va='center')
         else:
-            dates_dt = [datetime.strptime(s['date'], "%Y-%m-%d") for s in historique]
-            net = [s.get('patrimoine_net', 0) for s in historique]
-            actifs = [s.get('total_actifs', 0) for s in historique]
-            passifs = [s.get('total_passifs_magnitude', 0) for s in historique]
-            
-            ax.plot(dates_dt, net, marker='o', linestyle='-', label='Patrimoine Net')
-            ax.plot(dates_dt, actifs, marker='^', linestyle='--', label='Total Actifs')
-            ax.plot(dates_dt, passifs, marker='s', linestyle=':', label='Total Passifs')
+            ax.plot(series.dates, series.net, marker='o', linestyle='-', label='Patrimoine Net')
+            ax.plot(series.dates, series.actifs, marker='^', linestyle='--', label='Total Actifs')
+            ax.plot(series.dates, series.passifs, marker='s', linestyle=':', label='Total Passifs')
             
+            import matplotlib.dates as mdates
             ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
             fig.autofmt_xdate(rotation=45, ha='right')
             ax.set_title("Évolution du Patrimoine")
@@ -107,63 +159,66 @@ class GraphManager:
         fig.tight_layout()
         canvas.draw()
 
-    def update_historique_personnalise(self, historique, comptes_selectionnes):
+    @_graphique_differe('historique_perso')
+    def update_historique_personnalise(self, series):
+        """:param series: HistorySeries limitée aux comptes sélectionnés (NaN aux dates sans solde enregistré)."""
         ax = self.axes['historique_perso']
         fig = self.figs['historique_perso']
         canvas = self.canvases['historique_perso']
         ax.clear()
 
-        if not historique or not comptes_selectionnes:
+        if not series.comptes:
             ax.text(0.5, 0.5, "Veuillez sélectionner au moins un compte.", ha='center', va='center')
+        elif all(np.isnan(soldes).all() for soldes in series.comptes.values()):
+            ax.text(0.5, 0.5, "Aucun historique détaillé trouvé\npour les comptes sélectionnés.", ha='center', va='center')
         else:
-            soldes_par_compte = {compte: [] for compte in comptes_selectionnes}
-            dates_dt = []
-            
-            for snapshot in historique:
-                if 'soldes_comptes' not in snapshot:
-                    continue
-
-                dates_dt.append(datetime.strptime(snapshot['date'], "%Y-%m-%d"))
-                
-                for nom_compte in comptes_selectionnes:
-                    solde_du_jour = snapshot['soldes_comptes'].get(nom_compte, 0.0)
-                    soldes_par_compte[nom_compte].append(solde_du_jour)
-
-            if not dates_dt:
-                ax.text(0.5, 0.5, "Aucun historique détaillé trouvé\npour les comptes sélectionnés.", ha='center', va='center')
-            else:
-                for nom_compte, soldes in soldes_par_compte.items():
-                    ax.plot(dates_dt, soldes, marker='.', linestyle='-', label=nom_compte)
-            
-                ax.legend()
+            for nom_compte, soldes in series.comptes.items():
+                presents = ~np.isnan(soldes)
+                if presents.any():
+                    ax.plot(series.dates[presents], soldes[presents], marker='.', linestyle='-', label=nom_compte)
+            ax.legend()
             
         ax.set_title("Évolution des Comptes Sélectionnés")
         ax.grid(True, linestyle='--', alpha=0.6)
+        import matplotlib.dates as mdates
         ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
         fig.autofmt_xdate(rotation=30, ha='right')
         fig.tight_layout()
         canvas.draw()
         
     def update_all_budget_graphs(self, donnees_du_mois, annee, mois):
-        """Met à jour les 4 graphiques de l'onglet budget."""
-        transactions = donnees_du_mois.get('transactions', [])
+        """Met à jour les 4 graphiques de l'onglet budget.
+        donnees_du_mois contient 'rollup' (agrégats mensuels de la base), 'frame' (TransactionFrame, masque du mois)
+        ou la liste brute des 'transactions'."""
         categories_prevues = donnees_du_mois.get('categories_prevues', [])
+        if 'rollup' in donnees_du_mois:
+            depenses_par_cat, recettes_par_cat, realise_par_cat = self._agreger_rollup(donnees_du_mois['rollup'])
+        elif 'frame' in donnees_du_mois:
+            frame, masque = donnees_du_mois['frame']
+            depenses_par_cat, recettes_par_cat, realise_par_cat = frame.depenses_recettes_par_categorie(masque)
+        else:
+            depenses_par_cat, recettes_par_cat, realise_par_cat = TransactionFrame(donnees_du_mois.get('transactions', [])).depenses_recettes_par_categorie()
         
-        self._update_depenses_pie(transactions, annee, mois)
-        self._update_recettes_pie(transactions, annee, mois)
-        self._update_budget_vs_realise_bar(transactions, categories_prevues)
+        self._update_depenses_pie(depenses_par_cat, annee, mois)
+        self._update_recettes_pie(recettes_par_cat, annee, mois)
+        self._update_budget_vs_realise_bar(realise_par_cat, categories_prevues)
+
+    def _agreger_rollup(self, rollup):
+        depenses_par_cat, recettes_par_cat, realise_par_cat = defaultdict(float), defaultdict(float), defaultdict(float)
+        for row in rollup:
+            if row['categorie'] == "(Virement)": continue
+            realise_par_cat[row['categorie']] += row['somme']
+            if row['signe'] < 0: depenses_par_cat[row['categorie']] += abs(row['somme'])
+            elif row['somme'] > 0: recettes_par_cat[row['categorie']] += row['somme']
+        return depenses_par_cat, recettes_par_cat, realise_par_cat
 
-    def _update_depenses_pie(self, transactions, annee, mois):
+    @_graphique_differe('depenses')
+    def _update_depenses_pie(self, depenses_par_cat, annee, mois):
         ax = self.axes['depenses']
         fig = self.figs['depenses']
         canvas = self.canvases['depenses']
         ax.clear()
         
-        depenses_par_cat = defaultdict(float)
-        for t in transactions:
-            if t['montant'] < 0 and t['categorie'] != "(Virement)":
-                depenses_par_cat[t['categorie']] += abs(t['montant'])
-        
         if depenses_par_cat:
             ax.pie(depenses_par_cat.values(), labels=depenses_par_cat.keys(), autopct='%1.1f%%', startangle=90)
             ax.set_title(f"Dépenses de {mois:02}/{annee}")
@@ -173,17 +228,13 @@ class GraphManager:
         fig.tight_layout()
         canvas.draw()
 
-    def _update_recettes_pie(self, transactions, annee, mois):
+    @_graphique_differe('recettes')
+    def _update_recettes_pie(self, recettes_par_cat, annee, mois):
         ax = self.axes['recettes']
         fig = self.figs['recettes']
         canvas = self.canvases['recettes']
         ax.clear()
         
-        recettes_par_cat = defaultdict(float)
-        for t in transactions:
-            if t['montant'] > 0 and t['categorie'] != "(Virement)":
-                recettes_par_cat[t['categorie']] += t['montant']
-
         if recettes_par_cat:
             ax.pie(recettes_par_cat.values(), labels=recettes_par_cat.keys(), autopct='%1.1f%%', startangle=90)
             ax.set_title(f"Recettes de {mois:02}/{annee}")
@@ -193,17 +244,13 @@ class GraphManager:
         fig.tight_layout()
         canvas.draw()
 
-    def _update_budget_vs_realise_bar(self, transactions, categories_prevues):
+    @_graphique_differe('vs')
+    def _update_budget_vs_realise_bar(self, realise_par_cat, categories_prevues):
         ax = self.axes['vs']
         fig = self.figs['vs']
         canvas = self.canvases['vs']
         ax.clear()
         
-        realise_par_cat = defaultdict(float)
-        for t in transactions:
-            if t['categorie'] != "(Virement)":
-                realise_par_cat[t['categorie']] += t['montant']
-
         depenses_budget = sorted([c for c in categories_prevues if c['type'] == 'Dépense' and c['prevu'] > 0], key=lambda x: x['prevu'], reverse=True)[:7]
         
         if depenses_budget:
@@ -226,6 +273,7 @@ class GraphManager:
         fig.tight_layout()
         canvas.draw()
 
+    @_graphique_differe('evolution')
     def update_evolution_line(self, dates, evolution_par_compte):
             """Dessine le graphique d'évolution avec une courbe par compte."""
             ax = self.axes['evolution']
@@ -240,6 +288,7 @@ class GraphManager:
                     ax.plot(dates, soldes, marker='.', linestyle='-', label=nom_compte)
 
                 ax.axhline(0, color='r', linestyle='--', linewidth=0.8)
+                import matplotlib.dates as mdates
                 ax.xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
                 fig.autofmt_xdate()
                 ax.grid(True, linestyle='--', alpha=0.6)
@@ -249,18 +298,159 @@ class GraphManager:
             fig.tight_layout()
             canvas.draw()
 
+DELAI_VERROU_SECONDES = 10 # Attente maximale d'un verrou d'écriture tenu par une autre connexion
+FORMAT_CACHE_DEMARRAGE = 2 # À incrémenter si la structure des objets mis en cache (Compte, budget...) change
+
+# Rétention de l'historique du patrimoine (surchargée par la clé 'retention_historique' de settings.json) :
+# tous les instantanés des derniers jours, puis le premier et le dernier de chaque mois,
+# puis, au-delà de 'mois_premier_dernier' mois, le premier et le dernier de chaque trimestre.
+POLITIQUE_RETENTION_DEFAUT = {
+    'jours_quotidiens': 31,
+    'mois_premier_dernier': 60,
+}
+
+def _mois_entre(debut, fin):
+    """Clés 'YYYY-MM' de tous les mois entre deux dates ISO (dans un sens ou dans l'autre), bornes incluses."""
+    debut, fin = sorted((debut[:7], fin[:7]))
+    annee, mois = int(debut[:4]), int(debut[5:7])
+    while f"{annee:04d}-{mois:02d}" <= fin:
+        yield f"{annee:04d}-{mois:02d}"
+        annee, mois = (annee + 1, 1) if mois == 12 else (annee, mois + 1)
+
+def _mois_suivant(cle_mois):
+    annee, mois = int(cle_mois[:4]), int(cle_mois[5:7])
+    return f"{annee + 1:04d}-01" if mois == 12 else f"{annee:04d}-{mois + 1:02d}"
+
+SQL_INSERT_TRANSACTION = """
+    INSERT INTO transactions 
+    (id, date, description, montant, categorie, compte_affecte, pointe, virement_id, origine, id_recurrence, date_budgetaire) 
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _valeurs_transaction(trans):
+    """Paramètres de SQL_INSERT_TRANSACTION pour une transaction du budget."""
+    return (
+        trans.get('id'), trans.get('date'), trans.get('description'), trans.get('montant'), 
+        trans.get('categorie'), trans.get('compte_affecte'), int(trans.get('pointe', False)), 
+        trans.get('virement_id'), trans.get('origine'), trans.get('id_recurrence'),
+        trans.get('date_budgetaire')
+    )
+
+# Expressions SQL de la clé d'agrégation mensuelle ({t} = préfixe 'NEW.'/'OLD.' dans les triggers)
+ROLLUP_MOIS = "substr(COALESCE(NULLIF({t}date_budgetaire, ''), {t}date), 1, 7)"
+ROLLUP_SIGNE = "(CASE WHEN {t}montant < 0 THEN -1 ELSE 1 END)"
+
+# Condition des triggers d'agrégats ('monthly_rollup', 'categories') : suspendus pendant les écritures en masse, dont les agrégats sont
+# corrigés d'un bloc ensuite (voir _renommer_transactions_en_masse, archiver_budget, sauvegarder_budget_donnees)
+SQL_AGREGATS_ACTIFS = "WHEN NOT EXISTS (SELECT 1 FROM meta_agregats_suspendus)"
+
+OPERATIONS_CATEGORIES_ANNULABLES = 20 # Fusions / renommages de catégories conservés dans le journal d'annulation
+
+# Tables qui référencent une catégorie par son nom : (table, compteur dans 'categories', la table porte un type Dépense/Revenu)
+TABLES_CATEGORIES = (
+    ('transactions', 'nb_transactions', False),
+    ('categories_prevues', 'nb_prevues', True),
+    ('budget_template_categories', 'nb_modeles', True),
+    ('transactions_recurrentes', 'nb_recurrences', False),
+)
+
+# Pas (en mois) des périodicités dont le générateur cale les occurrences sur le mois de date_debut
+MOIS_PAR_PERIODICITE = {'Mensuelle': 1, 'Trimestrielle': 3, 'Tous les 4 mois': 4, 'Semestrielle': 6, 'Annuelle': 12}
+
+def _avancer_debut_regle(date_debut, periodicite, date_limite):
+    """Nouvelle date de début d'une règle en cours après archivage jusqu'à date_limite (chaînes ISO).
+
+    Le début est avancé d'un nombre entier de périodes jusqu'au premier mois d'échéance
+    >= mois de date_limite : la phase des règles trimestrielles, semestrielles ou annuelles
+    est conservée. Si ce mois est celui de date_limite, on repart de date_limite.
+    Les règles sans phase mensuelle (hebdomadaire, bi-mensuelle) repartent de date_limite.
+    """
+    pas = MOIS_PAR_PERIODICITE.get(periodicite or 'Mensuelle')
+    if pas is None:
+        return date_limite
+    try:
+        debut = datetime.strptime(date_debut, "%Y-%m-%d").date()
+        limite = datetime.strptime(date_limite, "%Y-%m-%d").date()
+    except (ValueError, TypeError):
+        return date_limite
+    index_debut = debut.year * 12 + debut.month - 1
+    index_limite = limite.year * 12 + limite.month - 1
+    index_cible = index_debut + -(-(index_limite - index_debut) // pas) * pas
+    if index_cible == index_limite:
+        return date_limite
+    return date(index_cible // 12, index_cible % 12 + 1, 1).strftime("%Y-%m-%d")
+
+class ConflitDeVersion(Exception):
+    """Levée quand une écriture conditionnelle trouve une version de la base différente de celle attendue."""
+    def __init__(self, version_attendue, version_actuelle):
+        super().__init__(f"Les données ont été modifiées entre-temps (version {version_actuelle}, attendue {version_attendue}).")
+        self.version_attendue = version_attendue
+        self.version_actuelle = version_actuelle
+
 class SqlDataManager:
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, connexion_par_thread=False):
+        """
+        :param connexion_par_thread: si True (serveur web multi-thread / multi-processus), chaque thread de
+            chaque processus réutilise sa propre connexion au lieu d'en ouvrir une à chaque appel.
+        """
         self.db_path = db_path
+        self.connexion_par_thread = connexion_par_thread
+        self._local = threading.local()
+        self.erreur_chargement = False
+        # Version de la base à laquelle correspondent les données chargées par ce gestionnaire : elle suit ses propres
+        # écritures tant qu'aucune autre connexion (application web...) n'a écrit entre-temps (voir _incrementer_version)
+        self.version_chargee = None
         self._creer_schema_si_necessaire()
 
     def _get_connection(self):
-        """Crée et retourne une connexion à la base de données."""
-        con = sqlite3.connect(self.db_path)
+        """Crée et retourne une connexion à la base de données (ou celle du thread courant en mode connexion_par_thread)."""
+        if self.connexion_par_thread:
+            con = getattr(self._local, 'connexion', None)
+            # Après un fork (workers gunicorn), une connexion héritée du processus parent ne doit pas être réutilisée
+            if con is not None and self._local.pid == os.getpid():
+                return con
+        con = sqlite3.connect(self.db_path, timeout=DELAI_VERROU_SECONDES)
         con.row_factory = sqlite3.Row
+        if self.connexion_par_thread:
+            con.execute(f"PRAGMA busy_timeout = {int(DELAI_VERROU_SECONDES * 1000)}")
+            self._local.connexion, self._local.pid = con, os.getpid()
         return con
 
+    def activer_mode_concurrent(self):
+        """Passe la base en journal WAL : les lectures des workers web ne sont plus bloquées par une écriture."""
+        with self._get_connection() as con:
+            mode = con.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        log.info("Mode de journalisation SQLite : %s", mode)
+        return mode
+
+    def ecrire_si_version(self, version_attendue, ecriture, avec_archive=False):
+        """
+        Exécute ecriture(cursor) dans une transaction exclusive si la version de la base vaut encore
+        version_attendue (concurrence optimiste), puis incrémente la version. Lève ConflitDeVersion sinon.
+        Si version_attendue est None, l'écriture est faite sans contrôle. Retourne le résultat de ecriture.
+        :param avec_archive: attache la base d'archive (schéma 'archive', créée au besoin) le temps de l'écriture.
+        """
+        con = self._get_connection()
+        if avec_archive:
+            con.execute("ATTACH DATABASE ? AS archive", (self.chemin_archive(),))
+        try:
+            cursor = con.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            version_actuelle = cursor.execute("SELECT version FROM meta_version WHERE id = 1").fetchone()[0]
+            if version_attendue is not None and version_actuelle != version_attendue:
+                raise ConflitDeVersion(version_attendue, version_actuelle)
+            resultat = ecriture(cursor)
+            self._incrementer_version(cursor)
+            con.commit()
+            return resultat
+        except Exception:
+            con.rollback()
+            raise
+        finally:
+            if avec_archive:
+                con.execute("DETACH DATABASE archive")
+
     def _creer_schema_si_necessaire(self):
         """S'assure que toutes les tables nécessaires existent et que leur schéma est à jour."""
         try:
@@ -268,7 +458,7 @@ class SqlDataManager:
                 cursor = con.cursor()
                 
                 # --- ÉTAPE A : On crée TOUTES les tables si elles n'existent pas ---
-                print("INFO: Création des tables si nécessaire...")
+                log.debug("Création des tables si nécessaire...")
                 cursor.execute("""
                 CREATE TABLE IF NOT EXISTS comptes (
                     id INTEGER PRIMARY KEY AUTOINCREMENT, nom TEXT NOT NULL, banque TEXT, type_compte TEXT,
@@ -291,74 +481,750 @@ class SqlDataManager:
                         FOREIGN KEY("compte_id") REFERENCES "comptes"("id") ON DELETE CASCADE
                     )""")
 
+                # Instantanés normalisés : un solde par (date, compte) et un montant par (date, classe d'actif)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS snapshot_balances (
+                        date TEXT NOT NULL, compte_nom TEXT NOT NULL, compte_id INTEGER, solde REAL NOT NULL,
+                        PRIMARY KEY (date, compte_nom)
+                    ) WITHOUT ROWID""")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_balances_compte ON snapshot_balances (compte_nom, date)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_balances_compte_id ON snapshot_balances (compte_id, date)")
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS snapshot_classes (
+                        date TEXT NOT NULL, classe TEXT NOT NULL, montant REAL NOT NULL,
+                        PRIMARY KEY (date, classe)
+                    ) WITHOUT ROWID""")
+                # Supprimer un instantané supprime ses détails (les INSERT OR REPLACE ne déclenchent pas ce trigger)
+                cursor.execute("""
+                    CREATE TRIGGER IF NOT EXISTS trg_historique_delete AFTER DELETE ON historique_patrimoine BEGIN
+                        DELETE FROM snapshot_balances WHERE date = OLD.date;
+                        DELETE FROM snapshot_classes WHERE date = OLD.date;
+                    END""")
+                # Bornes de la dernière application de la politique de rétention (pour un traitement incrémental)
+                cursor.execute("CREATE TABLE IF NOT EXISTS meta_retention (id INTEGER PRIMARY KEY CHECK (id = 1), limite_quotidienne TEXT, limite_mensuelle TEXT)")
+
+                # Index pour les lectures par mois (API paginée, purge)
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date, id)")
+                # Index pour les fusions / renommages de catégories
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_categorie ON transactions (categorie)")
+                # Index pour l'archivage des mois de budget anciens
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_categories_prevues_mois ON categories_prevues (cle_mois_annee)")
+
+                # Journal d'annulation des fusions et renommages de catégories
+                cursor.execute("CREATE TABLE IF NOT EXISTS journal_operations_categories (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, type TEXT NOT NULL, sources TEXT NOT NULL, destination TEXT NOT NULL, compteurs TEXT, annulee INTEGER NOT NULL DEFAULT 0)")
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS journal_lignes_categories (
+                        operation_id INTEGER NOT NULL, table_nom TEXT NOT NULL, ligne_id TEXT NOT NULL,
+                        ancienne_categorie TEXT, donnees_json TEXT,
+                        PRIMARY KEY (operation_id, table_nom, ligne_id)
+                    ) WITHOUT ROWID""")
+
+                # Empreintes (date, montant, libellé normalisé, compte) des opérations, pour l'import de relevés sans doublons
+                cursor.execute("CREATE TABLE IF NOT EXISTS empreintes_transactions (transaction_id TEXT PRIMARY KEY, empreinte TEXT NOT NULL) WITHOUT ROWID")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_empreintes_empreinte ON empreintes_transactions (empreinte)")
+
+                # Compteur de modifications : incrémenté à chaque écriture, il sert à invalider les caches
+                cursor.execute("CREATE TABLE IF NOT EXISTS meta_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL DEFAULT 0)")
+                # Tant qu'elle contient une ligne, les triggers de mise à jour des transactions ne maintiennent pas les agrégats :
+                # les opérations en masse (fusion de catégories) les corrigent elles-mêmes en une requête
+                cursor.execute("CREATE TABLE IF NOT EXISTS meta_agregats_suspendus (id INTEGER PRIMARY KEY CHECK (id = 1))")
+                self._supprimer_triggers_obsoletes(cursor)
+                cursor.execute("INSERT OR IGNORE INTO meta_version (id, version) VALUES (1, 0)")
+                # Identifiant aléatoire de la base : le cache de démarrage d'une autre base (copie remplacée,
+                # sauvegarde restaurée) n'est pas repris même si son compteur de modifications coïncide
+                cursor.execute("PRAGMA table_info(meta_version)")
+                if 'identifiant' not in [row['name'] for row in cursor.fetchall()]:
+                    cursor.execute("ALTER TABLE meta_version ADD COLUMN identifiant TEXT")
+                cursor.execute("UPDATE meta_version SET identifiant = lower(hex(randomblob(16))) WHERE id = 1 AND identifiant IS NULL")
+
+                # Agrégats mensuels (mois budgétaire, catégorie, compte, signe), tenus à jour par des triggers
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='monthly_rollup'")
+                rollup_a_initialiser = cursor.fetchone() is None
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS monthly_rollup (
+                        mois TEXT NOT NULL, categorie TEXT NOT NULL, compte TEXT NOT NULL, signe INTEGER NOT NULL,
+                        somme REAL NOT NULL DEFAULT 0, nombre INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (mois, categorie, compte, signe)
+                    ) WITHOUT ROWID""")
+                self._creer_triggers_rollup(cursor)
+                if rollup_a_initialiser:
+                    self._remplir_rollup(cursor)
+                    log.info("Table 'monthly_rollup' initialisée (%s agrégats).", cursor.rowcount)
+
+                # Dictionnaire des catégories : identifiant, type et nombre d'utilisations, tenus à jour par des triggers
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='categories'")
+                categories_a_initialiser = cursor.fetchone() is None
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS categories (
+                        id INTEGER PRIMARY KEY, nom TEXT NOT NULL UNIQUE, type TEXT,
+                        nb_transactions INTEGER NOT NULL DEFAULT 0, nb_prevues INTEGER NOT NULL DEFAULT 0,
+                        nb_modeles INTEGER NOT NULL DEFAULT 0, nb_recurrences INTEGER NOT NULL DEFAULT 0
+                    )""")
+                # Chaque table qui nomme une catégorie la référence aussi par son id (le nom reste la donnée de l'application)
+                categories_a_lier = False
+                for table, _, _ in TABLES_CATEGORIES:
+                    cursor.execute(f"PRAGMA table_info({table})")
+                    if 'categorie_id' not in [row['name'] for row in cursor.fetchall()]:
+                        cursor.execute(f"ALTER TABLE {table} ADD COLUMN categorie_id INTEGER REFERENCES categories (id)")
+                        categories_a_lier = True
+                self._creer_triggers_categories(cursor)
+                if categories_a_initialiser:
+                    self._recompter_categories(cursor)
+                    log.info("Table 'categories' initialisée (%s catégories).", cursor.execute("SELECT COUNT(*) FROM categories").fetchone()[0])
+                elif categories_a_lier:
+                    self._lier_categories(cursor)
+                    log.info("Colonne 'categorie_id' ajoutée et renseignée.")
+
                 # --- ÉTAPE B : On effectue les migrations sur les tables maintenant qu'on est sûr qu'elles existent ---
-                print("INFO: Vérification des migrations de schéma...")
+                log.debug("Vérification des migrations de schéma...")
                 
                 # Migration pour la colonne 'dernier_cours'
                 cursor.execute("PRAGMA table_info(lignes_portefeuille)")
                 if 'dernier_cours' not in [row['name'] for row in cursor.fetchall()]:
                     cursor.execute('ALTER TABLE lignes_portefeuille ADD COLUMN dernier_cours REAL DEFAULT 0.0')
-                    print("INFO: Colonne 'dernier_cours' ajoutée à 'lignes_portefeuille'.")
+                    log.info("Colonne 'dernier_cours' ajoutée à 'lignes_portefeuille'.")
+
+                # Migration des détails d'instantanés stockés en JSON vers les tables normalisées
+                self._migrer_details_json(cursor)
 
                 con.commit()
-                print("INFO: Schéma de la base de données vérifié et à jour.")
+                log.debug("Schéma de la base de données vérifié et à jour.")
 
         except Exception as e:
             messagebox.showerror("Erreur Critique DB", f"Impossible de créer ou vérifier le schéma de la base de données : {e}")
             raise e
 
-    def charger_donnees(self):
-        """Charge les données du patrimoine, Y COMPRIS les lignes de portefeuille."""
-        print("INFO: Chargement des données du patrimoine depuis SQLite...")
+    def _creer_triggers_rollup(self, cursor):
+        """Triggers qui répercutent chaque insertion, modification ou suppression de transaction dans 'monthly_rollup'."""
+        ajout = f"""
+            INSERT INTO monthly_rollup (mois, categorie, compte, signe, somme, nombre)
+            VALUES ({ROLLUP_MOIS.format(t='NEW.')}, COALESCE(NEW.categorie, ''), COALESCE(NEW.compte_affecte, ''), {ROLLUP_SIGNE.format(t='NEW.')}, COALESCE(NEW.montant, 0), 1)
+            ON CONFLICT (mois, categorie, compte, signe) DO UPDATE SET somme = somme + excluded.somme, nombre = nombre + 1;"""
+        retrait = f"""
+            UPDATE monthly_rollup SET somme = somme - COALESCE(OLD.montant, 0), nombre = nombre - 1
+            WHERE mois = {ROLLUP_MOIS.format(t='OLD.')} AND categorie = COALESCE(OLD.categorie, '')
+              AND compte = COALESCE(OLD.compte_affecte, '') AND signe = {ROLLUP_SIGNE.format(t='OLD.')};
+            DELETE FROM monthly_rollup
+            WHERE mois = {ROLLUP_MOIS.format(t='OLD.')} AND categorie = COALESCE(OLD.categorie, '')
+              AND compte = COALESCE(OLD.compte_affecte, '') AND signe = {ROLLUP_SIGNE.format(t='OLD.')} AND nombre <= 0;"""
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_rollup_insert AFTER INSERT ON transactions {SQL_AGREGATS_ACTIFS} BEGIN {ajout} END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_rollup_delete AFTER DELETE ON transactions {SQL_AGREGATS_ACTIFS} BEGIN {retrait} END")
+        cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_rollup_update
+            AFTER UPDATE OF date, date_budgetaire, montant, categorie, compte_affecte ON transactions
+            {SQL_AGREGATS_ACTIFS} BEGIN {retrait} {ajout} END""")
+
+    def _creer_triggers_categories(self, cursor):
+        """Triggers qui tiennent à jour les compteurs d'utilisation (et le type) de la table 'categories'."""
+        for table, compteur, avec_type in TABLES_CATEGORIES:
+            maj_type = ", type = COALESCE(NEW.type, type)" if avec_type else ""
+            ajout = f"""
+                INSERT OR IGNORE INTO categories (nom) SELECT NEW.categorie WHERE COALESCE(NEW.categorie, '') <> '';
+                UPDATE categories SET {compteur} = {compteur} + 1{maj_type} WHERE nom = NEW.categorie;
+                UPDATE {table} SET categorie_id = (SELECT id FROM categories WHERE nom = NEW.categorie) WHERE rowid = NEW.rowid;"""
+            retrait = f"""
+                UPDATE categories SET {compteur} = {compteur} - 1 WHERE nom = OLD.categorie;"""
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_categories_{table}_insert AFTER INSERT ON {table} {SQL_AGREGATS_ACTIFS} BEGIN {ajout} END")
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_categories_{table}_delete AFTER DELETE ON {table} {SQL_AGREGATS_ACTIFS} BEGIN {retrait} END")
+            colonnes = "categorie, type" if avec_type else "categorie"
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_categories_{table}_update AFTER UPDATE OF {colonnes} ON {table} {SQL_AGREGATS_ACTIFS} BEGIN {retrait} {ajout} END")
+
+    def _supprimer_triggers_obsoletes(self, cursor):
+        """
+        Supprime les triggers d'agrégats créés avant la condition SQL_AGREGATS_ACTIFS, et ceux des catégories créés
+        avant la colonne categorie_id (ils sont recréés ensuite).
+        """
+        for (nom,) in cursor.execute("""
+                SELECT name FROM sqlite_master WHERE type = 'trigger' AND (
+                    ((name LIKE 'trg_rollup_%' OR name LIKE 'trg_categories_%') AND sql NOT LIKE '%meta_agregats_suspendus%')
+                    OR (name LIKE 'trg_categories_%' AND name NOT LIKE '%_delete' AND sql NOT LIKE '%categorie_id%'))""").fetchall():
+            cursor.execute(f"DROP TRIGGER {nom}")
+
+    def _renommer_transactions_en_masse(self, cursor, sources, destination):
+        """
+        UPDATE des catégories de transactions sans passer par les triggers ligne à ligne : 'monthly_rollup'
+        et les compteurs de 'categories' sont corrigés ensuite par des requêtes ensemblistes.
+        Retourne le nombre de transactions modifiées.
+        """
+        marques = ','.join('?' * len(sources))
+        cursor.execute("INSERT OR IGNORE INTO categories (nom) VALUES (?)", (destination,))
+        cursor.execute("INSERT OR IGNORE INTO meta_agregats_suspendus (id) VALUES (1)")
+        try:
+            cursor.execute(f"""UPDATE transactions SET categorie = ?, categorie_id = (SELECT id FROM categories WHERE nom = ?)
+                               WHERE categorie IN ({marques})""", [destination, destination, *sources])
+            nombre = cursor.rowcount
+        finally:
+            cursor.execute("DELETE FROM meta_agregats_suspendus")
+        cursor.execute(f"""
+            INSERT INTO monthly_rollup (mois, categorie, compte, signe, somme, nombre)
+            SELECT mois, ?, compte, signe, SUM(somme), SUM(nombre) FROM monthly_rollup
+            WHERE categorie IN ({marques}) GROUP BY mois, compte, signe
+            ON CONFLICT (mois, categorie, compte, signe) DO UPDATE SET somme = somme + excluded.somme, nombre = nombre + excluded.nombre""",
+            [destination, *sources])
+        cursor.execute(f"DELETE FROM monthly_rollup WHERE categorie IN ({marques})", sources)
+        cursor.execute("UPDATE categories SET nb_transactions = nb_transactions + ? WHERE nom = ?", (nombre, destination))
+        cursor.execute(f"UPDATE categories SET nb_transactions = 0 WHERE nom IN ({marques})", sources)
+        return nombre
+
+    def _remplir_rollup(self, cursor):
+        """Calcule 'monthly_rollup' (supposée vide) en une requête ensembliste sur les transactions."""
+        cursor.execute(f"""
+            INSERT INTO monthly_rollup (mois, categorie, compte, signe, somme, nombre)
+            SELECT {ROLLUP_MOIS.format(t='')}, COALESCE(categorie, ''), COALESCE(compte_affecte, ''),
+                   {ROLLUP_SIGNE.format(t='')}, SUM(COALESCE(montant, 0)), COUNT(*)
+            FROM transactions GROUP BY 1, 2, 3, 4""")
+
+    def _compter_categories(self, cursor, table, compteur):
+        """Recompte les utilisations des catégories dans une table (les catégories absentes de 'categories' y sont ajoutées)."""
+        cursor.execute(f"UPDATE categories SET {compteur} = 0 WHERE {compteur} <> 0")
+        cursor.execute(f"""
+            INSERT INTO categories (nom, {compteur}) SELECT categorie, COUNT(*) FROM {table}
+            WHERE COALESCE(categorie, '') <> '' GROUP BY categorie
+            ON CONFLICT (nom) DO UPDATE SET {compteur} = excluded.{compteur}""")
+
+    def _recompter_categories(self, cursor):
+        """
+        Recalcule les compteurs et le type de la table 'categories', et les categorie_id, depuis les données (premier lancement après
+        la mise à jour, ou après une réécriture complète). Le type retenu est celui du mois budgété le plus récent,
+        à défaut celui du dernier modèle ; une catégorie absente des deux garde son type.
+        """
+        sources_type = []
+        for table, compteur, avec_type in TABLES_CATEGORIES:
+            self._compter_categories(cursor, table, compteur)
+            if avec_type:
+                ordre = "cle_mois_annee DESC" if table == 'categories_prevues' else "id DESC"
+                sources_type.append((compteur, f"(SELECT type FROM {table} t WHERE t.categorie = categories.nom AND t.type IS NOT NULL ORDER BY {ordre} LIMIT 1)"))
+        cursor.execute(f"""
+            UPDATE categories SET type = COALESCE({', '.join(requete for _, requete in sources_type)}, type)
+            WHERE {' OR '.join(f'{compteur} > 0' for compteur, _ in sources_type)}""")
+        self._lier_categories(cursor)
+
+    def _lier_categories(self, cursor):
+        """Renseigne categorie_id d'après le nom de la catégorie, en une requête par table."""
+        for table, _, _ in TABLES_CATEGORIES:
+            cursor.execute(f"""
+                UPDATE {table} SET categorie_id = c.id FROM categories c
+                WHERE c.nom = {table}.categorie AND {table}.categorie_id IS NOT c.id""")
+
+    def charger_categories(self):
+        """Toutes les lignes de la table 'categories' (id, nom, type, compteurs d'utilisation)."""
+        with self._get_connection() as con:
+            return [dict(row) for row in con.execute("SELECT * FROM categories ORDER BY nom").fetchall()]
+
+    def _remplacer_categories(self, cursor, operation_id, sources, destination, fusion):
+        """
+        Remplace 'sources' par 'destination' dans toutes les tables.
+        Pour une fusion, l'ancienne catégorie de chaque transaction et récurrence est journalisée, et les lignes
+        de budget et de modèle des sources sont supprimées (et journalisées en entier) au lieu d'être renommées.
+        Un renommage n'a pas besoin de journal ligne à ligne (voir annuler_operation_categories).
+        Retourne le nombre de lignes touchées par table.
+        """
+        marques = ','.join('?' * len(sources))
+        compteurs = {}
+        tables_renommees = [table for table, _, _ in TABLES_CATEGORIES
+                            if not fusion or table in ('transactions', 'transactions_recurrentes')]
+        for table in tables_renommees:
+            if fusion:
+                cursor.execute(f"""
+                    INSERT INTO journal_lignes_categories (operation_id, table_nom, ligne_id, ancienne_categorie)
+                    SELECT ?, '{table}', id, categorie FROM {table} WHERE categorie IN ({marques})""", [operation_id, *sources])
+            if table == 'transactions':
+                compteurs[table] = self._renommer_transactions_en_masse(cursor, sources, destination)
+                continue
+            cursor.execute(f"UPDATE {table} SET categorie = ? WHERE categorie IN ({marques})", [destination, *sources])
+            compteurs[table] = cursor.rowcount
+        if fusion:
+            cursor.execute(f"""
+                INSERT INTO journal_lignes_categories (operation_id, table_nom, ligne_id, ancienne_categorie, donnees_json)
+                SELECT ?, 'budget_details', d.id, NULL,
+                       json_object('categorie_prevue_id', d.categorie_prevue_id, 'jour', d.jour, 'montant', d.montant, 'neutralise', d.neutralise)
+                FROM budget_details d JOIN categories_prevues p ON p.id = d.categorie_prevue_id WHERE p.categorie IN ({marques})""", [operation_id, *sources])
+            cursor.execute(f"DELETE FROM budget_details WHERE categorie_prevue_id IN (SELECT id FROM categories_prevues WHERE categorie IN ({marques}))", sources)
+            cursor.execute(f"""
+                INSERT INTO journal_lignes_categories (operation_id, table_nom, ligne_id, ancienne_categorie, donnees_json)
+                SELECT ?, 'categories_prevues', id, categorie,
+                       json_object('cle_mois_annee', cle_mois_annee, 'prevu', prevu, 'type', type, 'compte_prevu', compte_prevu, 'soldee', soldee)
+                FROM categories_prevues WHERE categorie IN ({marques})""", [operation_id, *sources])
+            cursor.execute(f"DELETE FROM categories_prevues WHERE categorie IN ({marques})", sources)
+            compteurs['categories_prevues'] = cursor.rowcount
+            # Les modèles sont réécrits à chaque sauvegarde du budget : on retient le nom du modèle plutôt que son id
+            cursor.execute(f"""
+                INSERT INTO journal_lignes_categories (operation_id, table_nom, ligne_id, ancienne_categorie, donnees_json)
+                SELECT ?, 'budget_template_categories', c.id, c.categorie,
+                       json_object('modele', t.nom, 'type', c.type, 'prevu', c.prevu, 'compte_prevu', c.compte_prevu)
+                FROM budget_template_categories c JOIN budget_templates t ON t.id = c.template_id WHERE c.categorie IN ({marques})""", [operation_id, *sources])
+            cursor.execute(f"DELETE FROM budget_template_categories WHERE categorie IN ({marques})", sources)
+            compteurs['budget_template_categories'] = cursor.rowcount
+        return compteurs
+
+    def _operation_categories(self, type_operation, sources, destination):
+        def ecriture(cursor):
+            cursor.execute("INSERT INTO journal_operations_categories (date, type, sources, destination) VALUES (?, ?, ?, ?)",
+                           (datetime.now().isoformat(timespec='seconds'), type_operation, json.dumps(sources, ensure_ascii=False), destination))
+            operation_id = cursor.lastrowid
+            compteurs = self._remplacer_categories(cursor, operation_id, sources, destination, fusion=(type_operation == 'fusion'))
+            cursor.execute("UPDATE journal_operations_categories SET compteurs = ? WHERE id = ?", (json.dumps(compteurs), operation_id))
+            # Seules les dernières opérations restent annulables
+            cursor.execute("DELETE FROM journal_lignes_categories WHERE operation_id <= ?", (operation_id - OPERATIONS_CATEGORIES_ANNULABLES,))
+            cursor.execute("DELETE FROM journal_operations_categories WHERE id <= ?", (operation_id - OPERATIONS_CATEGORIES_ANNULABLES,))
+            return operation_id, compteurs
+        resultat = self.ecrire_si_version(None, ecriture)
+        log.info("%s de catégories %s -> '%s' : %s", type_operation.capitalize(), sources, destination, resultat[1])
+        return resultat
+
+    def fusionner_categories(self, sources, destination):
+        """
+        Fusionne les catégories 'sources' dans 'destination' en une transaction : les transactions et récurrences
+        sont réaffectées, les lignes de budget et de modèle des sources supprimées.
+        Retourne (id de l'opération pour annuler_operation_categories, {table: lignes touchées}).
+        """
+        return self._operation_categories('fusion', list(sources), destination)
+
+    def renommer_categorie(self, ancien_nom, nouveau_nom):
+        """Renomme une catégorie partout (budgets et modèles compris). Même retour que fusionner_categories."""
+        return self._operation_categories('renommage', [ancien_nom], nouveau_nom)
+
+    def derniere_operation_categories(self):
+        """La dernière fusion ou le dernier renommage non annulé (dictionnaire), ou None."""
+        with self._get_connection() as con:
+            row = con.execute("SELECT * FROM journal_operations_categories WHERE annulee = 0 ORDER BY id DESC LIMIT 1").fetchone()
+        if row is None: return None
+        operation = dict(row)
+        operation['sources'] = json.loads(operation['sources'])
+        operation['compteurs'] = json.loads(operation['compteurs'] or '{}')
+        return operation
+
+    def annuler_operation_categories(self, operation_id):
+        """
+        Annule une fusion ou un renommage à partir du journal. Les lignes réaffectées reprennent leur catégorie
+        (sauf si elles ont été recatégorisées depuis) et les lignes supprimées sont recréées.
+        Retourne {table: lignes restaurées}.
+        """
+        def ecriture(cursor):
+            operation = cursor.execute("SELECT type, sources, destination FROM journal_operations_categories WHERE id = ? AND annulee = 0", (operation_id,)).fetchone()
+            if operation is None:
+                raise ValueError(f"Opération {operation_id} introuvable ou déjà annulée.")
+            compteurs = {}
+            if operation['type'] == 'renommage':
+                # Le nouveau nom n'existait pas avant le renommage : on l'annule par nom, ce qui reste juste
+                # même si le budget a été réécrit depuis (les lignes de budget et de modèle changent alors d'id)
+                ancien_nom = json.loads(operation['sources'])[0]
+                compteurs['transactions'] = self._renommer_transactions_en_masse(cursor, [operation['destination']], ancien_nom)
+                for table, _, _ in TABLES_CATEGORIES[1:]:
+                    cursor.execute(f"UPDATE {table} SET categorie = ? WHERE categorie = ?", (ancien_nom, operation['destination']))
+                    compteurs[table] = cursor.rowcount
+                cursor.execute("UPDATE journal_operations_categories SET annulee = 1 WHERE id = ?", (operation_id,))
+                cursor.execute("DELETE FROM journal_lignes_categories WHERE operation_id = ?", (operation_id,))
+                return compteurs
+            for table in ('transactions', 'transactions_recurrentes'):
+                cursor.execute(f"""
+                    UPDATE {table} SET categorie = (
+                        SELECT j.ancienne_categorie FROM journal_lignes_categories j
+                        WHERE j.operation_id = ? AND j.table_nom = '{table}' AND j.ligne_id = {table}.id)
+                    WHERE categorie = ? AND id IN (
+                        SELECT ligne_id FROM journal_lignes_categories WHERE operation_id = ? AND table_nom = '{table}')""",
+                    (operation_id, operation['destination'], operation_id))
+                compteurs[table] = cursor.rowcount
+            cursor.execute("""
+                INSERT INTO categories_prevues (id, cle_mois_annee, categorie, prevu, type, compte_prevu, soldee)
+                SELECT CAST(ligne_id AS INTEGER), json_extract(donnees_json, '$.cle_mois_annee'), ancienne_categorie, json_extract(donnees_json, '$.prevu'),
+                       json_extract(donnees_json, '$.type'), json_extract(donnees_json, '$.compte_prevu'), json_extract(donnees_json, '$.soldee')
+                FROM journal_lignes_categories WHERE operation_id = ? AND table_nom = 'categories_prevues' AND donnees_json IS NOT NULL""", (operation_id,))
+            compteurs['categories_prevues'] = cursor.rowcount
+            cursor.execute("""
+                INSERT INTO budget_details (id, categorie_prevue_id, jour, montant, neutralise)
+                SELECT CAST(ligne_id AS INTEGER), json_extract(donnees_json, '$.categorie_prevue_id'), json_extract(donnees_json, '$.jour'),
+                       json_extract(donnees_json, '$.montant'), json_extract(donnees_json, '$.neutralise')
+                FROM journal_lignes_categories WHERE operation_id = ? AND table_nom = 'budget_details'""", (operation_id,))
+            cursor.execute("""
+                INSERT INTO budget_template_categories (template_id, categorie, type, prevu, compte_prevu)
+                SELECT t.id, j.ancienne_categorie, json_extract(j.donnees_json, '$.type'), json_extract(j.donnees_json, '$.prevu'), json_extract(j.donnees_json, '$.compte_prevu')
+                FROM journal_lignes_categories j JOIN budget_templates t ON t.nom = json_extract(j.donnees_json, '$.modele')
+                WHERE j.operation_id = ? AND j.table_nom = 'budget_template_categories' AND j.donnees_json IS NOT NULL""", (operation_id,))
+            compteurs['budget_template_categories'] = cursor.rowcount
+            cursor.execute("UPDATE journal_operations_categories SET annulee = 1 WHERE id = ?", (operation_id,))
+            cursor.execute("DELETE FROM journal_lignes_categories WHERE operation_id = ?", (operation_id,))
+            return compteurs
+        return self.ecrire_si_version(None, ecriture)
+
+    def _migrer_details_json(self, cursor):
+        """Reporte dans snapshot_balances / snapshot_classes les instantanés dont les détails sont encore en JSON
+        (anciennes bases, migrate_json_to_sql.py), puis vide leur colonne details_json. Sans effet une fois migré."""
+        cursor.execute("SELECT date, details_json FROM historique_patrimoine WHERE details_json IS NOT NULL")
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        for row in rows:
+            try:
+                details = json.loads(row['details_json'])
+            except (TypeError, ValueError) as e:
+                log.warning("Détails illisibles pour l'instantané du %s : %s", row['date'], e)
+                details = {}
+            self._ecrire_details_snapshot(cursor, row['date'], details.get('soldes_comptes', {}), details.get('repartition_actifs_par_classe', {}))
+        cursor.execute("UPDATE historique_patrimoine SET details_json = NULL WHERE details_json IS NOT NULL")
+        log.info("%s instantanés migrés vers les tables snapshot_balances / snapshot_classes.", len(rows))
+
+    def _ecrire_details_snapshot(self, cursor, date_snapshot, soldes_comptes, repartition, ids_comptes=None):
+        """Remplace les soldes par compte et la répartition par classe d'un instantané."""
+        if ids_comptes is None:
+            ids_comptes = {row['nom']: row['id'] for row in cursor.execute("SELECT id, nom FROM comptes").fetchall()}
+        cursor.execute("DELETE FROM snapshot_balances WHERE date = ?", (date_snapshot,))
+        cursor.execute("DELETE FROM snapshot_classes WHERE date = ?", (date_snapshot,))
+        cursor.executemany("INSERT INTO snapshot_balances (date, compte_nom, compte_id, solde) VALUES (?, ?, ?, ?)",
+                           [(date_snapshot, nom, ids_comptes.get(nom), solde or 0.0) for nom, solde in (soldes_comptes or {}).items()])
+        cursor.executemany("INSERT INTO snapshot_classes (date, classe, montant) VALUES (?, ?, ?)",
+                           [(date_snapshot, classe, montant or 0.0) for classe, montant in (repartition or {}).items()])
+
+    def _incrementer_version(self, cursor):
+        """Incrémente le compteur de modifications (dans la transaction d'écriture en cours) ; version_chargee le suit
+        si la base était encore à cette version, sinon elle reste en retard et la prochaine sauvegarde complète échoue."""
+        version = cursor.execute("SELECT version FROM meta_version WHERE id = 1").fetchone()[0]
+        cursor.execute("UPDATE meta_version SET version = version + 1 WHERE id = 1")
+        if self.version_chargee == version:
+            self.version_chargee = version + 1
+
+    def get_version(self):
+        """Retourne le compteur de modifications de la base (une seule lecture indexée)."""
+        with self._get_connection() as con:
+            row = con.execute("SELECT version FROM meta_version WHERE id = 1").fetchone()
+            return row['version'] if row else 0
+
+    def lister_transactions_mois(self, cle_mois_annee, compte=None, categorie=None, pointe=None, apres=None, limite=100):
+        """Transactions d'un mois (date réelle), triées par (date, id), filtrables, paginées par curseur.
+        'apres' est le couple (date, id) de la dernière transaction de la page précédente."""
+        annee, mois = int(cle_mois_annee[:4]), int(cle_mois_annee[5:7])
+        debut = f"{annee:04d}-{mois:02d}-01"
+        fin = f"{annee + mois // 12:04d}-{mois % 12 + 1:02d}-01"
+        conditions, params = ["date >= ?", "date < ?"], [debut, fin]
+        if compte is not None: conditions.append("compte_affecte = ?"); params.append(compte)
+        if categorie is not None: conditions.append("categorie = ?"); params.append(categorie)
+        if pointe is not None: conditions.append("pointe = ?"); params.append(int(bool(pointe)))
+        if apres: conditions.append("(date > ? OR (date = ? AND id > ?))"); params.extend([apres[0], apres[0], apres[1]])
+        with self._get_connection() as con:
+            cursor = con.cursor()
+            cursor.execute(f"SELECT * FROM transactions WHERE {' AND '.join(conditions)} ORDER BY date, id LIMIT ?", params + [limite])
+            transactions = [dict(row) for row in cursor.fetchall()]
+        for trans in transactions: trans['pointe'] = bool(trans.get('pointe'))
+        return transactions
+
+    def transactions_non_pointees(self, compte):
+        """Transactions non pointées d'un compte (prévisions, récurrences, saisies manuelles)."""
+        with self._get_connection() as con:
+            rows = con.execute("SELECT id, date, montant, description, id_recurrence, origine FROM transactions WHERE compte_affecte = ? AND pointe = 0", (compte,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def _pointer_en_base(self, cursor, ids):
+        """
+        Pointe les transactions non pointées parmi 'ids' et reporte leurs montants, cumulés par compte, sur les soldes
+        (soustraits pour un passif) : une requête de cumul sur la clé primaire, un UPDATE par compte, un UPDATE des drapeaux.
+        Les transactions dont le compte n'existe pas en base restent non pointées. Retourne {nom du compte: cumul}.
+        """
+        ids_json = json.dumps(list(ids))
+        cumuls = cursor.execute("""
+            SELECT c.id, c.nom, SUM(COALESCE(t.montant, 0)) AS cumul
+            FROM transactions t JOIN comptes c ON c.id = (SELECT MIN(id) FROM comptes WHERE nom = t.compte_affecte)
+            WHERE t.id IN (SELECT value FROM json_each(?)) AND t.pointe = 0
+            GROUP BY c.id""", (ids_json,)).fetchall()
+        cursor.executemany("UPDATE comptes SET solde = ROUND(CASE WHEN type_compte = 'Passif' THEN solde - ? ELSE solde + ? END, 2) WHERE id = ?",
+                           [(row['cumul'], row['cumul'], row['id']) for row in cumuls])
+        cursor.execute("""
+            UPDATE transactions SET pointe = 1
+            WHERE id IN (SELECT value FROM json_each(?)) AND pointe = 0 AND compte_affecte IN (SELECT nom FROM comptes)""", (ids_json,))
+        return {row['nom']: row['cumul'] for row in cumuls}
+
+    def pointer_transactions(self, ids, version_attendue=None):
+        """Pointe un lot de transactions et met à jour les soldes de leurs comptes en une seule transaction SQL (voir _pointer_en_base)."""
+        return self.ecrire_si_version(version_attendue, lambda cursor: self._pointer_en_base(cursor, ids))
+
+    def indexer_empreintes(self, calculer_empreinte):
+        """
+        Calcule l'empreinte des transactions qui n'en ont pas encore (calculer_empreinte(date, montant, description, compte))
+        et oublie celles des transactions supprimées. Les empreintes sont des données dérivées : la version n'est pas modifiée.
+        """
+        with self._get_connection() as con:
+            cursor = con.cursor()
+            cursor.execute("DELETE FROM empreintes_transactions WHERE transaction_id NOT IN (SELECT id FROM transactions)")
+            rows = cursor.execute("""
+                SELECT t.id, t.date, t.montant, t.description, t.compte_affecte FROM transactions t
+                WHERE NOT EXISTS (SELECT 1 FROM empreintes_transactions e WHERE e.transaction_id = t.id)
+            """).fetchall()
+            cursor.executemany("INSERT INTO empreintes_transactions (transaction_id, empreinte) VALUES (?, ?)",
+                               [(row['id'], calculer_empreinte(row['date'], row['montant'], row['description'], row['compte_affecte'])) for row in rows])
+            con.commit()
+        return len(rows)
+
+    def compter_empreintes(self, empreintes):
+        """{empreinte: nombre de transactions existantes qui la portent} pour les empreintes demandées."""
+        empreintes, comptes = list(empreintes), {}
+        with self._get_connection() as con:
+            for debut in range(0, len(empreintes), 500): # Limite de paramètres SQLite
+                lot = empreintes[debut:debut + 500]
+                rows = con.execute(f"""
+                    SELECT e.empreinte, COUNT(*) FROM empreintes_transactions e JOIN transactions t ON t.id = e.transaction_id
+                    WHERE e.empreinte IN ({','.join('?' * len(lot))}) GROUP BY e.empreinte
+                """, lot).fetchall()
+                comptes.update((row[0], row[1]) for row in rows)
+        return comptes
+
+    def enregistrer_import_releve(self, nouvelles, ids_pointees, empreintes, version_attendue=None):
+        """Écrit en une seule transaction les opérations d'un relevé, les prévisions pointées (et les soldes de leurs comptes) et leurs empreintes."""
+        def ecriture(cursor):
+            cursor.executemany(SQL_INSERT_TRANSACTION, (_valeurs_transaction(trans) for trans in nouvelles))
+            self._pointer_en_base(cursor, ids_pointees)
+            cursor.executemany("INSERT OR REPLACE INTO empreintes_transactions (transaction_id, empreinte) VALUES (?, ?)", empreintes)
+        return self.ecrire_si_version(version_attendue, ecriture)
+
+    def charger_rollup(self, mois_debut, mois_fin=None, inclure_archive=False):
+        """
+        Retourne les agrégats mensuels entre deux mois budgétaires 'AAAA-MM' inclus (une ligne par mois/catégorie/compte/signe).
+        Avec inclure_archive, ceux des transactions déplacées dans la base d'archive (archiver_budget) y sont ajoutés.
+        """
+        params = (mois_debut, mois_fin or mois_debut)
+        try:
+            con = self._get_connection()
+            avec_archive = inclure_archive and os.path.exists(self.chemin_archive())
+            if avec_archive:
+                con.execute("ATTACH DATABASE ? AS archive", (self.chemin_archive(),))
+            try:
+                cursor = con.cursor()
+                if avec_archive:
+                    cursor.execute("""
+                        SELECT mois, categorie, compte, signe, SUM(somme) AS somme, SUM(nombre) AS nombre FROM (
+                            SELECT mois, categorie, compte, signe, somme, nombre FROM main.monthly_rollup WHERE mois BETWEEN ? AND ?
+                            UNION ALL
+                            SELECT mois, categorie, compte, signe, somme, nombre FROM archive.monthly_rollup WHERE mois BETWEEN ? AND ?)
+                        GROUP BY mois, categorie, compte, signe ORDER BY mois""", params + params)
+                else:
+                    cursor.execute("SELECT mois, categorie, compte, signe, somme, nombre FROM monthly_rollup WHERE mois BETWEEN ? AND ? ORDER BY mois", params)
+                return [dict(row) for row in cursor.fetchall()]
+            finally:
+                if avec_archive:
+                    con.execute("DETACH DATABASE archive")
+        except Exception as e:
+            log.error("Impossible de lire les agrégats mensuels : %s", e)
+            return []
+
+    def realise_par_categorie(self, cle_mois_annee):
+        """
+        Montant réalisé (signé) par catégorie pour un mois budgétaire, hors virements. Une transaction compte dans le
+        mois de sa date_budgetaire, sinon de sa date réelle : même définition que la vue Budget du bureau.
+        """
+        realise = defaultdict(float)
+        for row in self.charger_rollup(cle_mois_annee):
+            if row['categorie'] != "(Virement)":
+                realise[row['categorie'] or '(Non assigné)'] += row['somme']
+        return realise
+
+    def _chemin_cache_demarrage(self):
+        return os.path.splitext(self.db_path)[0] + ".cache"
+
+    def _en_tete_cache_demarrage(self):
+        """(format, identifiant de la base, compteur de modifications) : le cache n'est valable que pour cet en-tête."""
+        with self._get_connection() as con:
+            row = con.execute("SELECT identifiant, version FROM meta_version WHERE id = 1").fetchone()
+            return (FORMAT_CACHE_DEMARRAGE, row['identifiant'], row['version']) if row else (FORMAT_CACHE_DEMARRAGE, None, 0)
+
+    def _lire_cache_demarrage(self, en_tete):
+        """Retourne (comptes, historique, budget_data) depuis le cache s'il a été écrit avec cet en-tête, sinon None.
+        L'en-tête est lu seul d'abord : un cache périmé ne coûte que cette petite lecture."""
+        try:
+            with open(self._chemin_cache_demarrage(), 'rb') as f:
+                if pickle.load(f) != en_tete:
+                    return None
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning("Cache de démarrage illisible, chargement depuis la base : %s", e)
+            return None
+
+    def _ecrire_cache_demarrage(self, en_tete, comptes, historique, budget_data):
+        chemin = self._chemin_cache_demarrage()
+        try:
+            with open(chemin + ".tmp", 'wb') as f:
+                pickle.dump(en_tete, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump((comptes, historique, budget_data), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(chemin + ".tmp", chemin)
+        except Exception as e:
+            log.warning("Impossible d'écrire le cache de démarrage : %s", e)
+
+    def charger_donnees_demarrage(self):
+        """Charge (comptes, historique, budget_data) pour le démarrage de l'application.
+        Si le cache de démarrage a été écrit pour cette base et son compteur de modifications, une seule lecture de fichier
+        suffit ; sinon les données sont lues dans SQLite et le cache est réécrit."""
+        # La version est lue AVANT les données : une écriture concurrente pendant le chargement
+        # rend au pire le cache périmé, jamais faux.
+        en_tete = self._en_tete_cache_demarrage()
+        donnees = self._lire_cache_demarrage(en_tete)
+        if donnees is not None:
+            log.info("Données chargées depuis le cache de démarrage (version %s).", en_tete[2])
+            self.version_chargee = en_tete[2]
+            return donnees
+        self.erreur_chargement = False
+        comptes, historique = self.charger_donnees()
+        budget_data = self.charger_budget_donnees()
+        if not self.erreur_chargement: # Un chargement incomplet ne doit pas être figé dans le cache
+            self._ecrire_cache_demarrage(en_tete, comptes, historique, budget_data)
+        return comptes, historique, budget_data
+
+    def rafraichir_cache_demarrage(self):
+        """Reconstruit le cache depuis la base s'il est périmé (à appeler à la fermeture, pour que le
+        prochain lancement soit immédiat). Les données en mémoire ne sont pas utilisées : seule la base fait foi."""
+        en_tete = self._en_tete_cache_demarrage()
+        try:
+            with open(self._chemin_cache_demarrage(), 'rb') as f:
+                if pickle.load(f) == en_tete:
+                    return
+        except Exception:
+            pass
+        self.charger_donnees_demarrage()
+
+    def _lire_comptes(self, cursor):
+        """Comptes triés par nom, avec leurs lignes de portefeuille."""
+        cursor.execute("SELECT * FROM comptes ORDER BY nom")
+        comptes_dict = {row['id']: Compte(**dict(row)) for row in cursor.fetchall()}
+
+        # --- DÉBUT MODIFICATION : CHARGEMENT DU DERNIER COURS ---
+        cursor.execute("SELECT * FROM lignes_portefeuille")
+        for ligne_row in cursor.fetchall():
+            compte_parent_id = ligne_row['compte_id']
+            if compte_parent_id in comptes_dict:
+                # On passe maintenant le dictionnaire entier au constructeur
+                ligne_obj = LignePortefeuille(**dict(ligne_row))
+                comptes_dict[compte_parent_id].lignes_portefeuille.append(ligne_obj)
+        # --- FIN MODIFICATION ---
+
+        return list(comptes_dict.values())
+
+    def charger_comptes(self):
+        """Les comptes seuls (sans l'historique), pour les fenêtres qui lisent les instantanés à la demande."""
+        try:
+            with self._get_connection() as con:
+                return self._lire_comptes(con.cursor())
+        except Exception as e:
+            self.erreur_chargement = True
+            messagebox.showerror("Erreur SQL", f"Impossible de charger les comptes : {e}")
+            return []
+
+    def charger_donnees(self, details=True):
+        """Charge les données du patrimoine, Y COMPRIS les lignes de portefeuille.
+        Avec details=False, les instantanés ne contiennent que les totaux (voir details_snapshot pour le reste)."""
+        log.debug("Chargement des données du patrimoine depuis SQLite...")
         comptes = []
         historique = []
         try:
             with self._get_connection() as con:
                 cursor = con.cursor()
                 
-                cursor.execute("SELECT * FROM comptes ORDER BY nom")
-                comptes_dict = {row['id']: Compte(**dict(row)) for row in cursor.fetchall()}
-
-                # --- DÉBUT MODIFICATION : CHARGEMENT DU DERNIER COURS ---
-                cursor.execute("SELECT * FROM lignes_portefeuille")
-                for ligne_row in cursor.fetchall():
-                    compte_parent_id = ligne_row['compte_id']
-                    if compte_parent_id in comptes_dict:
-                        # On passe maintenant le dictionnaire entier au constructeur
-                        ligne_obj = LignePortefeuille(**dict(ligne_row))
-                        comptes_dict[compte_parent_id].lignes_portefeuille.append(ligne_obj)
-                # --- FIN MODIFICATION ---
-                
-                comptes = list(comptes_dict.values())
+                comptes = self._lire_comptes(cursor)
 
-                cursor.execute("SELECT * FROM historique_patrimoine ORDER BY date")
-                rows = cursor.fetchall()
-                
-                for row in rows:
-                    try:
-                        snap = dict(row)
-                        details_json_str = snap.pop('details_json', None)
-                        
-                        if details_json_str:
-                            details = json.loads(details_json_str)
-                            snap.update(details)
-                        
-                        historique.append(snap)
+                cursor.execute("SELECT date, patrimoine_net, total_actifs, total_passifs_magnitude FROM historique_patrimoine ORDER BY date")
+                historique = [dict(row) for row in cursor.fetchall()]
 
-                    except Exception as row_error:
-                        print(f"AVERTISSEMENT: Impossible de charger une ligne d'historique. Données: {dict(row)}. Erreur: {row_error}")
-                        continue 
+                if details:
+                    snapshots_par_date = {}
+                    for snap in historique:
+                        snap['repartition_actifs_par_classe'] = {}
+                        snap['soldes_comptes'] = {}
+                        snapshots_par_date[snap['date']] = snap
+                    for row in cursor.execute("SELECT date, compte_nom, solde FROM snapshot_balances"):
+                        if row['date'] in snapshots_par_date:
+                            snapshots_par_date[row['date']]['soldes_comptes'][row['compte_nom']] = row['solde']
+                    for row in cursor.execute("SELECT date, classe, montant FROM snapshot_classes"):
+                        if row['date'] in snapshots_par_date:
+                            snapshots_par_date[row['date']]['repartition_actifs_par_classe'][row['classe']] = row['montant']
 
-            print(f"Chargé {len(comptes)} comptes (avec leurs lignes de portefeuille) et {len(historique)} entrées d'historique.")
+            log.info("Chargé %s comptes (avec leurs lignes de portefeuille) et %s entrées d'historique.", len(comptes), len(historique))
 
         except Exception as e:
+            self.erreur_chargement = True
             messagebox.showerror("Erreur SQL", f"Impossible de charger les données du patrimoine : {e}")
         
         return comptes, historique
 
-    def sauvegarder_donnees(self, comptes, historique):
-        """Sauvegarde les comptes, l'historique ET les lignes de portefeuille."""
-        print("INFO: Sauvegarde des données du patrimoine dans SQLite...")
+    def _conditions_periode(self, date_debut, date_fin, conditions=None, params=None):
+        conditions, params = list(conditions or ["1 = 1"]), list(params or [])
+        if date_debut:
+            conditions.append("date >= ?"); params.append(date_debut)
+        if date_fin:
+            conditions.append("date <= ?"); params.append(date_fin)
+        return ' AND '.join(conditions), params
+
+    def charger_totaux_historique(self, date_debut=None, date_fin=None):
+        """Totaux (date, patrimoine_net, total_actifs, total_passifs_magnitude) des instantanés d'une période, triés par date."""
+        where, params = self._conditions_periode(date_debut, date_fin)
+        with self._get_connection() as con:
+            return con.execute(f"SELECT date, patrimoine_net, total_actifs, total_passifs_magnitude FROM historique_patrimoine WHERE {where} ORDER BY date", params).fetchall()
+
+    def historique_soldes_comptes(self, noms_comptes=None, date_debut=None, date_fin=None):
+        """Retourne {nom du compte: [(date, solde), ...]} triés par date, en une requête sur l'index (compte_nom, date).
+        noms_comptes=None charge tous les comptes présents dans l'historique."""
+        if noms_comptes is None:
+            series, conditions, params = defaultdict(list), None, None
+        else:
+            series = {nom: [] for nom in noms_comptes}
+            if not series:
+                return series
+            conditions, params = [f"compte_nom IN ({','.join('?' * len(series))})"], list(series)
+        where, params = self._conditions_periode(date_debut, date_fin, conditions, params)
+        with self._get_connection() as con:
+            for row in con.execute(f"SELECT compte_nom, date, solde FROM snapshot_balances WHERE {where} ORDER BY compte_nom, date", params):
+                series[row['compte_nom']].append((row['date'], row['solde']))
+        return dict(series)
+
+    def details_snapshot(self, date_snapshot):
+        """Retourne {'soldes_comptes': {...}, 'repartition_actifs_par_classe': {...}} de l'instantané d'une date."""
+        with self._get_connection() as con:
+            soldes = {row['compte_nom']: row['solde'] for row in con.execute("SELECT compte_nom, solde FROM snapshot_balances WHERE date = ?", (date_snapshot,))}
+            repartition = {row['classe']: row['montant'] for row in con.execute("SELECT classe, montant FROM snapshot_classes WHERE date = ?", (date_snapshot,))}
+        return {'soldes_comptes': soldes, 'repartition_actifs_par_classe': repartition}
+
+    def flux_par_compte(self, date_debut, date_fin, pointees_seulement=False):
+        """
+        Somme des transactions par compte datées après date_debut et au plus tard date_fin (dates ISO),
+        y compris celles déplacées dans la base d'archive. Une borne None n'est pas appliquée.
+        :param pointees_seulement: ne compter que les transactions pointées, les seules qui ont modifié les soldes.
+        """
+        conditions, params = ["compte_affecte IS NOT NULL"], []
+        if pointees_seulement:
+            conditions.append("pointe = 1")
+        if date_debut:
+            conditions.append("date > ?"); params.append(date_debut)
+        if date_fin:
+            conditions.append("date <= ?"); params.append(date_fin)
+        where = ' AND '.join(conditions)
+        con = self._get_connection()
+        avec_archive = os.path.exists(self.chemin_archive())
+        if avec_archive:
+            con.execute("ATTACH DATABASE ? AS archive", (self.chemin_archive(),))
+        try:
+            if avec_archive:
+                requete = f"""
+                    SELECT compte_affecte, SUM(montant) AS somme FROM (
+                        SELECT compte_affecte, montant FROM main.transactions WHERE {where}
+                        UNION ALL
+                        SELECT compte_affecte, montant FROM archive.transactions WHERE {where})
+                    GROUP BY compte_affecte"""
+                params = params + params
+            else:
+                requete = f"SELECT compte_affecte, SUM(montant) AS somme FROM transactions WHERE {where} GROUP BY compte_affecte"
+            return {row['compte_affecte']: row['somme'] or 0.0 for row in con.execute(requete, params)}
+        finally:
+            if avec_archive:
+                con.execute("DETACH DATABASE archive")
+
+    def repartition_par_classe(self, date_debut=None, date_fin=None):
+        """Retourne {date: {classe: montant}} sur une période, pour les tableaux et graphiques de répartition."""
+        where, params = self._conditions_periode(date_debut, date_fin)
+        repartition = defaultdict(dict)
+        with self._get_connection() as con:
+            for row in con.execute(f"SELECT date, classe, montant FROM snapshot_classes WHERE {where} ORDER BY date", params):
+                repartition[row['date']][row['classe']] = row['montant']
+        return dict(repartition)
+
+    def sauvegarder_donnees(self, comptes, historique, dates_modifiees=None):
+        """Sauvegarde les comptes, l'historique ET les lignes de portefeuille.
+        Avec dates_modifiees, seuls les instantanés de ces dates sont réécrits (les autres sont déjà en base)."""
+        log.debug("Sauvegarde des données du patrimoine dans SQLite...")
         try:
             with self._get_connection() as con:
                 cursor = con.cursor()
@@ -379,7 +1245,7 @@ class SqlDataManager:
                                     :jour_debut_periode, :jour_fin_periode, :compte_debit_associe)
                         """, compte_dict)
                         compte.id = cursor.lastrowid # On récupère et assigne le nouvel ID
-                        print(f"INFO: Nouveau compte '{compte.nom}' inséré avec l'ID {compte.id}.")
+                        log.info("Nouveau compte '%s' inséré avec l'ID %s.", compte.nom, compte.id)
                     else: # C'est un compte existant
                         cursor.execute("""
                             UPDATE comptes SET 
@@ -406,24 +1272,186 @@ class SqlDataManager:
 
                 # --- FIN DE LA LOGIQUE AMÉLIORÉE ---
 
-                # La partie sur l'historique ne change pas
+                # L'historique : totaux dans historique_patrimoine, détails dans les tables normalisées
+                ids_comptes = {compte.nom: compte.id for compte in comptes}
                 for snap in historique:
+                    if dates_modifiees is not None and snap.get('date') not in dates_modifiees:
+                        continue
                     cursor.execute("""
                         INSERT OR REPLACE INTO historique_patrimoine (date, patrimoine_net, total_actifs, total_passifs_magnitude, details_json)
-                        VALUES (?, ?, ?, ?, ?)
+                        VALUES (?, ?, ?, ?, NULL)
                     """,(
-                        snap.get('date'), snap.get('patrimoine_net'), snap.get('total_actifs'), snap.get('total_passifs_magnitude'),
-                        json.dumps({'repartition_actifs_par_classe': snap.get('repartition_actifs_par_classe',{}), 'soldes_comptes': snap.get('soldes_comptes',{})})
+                        snap.get('date'), snap.get('patrimoine_net'), snap.get('total_actifs'), snap.get('total_passifs_magnitude')
                     ))
+                    self._ecrire_details_snapshot(cursor, snap.get('date'), snap.get('soldes_comptes', {}),
+                                                  snap.get('repartition_actifs_par_classe', {}), ids_comptes)
+                self._incrementer_version(cursor)
                 con.commit()
-                print("INFO: Sauvegarde des données du patrimoine terminée avec succès.")
+                log.info("Sauvegarde des données du patrimoine terminée avec succès.")
         except Exception as e:
             messagebox.showerror("Erreur SQL", f"Impossible de sauvegarder les données du patrimoine : {e}")
             traceback.print_exc() # Affiche l'erreur détaillée dans la console
        
+    def appliquer_retention(self, politique=None, dates_modifiees=None, aujourd_hui=None):
+        """
+        Applique la politique de rétention à l'historique par des DELETE sur l'index de date
+        (les détails suivent via trg_historique_delete). Retourne la liste des dates supprimées.
+        :param dates_modifiees: dates des instantanés écrits depuis le dernier passage. Seuls leurs mois, et ceux que
+            le glissement des limites de la politique a fait changer de régime, sont traités. None = tout l'historique.
+        """
+        politique = {**POLITIQUE_RETENTION_DEFAUT, **(politique or {})}
+        aujourd_hui = aujourd_hui or date.today()
+        limite_quotidienne = (aujourd_hui - timedelta(days=int(politique['jours_quotidiens']))).isoformat()
+        mois_absolu = aujourd_hui.year * 12 + aujourd_hui.month - 1 - int(politique['mois_premier_dernier'])
+        limite_mensuelle = f"{mois_absolu // 12:04d}-{mois_absolu % 12 + 1:02d}-01"
+
+        def ecriture(cursor):
+            etat = cursor.execute("SELECT limite_quotidienne, limite_mensuelle FROM meta_retention WHERE id = 1").fetchone()
+            if etat is None or dates_modifiees is None:
+                mois_a_traiter = {row[0] for row in cursor.execute(
+                    "SELECT DISTINCT substr(date, 1, 7) FROM historique_patrimoine WHERE date < ?", (limite_quotidienne,))}
+            else:
+                mois_a_traiter = {d[:7] for d in dates_modifiees if d and d < limite_quotidienne}
+                mois_a_traiter.update(_mois_entre(etat['limite_quotidienne'], limite_quotidienne))
+                mois_a_traiter.update(_mois_entre(etat['limite_mensuelle'], limite_mensuelle))
+
+            # Chaque mois est rattaché à sa période de conservation : le mois lui-même, ou son trimestre
+            # (tronqué à la limite mensuelle pour ne pas empiéter sur les mois conservés en détail)
+            periodes = set()
+            for cle_mois in mois_a_traiter:
+                if f"{cle_mois}-01" >= limite_mensuelle:
+                    periodes.add((f"{cle_mois}-01", f"{_mois_suivant(cle_mois)}-01"))
+                else:
+                    annee, mois = int(cle_mois[:4]), int(cle_mois[5:7])
+                    debut_trimestre = f"{annee:04d}-{(mois - 1) // 3 * 3 + 1:02d}"
+                    fin_trimestre = debut_trimestre
+                    for _ in range(3): fin_trimestre = _mois_suivant(fin_trimestre)
+                    periodes.add((f"{debut_trimestre}-01", min(f"{fin_trimestre}-01", limite_mensuelle)))
+
+            supprimees = []
+            for debut, fin in sorted(periodes):
+                condition = """date >= :debut AND date < :fin AND date < :limite
+                    AND date NOT IN ((SELECT MIN(date) FROM historique_patrimoine WHERE date >= :debut AND date < :fin),
+                                     (SELECT MAX(date) FROM historique_patrimoine WHERE date >= :debut AND date < :fin))"""
+                params = {'debut': debut, 'fin': fin, 'limite': limite_quotidienne}
+                dates = [row[0] for row in cursor.execute(f"SELECT date FROM historique_patrimoine WHERE {condition}", params)]
+                if dates:
+                    cursor.execute(f"DELETE FROM historique_patrimoine WHERE {condition}", params)
+                    supprimees.extend(dates)
+
+            cursor.execute("""INSERT INTO meta_retention (id, limite_quotidienne, limite_mensuelle) VALUES (1, ?, ?)
+                              ON CONFLICT (id) DO UPDATE SET limite_quotidienne = excluded.limite_quotidienne,
+                                                             limite_mensuelle = excluded.limite_mensuelle""",
+                           (limite_quotidienne, limite_mensuelle))
+            if supprimees:
+                log.info("Rétention de l'historique : %s instantanés supprimés sur %s périodes.", len(supprimees), len(periodes))
+            return supprimees
+        return self.ecrire_si_version(None, ecriture)
+
+    def chemin_archive(self):
+        """Base SQLite où archiver_budget déplace les données de budget anciennes (à côté de la base principale)."""
+        return os.path.splitext(self.db_path)[0] + "_archive.db"
+
+    def _creer_schema_archive(self, cursor):
+        """Tables de la base d'archive, attachée sous le nom 'archive'."""
+        cursor.execute("CREATE TABLE IF NOT EXISTS archive.transactions (id TEXT PRIMARY KEY, date TEXT, description TEXT, montant REAL, categorie TEXT, compte_affecte TEXT, pointe INTEGER, virement_id TEXT, origine TEXT, id_recurrence TEXT, date_budgetaire TEXT)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS archive.idx_transactions_date ON transactions (date, id)")
+        # Les détails journaliers d'une ligne de budget sont archivés avec elle, en JSON
+        cursor.execute("CREATE TABLE IF NOT EXISTS archive.categories_prevues (cle_mois_annee TEXT NOT NULL, categorie TEXT NOT NULL, prevu REAL, type TEXT, compte_prevu TEXT, soldee INTEGER, details_json TEXT)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS archive.idx_categories_prevues_mois ON categories_prevues (cle_mois_annee)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS archive.transactions_recurrentes (id TEXT PRIMARY KEY, active INTEGER, jour_du_mois INTEGER, jour_echeance TEXT, description TEXT, categorie TEXT, montant REAL, compte_affecte TEXT, type TEXT, source TEXT, destination TEXT, date_debut TEXT, date_fin TEXT, periodicite TEXT)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS archive.monthly_rollup (
+                mois TEXT NOT NULL, categorie TEXT NOT NULL, compte TEXT NOT NULL, signe INTEGER NOT NULL,
+                somme REAL NOT NULL DEFAULT 0, nombre INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (mois, categorie, compte, signe)
+            ) WITHOUT ROWID""")
+        cursor.execute("CREATE TABLE IF NOT EXISTS archive.meta_archive (id INTEGER PRIMARY KEY CHECK (id = 1), date_limite TEXT, date_archivage TEXT)")
+
+    def archiver_budget(self, date_limite, compacter=True, version_attendue=None):
+        """
+        Déplace dans la base d'archive (chemin_archive) les données de budget antérieures à date_limite 'AAAA-MM-JJ' :
+        les transactions (copie puis suppression par plage sur idx_transactions_date), les mois de budget entièrement
+        passés (lignes prévues et leurs détails) et les règles récurrentes terminées. Les règles encore en cours
+        commencent désormais à date_limite. Les agrégats mensuels des transactions archivées passent eux aussi
+        dans l'archive, où charger_rollup(..., inclure_archive=True) les retrouve.
+        Avec compacter, la base principale est ensuite réduite à ses pages utiles (VACUUM).
+        Retourne les compteurs {'transactions', 'lignes_budget', 'regles_archivees', 'regles_modifiees'}.
+        """
+        colonnes_transaction = "id, date, description, montant, categorie, compte_affecte, pointe, virement_id, origine, id_recurrence, date_budgetaire"
+        colonnes_recurrence = "id, active, jour_du_mois, jour_echeance, description, categorie, montant, compte_affecte, type, source, destination, date_debut, date_fin, periodicite"
+        regle_terminee = "COALESCE(date_fin, '') <> '' AND date_fin < ?"
+
+        def ecriture(cursor):
+            self._creer_schema_archive(cursor)
+            compteurs = {}
+
+            # Agrégats et compteurs de catégories des transactions archivées, corrigés d'un bloc (triggers suspendus)
+            cursor.execute(f"""
+                CREATE TEMP TABLE rollup_archive AS
+                SELECT {ROLLUP_MOIS.format(t='')} AS mois, COALESCE(categorie, '') AS categorie, COALESCE(compte_affecte, '') AS compte,
+                       {ROLLUP_SIGNE.format(t='')} AS signe, SUM(COALESCE(montant, 0)) AS somme, COUNT(*) AS nombre
+                FROM main.transactions WHERE date < ? GROUP BY 1, 2, 3, 4""", (date_limite,))
+            cursor.execute("""
+                INSERT INTO archive.monthly_rollup (mois, categorie, compte, signe, somme, nombre)
+                SELECT mois, categorie, compte, signe, somme, nombre FROM temp.rollup_archive WHERE true
+                ON CONFLICT (mois, categorie, compte, signe) DO UPDATE SET somme = somme + excluded.somme, nombre = nombre + excluded.nombre""")
+            cursor.execute("""
+                UPDATE main.monthly_rollup AS m SET somme = m.somme - r.somme, nombre = m.nombre - r.nombre
+                FROM temp.rollup_archive AS r
+                WHERE m.mois = r.mois AND m.categorie = r.categorie AND m.compte = r.compte AND m.signe = r.signe""")
+            cursor.execute("DELETE FROM main.monthly_rollup WHERE nombre <= 0")
+            cursor.execute("""
+                UPDATE main.categories AS c SET nb_transactions = c.nb_transactions - n.nombre
+                FROM (SELECT categorie, SUM(nombre) AS nombre FROM temp.rollup_archive GROUP BY categorie) AS n
+                WHERE c.nom = n.categorie""")
+            cursor.execute("DROP TABLE temp.rollup_archive")
+
+            cursor.execute(f"INSERT OR REPLACE INTO archive.transactions ({colonnes_transaction}) SELECT {colonnes_transaction} FROM main.transactions WHERE date < ?", (date_limite,))
+            cursor.execute("DELETE FROM main.empreintes_transactions WHERE transaction_id IN (SELECT id FROM main.transactions WHERE date < ?)", (date_limite,))
+            cursor.execute("INSERT OR IGNORE INTO main.meta_agregats_suspendus (id) VALUES (1)")
+            try:
+                cursor.execute("DELETE FROM main.transactions WHERE date < ?", (date_limite,))
+                compteurs['transactions'] = cursor.rowcount
+            finally:
+                cursor.execute("DELETE FROM main.meta_agregats_suspendus")
+
+            # Mois de budget entièrement antérieurs à la date limite
+            cursor.execute("""
+                INSERT INTO archive.categories_prevues (cle_mois_annee, categorie, prevu, type, compte_prevu, soldee, details_json)
+                SELECT cp.cle_mois_annee, cp.categorie, cp.prevu, cp.type, cp.compte_prevu, cp.soldee,
+                       (SELECT json_group_array(json_object('jour', d.jour, 'montant', d.montant, 'neutralise', d.neutralise))
+                        FROM main.budget_details d WHERE d.categorie_prevue_id = cp.id)
+                FROM main.categories_prevues cp WHERE cp.cle_mois_annee < ?""", (date_limite[:7],))
+            compteurs['lignes_budget'] = cursor.rowcount
+            cursor.execute("DELETE FROM main.budget_details WHERE categorie_prevue_id IN (SELECT id FROM main.categories_prevues WHERE cle_mois_annee < ?)", (date_limite[:7],))
+            cursor.execute("DELETE FROM main.categories_prevues WHERE cle_mois_annee < ?", (date_limite[:7],))
+
+            cursor.execute(f"INSERT OR REPLACE INTO archive.transactions_recurrentes ({colonnes_recurrence}) SELECT {colonnes_recurrence} FROM main.transactions_recurrentes WHERE {regle_terminee}", (date_limite,))
+            cursor.execute(f"DELETE FROM main.transactions_recurrentes WHERE {regle_terminee}", (date_limite,))
+            compteurs['regles_archivees'] = cursor.rowcount
+            # Les règles en cours repartent de la date limite, en gardant la phase des périodicités longues
+            cursor.execute("SELECT id, date_debut, periodicite FROM main.transactions_recurrentes WHERE COALESCE(date_debut, '') <> '' AND date_debut < ?", (date_limite,))
+            nouveaux_debuts = [(_avancer_debut_regle(debut, periodicite, date_limite), id_regle) for id_regle, debut, periodicite in cursor.fetchall()]
+            cursor.executemany("UPDATE main.transactions_recurrentes SET date_debut = ? WHERE id = ?", nouveaux_debuts)
+            compteurs['regles_modifiees'] = len(nouveaux_debuts)
+
+            cursor.execute("""INSERT INTO archive.meta_archive (id, date_limite, date_archivage) VALUES (1, ?, ?)
+                              ON CONFLICT (id) DO UPDATE SET date_limite = MAX(date_limite, excluded.date_limite), date_archivage = excluded.date_archivage""",
+                           (date_limite, date.today().isoformat()))
+            return compteurs
+
+        compteurs = self.ecrire_si_version(version_attendue, ecriture, avec_archive=True)
+        log.info("Archivage du budget avant le %s : %s", date_limite, compteurs)
+        if compacter and compteurs['transactions'] + compteurs['lignes_budget']:
+            with self._get_connection() as con:
+                con.execute("VACUUM")
+        return compteurs
+
     def charger_budget_donnees(self):
-        print("INFO: Chargement des données de budget depuis SQLite...")
+        log.debug("Chargement des données de budget depuis SQLite...")
         budget_data = defaultdict(lambda: {'categories_prevues': [], 'transactions': []})
+        version = self.get_version() # Lue avant les données (voir charger_donnees_demarrage)
         try:
             with self._get_connection() as con:
                 try:
@@ -431,7 +1459,7 @@ class SqlDataManager:
                     cursor_check.execute("PRAGMA table_info(budget_details)")
                     if 'neutralise' not in [row['name'] for row in cursor_check.fetchall()]:
                         cursor_check.execute('ALTER TABLE budget_details ADD COLUMN neutralise INTEGER DEFAULT 0')
-                        print("INFO: Colonne 'neutralise' ajoutée à la volée à 'budget_details'.")
+                        log.info("Colonne 'neutralise' ajoutée à la volée à 'budget_details'.")
                         con.commit()
                 except sqlite3.OperationalError:
                     pass
@@ -451,18 +1479,18 @@ class SqlDataManager:
                 
                 for cat_data in categories_par_id.values():
                     cle_mois = cat_data.pop('cle_mois_annee')
+                    cat_data.pop('categorie_id', None) # En mémoire, la catégorie est désignée par son nom
                     cat_data['soldee'] = bool(cat_data.get('soldee'))
                     budget_data[cle_mois]['categories_prevues'].append(cat_data)
                 
-                cursor.execute("SELECT * FROM transactions")
+                # Transactions compactes (slots, chaînes internées) : l'historique complet reste en mémoire
+                cursor.execute(f"SELECT {', '.join(Transaction.CHAMPS)} FROM transactions")
                 for row in cursor.fetchall():
-                    trans = dict(row)
-                    trans['pointe'] = bool(trans.get('pointe'))
-                    cle_mois = datetime.strptime(trans['date'], "%Y-%m-%d").strftime("%Y-%m")
-                    budget_data[cle_mois]['transactions'].append(trans)
+                    trans = Transaction.depuis_ligne(row)
+                    budget_data[trans['date'][:7]]['transactions'].append(trans)
                 
                 cursor.execute("SELECT * FROM transactions_recurrentes")
-                budget_data['transactions_recurrentes'] = [dict(row) for row in cursor.fetchall()]
+                budget_data['transactions_recurrentes'] = [{cle: row[cle] for cle in row.keys() if cle != 'categorie_id'} for row in cursor.fetchall()]
 
                 templates = {}
                 cursor.execute("SELECT id, nom FROM budget_templates")
@@ -472,18 +1500,37 @@ class SqlDataManager:
                     cat_cursor.execute("SELECT categorie, type, prevu, compte_prevu FROM budget_template_categories WHERE template_id = ?", (template_id,))
                     templates[template_nom] = [dict(cat_row) for cat_row in cat_cursor.fetchall()]
                 budget_data['_templates'] = templates
+            self.version_chargee = version
 
         except Exception as e:
+             self.erreur_chargement = True
              messagebox.showerror("Erreur SQL", f"Impossible de charger les données du budget : {e}\n{traceback.format_exc()}")
 
         return dict(budget_data)
 
-    def sauvegarder_budget_donnees(self, budget_data):
-        print("INFO: Sauvegarde des données de budget dans SQLite...")
+    def sauvegarder_budget_donnees(self, budget_data, version_attendue=None):
+        """
+        Réécrit tout le budget. Avec version_attendue (en général version_chargee), la réécriture n'a lieu que si
+        la base n'a pas été modifiée depuis : sinon ConflitDeVersion, pour ne pas effacer les écritures d'un autre
+        processus (application web, génération des récurrences).
+        """
+        log.debug("Sauvegarde des données de budget dans SQLite...")
         try:
             with self._get_connection() as con:
                 cursor = con.cursor()
-                cursor.execute("BEGIN TRANSACTION")
+                cursor.execute("BEGIN IMMEDIATE")
+                version_actuelle = cursor.execute("SELECT version FROM meta_version WHERE id = 1").fetchone()[0]
+                if version_attendue is not None and version_actuelle != version_attendue:
+                    raise ConflitDeVersion(version_attendue, version_actuelle)
+                # Réécriture complète : les triggers d'agrégats sont suspendus, 'monthly_rollup' et la table
+                # 'categories' sont recalculés d'un bloc à la fin
+                cursor.execute("INSERT OR IGNORE INTO meta_agregats_suspendus (id) VALUES (1)")
+                # Champs des transactions qui ont une empreinte, pour oublier celles que la réécriture rend périmées
+                cursor.execute("DROP TABLE IF EXISTS temp.transactions_empreintes")
+                cursor.execute("""
+                    CREATE TEMP TABLE transactions_empreintes AS
+                    SELECT t.id, t.date, t.montant, t.description, t.compte_affecte
+                    FROM transactions t JOIN empreintes_transactions e ON e.transaction_id = t.id""")
                 cursor.execute("DELETE FROM budget_details")
                 cursor.execute("DELETE FROM transactions")
                 cursor.execute("DELETE FROM categories_prevues")
@@ -500,32 +1547,84 @@ class SqlDataManager:
                         for rec in data: cursor.execute("INSERT INTO transactions_recurrentes (id, active, jour_du_mois, jour_echeance, description, categorie, montant, compte_affecte, type, source, destination, date_debut, date_fin, periodicite) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (rec.get('id'), int(rec.get('active', True)), rec.get('jour_du_mois'), str(rec.get('jour_echeance')), rec.get('description'), rec.get('categorie'), rec.get('montant'), rec.get('compte_affecte'), rec.get('type'), rec.get('source'), rec.get('destination'), rec.get('date_debut'), rec.get('date_fin'), rec.get('periodicite')))
                     else:
                         for cat in data.get('categories_prevues', []):
-                            cursor.execute("INSERT INTO categories_prevues (cle_mois_annee, categorie, prevu, type, compte_prevu, soldee) VALUES (?, ?, ?, ?, ?, ?)", (cle, cat.get('categorie'), cat.get('prevu'), cat.get('type'), cat.get('compte_prevu'), int(cat.get('soldee', False))))
-                            categorie_id = cursor.lastrowid
-                            if 'details' in cat and cat['details']:
-                                for detail in cat['details']:
-                                    cursor.execute("INSERT INTO budget_details (categorie_prevue_id, jour, montant, neutralise) VALUES (?, ?, ?, ?)", 
-                                                   (categorie_id, detail.get('jour'), detail.get('montant'), int(detail.get('neutralise', False))))
+                            self._inserer_categorie_prevue(cursor, cle, cat)
                         
-                        for trans in data.get('transactions', []):
-                            # --- CORRECTION DE LA REQUÊTE D'INSERTION ---
-                            cursor.execute("""
-                                INSERT INTO transactions 
-                                (id, date, description, montant, categorie, compte_affecte, pointe, virement_id, origine, id_recurrence, date_budgetaire) 
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """, (
-                                trans.get('id'), trans.get('date'), trans.get('description'), trans.get('montant'), 
-                                trans.get('categorie'), trans.get('compte_affecte'), int(trans.get('pointe', False)), 
-                                trans.get('virement_id'), trans.get('origine'), trans.get('id_recurrence'),
-                                trans.get('date_budgetaire') # On ajoute la nouvelle donnée
-                            ))
-                            # --- FIN DE LA CORRECTION ---
-                
+                        cursor.executemany(SQL_INSERT_TRANSACTION, [_valeurs_transaction(trans) for trans in data.get('transactions', [])])
+
+                cursor.execute("DELETE FROM meta_agregats_suspendus")
+                cursor.execute("DELETE FROM monthly_rollup")
+                self._remplir_rollup(cursor)
+                self._recompter_categories(cursor)
+                # Transaction supprimée, ou modifiée sur un champ de l'empreinte : indexer_empreintes la recalculera
+                cursor.execute("""
+                    DELETE FROM empreintes_transactions WHERE transaction_id IN (
+                        SELECT a.id FROM temp.transactions_empreintes a LEFT JOIN transactions t ON t.id = a.id
+                        WHERE t.id IS NULL OR t.date IS NOT a.date OR t.montant IS NOT a.montant
+                           OR t.description IS NOT a.description OR t.compte_affecte IS NOT a.compte_affecte)""")
+                cursor.execute("DROP TABLE temp.transactions_empreintes")
+                self._incrementer_version(cursor)
                 con.commit()
+        except ConflitDeVersion:
+            con.rollback()
+            raise
         except Exception as e:
              messagebox.showerror("Erreur SQL", f"Impossible de sauvegarder les données du budget : {e}\n{traceback.format_exc()}")
              con.rollback()
 
+    def _inserer_categorie_prevue(self, cursor, cle_mois_annee, cat):
+        cursor.execute("INSERT INTO categories_prevues (cle_mois_annee, categorie, prevu, type, compte_prevu, soldee) VALUES (?, ?, ?, ?, ?, ?)", (cle_mois_annee, cat.get('categorie'), cat.get('prevu'), cat.get('type'), cat.get('compte_prevu'), int(cat.get('soldee', False))))
+        categorie_id = cursor.lastrowid
+        if 'details' in cat and cat['details']:
+            cursor.executemany("INSERT INTO budget_details (categorie_prevue_id, jour, montant, neutralise) VALUES (?, ?, ?, ?)",
+                               [(categorie_id, detail.get('jour'), detail.get('montant'), int(detail.get('neutralise', False))) for detail in cat['details']])
+        return categorie_id
+
+    def ajouter_elements_budget(self, cle_mois_annee, transactions=(), categories=(), version_attendue=None):
+        """Ajoute des transactions et des catégories prévues à un mois sans réécrire le budget.
+        Les catégories déjà présentes pour ce mois (même nom, sans tenir compte de la casse) sont ignorées.
+        Avec version_attendue, l'ajout n'a lieu que si la base n'a pas changé (sinon ConflitDeVersion).
+        Retourne la liste des catégories effectivement ajoutées."""
+        def ecriture(cursor):
+            categories_ajoutees = []
+            cursor.executemany(SQL_INSERT_TRANSACTION, [_valeurs_transaction(trans) for trans in transactions])
+            for cat in categories:
+                cursor.execute("SELECT 1 FROM categories_prevues WHERE cle_mois_annee = ? AND lower(categorie) = lower(?)", (cle_mois_annee, cat.get('categorie')))
+                if cursor.fetchone(): continue
+                cat['id'] = self._inserer_categorie_prevue(cursor, cle_mois_annee, cat)
+                categories_ajoutees.append(cat)
+            return categories_ajoutees
+        return self.ecrire_si_version(version_attendue, ecriture)
+
+    def inserer_transactions(self, transactions, version_attendue=None):
+        """Insère un lot de transactions (tous mois confondus) en un seul executemany et un seul commit."""
+        def ecriture(cursor):
+            cursor.executemany(SQL_INSERT_TRANSACTION, (_valeurs_transaction(trans) for trans in transactions))
+            return cursor.rowcount
+        return self.ecrire_si_version(version_attendue, ecriture)
+
+    def importer_instantanes(self, instantanes, version_attendue=None):
+        """
+        Écrit (ajout ou remplacement) un lot d'instantanés de l'historique en une seule transaction.
+        Les détails des dates importées sont remplacés par ceux des instantanés fournis.
+        """
+        def ecriture(cursor):
+            dates = [(snap['date'],) for snap in instantanes]
+            cursor.executemany("""
+                INSERT OR REPLACE INTO historique_patrimoine (date, patrimoine_net, total_actifs, total_passifs_magnitude, details_json)
+                VALUES (?, ?, ?, ?, NULL)
+            """, [(snap['date'], snap.get('patrimoine_net'), snap.get('total_actifs'), snap.get('total_passifs_magnitude')) for snap in instantanes])
+            cursor.executemany("DELETE FROM snapshot_balances WHERE date = ?", dates)
+            cursor.executemany("DELETE FROM snapshot_classes WHERE date = ?", dates)
+            ids_comptes = {row['nom']: row['id'] for row in cursor.execute("SELECT id, nom FROM comptes").fetchall()}
+            cursor.executemany("INSERT INTO snapshot_balances (date, compte_nom, compte_id, solde) VALUES (?, ?, ?, ?)",
+                               [(snap['date'], nom, ids_comptes.get(nom), solde or 0.0)
+                                for snap in instantanes for nom, solde in (snap.get('soldes_comptes') or {}).items()])
+            cursor.executemany("INSERT INTO snapshot_classes (date, classe, montant) VALUES (?, ?, ?)",
+                               [(snap['date'], classe, montant or 0.0)
+                                for snap in instantanes for classe, montant in (snap.get('repartition_actifs_par_classe') or {}).items()])
+            return len(instantanes)
+        return self.ecrire_si_version(version_attendue, ecriture)
+
     def charger_parametres(self):
         try:
             settings_path = os.path.join(os.path.dirname(self.db_path), "settings.json")
@@ -537,4 +1636,4 @@ class SqlDataManager:
         try:
             settings_path = os.path.join(os.path.dirname(self.db_path), "settings.json")
             with open(settings_path, 'w') as f: json.dump(settings, f, indent=4)
-        except IOError as e: print(f"Erreur de sauvegarde des paramètres: {e}")
+        except IOError as e: log.error("Erreur de sauvegarde des paramètres: %s", e)
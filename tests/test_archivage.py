@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from services import _avancer_debut_regle
+
+def test_archivage_conserve_la_phase_des_regles_periodiques():
+    # Trimestrielle calée sur janvier : prochaine échéance en juillet, pas en juin
+    assert _avancer_debut_regle("2024-01-01", "Trimestrielle", "2024-06-15") == "2024-07-01"
+    assert _avancer_debut_regle("2023-03-10", "Annuelle", "2024-06-01") == "2025-03-01"
+    # Échéance dans le mois de la date limite : on repart de la date limite
+    assert _avancer_debut_regle("2024-04-20", "Trimestrielle", "2024-07-10") == "2024-07-10"
+
+def test_archivage_regles_sans_phase_mensuelle():
+    assert _avancer_debut_regle("2024-01-05", "Mensuelle", "2024-06-15") == "2024-06-15"
+    assert _avancer_debut_regle("2024-01-05", "Hebdomadaire", "2024-06-15") == "2024-06-15"
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from services import SqlDataManager
+from import_releve import ImportReleve
+
+def _releve(chemin, lignes):
+    chemin.write_text("Date;Libellé;Montant\n" + "".join(f"{ligne}\n" for ligne in lignes), encoding='utf-8')
+    return str(chemin)
+
+def test_operation_d_un_releve_precedent_n_est_pas_une_prevision(tmp_path):
+    # Le même café deux fois à trois jours d'écart : la seconde opération ne doit pas « pointer » la première
+    data_manager = SqlDataManager(str(tmp_path / "budget.db"))
+    ImportReleve(data_manager, "CC").importer(_releve(tmp_path / "janvier.csv", ["30/01/2024;CB CAFE DU COIN;-4,50"]))
+    rapport, nouvelles, ids_pointees = ImportReleve(data_manager, "CC").importer(_releve(tmp_path / "fevrier.csv", ["02/02/2024;CB CAFE DU COIN;-4,50"]))
+    assert (rapport.ajoutes, rapport.mis_a_jour, ids_pointees) == (1, 0, [])
+    assert nouvelles[0]['date'] == "2024-02-02"
+
+def test_prevision_pointee(tmp_path):
+    data_manager = SqlDataManager(str(tmp_path / "budget.db"))
+    data_manager.inserer_transactions([{'id': "prevu", 'date': "2024-02-01", 'description': "Café", 'montant': -4.5, 'compte_affecte': "CC", 'pointe': False}])
+    rapport, nouvelles, ids_pointees = ImportReleve(data_manager, "CC").importer(_releve(tmp_path / "fevrier.csv", ["02/02/2024;CB CAFE DU COIN;-4,50"]))
+    assert (rapport.ajoutes, rapport.mis_a_jour, ids_pointees, nouvelles) == (0, 1, ["prevu"], [])
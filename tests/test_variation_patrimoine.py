@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from models import Compte
+from frame_transactions import TransactionFrame
+from series_patrimoine import HistorySeries
+from variation_patrimoine import ServiceVariationPatrimoine
+
+def _service(transactions):
+    comptes = [Compte(nom="CC", type_compte="Actif", solde=1000.0, classe_actif="Monétaire"),
+               Compte(nom="CB", type_compte="Passif", solde=700.0)]
+    historique = [
+        {'date': "2024-01-31", 'patrimoine_net': 300.0, 'total_actifs': 1000.0, 'total_passifs_magnitude': 700.0,
+         'soldes_comptes': {"CC": 1000.0, "CB": 700.0}},
+        {'date': "2024-02-29", 'patrimoine_net': 300.0, 'total_actifs': 1000.0, 'total_passifs_magnitude': 700.0,
+         'soldes_comptes': {"CC": 1000.0, "CB": 700.0}},
+    ]
+    return ServiceVariationPatrimoine(HistorySeries.depuis_historique(historique), TransactionFrame(transactions), comptes)
+
+def test_achat_carte_rattache_au_mois_suivant():
+    # Achat de janvier budgété en février : déjà dans la dette de l'instantané de fin janvier
+    service = _service([{'id': "1", 'date': "2024-01-20", 'date_budgetaire': "2024-02-01", 'montant': -200.0,
+                         'categorie': "Courses", 'compte_affecte': "CB"}])
+    reco = service.variation_mois("2024-02")
+    assert reco.snapshot_debut['soldes_comptes']["CB"] == 500.0
+    assert reco.snapshot_debut['total_passifs_magnitude'] == 500.0
+    assert reco.variation_nette == -200.0
+    assert reco.cash_flow == -200.0
+    assert reco.mouvement_passifs == 0.0
+    assert reco.effet_marche == 0.0
+
+def test_retrait_sur_un_actif():
+    service = _service([{'id': "1", 'date': "2024-01-20", 'date_budgetaire': "2024-02-01", 'montant': -200.0,
+                         'categorie': "Courses", 'compte_affecte': "CC"}])
+    reco = service.variation_mois("2024-02")
+    assert reco.snapshot_debut['soldes_comptes']["CC"] == 1200.0
+    assert reco.variation_nette == -200.0
+    assert reco.effet_marche == 0.0
@@ -8,6 +8,7 @@ from collections import defaultdict
 # Importer les dépendances depuis vos autres modules
 from utils import format_nombre_fr
 from models import Compte
+from rapprochement import rapprocher, RechercheTropVaste
 
 class ConflictStrategyDialog(simpledialog.Dialog):
     def __init__(self, parent, title=None, potential_conflicts=0):
@@ -1253,46 +1254,24 @@ class TransactionDialog(tk.Toplevel):
         self.destroy()
 
 class RapportVariationPatrimoineWindow(tk.Toplevel):
-    def __init__(self, parent, cle_mois_annee, snapshot_debut, snapshot_fin, tous_les_comptes, transactions_du_mois):
+    """
+    Affiche une ReconciliationPatrimoine (variation_patrimoine.py) et, si fourni, le tableau des
+    réconciliations mensuelles de l'année (None pour un mois sans instantané).
+    """
+    def __init__(self, parent, reconciliation, reconciliations_annee=None):
         super().__init__(parent)
         self.transient(parent)
-        self.title(f"Analyse Détaillée pour {cle_mois_annee}")
+        self.title(f"Analyse Détaillée pour {reconciliation.libelle}")
         self.geometry("950x800")
         self.minsize(800, 600)
 
-        # --- ÉTAPE 1 : Logique de calcul (inchangée) ---
-        soldes_debut = snapshot_debut.get('soldes_comptes', {})
-        soldes_fin = snapshot_fin.get('soldes_comptes', {})
-        noms_comptes_uniques = sorted(list(set(soldes_debut.keys()) | set(soldes_fin.keys())))
-        compte_props = {c.nom: {'type': c.type_compte, 'classe_actif': c.classe_actif} for c in tous_les_comptes}
-        augmentations_patrimoine = []
-        diminutions_patrimoine = []
-        for nom in noms_comptes_uniques:
-            solde_d = soldes_debut.get(nom, 0.0)
-            solde_f = soldes_fin.get(nom, 0.0)
-            variation = solde_f - solde_d
-            is_passif = compte_props.get(nom, {}).get('type') == 'Passif'
-            impact = -variation if is_passif else variation
-            item = {'nom': nom, 'solde_debut': solde_d, 'solde_fin': solde_f, 'impact': impact, 'type': 'Passif' if is_passif else 'Actif'}
-            if impact > 0.01: augmentations_patrimoine.append(item)
-            elif impact < -0.01: diminutions_patrimoine.append(item)
-        soustotal_aug = sum(item['impact'] for item in augmentations_patrimoine)
-        soustotal_dim = sum(item['impact'] for item in diminutions_patrimoine)
-        total_variation_nette = soustotal_aug + soustotal_dim
-        ventilation = defaultdict(float)
-        for item in augmentations_patrimoine + diminutions_patrimoine:
-            if item['type'] == 'Actif':
-                classe = compte_props.get(item['nom'], {}).get('classe_actif', 'Non Renseigné')
-                ventilation[classe] += item['impact']
-            elif item['type'] == 'Passif':
-                if item['impact'] > 0: ventilation["Réduction de Passif"] += item['impact']
-                else: ventilation["Augmentation de Passif"] += item['impact']
-        cash_flow_par_compte = defaultdict(float)
-        for t in transactions_du_mois:
-            compte = t.get('compte_affecte')
-            if compte: cash_flow_par_compte[compte] += t.get('montant', 0.0)
-        total_cash_flow = sum(cash_flow_par_compte.values())
-        valeur_latente_et_autres = total_variation_nette - total_cash_flow
+        # --- ÉTAPE 1 : Valeurs calculées par le service de variation ---
+        augmentations_patrimoine, diminutions_patrimoine = reconciliation.augmentations, reconciliation.diminutions
+        soustotal_aug, soustotal_dim = reconciliation.soustotal_augmentations, reconciliation.soustotal_diminutions
+        total_variation_nette = reconciliation.variation_nette
+        ventilation = reconciliation.ventilation
+        cash_flow_par_compte = reconciliation.cash_flow_par_compte
+        total_cash_flow = reconciliation.cash_flow
 
         # --- ÉTAPE 2 : NOUVEAU LAYOUT AVEC GRID ---
         self.columnconfigure(0, weight=1)
@@ -1316,12 +1295,15 @@ class RapportVariationPatrimoineWindow(tk.Toplevel):
         ttk.Label(reconciliation_frame, text=f"{total_cash_flow:+.2f} €".replace('.', ','), style="Cadrage.Bold.TLabel", foreground="green" if total_cash_flow >= 0 else "red").grid(row=0, column=2, sticky='e')
         
         ttk.Label(reconciliation_frame, text="2. En parallèle, vos actifs ont varié (plus/moins-values, etc.) de :", style="Cadrage.TLabel").grid(row=1, column=0, columnspan=2, sticky='w')
-        ttk.Label(reconciliation_frame, text=f"{valeur_latente_et_autres:+.2f} €".replace('.', ','), style="Cadrage.Bold.TLabel", foreground="green" if valeur_latente_et_autres >= 0 else "red").grid(row=1, column=2, sticky='e')
-        
-        ttk.Separator(reconciliation_frame).grid(row=2, column=0, columnspan=3, sticky='ew', pady=5)
+        ttk.Label(reconciliation_frame, text=f"{reconciliation.effet_marche:+.2f} €".replace('.', ','), style="Cadrage.Bold.TLabel", foreground="green" if reconciliation.effet_marche >= 0 else "red").grid(row=1, column=2, sticky='e')
+
+        ttk.Label(reconciliation_frame, text="3. Vos dettes ont évolué hors transactions (amortissement, intérêts...) de :", style="Cadrage.TLabel").grid(row=2, column=0, columnspan=2, sticky='w')
+        ttk.Label(reconciliation_frame, text=f"{reconciliation.mouvement_passifs:+.2f} €".replace('.', ','), style="Cadrage.Bold.TLabel", foreground="green" if reconciliation.mouvement_passifs >= 0 else "red").grid(row=2, column=2, sticky='e')
 
-        ttk.Label(reconciliation_frame, text="3. Résultat : Votre patrimoine net a donc bien varié de :", style="Cadrage.TLabel").grid(row=3, column=0, columnspan=2, sticky='w')
-        ttk.Label(reconciliation_frame, text=f"{total_variation_nette:+.2f} €".replace('.', ','), style="Cadrage.Bold.TLabel", foreground="green" if total_variation_nette >= 0 else "red").grid(row=3, column=2, sticky='e')
+        ttk.Separator(reconciliation_frame).grid(row=3, column=0, columnspan=3, sticky='ew', pady=5)
+
+        ttk.Label(reconciliation_frame, text="4. Résultat : Votre patrimoine net a donc bien varié de :", style="Cadrage.TLabel").grid(row=4, column=0, columnspan=2, sticky='w')
+        ttk.Label(reconciliation_frame, text=f"{total_variation_nette:+.2f} €".replace('.', ','), style="Cadrage.Bold.TLabel", foreground="green" if total_variation_nette >= 0 else "red").grid(row=4, column=2, sticky='e')
         # --- FIN DE LA NOUVELLE PRÉSENTATION ---
 
         # --- Onglet 1 : Analyse du Patrimoine ---
@@ -1373,6 +1355,130 @@ class RapportVariationPatrimoineWindow(tk.Toplevel):
         tree_cashflow.insert('', 'end', values=("SOUS-TOTAL FLUX SORTANTS", f"{soustotal_sortants:+.2f}".replace('.', ',')), tags=('total', 'perte'))
         tree_cashflow.insert('', 'end', values=("CASH-FLOW NET TOTAL", f"{total_cash_flow:+.2f}".replace('.', ',')), tags=('total',))
 
+        # --- Onglet 3 : Réconciliations mensuelles de l'année ---
+        if reconciliations_annee:
+            tab_annee = ttk.Frame(notebook); notebook.add(tab_annee, text="Réconciliation Mois par Mois")
+            tab_annee.columnconfigure(0, weight=1); tab_annee.rowconfigure(0, weight=1)
+            colonnes = ('mois', 'variation', 'cash_flow', 'marche', 'passifs')
+            tree_annee = ttk.Treeview(tab_annee, columns=colonnes, show='headings')
+            for colonne, titre in zip(colonnes, ("Mois", "Variation Nette (€)", "Cash-Flow (€)", "Effet Marché (€)", "Mouvement Passifs (€)")):
+                tree_annee.heading(colonne, text=titre)
+                tree_annee.column(colonne, anchor=tk.W if colonne == 'mois' else tk.E)
+            tree_annee.grid(row=0, column=0, sticky='nsew', pady=5)
+            tree_annee.tag_configure('gain', foreground='green'); tree_annee.tag_configure('perte', foreground='red'); tree_annee.tag_configure('total', font=('TkDefaultFont', 9, 'bold'))
+            totaux = [0.0, 0.0, 0.0, 0.0]
+            for rec in reconciliations_annee:
+                if rec is None: continue
+                valeurs = (rec.variation_nette, rec.cash_flow, rec.effet_marche, rec.mouvement_passifs)
+                totaux = [total + valeur for total, valeur in zip(totaux, valeurs)]
+                tag = 'gain' if rec.variation_nette > 0 else 'perte' if rec.variation_nette < 0 else ''
+                tree_annee.insert('', 'end', values=(rec.libelle, *(f"{v:+.2f}".replace('.', ',') for v in valeurs)), tags=(tag,))
+            tree_annee.insert('', 'end', values=("TOTAL", *(f"{v:+.2f}".replace('.', ',') for v in totaux)), tags=('total',))
+
+        self.protocol("WM_DELETE_WINDOW", self.destroy)
+        self.grab_set()
+        self.wait_window(self)
+
+class RapprochementWindow(tk.Toplevel):
+    """
+    Rapprochement d'un compte avec le solde d'un relevé : propose les transactions non pointées qui expliquent
+    l'écart (voir rapprochement.py) et les pointe en un clic.
+    :param transactions_non_pointees: fonction nom du compte -> transactions non pointées de ce compte.
+    :param pointer: fonction liste d'ids -> nombre de transactions pointées.
+    """
+    def __init__(self, parent, comptes, transactions_non_pointees, pointer):
+        super().__init__(parent)
+        self.transient(parent)
+        self.title("Rapprochement avec un Relevé")
+        self.geometry("800x550")
+        self.comptes_par_nom = {}
+        for compte in comptes: self.comptes_par_nom.setdefault(compte.nom, compte)
+        self.transactions_non_pointees = transactions_non_pointees
+        self.pointer = pointer
+        self.proposition = None
+
+        main_frame = ttk.Frame(self, padding=10)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        params_frame = ttk.LabelFrame(main_frame, text="Relevé", padding=10)
+        params_frame.pack(fill=tk.X)
+        ttk.Label(params_frame, text="Compte :").grid(row=0, column=0, sticky=tk.W, pady=2)
+        self.compte_var = tk.StringVar(value=next(iter(self.comptes_par_nom), ""))
+        ttk.Combobox(params_frame, textvariable=self.compte_var, values=list(self.comptes_par_nom), state="readonly", width=30).grid(row=0, column=1, sticky=tk.W)
+        ttk.Label(params_frame, text="Solde du relevé (€) :").grid(row=1, column=0, sticky=tk.W, pady=2)
+        self.solde_entry = ttk.Entry(params_frame, width=15)
+        self.solde_entry.grid(row=1, column=1, sticky=tk.W)
+        ttk.Label(params_frame, text="Date du relevé (AAAA-MM-JJ) :").grid(row=2, column=0, sticky=tk.W, pady=2)
+        self.date_entry = ttk.Entry(params_frame, width=15)
+        self.date_entry.insert(0, date.today().isoformat())
+        self.date_entry.grid(row=2, column=1, sticky=tk.W)
+        ttk.Button(params_frame, text="Rechercher", command=self.rechercher).grid(row=0, column=2, rowspan=3, padx=20)
+
+        self.resultat_label = ttk.Label(main_frame, text="Saisissez le solde et la date du relevé.", wraplength=760)
+        self.resultat_label.pack(fill=tk.X, pady=10)
+
+        tree_frame = ttk.Frame(main_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(tree_frame, columns=('date', 'description', 'categorie', 'montant'), show='headings', selectmode='none')
+        for col, titre, largeur in (('date', "Date", 90), ('description', "Description", 300), ('categorie', "Catégorie", 160), ('montant', "Montant (€)", 100)):
+            self.tree.heading(col, text=titre)
+            self.tree.column(col, width=largeur, anchor=tk.E if col == 'montant' else tk.W)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        buttons_frame = ttk.Frame(main_frame)
+        buttons_frame.pack(fill=tk.X, pady=(10, 0))
+        self.pointer_button = ttk.Button(buttons_frame, text="Pointer ces transactions", command=self.pointer_proposition, state=tk.DISABLED)
+        self.pointer_button.pack(side=tk.RIGHT)
+        ttk.Button(buttons_frame, text="Fermer", command=self.destroy).pack(side=tk.RIGHT, padx=5)
+
         self.protocol("WM_DELETE_WINDOW", self.destroy)
         self.grab_set()
-        self.wait_window(self)
\ No newline at end of file
+        self.wait_window(self)
+
+    def rechercher(self):
+        compte = self.comptes_par_nom.get(self.compte_var.get())
+        if compte is None:
+            messagebox.showerror("Erreur", "Veuillez choisir un compte.", parent=self)
+            return
+        try:
+            solde_releve = float(self.solde_entry.get().replace(' ', '').replace('\u00a0', '').replace(',', '.'))
+            date_releve = datetime.strptime(self.date_entry.get().strip(), "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            messagebox.showerror("Erreur", "Le solde doit être un nombre et la date au format AAAA-MM-JJ.", parent=self)
+            return
+        self.proposition = None
+        self.pointer_button.config(state=tk.DISABLED)
+        for item in self.tree.get_children(): self.tree.delete(item)
+        ecart = solde_releve - compte.solde
+        if abs(ecart) < 0.005:
+            self.resultat_label.config(text="Le solde du compte correspond déjà au relevé : rien à pointer.")
+            return
+        try:
+            self.proposition = rapprocher(self.transactions_non_pointees(compte.nom), compte.solde, solde_releve, date_releve,
+                                          passif=compte.type_compte == 'Passif')
+        except RechercheTropVaste:
+            self.resultat_label.config(text=f"Écart de {format_nombre_fr(ecart)} € : trop de transactions en attente pour une recherche rapide. "
+                                            "Pointez d'abord les plus anciennes, ou choisissez une date de relevé plus ancienne.")
+            return
+        if self.proposition is None:
+            self.resultat_label.config(text=f"Écart de {format_nombre_fr(ecart)} € : aucune combinaison de transactions non pointées "
+                                            "n'atteint le solde du relevé. Une opération manque peut-être dans le budget.")
+            return
+        for trans in self.proposition.transactions:
+            self.tree.insert('', 'end', values=(trans.get('date', ''), trans.get('description', ''), trans.get('categorie', ''),
+                                                format_nombre_fr(trans.get('montant') or 0.0)))
+        self.resultat_label.config(text=f"Écart de {format_nombre_fr(ecart)} € expliqué par {len(self.proposition.ids)} transaction(s) "
+                                        f"(total {format_nombre_fr(self.proposition.total)} €, fenêtre de {self.proposition.fenetre_jours} jours avant le relevé).")
+        self.pointer_button.config(state=tk.NORMAL)
+
+    def pointer_proposition(self):
+        if not self.proposition: return
+        nombre = self.pointer(self.proposition.ids)
+        messagebox.showinfo("Pointage Réussi", f"{nombre} transaction(s) pointée(s) et solde du compte mis à jour.", parent=self)
+        self.proposition = None
+        self.pointer_button.config(state=tk.DISABLED)
+        for item in self.tree.get_children(): self.tree.delete(item)
+        self.resultat_label.config(text="Saisissez le solde et la date du relevé.")
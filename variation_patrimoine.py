@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Explication de la variation du patrimoine net entre deux instantanés.
+
+La variation nette (somme des impacts des comptes : +variation pour un actif, -variation pour un passif)
+se décompose en trois parts qui s'additionnent :
+- le cash-flow : somme des transactions de la période, tous comptes confondus (les virements s'annulent) ;
+- l'effet de marché : ce que les transactions n'expliquent pas sur les actifs (plus/moins-values, cours...) ;
+- le mouvement des passifs : ce que les transactions n'expliquent pas sur les passifs (amortissement
+  d'un emprunt mis à jour par l'échéancier, intérêts...).
+Les instantanés sont cherchés dans une HistorySeries (recherche dichotomique sur les dates) et les flux sont
+regroupés par compte sur une TransactionFrame : une année de réconciliations mensuelles tient en deux
+regroupements, sans relire de dates ni recopier d'instantané.
+"""
+from datetime import date, timedelta
+from collections import defaultdict
+
+import numpy as np
+
+from frame_transactions import jour_ordinal, mois_ordinal
+
+SEUIL_IMPACT = 0.01 # En dessous, un compte est considéré comme inchangé
+
+def _bornes_mois(cle_mois):
+    """(premier jour, premier jour du mois suivant) du mois 'AAAA-MM'."""
+    debut = date(int(cle_mois[:4]), int(cle_mois[5:7]), 1)
+    return debut, (debut + timedelta(days=31)).replace(day=1)
+
+def _mois_precedent(cle_mois):
+    debut, _ = _bornes_mois(cle_mois)
+    return (debut - timedelta(days=1)).strftime("%Y-%m")
+
+class ReconciliationPatrimoine:
+    """
+    Variation du patrimoine net entre snapshot_debut et snapshot_fin (dictionnaires au format de l'historique)
+    et sa décomposition. cash_flow_par_compte : {compte: somme des transactions de la période}.
+    """
+    def __init__(self, libelle, snapshot_debut, snapshot_fin, comptes, cash_flow_par_compte):
+        self.libelle = libelle
+        self.snapshot_debut, self.snapshot_fin = snapshot_debut, snapshot_fin
+        self.cash_flow_par_compte = {nom: montant for nom, montant in cash_flow_par_compte.items() if nom}
+        proprietes = {c.nom: c for c in comptes}
+        soldes_debut = snapshot_debut.get('soldes_comptes', {})
+        soldes_fin = snapshot_fin.get('soldes_comptes', {})
+
+        self.augmentations, self.diminutions = [], []
+        self.ventilation = defaultdict(float) # Classe d'actif, ou réduction / augmentation de passif -> impact
+        self.mouvement_passifs = 0.0
+        for nom in sorted(set(soldes_debut) | set(soldes_fin)):
+            solde_d, solde_f = soldes_debut.get(nom, 0.0), soldes_fin.get(nom, 0.0)
+            compte = proprietes.get(nom)
+            est_passif = compte is not None and compte.type_compte == 'Passif'
+            impact = -(solde_f - solde_d) if est_passif else solde_f - solde_d
+            if est_passif: # Part de la variation de la dette que les transactions du compte n'expliquent pas
+                self.mouvement_passifs += impact - self.cash_flow_par_compte.get(nom, 0.0)
+            item = {'nom': nom, 'solde_debut': solde_d, 'solde_fin': solde_f, 'impact': impact, 'type': 'Passif' if est_passif else 'Actif'}
+            if impact > SEUIL_IMPACT: self.augmentations.append(item)
+            elif impact < -SEUIL_IMPACT: self.diminutions.append(item)
+            else: continue
+            if est_passif:
+                self.ventilation["Réduction de Passif" if impact > 0 else "Augmentation de Passif"] += impact
+            else:
+                self.ventilation[compte.classe_actif if compte is not None else 'Non Renseigné'] += impact
+
+        self.soustotal_augmentations = sum(item['impact'] for item in self.augmentations)
+        self.soustotal_diminutions = sum(item['impact'] for item in self.diminutions)
+        self.variation_nette = self.soustotal_augmentations + self.soustotal_diminutions
+        self.cash_flow = sum(self.cash_flow_par_compte.values())
+        # Le reste est porté par les actifs (y compris les écarts sous le seuil, exclus de la variation nette)
+        self.effet_marche = self.variation_nette - self.cash_flow - self.mouvement_passifs
+
+class ServiceVariationPatrimoine:
+    """
+    Réconciliations du patrimoine sur un historique (HistorySeries avec les soldes des comptes) et les transactions
+    du budget (TransactionFrame). comptes : les comptes actuels (type et classe d'actif par nom).
+    """
+    def __init__(self, series, frame, comptes):
+        self.series = series
+        self.frame = frame
+        self.comptes = comptes
+
+    # --- Recherche d'instantanés ---
+
+    def indice_au(self, jour):
+        """Indice du dernier instantané daté au plus tard du jour donné (date ou ISO), ou None."""
+        i = int(np.searchsorted(self.series.dates, np.datetime64(jour, 'D'), side='right')) - 1
+        return i if i >= 0 else None
+
+    def indice_fin_de_mois(self, cle_mois):
+        """Indice du dernier instantané du mois 'AAAA-MM', ou None si le mois n'en a aucun."""
+        debut, suivant = _bornes_mois(cle_mois)
+        i = self.indice_au(suivant - timedelta(days=1))
+        return i if i is not None and self.series.dates[i] >= np.datetime64(debut, 'D') else None
+
+    # --- Réconciliations ---
+
+    def variation(self, date_debut, date_fin):
+        """
+        Variation entre les instantanés en vigueur aux deux dates (dernier instantané au plus tard de chaque date).
+        Le cash-flow est celui des transactions datées après le premier instantané et au plus tard le second.
+        Retourne None s'il n'y a pas d'instantané à l'une des dates.
+        """
+        i, j = self.indice_au(date_debut), self.indice_au(date_fin)
+        if i is None or j is None:
+            return None
+        frame = self.frame
+        periode = (frame.jour > jour_ordinal(self.series.dates[i])) & (frame.jour <= jour_ordinal(self.series.dates[j]))
+        return ReconciliationPatrimoine(f"{self.series.dates[i]} → {self.series.dates[j]}", self.series.instantane(i),
+                                        self.series.instantane(j), self.comptes, frame.somme_par_compte(periode))
+
+    def variation_mois(self, cle_mois):
+        """Réconciliation du mois budgétaire 'AAAA-MM' (voir reconciliations_mensuelles), ou None."""
+        return self.reconciliations_mensuelles([cle_mois])[0]
+
+    def reconciliations_annee(self, annee):
+        """Les douze réconciliations mensuelles de l'année (None pour un mois sans instantané de début ou de fin)."""
+        return self.reconciliations_mensuelles([f"{annee:04d}-{mois:02d}" for mois in range(1, 13)])
+
+    def reconciliations_mensuelles(self, cles_mois):
+        """
+        Réconciliation de chaque mois budgétaire : du dernier instantané du mois précédent au dernier du mois.
+        Le cash-flow est celui des transactions rattachées au mois budgétaire. Celles datées du mois précédent
+        mais rattachées à ce mois sont déjà dans l'instantané de départ : elles en sont retirées (instantané virtuel).
+        """
+        if not cles_mois:
+            return []
+        frame = self.frame
+        ordinaux = [mois_ordinal(cle) for cle in cles_mois]
+        premier, dernier = min(ordinaux), max(ordinaux)
+        nb_mois, nb_comptes = dernier - premier + 1, len(frame.comptes)
+        position = frame.mois_budget - premier
+        dans_la_plage = (position >= 0) & (position < nb_mois)
+        # Flux par (mois budgétaire, compte), et ajustements de l'instantané de départ par (mois budgétaire, compte)
+        flux = np.zeros((nb_mois, nb_comptes))
+        np.add.at(flux, (position[dans_la_plage], frame.compte[dans_la_plage]), frame.montant[dans_la_plage])
+        a_retirer = dans_la_plage & (frame.mois_budget - frame.mois == 1)
+        ajustements = np.zeros((nb_mois, nb_comptes))
+        np.add.at(ajustements, (position[a_retirer], frame.compte[a_retirer]), frame.montant[a_retirer])
+        compte_present = np.zeros((nb_mois, nb_comptes), dtype=bool)
+        compte_present[position[dans_la_plage], frame.compte[dans_la_plage]] = True
+        ajustement_present = np.zeros((nb_mois, nb_comptes), dtype=bool)
+        ajustement_present[position[a_retirer], frame.compte[a_retirer]] = True
+
+        reconciliations = []
+        for cle_mois, ordinal in zip(cles_mois, ordinaux):
+            i, j = self.indice_fin_de_mois(_mois_precedent(cle_mois)), self.indice_fin_de_mois(cle_mois)
+            if i is None or j is None:
+                reconciliations.append(None)
+                continue
+            ligne = ordinal - premier
+            snapshot_debut = self.series.instantane(i)
+            retraits = {frame.comptes[code]: float(ajustements[ligne, code]) for code in np.flatnonzero(ajustement_present[ligne])}
+            if retraits:
+                self._retirer(snapshot_debut, retraits)
+            cash_flow = {frame.comptes[code]: float(flux[ligne, code]) for code in np.flatnonzero(compte_present[ligne])}
+            reconciliations.append(ReconciliationPatrimoine(cle_mois, snapshot_debut, self.series.instantane(j), self.comptes, cash_flow))
+        return reconciliations
+
+    def _retirer(self, snapshot, montants_par_compte):
+        """
+        Annule des transactions sur les soldes d'un instantané et recalcule ses totaux avec les comptes actuels.
+        Le solde d'un passif est une dette : une transaction l'a diminué de son montant (voir le pointage), on le rajoute.
+        """
+        soldes = snapshot['soldes_comptes']
+        types = {c.nom: c.type_compte for c in self.comptes}
+        for nom, montant in montants_par_compte.items():
+            if nom in soldes:
+                soldes[nom] += montant if types.get(nom) == 'Passif' else -montant
+        total_actifs = sum(soldes.get(c.nom, c.solde) for c in self.comptes if c.type_compte == 'Actif')
+        total_passifs = sum(soldes.get(c.nom, c.solde) for c in self.comptes if c.type_compte == 'Passif')
+        snapshot['patrimoine_net'] = total_actifs - total_passifs
+        snapshot['total_actifs'] = total_actifs
+        snapshot['total_passifs_magnitude'] = total_passifs
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Point d'entrée WSGI de l'application web (déploiement multi-workers).
+
+Chaque worker importe app_web et ouvre ses propres connexions SQLite (une par thread) ;
+la base passe en journal WAL pour que les lectures ne soient pas bloquées par une écriture.
+Les caches sont propres à chaque worker et invalidés par le compteur de version de la base,
+et les écritures concurrentes (catégories, récurrences) sont contrôlées par cette même version.
+
+Gunicorn (Linux / macOS) :
+    gunicorn -c gunicorn.conf.py wsgi:app
+    (SLC_WEB_WORKERS, SLC_WEB_THREADS et SLC_WEB_BIND ajustent la configuration)
+
+Waitress (Windows, un seul processus multi-thread) :
+    waitress-serve --listen=0.0.0.0:8000 --threads=8 wsgi:app
+    ou simplement : python wsgi.py
+
+Variables utiles : SLC_DB_PATH (chemin de budget.db), SLC_LOG_LEVEL, SLC_DEBUG_PROJECTION.
+"""
+import os
+
+from app_web import app
+
+if __name__ == "__main__":
+    try:
+        from waitress import serve
+    except ImportError:
+        print("ATTENTION: Le package 'waitress' n'est pas installé (pip install waitress).")
+        raise SystemExit(1)
+    hote, _, port = os.environ.get("SLC_WEB_BIND", "0.0.0.0:8000").rpartition(":")
+    serve(app, host=hote or "0.0.0.0", port=int(port), threads=int(os.environ.get("SLC_WEB_THREADS", 8)))